@@ -1,10 +1,18 @@
+from dotenv import load_dotenv
+
+load_dotenv()  # Carregar variáveis de ambiente
+
+# eventlet/gevent: monkey patch antes de importar Flask, sockets e threads
+from app.async_mode import ASYNC_MODE, monkey_patch
+monkey_patch()
+
 from flask import Flask
 from flask_socketio import SocketIO
 from datetime import timedelta
 import os
-from dotenv import load_dotenv
 
-load_dotenv()  # Carregar variáveis de ambiente
+from app.serializer import SOCKETIO_SERIALIZER, socketio_serializer_options
+from app.state_backend import socketio_queue_options
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'fallback-key-change-me')
@@ -12,14 +20,23 @@ app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 app.config['SESSION_COOKIE_SECURE'] = os.getenv('FLASK_ENV') == 'production'  # HTTPS em produção
 app.config['SESSION_COOKIE_HTTPONLY'] = True
+app.config['SOCKETIO_SERIALIZER'] = SOCKETIO_SERIALIZER  # Templates escolhem o cliente Socket.IO
 
 socketio = SocketIO(
     app, 
     cors_allowed_origins="*",
-    async_mode='threading',
+    async_mode=ASYNC_MODE,
     logger=False,
     ping_timeout=60,
-    ping_interval=25
+    ping_interval=25,
+    # Compressão: o polling já sai com gzip/deflate a partir de 1 KB (padrão do
+    # engineio) e o WebSocket usa permessage-deflate no eventlet; payloads grandes
+    # também saem comprimidos pela aplicação (SOCKETIO_COMPRESSION_THRESHOLD,
+    # ver payload_cache.py)
+    # JSON (aceita payloads pré-codificados) ou MessagePack (SOCKETIO_SERIALIZER)
+    **socketio_serializer_options(),
+    # Vários workers: emits de um worker chegam aos sockets dos outros
+    **socketio_queue_options(os.getenv('SOCKETIO_MESSAGE_QUEUE'), os.getenv('STATE_BACKEND'))
 )
 
 from app.database import db
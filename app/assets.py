@@ -0,0 +1,180 @@
+import base64
+import hashlib
+import os
+import re
+import threading
+
+# Prefixo público das URLs de assets (servidas por /assets/<hash>)
+ASSET_URL_PREFIX = '/assets/'
+
+# Campos que carregam imagens de mapas, entidades e tokens
+ASSET_FIELDS = ('image',)
+
+HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+DATA_URL_PATTERN = re.compile(r'^data:(image/[\w.+-]+)?(;base64)?,', re.IGNORECASE)
+ASSET_URL_PATTERN = re.compile(r'/assets/([0-9a-f]{64})')
+
+# Tamanho máximo de um asset (bytes já decodificados)
+MAX_ASSET_BYTES = 64 * 1024 * 1024
+
+# Assinaturas (magic bytes) das imagens aceitas: (deslocamento, bytes, mimetype)
+# SVG não entra: é servido na mesma origem e pode carregar <script>
+MAGIC_MIMETYPES = (
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (8, b'WEBP', 'image/webp'),
+)
+
+
+def sniff_mimetype(head):
+    """Mimetype de imagem pelos primeiros bytes, ou None se não for reconhecida"""
+    for offset, magic, mimetype in MAGIC_MIMETYPES:
+        if head[offset:offset + len(magic)] == magic:
+            if mimetype == 'image/webp' and not head.startswith(b'RIFF'):
+                continue
+            return mimetype
+
+    return None
+
+
+class AssetStore:
+    """
+    Armazenamento de imagens endereçado por conteúdo (SHA-256)
+
+    Cada imagem é gravada uma única vez em disco e referenciada nas cenas,
+    mapas e tokens pela URL /assets/<hash>, no lugar do data URL base64.
+    """
+
+    def __init__(self, root='data/assets'):
+        self.root = os.path.abspath(root)
+        self._lock = threading.Lock()
+        self.stats = {'stored': 0, 'deduplicated': 0, 'externalized': 0}
+
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+
+    def path_for(self, asset_hash):
+        """Caminho em disco do asset (sharding pelos 2 primeiros caracteres)"""
+        return os.path.join(self.root, asset_hash[:2], asset_hash)
+
+    def exists(self, asset_hash):
+        return bool(HASH_PATTERN.match(asset_hash or '')) and os.path.exists(self.path_for(asset_hash))
+
+    def put(self, content):
+        """
+        Gravar bytes e retornar o hash
+
+        Conteúdo já existente não é regravado (deduplicação natural).
+        Só aceita PNG, JPEG, GIF e WebP até MAX_ASSET_BYTES (ValueError).
+        """
+        if len(content) > MAX_ASSET_BYTES:
+            raise ValueError(f'imagem maior que {MAX_ASSET_BYTES // (1024 * 1024)} MB')
+
+        if not sniff_mimetype(content[:16]):
+            raise ValueError('formato de imagem não suportado')
+
+        asset_hash = hashlib.sha256(content).hexdigest()
+        path = self.path_for(asset_hash)
+
+        with self._lock:
+            if os.path.exists(path):
+                self.stats['deduplicated'] += 1
+                return asset_hash
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # Escrita atômica: arquivo temporário + rename
+            tmp_path = f'{path}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+
+            self.stats['stored'] += 1
+
+        print(f'🖼️ Asset {asset_hash[:12]} armazenado ({len(content) / 1024:.1f} KB)')
+        return asset_hash
+
+    def put_data_url(self, data_url):
+        """Decodificar um data URL base64 e gravar; retorna o hash ou None"""
+        match = DATA_URL_PATTERN.match(data_url or '')
+        if not match or not match.group(2):
+            return None
+
+        # Estimar o tamanho decodificado antes de decodificar (4 chars -> 3 bytes)
+        if (len(data_url) - match.end()) * 3 // 4 > MAX_ASSET_BYTES + 3:
+            return None
+
+        try:
+            content = base64.b64decode(data_url[match.end():], validate=False)
+        except (ValueError, TypeError):
+            return None
+
+        if not content:
+            return None
+
+        try:
+            return self.put(content)
+        except ValueError:
+            return None
+
+    def read(self, asset_hash):
+        """Ler bytes de um asset (ou None se não existir)"""
+        if not self.exists(asset_hash):
+            return None
+
+        with open(self.path_for(asset_hash), 'rb') as f:
+            return f.read()
+
+    def mimetype_for(self, asset_hash):
+        """Descobrir o mimetype pelos primeiros bytes do arquivo"""
+        with open(self.path_for(asset_hash), 'rb') as f:
+            head = f.read(16)
+
+        return sniff_mimetype(head) or 'application/octet-stream'
+
+    def externalize(self, obj):
+        """
+        Substituir data URLs embutidos por referências /assets/<hash>
+
+        Percorre dicts/listas (cenas, mapas, entidades, tokens) e altera o
+        objeto no lugar. Retorna quantas imagens foram externalizadas.
+        """
+        count = self._externalize(obj)
+
+        if count:
+            self.stats['externalized'] += count
+
+        return count
+
+    def _externalize(self, obj):
+        count = 0
+
+        if isinstance(obj, dict):
+            for key, value in obj.items():
+                if key in ASSET_FIELDS and isinstance(value, str) and value.startswith('data:'):
+                    asset_hash = self.put_data_url(value)
+                    if asset_hash:
+                        obj[key] = asset_url(asset_hash)
+                        count += 1
+                elif isinstance(value, (dict, list)):
+                    count += self._externalize(value)
+
+        elif isinstance(obj, list):
+            for item in obj:
+                if isinstance(item, (dict, list)):
+                    count += self._externalize(item)
+
+        return count
+
+    def references(self, text):
+        """Hashes de assets referenciados num JSON já serializado"""
+        return set(ASSET_URL_PATTERN.findall(text))
+
+
+def asset_url(asset_hash):
+    return f'{ASSET_URL_PREFIX}{asset_hash}'
+
+
+assets = AssetStore()
@@ -0,0 +1,115 @@
+import os
+
+# Servidor do Socket.IO (ASYNC_MODE):
+#   threading  uma thread por conexão (padrão; run.py e executável do Windows)
+#   eventlet   green threads; milhares de sockets ociosos por processo
+#   gevent     idem, com gevent
+ASYNC_MODES = ('threading', 'eventlet', 'gevent')
+
+ASYNC_MODE = os.getenv('ASYNC_MODE', 'threading').strip().lower()
+
+if ASYNC_MODE not in ASYNC_MODES:
+    raise ValueError(f'ASYNC_MODE desconhecido: {ASYNC_MODE} (use {", ".join(ASYNC_MODES)})')
+
+# Com green threads, chamadas bloqueantes (SQLite) travam o processo inteiro
+GREEN = ASYNC_MODE != 'threading'
+
+
+def monkey_patch():
+    """
+    Trocar socket/threading/time da biblioteca padrão pelas versões cooperativas
+
+    Precisa rodar antes de qualquer outro import (início de app/__init__.py).
+    """
+    if ASYNC_MODE == 'eventlet':
+        import eventlet
+        eventlet.monkey_patch()
+    elif ASYNC_MODE == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+
+
+def run_blocking(func, *args, **kwargs):
+    """
+    Executar func numa thread real do sistema, sem travar o loop de green threads
+
+    No modo threading, só chama func.
+    """
+    if ASYNC_MODE == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(func, *args, **kwargs)
+    if ASYNC_MODE == 'gevent':
+        from gevent import get_hub
+        return get_hub().threadpool.apply(func, args, kwargs)
+    return func(*args, **kwargs)
+
+
+class _OffloadedCursor:
+    """Cursor SQLite cujas operações rodam fora do loop (ver OffloadedConnection)"""
+
+    __slots__ = ('_cursor',)
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, *args):
+        run_blocking(self._cursor.execute, *args)
+        return self
+
+    def executemany(self, *args):
+        run_blocking(self._cursor.executemany, *args)
+        return self
+
+    def fetchone(self):
+        return run_blocking(self._cursor.fetchone)
+
+    def fetchmany(self, size=256):
+        return run_blocking(self._cursor.fetchmany, size)
+
+    def fetchall(self):
+        return run_blocking(self._cursor.fetchall)
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany()
+            if not rows:
+                return
+            yield from rows
+
+    def __getattr__(self, name):
+        # rowcount, lastrowid, description...
+        return getattr(self._cursor, name)
+
+
+class OffloadedConnection:
+    """
+    Conexão SQLite para modos green: cada comando roda no pool de threads
+
+    Só as chamadas ao SQLite saem do loop; o pool de conexões e os locks
+    continuam cooperativos (monkey patch), então esperar por uma conexão
+    não trava os outros sockets.
+    """
+
+    __slots__ = ('_conn',)
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self):
+        return _OffloadedCursor(self._conn.cursor())
+
+    def execute(self, *args):
+        return _OffloadedCursor(run_blocking(self._conn.execute, *args))
+
+    def executemany(self, *args):
+        return _OffloadedCursor(run_blocking(self._conn.executemany, *args))
+
+    def commit(self):
+        run_blocking(self._conn.commit)
+
+    def rollback(self):
+        run_blocking(self._conn.rollback)
+
+    def __getattr__(self, name):
+        # in_transaction, row_factory, close...
+        return getattr(self._conn, name)
@@ -0,0 +1,201 @@
+import itertools
+import os
+import threading
+
+# Envios por segundo (0 = emitir na hora, sem agrupar)
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))
+
+
+class _Entry:
+    __slots__ = ('event', 'payload', 'skip_sid')
+
+    def __init__(self, event, payload, skip_sid):
+        self.event = event
+        self.payload = payload
+        self.skip_sid = skip_sid
+
+
+class BroadcastScheduler:
+    """
+    Fila de saída dos broadcasts, enviada em ticks (BROADCAST_RATE por segundo)
+
+    Eventos para a mesma sala/socket ficam em ordem num buffer; um evento
+    com a mesma chave (ex.: entity_updated da mesma entidade) substitui o
+    anterior ainda não enviado, ou é fundido com ele (merge). Assim um drag
+    rápido vira no máximo um envio por objeto por tick, não importa quantas
+    mensagens o cliente mande.
+
+    Fontes (add_source) como o StrokeStream entregam seus próprios lotes a
+    cada tick.
+    """
+
+    def __init__(self, socketio, rate=BROADCAST_RATE):
+        self.socketio = socketio
+        self.interval = 1 / rate if rate > 0 else 0
+        self._buffers = {}   # destino → {id: _Entry} (ordem de chegada)
+        self._keys = {}      # destino → {chave: id}
+        self._ids = itertools.count()
+        self._sources = []
+        self._lock = threading.Lock()
+        self._task_pid = None
+
+        self.stats = {
+            'queued': 0,
+            'coalesced': 0,
+            'emitted': 0,
+            'ticks': 0
+        }
+
+    def add_source(self, source):
+        """source.collect() → [(evento, payload, destino, skip_sid)]; source.pending() → bool"""
+        self._sources.append(source)
+
+    def wake(self):
+        """Garantir que os ticks estão rodando (fontes chamam ao receber dados)"""
+        if not self.interval:
+            self.flush()
+            return
+        with self._lock:
+            self._ensure_task()
+
+    def _ensure_task(self):
+        # Roda só enquanto houver o que enviar; o pid evita herdar o estado
+        # do processo pai (fork dos workers)
+        if self._task_pid != os.getpid():
+            self._task_pid = os.getpid()
+            self.socketio.start_background_task(self._run)
+
+    # ==================
+    # API
+    # ==================
+
+    def send(self, event, payload, to, key=None, skip_sid=None, merge=None):
+        """
+        Agendar evento para a sala/socket `to`; retorna o payload que será enviado
+
+        key: eventos com a mesma chave (e mesmo destino) se substituem.
+        merge(pendente, novo): junta os dois payloads (o resultado fica na
+        posição do pendente); retornar None para enfileirar o novo em separado.
+        """
+        if not self.interval:
+            self.socketio.emit(event, payload, to=to, skip_sid=skip_sid)
+            return payload
+
+        with self._lock:
+            buffer = self._buffers.setdefault(to, {})
+            keys = self._keys.setdefault(to, {})
+            self.stats['queued'] += 1
+
+            if key is not None:
+                key = (event, key)
+                pending_id = keys.get(key)
+                pending = buffer.get(pending_id) if pending_id is not None else None
+
+                if pending is not None:
+                    if merge is not None:
+                        merged = merge(pending.payload, payload)
+                        if merged is not None:
+                            pending.payload = merged
+                            pending.skip_sid = skip_sid
+                            self.stats['coalesced'] += 1
+                            return merged
+                    else:
+                        del buffer[pending_id]
+                        self.stats['coalesced'] += 1
+
+            entry_id = next(self._ids)
+            buffer[entry_id] = _Entry(event, payload, skip_sid)
+            if key is not None:
+                keys[key] = entry_id
+
+            self._ensure_task()
+            return payload
+
+    def discard(self, to, event):
+        """Descartar eventos pendentes de um tipo (ex.: deltas cobertos por um snapshot)"""
+        with self._lock:
+            buffer = self._buffers.get(to)
+            if not buffer:
+                return
+            for entry_id in [i for i, entry in buffer.items() if entry.event == event]:
+                del buffer[entry_id]
+            keys = self._keys.get(to, {})
+            for key in [k for k in keys if k[0] == event]:
+                del keys[key]
+
+    # ==================
+    # TICK
+    # ==================
+
+    def flush(self):
+        with self._lock:
+            buffers, self._buffers, self._keys = self._buffers, {}, {}
+
+        messages = [
+            (entry.event, entry.payload, to, entry.skip_sid)
+            for to, buffer in buffers.items()
+            for entry in buffer.values()
+        ]
+        for source in self._sources:
+            messages.extend(source.collect())
+
+        self._emit(messages)
+        self.stats['ticks'] += 1
+
+    def flush_to(self, *destinations):
+        """
+        Enviar já os eventos pendentes destes destinos
+
+        Usado antes de um emit imediato que torna os pendentes obsoletos
+        (ex.: scene_activated): assim eles não chegam depois dele.
+        """
+        if not self.interval:
+            return
+
+        messages = []
+        with self._lock:
+            for to in destinations:
+                buffer = self._buffers.pop(to, None)
+                self._keys.pop(to, None)
+                if buffer:
+                    messages.extend((entry.event, entry.payload, to, entry.skip_sid) for entry in buffer.values())
+
+        self._emit(messages)
+
+    def _emit(self, messages):
+        for event, payload, to, skip_sid in messages:
+            self.socketio.emit(event, payload, to=to, skip_sid=skip_sid)
+
+        self.stats['emitted'] += len(messages)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f'❌ Erro ao enviar broadcasts: {e}')
+
+            with self._lock:
+                if self._buffers:
+                    continue
+                self._task_pid = None
+
+            # Fontes têm locks próprios: consultar fora do nosso, depois de
+            # soltar o task. Um wake() daqui em diante inicia outro task; o
+            # que chegou antes aparece em pending() e este task continua
+            if not any(source.pending() for source in self._sources):
+                return
+
+            with self._lock:
+                if self._task_pid is not None:
+                    return
+                self._task_pid = os.getpid()
+
+    def status(self):
+        with self._lock:
+            return {
+                **self.stats,
+                'rate': 1 / self.interval if self.interval else 0,
+                'pending': sum(len(buffer) for buffer in self._buffers.values())
+            }
@@ -0,0 +1,94 @@
+import os
+from bisect import bisect_left
+
+from app.database import db
+
+# Mensagens mais recentes de cada conversa mantidas em memória (o resto fica no SQLite)
+CHAT_BUFFER_SIZE = int(os.getenv('CHAT_BUFFER_SIZE', '100'))
+
+# Tamanho padrão / máximo de uma página de get_conversation
+CHAT_PAGE_SIZE = 50
+CHAT_PAGE_MAX = 200
+
+# Separador do id da conversa (ids de jogador já contêm '_')
+CONVERSATION_SEPARATOR = '|'
+
+
+def conversation_id(user_a, user_b):
+    """Id da conversa entre dois usuários (o mesmo nos dois sentidos)"""
+    return CONVERSATION_SEPARATOR.join(sorted((user_a, user_b)))
+
+
+class ChatStore:
+    """
+    Histórico do chat: SQLite + buffer das últimas mensagens por conversa
+
+    Cada mensagem é gravada uma vez no SQLite (o id da linha é o cursor das
+    páginas) e entra no buffer da conversa em session.chat_conversations:
+
+        {conversation_id: {'messages': [...], 'complete': bool}}
+
+    O buffer guarda no máximo CHAT_BUFFER_SIZE mensagens; 'complete' diz se
+    ele ainda contém o início da conversa. Páginas que cabem no buffer não
+    tocam o banco; as mais antigas vêm do SQLite.
+    """
+
+    def __init__(self, buffer_size=CHAT_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+
+    def append(self, session, message):
+        """Gravar mensagem (sender_id/recipient_id...) e colocar no buffer; retorna a mensagem com id"""
+        conv_id = conversation_id(message['sender_id'], message['recipient_id'])
+        message['id'] = db.add_chat_message(session.session_id, conv_id, message)
+
+        buffer = session.chat_conversations.get(conv_id)
+        if buffer is None:
+            # Conversa fora da memória (ex.: servidor reiniciado): o banco diz se há anteriores
+            older = db.chat_messages(session.session_id, conv_id, before=message['id'], limit=1)
+            buffer = session.chat_conversations[conv_id] = {'messages': [], 'complete': not older}
+
+        messages = buffer['messages']
+        messages.append(message)
+        if len(messages) > self.buffer_size:
+            del messages[:-self.buffer_size]
+            buffer['complete'] = False
+        return message
+
+    def page(self, session, conv_id, before=None, limit=CHAT_PAGE_SIZE):
+        """
+        Até `limit` mensagens anteriores a `before` (None = as mais recentes)
+
+        Retorna (mensagens em ordem cronológica, has_more).
+        """
+        limit = max(1, min(int(limit), CHAT_PAGE_MAX))
+        buffer = session.chat_conversations.get(conv_id)
+
+        if buffer is None:
+            messages = db.chat_messages(session.session_id, conv_id, before=before, limit=limit + 1)
+            return messages[-limit:], len(messages) > limit
+
+        buffered = buffer['messages']
+        end = len(buffered) if before is None else bisect_left([m['id'] for m in buffered], before)
+        start = max(0, end - limit)
+        messages = buffered[start:end]
+
+        if start > 0:
+            return messages, True
+        if buffer['complete']:
+            return messages, False
+
+        # Completar a página com as mensagens anteriores ao buffer
+        missing = limit - len(messages)
+        cursor = messages[0]['id'] if messages else before
+        older = db.chat_messages(session.session_id, conv_id, before=cursor, limit=missing + 1)
+        has_more = len(older) > missing
+        if has_more:
+            older = older[1:]
+        return older + messages, has_more
+
+    def conversations(self, session, exclude=None):
+        """Índice das conversas da sessão (mantido no SQLite a cada mensagem)"""
+        return db.chat_conversations(session.session_id, exclude=exclude)
+
+
+chat = ChatStore()
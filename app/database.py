@@ -1,8 +1,191 @@
 import sqlite3
 import json
+import zlib
 import os
-from datetime import datetime
+import re
+import hashlib
+import atexit
+import queue
+from contextlib import contextmanager
+from datetime import datetime, timezone
 import threading
+from app.assets import assets
+from app.drawings import compact_drawings
+from app.async_mode import GREEN, OffloadedConnection
+
+# Versão do schema (PRAGMA user_version)
+#   1: um blob JSON por sessão (sessions.data)
+#   2: cenas, camadas, tokens, desenhos, névoa e assets em tabelas próprias
+#   3: histórico (log de operações + snapshots por sessão)
+#   4: mensagens do chat (chat_messages)
+#   5: índice das conversas do chat (chat_conversations)
+#   6: log de rolagens de dados (dice_rolls)
+#   7: contadores de rolagens por jogador e fórmula (dice_stats)
+#   8: notas do mestre com índice de busca FTS5 (notes, notes_fts)
+SCHEMA_VERSION = 8
+
+# Escopo das camadas do modo legado (sem cenas): images/tokens/drawings/fogImage
+LEGACY_SCENE_ID = ''
+
+# Campos da cena que viram linhas próprias; o resto fica em scenes.data
+SCENE_ROW_FIELDS = ('maps', 'entities', 'tokens', 'drawings', 'fog_image')
+
+# Campos do estado legado que viram linhas próprias; o resto fica em sessions.data
+LEGACY_ROW_FIELDS = ('images', 'tokens', 'drawings', 'fogImage')
+
+# Tipo de camada -> campo da cena (LEGACY_SCENE_ID usa 'image')
+LAYER_FIELDS = {'map': 'maps', 'entity': 'entities', 'image': 'images'}
+
+# Linhas de uma sessão: tabela -> (colunas da chave, colunas de valor); todas
+# têm digest, menos sessions (uma linha só, sem chave)
+ROW_TABLES = {
+    'sessions': ((), ('data',)),
+    'scenes': (('scene_id',), ('position', 'name', 'data')),
+    'layers': (('scene_id', 'kind', 'layer_id'), ('position', 'data')),
+    'tokens': (('scene_id', 'token_id'), ('position', 'data')),
+    'drawings': (('scene_id', 'position'), ('data',)),
+    'fog': (('scene_id',), ('image',))
+}
+
+# Histórico: snapshot completo a cada N versões com alterações...
+SNAPSHOT_INTERVAL = 50
+
+# ...ou quando as operações desde o último snapshot passam disso
+SNAPSHOT_MAX_OPS = 5000
+
+# Versões com alterações mantidas por sessão (as mais antigas são descartadas)
+HISTORY_VERSIONS = 500
+
+
+# Categorias das notas do mestre (as mesmas da página /notes)
+NOTE_CATEGORIES = ('npcs', 'locations', 'quests', 'items', 'lore', 'other')
+
+# Pesos do bm25 na busca de notas: título, corpo, categoria
+NOTE_SEARCH_WEIGHTS = (10.0, 1.0, 2.0)
+
+
+# Aplicados a toda conexão aberta pelos pools
+SQLITE_BUSY_TIMEOUT = 5000  # ms
+SQLITE_PRAGMAS = {
+    'busy_timeout': SQLITE_BUSY_TIMEOUT,
+    'synchronous': 'NORMAL',       # seguro em WAL; só o último commit pode se perder numa queda de energia
+    'cache_size': -16000,          # ~16 MB por conexão
+    'mmap_size': 128 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'foreign_keys': 'ON'
+}
+
+# Conexões de leitura simultâneas por processo
+READ_POOL_SIZE = int(os.getenv('DB_READ_POOL_SIZE', '8'))
+
+# Tempo máximo (s) esperando uma conexão livre
+POOL_TIMEOUT = 10
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _digest(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class ConnectionPool:
+    """
+    Pool limitado de conexões SQLite
+
+    Conexões ociosas são reaproveitadas; com `size` conexões em uso, quem
+    pedir outra espera até `timeout` segundos. Conexões herdadas de outro
+    processo (fork dos workers do gunicorn com preload_app) são descartadas.
+    Nos modos eventlet/gevent as conexões são OffloadedConnection.
+    """
+
+    def __init__(self, db_path, size, readonly=False, timeout=POOL_TIMEOUT):
+        self.db_path = db_path
+        self.size = size
+        self.readonly = readonly
+        self.timeout = timeout
+
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._all = []
+
+    def _connect(self):
+        if self.readonly:
+            conn = sqlite3.connect(
+                f'file:{self.db_path}?mode=ro', uri=True,
+                check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT / 1000
+            )
+        else:
+            conn = sqlite3.connect(
+                self.db_path, check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT / 1000
+            )
+
+        conn.row_factory = sqlite3.Row
+        for pragma, value in SQLITE_PRAGMAS.items():
+            conn.execute(f'PRAGMA {pragma} = {value}')
+        if self.readonly:
+            conn.execute('PRAGMA query_only = ON')
+
+        # eventlet/gevent: consultas rodam no pool de threads, fora do loop
+        if GREEN:
+            conn = OffloadedConnection(conn)
+
+        with self._lock:
+            self._all.append(conn)
+        return conn
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # Não fechar: o handle pertence ao processo pai
+            self._idle = queue.LifoQueue()
+            self._slots = threading.BoundedSemaphore(self.size)
+            self._all = []
+            self._pid = os.getpid()
+
+    @contextmanager
+    def connection(self):
+        self._check_fork()
+
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError('pool de conexões esgotado')
+
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+
+            try:
+                yield conn
+            finally:
+                # Não devolver ao pool uma transação aberta
+                if conn.in_transaction:
+                    conn.rollback()
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            connections, self._all = self._all, []
+        self._idle = queue.LifoQueue()
+
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def status(self):
+        return {
+            'size': self.size,
+            'open': len(self._all),
+            'idle': self._idle.qsize()
+        }
+
 
 class Database:
     def __init__(self):
@@ -10,43 +193,378 @@ class Database:
             os.makedirs('data')
         
         self.db_path = 'data/rpg_manager.db'
-        self._local = threading.local()
+        
+        # Um único escritor (o SQLite serializa escritas de qualquer forma) e
+        # um pool de leitores: em WAL, leituras não esperam pelo escritor
+        self.writer = ConnectionPool(self.db_path, size=1)
         self.init_database()
+        self.reader = ConnectionPool(self.db_path, size=READ_POOL_SIZE, readonly=True)
+    
+    def read(self):
+        """Conexão somente leitura (loads, listagens)"""
+        return self.reader.connection()
     
-    def get_connection(self):
-        """Thread-safe connection"""
-        if not hasattr(self._local, 'conn') or self._local.conn is None:
-            self._local.conn = sqlite3.connect(self.db_path, check_same_thread=False)
-            self._local.conn.row_factory = sqlite3.Row
-        return self._local.conn
+    def write(self):
+        """Conexão de escrita (transações são confirmadas pelo chamador)"""
+        return self.writer.connection()
+    
+    def close(self):
+        """Fechar conexões e consolidar o WAL no arquivo principal"""
+        try:
+            with self.write() as conn:
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        except sqlite3.Error as e:
+            print(f'⚠️ Erro no checkpoint do WAL: {e}')
+        
+        self.reader.close()
+        self.writer.close()
+    
+    def pool_status(self):
+        return {'reader': self.reader.status(), 'writer': self.writer.status()}
     
     def init_database(self):
         """Inicializar tabelas com índices"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.write() as conn:
+            # WAL é persistente no arquivo; basta ativar uma vez
+            conn.execute('PRAGMA journal_mode = WAL')
+            
+            cursor = conn.cursor()
+            
+            # Tabela de Sessões (metadados + campos soltos do estado, ex.: grid_settings)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    data TEXT NOT NULL,
+                    version INTEGER DEFAULT 1
+                )
+            ''')
+            
+            # Índice para busca rápida
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_sessions_updated
+                ON sessions(updated_at DESC)
+            ''')
+            
+            # Cenas (sem mapas/entidades/tokens/desenhos/névoa)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS scenes (
+                    session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+                    scene_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    name TEXT,
+                    data TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    PRIMARY KEY (session_id, scene_id)
+                ) WITHOUT ROWID
+            ''')
+            
+            # Camadas de imagem: mapas e entidades de cada cena
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS layers (
+                    session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+                    scene_id TEXT NOT NULL,
+                    layer_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    PRIMARY KEY (session_id, scene_id, kind, layer_id)
+                ) WITHOUT ROWID
+            ''')
+            
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS tokens (
+                    session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+                    scene_id TEXT NOT NULL,
+                    token_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    PRIMARY KEY (session_id, scene_id, token_id)
+                ) WITHOUT ROWID
+            ''')
+            
+            # Desenhos não têm id estável: a posição na lista é a chave
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS drawings (
+                    session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+                    scene_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    PRIMARY KEY (session_id, scene_id, position)
+                ) WITHOUT ROWID
+            ''')
+            
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS fog (
+                    session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+                    scene_id TEXT NOT NULL,
+                    image TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    PRIMARY KEY (session_id, scene_id)
+                ) WITHOUT ROWID
+            ''')
+            
+            # Assets (/assets/<hash>) referenciados por cada sessão
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS session_assets (
+                    session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+                    asset_hash TEXT NOT NULL,
+                    PRIMARY KEY (session_id, asset_hash)
+                ) WITHOUT ROWID
+            ''')
+            
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_session_assets_hash
+                ON session_assets(asset_hash)
+            ''')
+            
+            # Histórico: versões com alterações (parent = versão que o undo restaura)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS session_versions (
+                    session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+                    version INTEGER NOT NULL,
+                    parent INTEGER,
+                    ops INTEGER NOT NULL,
+                    restored_from INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (session_id, version)
+                ) WITHOUT ROWID
+            ''')
+            
+            # Operações de cada versão: linha gravada (value) ou removida (NULL)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS session_ops (
+                    session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+                    version INTEGER NOT NULL,
+                    seq INTEGER NOT NULL,
+                    tbl TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT,
+                    PRIMARY KEY (session_id, version, seq)
+                ) WITHOUT ROWID
+            ''')
+            
+            # Todas as linhas da sessão numa versão (JSON comprimido com zlib)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS session_snapshots (
+                    session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+                    version INTEGER NOT NULL,
+                    data BLOB NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (session_id, version)
+                ) WITHOUT ROWID
+            ''')
+            
+            # Mensagens do chat: uma linha por mensagem, ordem pelo id. Sem FK
+            # para sessions: o chat é gravado antes do primeiro save da sessão
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS chat_messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    conversation_id TEXT NOT NULL,
+                    sender_id TEXT NOT NULL,
+                    sender_name TEXT,
+                    recipient_id TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    timestamp REAL NOT NULL
+                )
+            ''')
+            
+            # Páginas de uma conversa (id < cursor, do mais recente para trás)
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_chat_conversation
+                ON chat_messages(session_id, conversation_id, id)
+            ''')
+            
+            # Índice das conversas (um par de usuários por linha), atualizado a cada mensagem
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS chat_conversations (
+                    session_id TEXT NOT NULL,
+                    conversation_id TEXT NOT NULL,
+                    user_a TEXT NOT NULL,
+                    user_b TEXT NOT NULL,
+                    message_count INTEGER NOT NULL,
+                    last_message_id INTEGER NOT NULL,
+                    last_timestamp REAL NOT NULL,
+                    PRIMARY KEY (session_id, conversation_id)
+                ) WITHOUT ROWID
+            ''')
+            
+            # Rolagens de dados feitas no servidor (detail = termos e dados de cada um)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS dice_rolls (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    roller_id TEXT,
+                    roller_name TEXT,
+                    formula TEXT NOT NULL,
+                    total INTEGER NOT NULL,
+                    detail TEXT NOT NULL,
+                    is_critical INTEGER NOT NULL DEFAULT 0,
+                    is_failure INTEGER NOT NULL DEFAULT 0,
+                    private INTEGER NOT NULL DEFAULT 0,
+                    timestamp REAL NOT NULL
+                )
+            ''')
+            
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_dice_rolls_session
+                ON dice_rolls(session_id, id)
+            ''')
+            
+            # Contadores das rolagens públicas por jogador e fórmula (atualizados a cada rolagem)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS dice_stats (
+                    session_id TEXT NOT NULL,
+                    roller_key TEXT NOT NULL,
+                    formula TEXT NOT NULL,
+                    roller_id TEXT,
+                    roller_name TEXT,
+                    rolls INTEGER NOT NULL,
+                    total_sum INTEGER NOT NULL,
+                    total_squares INTEGER NOT NULL,
+                    criticals INTEGER NOT NULL,
+                    failures INTEGER NOT NULL,
+                    min_total INTEGER NOT NULL,
+                    max_total INTEGER NOT NULL,
+                    PRIMARY KEY (session_id, roller_key, formula)
+                ) WITHOUT ROWID
+            ''')
+            
+            # Notas do mestre (o id vem do cliente nas notas importadas do localStorage)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS notes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    title TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            ''')
+            
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_notes_category
+                ON notes(category, updated_at DESC)
+            ''')
+            
+            # Índice de busca (conteúdo externo = notes), sem acentos e com prefixos de 2-3 letras
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+                    title, body, category,
+                    content='notes', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2',
+                    prefix='2 3'
+                )
+            ''')
+            
+            # Triggers mantêm o índice igual à tabela a cada gravação
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS notes_fts_insert AFTER INSERT ON notes BEGIN
+                    INSERT INTO notes_fts(rowid, title, body, category)
+                    VALUES (new.id, new.title, new.body, new.category);
+                END
+            ''')
+            
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS notes_fts_delete AFTER DELETE ON notes BEGIN
+                    INSERT INTO notes_fts(notes_fts, rowid, title, body, category)
+                    VALUES ('delete', old.id, old.title, old.body, old.category);
+                END
+            ''')
+            
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS notes_fts_update AFTER UPDATE ON notes BEGIN
+                    INSERT INTO notes_fts(notes_fts, rowid, title, body, category)
+                    VALUES ('delete', old.id, old.title, old.body, old.category);
+                    INSERT INTO notes_fts(rowid, title, body, category)
+                    VALUES (new.id, new.title, new.body, new.category);
+                END
+            ''')
+            
+            conn.commit()
+            
+            self.migrate(conn)
         
-        # Tabela de Sessões (simplificada)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sessions (
-                session_id TEXT PRIMARY KEY,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                data TEXT NOT NULL,
-                version INTEGER DEFAULT 1
-            )
-        ''')
+        print('✅ Banco de dados inicializado')
+    
+    def migrate(self, conn):
+        """
+        Migrar sessões do schema 1 (blob único) para as tabelas normalizadas
         
-        # Índice para busca rápida
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_sessions_updated 
-            ON sessions(updated_at DESC)
-        ''')
+        Cada sessão é dividida em linhas e sessions.data fica só com os campos
+        soltos (grid_settings, timestamp...). Roda numa única transação.
+        """
+        current = conn.execute('PRAGMA user_version').fetchone()[0]
+        if current >= SCHEMA_VERSION:
+            return
         
-        conn.commit()
-        print('✅ Banco de dados inicializado')
+        cursor = conn.cursor()
+        migrated = 0
+        
+        try:
+            # Schemas 2 → 3 → 4, 5 → 6 e 7 → 8 só criam tabelas novas (histórico, chat, dados, notas)
+            rows = cursor.execute('SELECT session_id, data FROM sessions').fetchall() if current < 2 else []
+            
+            # Backfills por faixa (um banco pode pular várias versões de uma vez).
+            # Cada um recalcula tudo com INSERT OR REPLACE: rodar de novo, ou sobre
+            # linhas já gravadas, dá o mesmo resultado
+            
+            # < 5: montar o índice das conversas com as mensagens já gravadas
+            if current < 5:
+                cursor.execute('''
+                    INSERT OR REPLACE INTO chat_conversations
+                        (session_id, conversation_id, user_a, user_b, message_count, last_message_id, last_timestamp)
+                    SELECT session_id, conversation_id, MIN(sender_id, recipient_id), MAX(sender_id, recipient_id),
+                           COUNT(*), MAX(id), MAX(timestamp)
+                    FROM chat_messages
+                    GROUP BY session_id, conversation_id
+                ''')
+            
+            # < 7: contadores das rolagens já gravadas
+            if current < 7:
+                cursor.execute('''
+                    INSERT OR REPLACE INTO dice_stats
+                        (session_id, roller_key, formula, roller_id, roller_name, rolls, total_sum,
+                         total_squares, criticals, failures, min_total, max_total)
+                    SELECT session_id, COALESCE(roller_id, roller_name, ''), formula, roller_id, MAX(roller_name),
+                           COUNT(*), SUM(total), SUM(total * total), SUM(is_critical), SUM(is_failure),
+                           MIN(total), MAX(total)
+                    FROM dice_rolls
+                    WHERE private = 0
+                    GROUP BY session_id, COALESCE(roller_id, roller_name, ''), formula
+                ''')
+            
+            for row in rows:
+                try:
+                    data = json.loads(row['data'])
+                except ValueError:
+                    print(f'⚠️ Sessão {row["session_id"]} com JSON inválido - mantida como está')
+                    continue
+                
+                if not isinstance(data, dict):
+                    continue
+                
+                self._write_session(cursor, row['session_id'], data, history=False)
+                migrated += 1
+            
+            cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            conn.commit()
+            
+        except Exception as e:
+            conn.rollback()
+            print(f'❌ Erro na migração do banco: {e}')
+            raise
+        
+        if migrated:
+            print(f'🔄 {migrated} sessões migradas para o schema {SCHEMA_VERSION}')
     
     # ==================
-    # SESSÕES - CRUD SIMPLES
+    # SESSÕES - GRAVAÇÃO
     # ==================
     
     def save_session(self, session_id, data):
@@ -57,149 +575,1080 @@ class Database:
             session_id: ID da sessão
             data: Dict contendo {images, tokens, drawings, fogImage, scenes, grid_settings}
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         try:
-            # Serializar dados
-            data_json = json.dumps(data, ensure_ascii=False)
-            
-            # Verificar se existe
-            cursor.execute('SELECT version FROM sessions WHERE session_id = ?', (session_id,))
-            result = cursor.fetchone()
-            
-            if result:
-                # Update com versionamento
-                new_version = result['version'] + 1
-                cursor.execute('''
-                    UPDATE sessions 
-                    SET data = ?, updated_at = CURRENT_TIMESTAMP, version = ?
-                    WHERE session_id = ?
-                ''', (data_json, new_version, session_id))
-            else:
-                # Insert novo
-                cursor.execute('''
-                    INSERT INTO sessions (session_id, data, version)
-                    VALUES (?, ?, 1)
-                ''', (session_id, data_json))
-            
-            conn.commit()
-            print(f'💾 Sessão {session_id} salva (versão {new_version if result else 1})')
+            self.save_sessions([(session_id, data)])
             return True
             
         except Exception as e:
             print(f'❌ Erro ao salvar sessão: {e}')
-            conn.rollback()
             return False
     
+    def save_sessions(self, items):
+        """
+        Salvar várias sessões numa única transação (usado pela fila de gravação)
+        
+        Só as linhas que mudaram são escritas: cada linha guarda o digest do
+        seu JSON e as que vieram iguais são ignoradas. As linhas gravadas e
+        removidas vão para o log de operações da nova versão (histórico).
+        
+        Args:
+            items: Lista de (session_id, data)
+        
+        Returns:
+            Número de sessões gravadas
+        
+        Raises:
+            sqlite3.Error: a transação inteira é desfeita
+        """
+        # Imagens embutidas viram referências /assets/<hash> (fora da conexão de escrita)
+        for _, data in items:
+            assets.externalize(data)
+        
+        with self.write() as conn:
+            cursor = conn.cursor()
+            
+            try:
+                for session_id, data in items:
+                    self._write_session(cursor, session_id, data)
+                conn.commit()
+                
+            except Exception:
+                conn.rollback()
+                raise
+        
+        print(f'💾 {len(items)} sessão(ões) salva(s) em lote')
+        return len(items)
+    
+    def _write_session(self, cursor, session_id, data, history=True):
+        """Dividir o estado da sessão em linhas e gravar apenas as diferenças"""
+        scenes = data.get('scenes') or []
+        remainder = {
+            key: value for key, value in data.items()
+            if key != 'scenes' and key not in LEGACY_ROW_FIELDS
+        }
+        
+        rows = {table: [] for table in ROW_TABLES if table != 'sessions'}
+        
+        for position, scene in enumerate(scenes):
+            if not isinstance(scene, dict) or not scene.get('id'):
+                continue
+            
+            scene_id = str(scene['id'])
+            meta = _dumps({k: v for k, v in scene.items() if k not in SCENE_ROW_FIELDS})
+            rows['scenes'].append((session_id, scene_id, position, scene.get('name'), meta, _digest(meta)))
+            
+            self._collect_scene(
+                session_id, scene_id,
+                (('map', scene.get('maps')), ('entity', scene.get('entities'))),
+                scene.get('tokens'), scene.get('drawings'), scene.get('fog_image'),
+                rows['layers'], rows['tokens'], rows['drawings'], rows['fog']
+            )
+        
+        # Estado legado (sem cenas) vive no escopo LEGACY_SCENE_ID
+        self._collect_scene(
+            session_id, LEGACY_SCENE_ID,
+            (('image', data.get('images')),),
+            data.get('tokens'), data.get('drawings'), data.get('fogImage'),
+            rows['layers'], rows['tokens'], rows['drawings'], rows['fog']
+        )
+        
+        return self._apply_rows(cursor, session_id, _dumps(remainder), rows, history=history)
+    
+    def _apply_rows(self, cursor, session_id, remainder, rows, history=True, restored_from=None):
+        """
+        Deixar as linhas da sessão iguais a `rows` e registrar a versão no histórico
+        
+        rows: tabela -> tuplas (session_id, *chave, *valores, digest)
+        Retorna a nova versão (ou None sem histórico, como na migração).
+        """
+        # Primeira gravação com histórico: snapshot do estado anterior como base
+        base = None
+        if history and not cursor.execute(
+            'SELECT 1 FROM session_snapshots WHERE session_id = ? LIMIT 1', (session_id,)
+        ).fetchone():
+            base = self._read_rows(cursor, session_id)
+        
+        previous = cursor.execute(
+            'SELECT data, version FROM sessions WHERE session_id = ?', (session_id,)
+        ).fetchone()
+        
+        # Na migração a versão e a data de atualização ficam como estavam
+        touch = 'updated_at = CURRENT_TIMESTAMP, version = sessions.version + 1,' if history else ''
+        cursor.execute(f'''
+            INSERT INTO sessions (session_id, data, version)
+            VALUES (?, ?, 1)
+            ON CONFLICT(session_id) DO UPDATE SET
+                {touch}
+                data = excluded.data
+        ''', (session_id, remainder))
+        
+        ops = []
+        if previous is None or previous['data'] != remainder:
+            ops.append(('sessions', (), (remainder,)))
+        
+        for table, table_rows in rows.items():
+            ops.extend(self._sync_rows(cursor, table, session_id, table_rows))
+        
+        self._sync_assets(cursor, session_id, (row[-2] for table in (
+            'scenes', 'layers', 'tokens', 'drawings'
+        ) for row in rows[table]))
+        
+        if not history:
+            return None
+        
+        version = previous['version'] + 1 if previous else 1
+        if base is not None:
+            self._write_snapshot(cursor, session_id, previous['version'] if previous else 0, base)
+            if previous:
+                # Estado de antes do histórico também pode ser restaurado (undo)
+                cursor.execute('''
+                    INSERT OR IGNORE INTO session_versions (session_id, version, parent, ops)
+                    VALUES (?, ?, NULL, 0)
+                ''', (session_id, previous['version']))
+        if ops:
+            self._record_version(cursor, session_id, version, ops, restored_from)
+        return version
+    
+    def _collect_scene(self, session_id, scene_id, layer_groups, tokens, drawings, fog_image,
+                       layer_rows, token_rows, drawing_rows, fog_rows):
+        for kind, items in layer_groups:
+            for position, item_id, text in self._keyed_items(items):
+                layer_rows.append((session_id, scene_id, kind, item_id, position, text, _digest(text)))
+        
+        for position, item_id, text in self._keyed_items(tokens):
+            token_rows.append((session_id, scene_id, item_id, position, text, _digest(text)))
+        
+        # Traços simplificados e agrupados (os antigos viram imagem)
+        for position, drawing in enumerate(compact_drawings(drawings) or []):
+            text = _dumps(drawing)
+            drawing_rows.append((session_id, scene_id, position, text, _digest(text)))
+        
+        if fog_image:
+            fog_rows.append((session_id, scene_id, fog_image, _digest(fog_image)))
+    
+    def _keyed_items(self, items):
+        """(posição, id, json) de cada item; ids ausentes/repetidos usam a posição"""
+        seen = set()
+        for position, item in enumerate(items or []):
+            item_id = item.get('id') if isinstance(item, dict) else None
+            item_id = str(item_id) if item_id is not None else None
+            if item_id is None or item_id in seen:
+                item_id = f'#{position}'
+            seen.add(item_id)
+            yield position, item_id, _dumps(item)
+    
+    def _sync_rows(self, cursor, table, session_id, rows):
+        """
+        Deixar as linhas da sessão em `table` iguais a `rows`
+        
+        rows: tuplas (session_id, *chave, *valores, digest)
+        Linhas com o mesmo digest (e mesma posição) não são reescritas.
+        Retorna as operações: (tabela, chave, valores) ou (tabela, chave, None).
+        """
+        key_columns, value_columns = ROW_TABLES[table]
+        columns = ('session_id',) + key_columns + value_columns + ('digest',)
+        keys = ', '.join(('session_id',) + key_columns)
+        size = len(key_columns)
+        
+        # O que decide se a linha mudou: digest (+ posição, se for valor)
+        compared = ('digest', 'position') if 'position' in value_columns else ('digest',)
+        existing = {
+            tuple(row)[:size]: tuple(row)[size:] for row in cursor.execute(
+                f'SELECT {", ".join(key_columns + compared)} FROM {table} WHERE session_id = ?',
+                (session_id,)
+            )
+        }
+        
+        changed = []
+        for row in rows:
+            key = tuple(row[1:1 + size])
+            current = existing.pop(key, None)
+            marker = (row[-1], row[1 + size + value_columns.index('position')]) if len(compared) > 1 else (row[-1],)
+            if current != marker:
+                changed.append(row)
+        
+        updates = ', '.join(f'{c} = excluded.{c}' for c in value_columns + ('digest',))
+        cursor.executemany(f'''
+            INSERT INTO {table} ({', '.join(columns)})
+            VALUES ({', '.join('?' for _ in columns)})
+            ON CONFLICT({keys}) DO UPDATE SET {updates}
+        ''', changed)
+        
+        # Remover as linhas que saíram do estado
+        if existing:
+            conditions = ' AND '.join(f'{c} = ?' for c in key_columns)
+            cursor.executemany(
+                f'DELETE FROM {table} WHERE session_id = ? AND {conditions}',
+                [(session_id, *key) for key in existing]
+            )
+        
+        return (
+            [(table, tuple(row[1:1 + size]), tuple(row[1 + size:])) for row in changed] +
+            [(table, key, None) for key in existing]
+        )
+    
+    def _sync_assets(self, cursor, session_id, texts):
+        referenced = set()
+        for text in texts:
+            referenced |= assets.references(text)
+        
+        existing = {
+            row['asset_hash'] for row in cursor.execute(
+                'SELECT asset_hash FROM session_assets WHERE session_id = ?', (session_id,)
+            )
+        }
+        
+        cursor.executemany(
+            'INSERT INTO session_assets (session_id, asset_hash) VALUES (?, ?)',
+            [(session_id, h) for h in referenced - existing]
+        )
+        cursor.executemany(
+            'DELETE FROM session_assets WHERE session_id = ? AND asset_hash = ?',
+            [(session_id, h) for h in existing - referenced]
+        )
+    
+    # ==================
+    # SESSÕES - LEITURA
+    # ==================
+    
     def load_session(self, session_id):
         """Carregar estado da sessão"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.read() as conn:
+            cursor = conn.cursor()
+            
+            try:
+                cursor.execute('''
+                    SELECT data, version, updated_at
+                    FROM sessions
+                    WHERE session_id = ?
+                ''', (session_id,))
+                
+                result = cursor.fetchone()
+                
+                if result:
+                    data = json.loads(result['data'])
+                    data.update(self._load_scopes(cursor, session_id))
+                    print(f'✅ Sessão {session_id} carregada (versão {result["version"]})')
+                    return {
+                        'data': data,
+                        'version': result['version'],
+                        'updated_at': result['updated_at']
+                    }
+                
+                print(f'ℹ️ Sessão {session_id} não encontrada')
+                return None
+                
+            except Exception as e:
+                print(f'❌ Erro ao carregar sessão: {e}')
+                return None
+    
+    def list_scenes(self, session_id):
+        """Cenas da sessão, só com os metadados (sem camadas, tokens e névoa)"""
+        with self.read() as conn:
+            try:
+                rows = conn.execute('''
+                    SELECT data FROM scenes
+                    WHERE session_id = ?
+                    ORDER BY position
+                ''', (session_id,)).fetchall()
+                return [json.loads(row['data']) for row in rows]
+                
+            except Exception as e:
+                print(f'❌ Erro ao listar cenas: {e}')
+                return []
+    
+    def load_scene(self, session_id, scene_id):
+        """Carregar uma única cena completa, sem ler o resto da campanha"""
+        with self.read() as conn:
+            cursor = conn.cursor()
+            
+            try:
+                row = cursor.execute('''
+                    SELECT data FROM scenes
+                    WHERE session_id = ? AND scene_id = ?
+                ''', (session_id, scene_id)).fetchone()
+                
+                if not row:
+                    return None
+                
+                scene = json.loads(row['data'])
+                scene.update(self._load_scope(cursor, session_id, scene_id))
+                return scene
+                
+            except Exception as e:
+                print(f'❌ Erro ao carregar cena: {e}')
+                return None
+    
+    def stream_session(self, session_id, first_scene_id=None):
+        """
+        Gerar a sessão em seções, uma de cada vez (para o load em NDJSON)
         
-        try:
-            cursor.execute('''
-                SELECT data, version, updated_at 
-                FROM sessions 
+        Ordem: 'meta' (campos soltos + versão), 'scenes' (só metadados),
+        'scene' para cada cena (a ativa primeiro), 'legacy' (estado sem
+        cenas, se houver) e 'end'. Cada cena é lida com uma conexão própria,
+        então nenhuma conexão fica presa enquanto o cliente baixa o resto.
+        Retorna None se a sessão não existir.
+        """
+        with self.read() as conn:
+            row = conn.execute('''
+                SELECT data, version, updated_at
+                FROM sessions
                 WHERE session_id = ?
-            ''', (session_id,))
+            ''', (session_id,)).fetchone()
             
-            result = cursor.fetchone()
+            if not row:
+                return None
             
-            if result:
-                data = json.loads(result['data'])
-                print(f'✅ Sessão {session_id} carregada (versão {result["version"]})')
-                return {
-                    'data': data,
-                    'version': result['version'],
-                    'updated_at': result['updated_at']
-                }
+            meta = {
+                'type': 'meta',
+                'session_id': session_id,
+                'version': row['version'],
+                'updated_at': row['updated_at'],
+                'data': json.loads(row['data'])
+            }
+        
+        scenes = self.list_scenes(session_id)
+        ids = [scene.get('id') for scene in scenes]
+        
+        if first_scene_id not in ids:
+            first_scene_id = ids[-1] if ids else None
+        meta['active_scene_id'] = first_scene_id
+        
+        def sections():
+            yield meta
+            yield {'type': 'scenes', 'scenes': scenes}
             
-            print(f'ℹ️ Sessão {session_id} não encontrada')
-            return None
+            order = [first_scene_id] + [i for i in ids if i != first_scene_id] if ids else []
+            for scene_id in order:
+                scene = self.load_scene(session_id, scene_id)
+                if scene:
+                    yield {'type': 'scene', 'scene': scene}
             
-        except Exception as e:
-            print(f'❌ Erro ao carregar sessão: {e}')
+            with self.read() as conn:
+                scope = self._load_scope(conn.cursor(), session_id, LEGACY_SCENE_ID)
+            
+            legacy = {
+                'images': scope.get('images', []),
+                'tokens': scope['tokens'],
+                'drawings': scope['drawings']
+            }
+            if scope['fog_image']:
+                legacy['fogImage'] = scope['fog_image']
+            
+            if any(legacy.values()):
+                yield {'type': 'legacy', 'data': legacy}
+            
+            yield {'type': 'end', 'scene_count': len(ids)}
+        
+        return sections()
+    
+    def _load_scope(self, cursor, session_id, scene_id):
+        """Campos de linha (mapas, entidades, tokens, desenhos, névoa) de uma cena"""
+        scope = {'maps': [], 'entities': [], 'tokens': [], 'drawings': [], 'fog_image': None}
+        
+        for row in cursor.execute('''
+            SELECT kind, data FROM layers
+            WHERE session_id = ? AND scene_id = ?
+            ORDER BY position
+        ''', (session_id, scene_id)):
+            scope[LAYER_FIELDS[row['kind']]].append(json.loads(row['data']))
+        
+        scope['tokens'] = [json.loads(row['data']) for row in cursor.execute('''
+            SELECT data FROM tokens
+            WHERE session_id = ? AND scene_id = ?
+            ORDER BY position
+        ''', (session_id, scene_id))]
+        
+        scope['drawings'] = [json.loads(row['data']) for row in cursor.execute('''
+            SELECT data FROM drawings
+            WHERE session_id = ? AND scene_id = ?
+            ORDER BY position
+        ''', (session_id, scene_id))]
+        
+        fog = cursor.execute(
+            'SELECT image FROM fog WHERE session_id = ? AND scene_id = ?',
+            (session_id, scene_id)
+        ).fetchone()
+        if fog:
+            scope['fog_image'] = fog['image']
+        
+        return scope
+    
+    def _load_scopes(self, cursor, session_id):
+        """Remontar scenes[] e o estado legado a partir das linhas"""
+        return self._assemble_scopes(self._read_rows(cursor, session_id))
+    
+    def _read_rows(self, cursor, session_id):
+        """Todas as linhas da sessão: tabela -> {chave: (*valores, digest)}"""
+        rows = {}
+        for table, (key_columns, value_columns) in ROW_TABLES.items():
+            columns = key_columns + value_columns + (('digest',) if table != 'sessions' else ())
+            size = len(key_columns)
+            rows[table] = {
+                tuple(row)[:size]: tuple(row)[size:] for row in cursor.execute(
+                    f'SELECT {", ".join(columns)} FROM {table} WHERE session_id = ?',
+                    (session_id,)
+                )
+            }
+        return rows
+    
+    def _assemble_scopes(self, rows):
+        """scenes[] e estado legado a partir das linhas (ver _read_rows)"""
+        def by_position(items, index=0):
+            return sorted(items, key=lambda item: item[1][index])
+        
+        scenes = {}
+        for (scene_id,), (position, name, data, digest) in by_position(rows['scenes'].items()):
+            scene = json.loads(data)
+            scene.update({'maps': [], 'entities': [], 'tokens': [], 'drawings': [], 'fog_image': None})
+            scenes[scene_id] = scene
+        
+        legacy = {'images': [], 'tokens': [], 'drawings': []}
+        
+        def target(scene_id):
+            return scenes.get(scene_id) if scene_id != LEGACY_SCENE_ID else legacy
+        
+        for (scene_id, kind, _), (position, data, digest) in by_position(rows['layers'].items()):
+            scope = target(scene_id)
+            if scope is not None:
+                scope[LAYER_FIELDS[kind]].append(json.loads(data))
+        
+        for (scene_id, _), (position, data, digest) in by_position(rows['tokens'].items()):
+            scope = target(scene_id)
+            if scope is not None:
+                scope['tokens'].append(json.loads(data))
+        
+        # Desenhos: a posição é parte da chave
+        for (scene_id, position), (data, digest) in sorted(rows['drawings'].items(), key=lambda item: item[0][1]):
+            scope = target(scene_id)
+            if scope is not None:
+                scope['drawings'].append(json.loads(data))
+        
+        for (scene_id,), (image, digest) in rows['fog'].items():
+            if scene_id == LEGACY_SCENE_ID:
+                legacy['fogImage'] = image
+            elif scene_id in scenes:
+                scenes[scene_id]['fog_image'] = image
+        
+        result = {'scenes': list(scenes.values())}
+        if any(legacy.values()):
+            result.update(legacy)
+        return result
+    
+    # ==================
+    # SESSÕES - HISTÓRICO
+    # ==================
+    #
+    # Cada save com alterações vira uma versão em session_versions, com as
+    # linhas gravadas/removidas em session_ops. A cada SNAPSHOT_INTERVAL
+    # versões (ou SNAPSHOT_MAX_OPS operações) todas as linhas vão para
+    # session_snapshots; o estado de qualquer versão é o snapshot anterior
+    # mais as operações seguintes, sem reprocessar o histórico inteiro.
+    
+    def _write_snapshot(self, cursor, session_id, version, rows):
+        packed = {
+            table: [list(key) + list(values) for key, values in table_rows.items()]
+            for table, table_rows in rows.items()
+        }
+        cursor.execute('''
+            INSERT OR REPLACE INTO session_snapshots (session_id, version, data)
+            VALUES (?, ?, ?)
+        ''', (session_id, version, zlib.compress(_dumps(packed).encode('utf-8'))))
+    
+    def _record_version(self, cursor, session_id, version, ops, restored_from=None):
+        """Registrar versão + operações; tirar snapshot e podar o histórico se preciso"""
+        if restored_from is None:
+            # Save normal: o undo volta para a última versão registrada
+            last = cursor.execute('''
+                SELECT version FROM session_versions
+                WHERE session_id = ? ORDER BY version DESC LIMIT 1
+            ''', (session_id,)).fetchone()
+            parent = last['version'] if last else None
+        else:
+            # Restore: mesmo estado da versão restaurada, então o mesmo undo
+            origin = self._version_entry(cursor, session_id, restored_from)
+            parent = origin['parent'] if origin else None
+        
+        cursor.execute('''
+            INSERT OR REPLACE INTO session_versions (session_id, version, parent, ops, restored_from)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (session_id, version, parent, len(ops), restored_from))
+        
+        cursor.executemany('''
+            INSERT OR REPLACE INTO session_ops (session_id, version, seq, tbl, key, value)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [
+            (session_id, version, seq, table, _dumps(list(key)), _dumps(list(values)) if values is not None else None)
+            for seq, (table, key, values) in enumerate(ops)
+        ])
+        
+        snapshot = cursor.execute(
+            'SELECT MAX(version) AS version FROM session_snapshots WHERE session_id = ?', (session_id,)
+        ).fetchone()['version'] or 0
+        
+        pending = cursor.execute('''
+            SELECT COUNT(*) AS versions, COALESCE(SUM(ops), 0) AS ops
+            FROM session_versions WHERE session_id = ? AND version > ?
+        ''', (session_id, snapshot)).fetchone()
+        
+        if pending['versions'] >= SNAPSHOT_INTERVAL or pending['ops'] >= SNAPSHOT_MAX_OPS:
+            self._write_snapshot(cursor, session_id, version, self._read_rows(cursor, session_id))
+            self._prune_history(cursor, session_id)
+    
+    def _prune_history(self, cursor, session_id, keep=HISTORY_VERSIONS):
+        """Descartar versões além das `keep` mais recentes (a partir de um snapshot)"""
+        oldest = cursor.execute('''
+            SELECT version FROM session_versions
+            WHERE session_id = ? ORDER BY version DESC LIMIT 1 OFFSET ?
+        ''', (session_id, keep - 1)).fetchone()
+        if not oldest:
+            return
+        
+        base = cursor.execute('''
+            SELECT MAX(version) AS version FROM session_snapshots
+            WHERE session_id = ? AND version <= ?
+        ''', (session_id, oldest['version'])).fetchone()['version']
+        if base is None:
+            return
+        
+        cursor.execute('DELETE FROM session_snapshots WHERE session_id = ? AND version < ?', (session_id, base))
+        cursor.execute('DELETE FROM session_ops WHERE session_id = ? AND version <= ?', (session_id, base))
+        cursor.execute('DELETE FROM session_versions WHERE session_id = ? AND version < ?', (session_id, base))
+    
+    def _version_entry(self, cursor, session_id, version):
+        """Versão registrada que vale para `version` (a última até ela)"""
+        return cursor.execute('''
+            SELECT version, parent FROM session_versions
+            WHERE session_id = ? AND version <= ?
+            ORDER BY version DESC LIMIT 1
+        ''', (session_id, version)).fetchone()
+    
+    def _rows_at(self, cursor, session_id, version):
+        """Linhas da sessão na versão pedida: snapshot anterior + operações até ela"""
+        snapshot = cursor.execute('''
+            SELECT version, data FROM session_snapshots
+            WHERE session_id = ? AND version <= ?
+            ORDER BY version DESC LIMIT 1
+        ''', (session_id, version)).fetchone()
+        if not snapshot:
             return None
+        
+        packed = json.loads(zlib.decompress(snapshot['data']))
+        rows = {}
+        for table, (key_columns, _) in ROW_TABLES.items():
+            size = len(key_columns)
+            rows[table] = {tuple(item[:size]): tuple(item[size:]) for item in packed.get(table, [])}
+        
+        for op in cursor.execute('''
+            SELECT tbl, key, value FROM session_ops
+            WHERE session_id = ? AND version > ? AND version <= ?
+            ORDER BY version, seq
+        ''', (session_id, snapshot['version'], version)):
+            key = tuple(json.loads(op['key']))
+            if op['value'] is None:
+                rows[op['tbl']].pop(key, None)
+            else:
+                rows[op['tbl']][key] = tuple(json.loads(op['value']))
+        
+        return rows
     
-    def delete_session(self, session_id):
-        """Deletar sessão"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def session_history(self, session_id, limit=50):
+        """Versões com alterações, da mais recente para a mais antiga"""
+        with self.read() as conn:
+            try:
+                rows = conn.execute('''
+                    SELECT v.version, v.parent, v.ops, v.restored_from, v.created_at,
+                           s.version IS NOT NULL AS snapshot
+                    FROM session_versions v
+                    LEFT JOIN session_snapshots s
+                        ON s.session_id = v.session_id AND s.version = v.version
+                    WHERE v.session_id = ?
+                    ORDER BY v.version DESC
+                    LIMIT ?
+                ''', (session_id, limit)).fetchall()
+                return [dict(row) for row in rows]
+                
+            except Exception as e:
+                print(f'❌ Erro ao listar histórico: {e}')
+                return []
+    
+    def load_session_version(self, session_id, version):
+        """Estado da sessão numa versão anterior (None se fora do histórico)"""
+        with self.read() as conn:
+            try:
+                current = conn.execute(
+                    'SELECT version FROM sessions WHERE session_id = ?', (session_id,)
+                ).fetchone()
+                rows = self._rows_at(conn.cursor(), session_id, version) if current and version <= current['version'] else None
+                if not rows or () not in rows['sessions']:
+                    return None
+                
+                data = json.loads(rows['sessions'][()][0])
+                data.update(self._assemble_scopes(rows))
+                return {'data': data, 'version': version}
+                
+            except Exception as e:
+                print(f'❌ Erro ao carregar versão {version} da sessão: {e}')
+                return None
+    
+    def restore_session(self, session_id, version):
+        """
+        Voltar a sessão para o estado de uma versão anterior
         
-        try:
-            cursor.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
-            conn.commit()
-            print(f'🗑️ Sessão {session_id} deletada')
-            return True
+        O restore é gravado como uma versão nova (com as operações que
+        desfazem as posteriores), então também pode ser desfeito.
+        Retorna a nova versão, ou None se a versão não está no histórico.
+        """
+        with self.write() as conn:
+            cursor = conn.cursor()
             
-        except Exception as e:
-            print(f'❌ Erro ao deletar sessão: {e}')
-            conn.rollback()
-            return False
+            try:
+                current = cursor.execute(
+                    'SELECT version FROM sessions WHERE session_id = ?', (session_id,)
+                ).fetchone()
+                rows = self._rows_at(cursor, session_id, version) if current and version <= current['version'] else None
+                if not rows or () not in rows['sessions']:
+                    return None
+                
+                remainder = rows.pop('sessions')[()][0]
+                table_rows = {
+                    table: [(session_id, *key, *values) for key, values in items.items()]
+                    for table, items in rows.items()
+                }
+                new_version = self._apply_rows(cursor, session_id, remainder, table_rows,
+                                               restored_from=version)
+                conn.commit()
+                
+            except Exception:
+                conn.rollback()
+                raise
+        
+        print(f'⏪ Sessão {session_id} restaurada para a versão {version} (nova versão {new_version})')
+        return new_version
     
-    def list_sessions(self, limit=50):
-        """Listar sessões recentes"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def undo_session(self, session_id):
+        """Restaurar a versão anterior à atual (sobrevive a reinícios); None se não houver"""
+        with self.read() as conn:
+            current = conn.execute('''
+                SELECT parent FROM session_versions
+                WHERE session_id = ? ORDER BY version DESC LIMIT 1
+            ''', (session_id,)).fetchone()
         
-        try:
-            cursor.execute('''
-                SELECT session_id, created_at, updated_at, version
-                FROM sessions 
-                ORDER BY updated_at DESC 
-                LIMIT ?
-            ''', (limit,))
+        if not current or current['parent'] is None:
+            return None
+        return self.restore_session(session_id, current['parent'])
+    
+    # ==================
+    # CHAT
+    # ==================
+    
+    def add_chat_message(self, session_id, conversation_id, message):
+        """Gravar mensagem do chat; retorna o id (crescente, usado como cursor)"""
+        with self.write() as conn:
+            cursor = conn.cursor()
             
-            results = cursor.fetchall()
-            return [dict(row) for row in results]
+            try:
+                cursor.execute('''
+                    INSERT INTO chat_messages
+                        (session_id, conversation_id, sender_id, sender_name, recipient_id, message, timestamp)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    session_id, conversation_id, message['sender_id'], message.get('sender_name'),
+                    message['recipient_id'], message['message'], message['timestamp']
+                ))
+                message_id = cursor.lastrowid
+                
+                # Índice da conversa (mesma transação)
+                user_a, user_b = sorted((message['sender_id'], message['recipient_id']))
+                cursor.execute('''
+                    INSERT INTO chat_conversations
+                        (session_id, conversation_id, user_a, user_b, message_count, last_message_id, last_timestamp)
+                    VALUES (?, ?, ?, ?, 1, ?, ?)
+                    ON CONFLICT (session_id, conversation_id) DO UPDATE SET
+                        message_count = message_count + 1,
+                        last_message_id = excluded.last_message_id,
+                        last_timestamp = excluded.last_timestamp
+                ''', (session_id, conversation_id, user_a, user_b, message_id, message['timestamp']))
+                
+                conn.commit()
+                return message_id
+                
+            except Exception:
+                conn.rollback()
+                raise
+    
+    def chat_messages(self, session_id, conversation_id, before=None, limit=50):
+        """Até `limit` mensagens da conversa com id < before, em ordem cronológica"""
+        with self.read() as conn:
+            try:
+                rows = conn.execute('''
+                    SELECT id, sender_id, sender_name, recipient_id, message, timestamp
+                    FROM chat_messages
+                    WHERE session_id = ? AND conversation_id = ? AND id < ?
+                    ORDER BY id DESC
+                    LIMIT ?
+                ''', (session_id, conversation_id, before if before is not None else 2 ** 63 - 1, limit)).fetchall()
+                return [dict(row) for row in reversed(rows)]
+                
+            except Exception as e:
+                print(f'❌ Erro ao carregar mensagens do chat: {e}')
+                return []
+    
+    def chat_conversations(self, session_id, exclude=None):
+        """Conversas da sessão (sem as que envolvem `exclude`), a mais recente primeiro"""
+        with self.read() as conn:
+            try:
+                rows = conn.execute('''
+                    SELECT conversation_id, user_a, user_b, message_count, last_message_id, last_timestamp
+                    FROM chat_conversations
+                    WHERE session_id = ? AND user_a IS NOT ? AND user_b IS NOT ?
+                    ORDER BY last_message_id DESC
+                ''', (session_id, exclude, exclude)).fetchall()
+                return [dict(row) for row in rows]
+                
+            except Exception as e:
+                print(f'❌ Erro ao listar conversas do chat: {e}')
+                return []
+    
+    # ==================
+    # DADOS
+    # ==================
+    
+    def add_dice_rolls(self, session_id, rolls):
+        """Gravar várias rolagens numa transação; retorna os ids na mesma ordem"""
+        with self.write() as conn:
+            cursor = conn.cursor()
             
-        except Exception as e:
-            print(f'❌ Erro ao listar sessões: {e}')
-            return []
+            try:
+                ids = []
+                for roll in rolls:
+                    cursor.execute('''
+                        INSERT INTO dice_rolls
+                            (session_id, roller_id, roller_name, formula, total, detail,
+                             is_critical, is_failure, private, timestamp)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', (
+                        session_id, roll.get('roller_id'), roll.get('roller_name'), roll['formula'],
+                        roll['total'], _dumps({'terms': roll['terms'], 'breakdown': roll['breakdown']}),
+                        roll['is_critical'], roll['is_failure'], roll.get('private', False), roll['timestamp']
+                    ))
+                    ids.append(cursor.lastrowid)
+                    
+                    if not roll.get('private'):
+                        self._count_dice_roll(cursor, session_id, roll)
+                
+                conn.commit()
+                return ids
+                
+            except Exception:
+                conn.rollback()
+                raise
     
-    def cleanup_old_sessions(self, days=30):
-        """Limpar sessões antigas"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def _count_dice_roll(self, cursor, session_id, roll):
+        """Atualizar os contadores de dice_stats (mesma transação da rolagem)"""
+        roller_key = roll.get('roller_id') or roll.get('roller_name') or ''
+        total = roll['total']
+        cursor.execute('''
+            INSERT INTO dice_stats
+                (session_id, roller_key, formula, roller_id, roller_name, rolls, total_sum,
+                 total_squares, criticals, failures, min_total, max_total)
+            VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (session_id, roller_key, formula) DO UPDATE SET
+                roller_name = excluded.roller_name,
+                rolls = rolls + 1,
+                total_sum = total_sum + excluded.total_sum,
+                total_squares = total_squares + excluded.total_squares,
+                criticals = criticals + excluded.criticals,
+                failures = failures + excluded.failures,
+                min_total = MIN(min_total, excluded.min_total),
+                max_total = MAX(max_total, excluded.max_total)
+        ''', (
+            session_id, roller_key, roll['formula'], roll.get('roller_id'), roll.get('roller_name'),
+            total, total * total, int(roll['is_critical']), int(roll['is_failure']), total, total
+        ))
+    
+    def dice_stats(self, session_id):
+        """Contadores das rolagens públicas da sessão (uma linha por jogador e fórmula)"""
+        with self.read() as conn:
+            try:
+                rows = conn.execute('''
+                    SELECT roller_key, formula, roller_id, roller_name, rolls, total_sum,
+                           total_squares, criticals, failures, min_total, max_total
+                    FROM dice_stats
+                    WHERE session_id = ?
+                    ORDER BY roller_key, rolls DESC
+                ''', (session_id,)).fetchall()
+                return [dict(row) for row in rows]
+                
+            except Exception as e:
+                print(f'❌ Erro ao carregar estatísticas de dados: {e}')
+                return []
+    
+    def dice_history(self, session_id, before=None, limit=50, include_private=False, roller_id=None):
+        """
+        Rolagens da sessão com id < before, da mais recente para a mais antiga
         
-        try:
-            cursor.execute('''
-                DELETE FROM sessions 
-                WHERE updated_at < datetime('now', '-' || ? || ' days')
-            ''', (days,))
+        Rolagens privadas só entram com include_private (mestre) ou, com
+        roller_id, as do próprio jogador.
+        """
+        with self.read() as conn:
+            try:
+                rows = conn.execute('''
+                    SELECT id, roller_id, roller_name, formula, total, detail,
+                           is_critical, is_failure, private, timestamp
+                    FROM dice_rolls
+                    WHERE session_id = ? AND id < ? AND (private = 0 OR ? OR roller_id = ?)
+                    ORDER BY id DESC
+                    LIMIT ?
+                ''', (session_id, before if before is not None else 2 ** 63 - 1, include_private,
+                      roller_id, limit)).fetchall()
+                
+                history = []
+                for row in rows:
+                    entry = dict(row)
+                    entry.update(json.loads(entry.pop('detail')))
+                    for flag in ('is_critical', 'is_failure', 'private'):
+                        entry[flag] = bool(entry[flag])
+                    history.append(entry)
+                return history
+                
+            except Exception as e:
+                print(f'❌ Erro ao carregar histórico de rolagens: {e}')
+                return []
+    
+    # ==================
+    # NOTAS
+    # ==================
+    
+    def save_notes(self, notes):
+        """
+        Criar/atualizar notas numa transação (uma nota por save no uso normal)
+        
+        Cada nota: {id?, title, body, category, created_at?, updated_at?};
+        sem id, o banco gera um. Retorna as notas gravadas. Título vazio
+        levanta ValueError.
+        """
+        now = datetime.now(timezone.utc).isoformat()
+        rows = []
+        for note in notes:
+            title = str(note.get('title') or '').strip()
+            if not title:
+                raise ValueError('título obrigatório')
+            category = note.get('category') if note.get('category') in NOTE_CATEGORIES else 'other'
+            rows.append((
+                note.get('id'), title, str(note.get('body') or ''), category,
+                note.get('created_at') or now, note.get('updated_at') or now
+            ))
+        
+        with self.write() as conn:
+            cursor = conn.cursor()
             
-            deleted = cursor.rowcount
-            conn.commit()
-            print(f'🧹 {deleted} sessões antigas removidas')
-            return deleted
+            try:
+                ids = []
+                for row in rows:
+                    cursor.execute('''
+                        INSERT INTO notes (id, title, body, category, created_at, updated_at)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (id) DO UPDATE SET
+                            title = excluded.title,
+                            body = excluded.body,
+                            category = excluded.category,
+                            updated_at = excluded.updated_at
+                    ''', row)
+                    ids.append(row[0] if row[0] is not None else cursor.lastrowid)
+                
+                conn.commit()
+                
+            except Exception:
+                conn.rollback()
+                raise
             
-        except Exception as e:
-            print(f'❌ Erro ao limpar sessões: {e}')
-            conn.rollback()
-            return 0
+            placeholders = ', '.join('?' * len(ids))
+            saved = cursor.execute(
+                f'SELECT * FROM notes WHERE id IN ({placeholders})', ids
+            ).fetchall() if ids else []
+            return [dict(row) for row in saved]
     
-    def get_session_size(self, session_id):
-        """Obter tamanho da sessão em MB"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def list_notes(self, category=None, limit=None):
+        """Notas da mais recente para a mais antiga (category None = todas)"""
+        with self.read() as conn:
+            try:
+                rows = conn.execute('''
+                    SELECT * FROM notes
+                    WHERE ? IS NULL OR category = ?
+                    ORDER BY updated_at DESC
+                    LIMIT ?
+                ''', (category, category, limit if limit is not None else -1)).fetchall()
+                return [dict(row) for row in rows]
+                
+            except Exception as e:
+                print(f'❌ Erro ao listar notas: {e}')
+                return []
+    
+    def note_counts(self):
+        """Quantidade de notas por categoria"""
+        with self.read() as conn:
+            rows = conn.execute('SELECT category, COUNT(*) AS count FROM notes GROUP BY category').fetchall()
+            return {row['category']: row['count'] for row in rows}
+    
+    def delete_note(self, note_id):
+        """Deletar nota (o índice de busca é atualizado pelo trigger)"""
+        with self.write() as conn:
+            try:
+                deleted = conn.execute('DELETE FROM notes WHERE id = ?', (note_id,)).rowcount
+                conn.commit()
+                return deleted > 0
+                
+            except Exception as e:
+                print(f'❌ Erro ao deletar nota: {e}')
+                conn.rollback()
+                return False
+    
+    def search_notes(self, query, category=None, limit=50):
+        """
+        Busca por relevância (bm25, título pesa mais) com prefixo em cada palavra
         
-        try:
-            cursor.execute('''
-                SELECT length(data) as size 
-                FROM sessions 
-                WHERE session_id = ?
-            ''', (session_id,))
+        'gob rei' encontra 'Goblin' e 'Reino'; acentos são ignorados.
+        """
+        words = re.findall(r'\w+', str(query or '').lower())
+        if not words:
+            return []
+        match = ' '.join(f'"{word}"*' for word in words)
+        
+        with self.read() as conn:
+            try:
+                rows = conn.execute(f'''
+                    SELECT notes.*, bm25(notes_fts, {', '.join(map(str, NOTE_SEARCH_WEIGHTS))}) AS rank
+                    FROM notes_fts
+                    JOIN notes ON notes.id = notes_fts.rowid
+                    WHERE notes_fts MATCH ? AND (? IS NULL OR notes.category = ?)
+                    ORDER BY rank
+                    LIMIT ?
+                ''', (match, category, category, limit)).fetchall()
+                return [dict(row) for row in rows]
+                
+            except Exception as e:
+                print(f'❌ Erro na busca de notas: {e}')
+                return []
+    
+    # ==================
+    # SESSÕES - MANUTENÇÃO
+    # ==================
+    
+    def delete_session(self, session_id):
+        """Deletar sessão (as linhas das outras tabelas vão em cascata)"""
+        with self.write() as conn:
+            cursor = conn.cursor()
             
-            result = cursor.fetchone()
-            if result:
-                size_mb = result['size'] / (1024 * 1024)
-                return round(size_mb, 2)
+            try:
+                cursor.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+                cursor.execute('DELETE FROM chat_messages WHERE session_id = ?', (session_id,))
+                cursor.execute('DELETE FROM chat_conversations WHERE session_id = ?', (session_id,))
+                cursor.execute('DELETE FROM dice_rolls WHERE session_id = ?', (session_id,))
+                cursor.execute('DELETE FROM dice_stats WHERE session_id = ?', (session_id,))
+                conn.commit()
+                print(f'🗑️ Sessão {session_id} deletada')
+                return True
+                
+            except Exception as e:
+                print(f'❌ Erro ao deletar sessão: {e}')
+                conn.rollback()
+                return False
+    
+    def list_sessions(self, limit=50):
+        """Listar sessões recentes"""
+        with self.read() as conn:
+            cursor = conn.cursor()
             
-            return 0
+            try:
+                cursor.execute('''
+                    SELECT session_id, created_at, updated_at, version
+                    FROM sessions
+                    ORDER BY updated_at DESC
+                    LIMIT ?
+                ''', (limit,))
+                
+                results = cursor.fetchall()
+                return [dict(row) for row in results]
+                
+            except Exception as e:
+                print(f'❌ Erro ao listar sessões: {e}')
+                return []
+    
+    def cleanup_old_sessions(self, days=30):
+        """Limpar sessões antigas"""
+        with self.write() as conn:
+            cursor = conn.cursor()
             
-        except Exception as e:
-            print(f'❌ Erro ao calcular tamanho: {e}')
-            return 0
+            try:
+                cursor.execute('''
+                    DELETE FROM sessions
+                    WHERE updated_at < datetime('now', '-' || ? || ' days')
+                ''', (days,))
+                
+                deleted = cursor.rowcount
+                
+                # Chat de sessões que não existem mais (ou nunca foram salvas)
+                cursor.execute('''
+                    DELETE FROM chat_messages
+                    WHERE session_id NOT IN (SELECT session_id FROM sessions)
+                    AND timestamp < (strftime('%s', 'now') - ? * 86400) * 1000
+                ''', (days,))
+                cursor.execute('''
+                    DELETE FROM chat_conversations
+                    WHERE session_id NOT IN (SELECT session_id FROM sessions)
+                    AND last_timestamp < (strftime('%s', 'now') - ? * 86400) * 1000
+                ''', (days,))
+                cursor.execute('''
+                    DELETE FROM dice_rolls
+                    WHERE session_id NOT IN (SELECT session_id FROM sessions)
+                    AND timestamp < (strftime('%s', 'now') - ? * 86400) * 1000
+                ''', (days,))
+                cursor.execute('''
+                    DELETE FROM dice_stats
+                    WHERE session_id NOT IN (SELECT session_id FROM sessions)
+                    AND session_id NOT IN (SELECT session_id FROM dice_rolls)
+                ''')
+                
+                conn.commit()
+                print(f'🧹 {deleted} sessões antigas removidas')
+                return deleted
+                
+            except Exception as e:
+                print(f'❌ Erro ao limpar sessões: {e}')
+                conn.rollback()
+                return 0
+    
+    def get_session_size(self, session_id):
+        """Obter tamanho da sessão em MB (somando todas as tabelas)"""
+        with self.read() as conn:
+            cursor = conn.cursor()
+            
+            try:
+                cursor.execute('''
+                    SELECT
+                        (SELECT COALESCE(SUM(length(data)), 0) FROM sessions WHERE session_id = :id) +
+                        (SELECT COALESCE(SUM(length(data)), 0) FROM scenes WHERE session_id = :id) +
+                        (SELECT COALESCE(SUM(length(data)), 0) FROM layers WHERE session_id = :id) +
+                        (SELECT COALESCE(SUM(length(data)), 0) FROM tokens WHERE session_id = :id) +
+                        (SELECT COALESCE(SUM(length(data)), 0) FROM drawings WHERE session_id = :id) +
+                        (SELECT COALESCE(SUM(length(image)), 0) FROM fog WHERE session_id = :id) +
+                        (SELECT COALESCE(SUM(length(data)), 0) FROM session_snapshots WHERE session_id = :id) +
+                        (SELECT COALESCE(SUM(length(value)), 0) FROM session_ops WHERE session_id = :id) +
+                        (SELECT COALESCE(SUM(length(message)), 0) FROM chat_messages WHERE session_id = :id)
+                        AS size
+                ''', {'id': session_id})
+                
+                result = cursor.fetchone()
+                if result:
+                    size_mb = result['size'] / (1024 * 1024)
+                    return round(size_mb, 2)
+                
+                return 0
+                
+            except Exception as e:
+                print(f'❌ Erro ao calcular tamanho: {e}')
+                return 0
 
-db = Database()
\ No newline at end of file
+db = Database()
+atexit.register(db.close)
@@ -0,0 +1,219 @@
+import os
+import re
+
+# Limites de segurança para fórmulas vindas do cliente
+MAX_FORMULA_LENGTH = 100
+MAX_TERMS = 20
+MAX_DICE = 1000          # dados por termo
+MAX_SIDES = 1000
+MAX_EXPLOSIONS = 100     # dados extras por termo explosivo
+
+# Termo: [+-] NdS[modificadores] ou constante; d% = d100
+_TERM_PATTERN = re.compile(r'([+-]?)(?:(\d*)d(\d+|%)((?:kh\d*|kl\d*|dh\d*|dl\d*|adv|dis|!)*)|(\d+))')
+_MODIFIER_PATTERN = re.compile(r'(kh|kl|dh|dl)(\d*)|adv|dis|!')
+
+
+class DiceTerm:
+    """Um termo da fórmula: grupo de dados (NdS com keep/drop/explosão) ou constante"""
+
+    __slots__ = ('sign', 'count', 'sides', 'keep', 'explode', 'constant')
+
+    def __init__(self, sign, count=0, sides=0, keep=None, explode=False, constant=0):
+        self.sign = sign
+        self.count = count
+        self.sides = sides
+        # ('high' | 'low', quantos dados ficam) ou None = todos
+        self.keep = keep
+        self.explode = explode
+        self.constant = constant
+
+    @property
+    def is_dice(self):
+        return self.sides > 0
+
+    def __str__(self):
+        if not self.is_dice:
+            return str(self.constant)
+        text = f'{self.count}d{self.sides}'
+        if self.explode:
+            text += '!'
+        if self.keep:
+            text += f'{"kh" if self.keep[0] == "high" else "kl"}{self.keep[1]}'
+        return text
+
+
+def parse_formula(formula):
+    """
+    '4d6kh3+2', 'd20adv', '2d6!-1', 'd%' → lista de DiceTerm
+
+    Modificadores: khN/klN (manter os N maiores/menores), dhN/dlN
+    (descartar), adv/dis (2d20 mantendo o maior/menor) e ! (explodir no
+    valor máximo). Fórmulas inválidas levantam ValueError.
+    """
+    text = str(formula or '').strip().lower()
+    if re.search(r'\d\s+\d', text):
+        raise ValueError(f'fórmula inválida: {formula}')
+    text = re.sub(r'\s+', '', text)
+    if not text:
+        raise ValueError('fórmula vazia')
+    if len(text) > MAX_FORMULA_LENGTH:
+        raise ValueError('fórmula longa demais')
+
+    terms = []
+    position = 0
+    while position < len(text):
+        match = _TERM_PATTERN.match(text, position)
+        if not match or match.end() == position or (terms and not match.group(1)):
+            raise ValueError(f'fórmula inválida: {formula}')
+        position = match.end()
+
+        sign = -1 if match.group(1) == '-' else 1
+        if match.group(5) is not None:
+            terms.append(DiceTerm(sign, constant=int(match.group(5))))
+        else:
+            terms.append(_dice_term(sign, match.group(2), match.group(3), match.group(4)))
+
+        if len(terms) > MAX_TERMS:
+            raise ValueError('termos demais na fórmula')
+
+    return terms
+
+
+def format_formula(terms):
+    """Fórmula normalizada dos termos ('d20adv' → '2d20kh1')"""
+    return ''.join(
+        f'{"-" if term.sign < 0 else ("+" if index else "")}{term}'
+        for index, term in enumerate(terms)
+    )
+
+
+def _dice_term(sign, count, sides, modifiers):
+    count = int(count) if count else 1
+    sides = 100 if sides == '%' else int(sides)
+    keep = None
+    explode = False
+
+    for match in _MODIFIER_PATTERN.finditer(modifiers):
+        modifier = match.group(0)
+        if modifier == '!':
+            explode = True
+        elif modifier in ('adv', 'dis'):
+            if count > 2:
+                raise ValueError('vantagem/desvantagem é para um dado só')
+            count = 2
+            keep = ('high' if modifier == 'adv' else 'low', 1)
+        else:
+            kind, amount = match.group(1), int(match.group(2) or 1)
+            if kind == 'kh':
+                keep = ('high', amount)
+            elif kind == 'kl':
+                keep = ('low', amount)
+            elif kind == 'dh':
+                keep = ('low', count - amount)
+            else:
+                keep = ('high', count - amount)
+
+    if not 1 <= count <= MAX_DICE:
+        raise ValueError(f'quantidade de dados fora do limite (1-{MAX_DICE})')
+    if not 2 <= sides <= MAX_SIDES:
+        raise ValueError(f'número de faces fora do limite (2-{MAX_SIDES})')
+    if keep and not 0 < keep[1] <= count:
+        raise ValueError('manter/descartar mais dados do que rolados')
+    if keep and keep[1] == count:
+        keep = None
+
+    return DiceTerm(sign, count, sides, keep, explode)
+
+
+class DiceRoller:
+    """
+    Rolagens com o CSPRNG do sistema (os.urandom), sorteadas em lote
+
+    Cada lote pede todos os bytes de uma vez e converte com rejeição
+    (valores acima do último múltiplo de `sides` são sorteados de novo),
+    então todos os resultados são equiprováveis.
+    """
+
+    def batch(self, count, sides):
+        """`count` resultados de 1 a `sides`"""
+        limit = (1 << 32) // sides * sides
+        rolls = []
+        while len(rolls) < count:
+            raw = memoryview(os.urandom(4 * (count - len(rolls)))).cast('I')
+            rolls.extend(value % sides + 1 for value in raw if value < limit)
+        return rolls
+
+    def roll_term(self, term):
+        """Resultado de um termo: {'dice', 'rolls', 'dropped', 'value'}"""
+        if not term.is_dice:
+            return {'dice': str(term), 'rolls': [], 'dropped': [], 'value': term.sign * term.constant}
+
+        rolls = self.batch(term.count, term.sides)
+
+        if term.explode:
+            pending = rolls.count(term.sides)
+            extra = 0
+            while pending and extra < MAX_EXPLOSIONS:
+                pending = min(pending, MAX_EXPLOSIONS - extra)
+                more = self.batch(pending, term.sides)
+                rolls.extend(more)
+                extra += pending
+                pending = more.count(term.sides)
+
+        dropped = []
+        if term.keep:
+            kind, amount = term.keep
+            order = sorted(range(len(rolls)), key=rolls.__getitem__, reverse=kind == 'high')
+            dropped = sorted(order[amount:])
+
+        skip = set(dropped)
+        value = sum(roll for index, roll in enumerate(rolls) if index not in skip)
+        return {'dice': str(term), 'rolls': rolls, 'dropped': dropped, 'value': term.sign * value}
+
+    def roll(self, formula):
+        """
+        Rolar uma fórmula
+
+        Retorna {'formula', 'total', 'terms', 'breakdown', 'dice_type',
+        'is_critical', 'is_failure'}; crítico/falha só valem para fórmulas
+        com um único d20 mantido (1d20+N, d20adv...).
+        """
+        terms = parse_formula(formula)
+        results = [self.roll_term(term) for term in terms]
+
+        breakdown = ''
+        for index, (term, result) in enumerate(zip(terms, results)):
+            sign = '-' if term.sign < 0 else ('+' if index else '')
+
+            # Dados descartados aparecem entre parênteses: [6, 5, 4, (2)]
+            if term.is_dice:
+                shown = ', '.join(
+                    f'({roll})' if i in result['dropped'] else str(roll)
+                    for i, roll in enumerate(result['rolls'])
+                )
+                part = f'[{shown}]'
+            else:
+                part = str(term.constant)
+            breakdown += f' {sign} {part}' if index else f'{sign}{part}'
+
+        dice_terms = [(term, result) for term, result in zip(terms, results) if term.is_dice]
+        is_critical = is_failure = False
+        if len(dice_terms) == 1:
+            term, result = dice_terms[0]
+            kept = [roll for i, roll in enumerate(result['rolls']) if i not in result['dropped']]
+            if term.sides == 20 and len(kept) == 1:
+                is_critical = kept[0] == 20
+                is_failure = kept[0] == 1
+
+        return {
+            'formula': format_formula(terms),
+            'total': sum(result['value'] for result in results),
+            'terms': results,
+            'breakdown': breakdown,
+            'dice_type': f'd{dice_terms[0][0].sides}' if dice_terms else '',
+            'is_critical': is_critical,
+            'is_failure': is_failure
+        }
+
+
+roller = DiceRoller()
@@ -0,0 +1,292 @@
+import math
+from functools import lru_cache
+
+from app.dice import format_formula, parse_formula
+
+# NumPy é opcional: sem ele as convoluções rodam em Python puro
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Maior número de resultados possíveis numa distribuição (max - min + 1)
+MAX_OUTCOMES = 200000
+
+# Sem NumPy: maior convolução (multiplicações) feita em Python puro
+MAX_PYTHON_CONVOLUTION = 4000000
+
+# Manter/descartar: limite de faces² × mantidos³ (custo da distribuição exata)
+MAX_KEEP_WORK = 5000000
+
+# Dados explosivos: cauda cortada quando a probabilidade fica abaixo disso
+EXPLODE_EPSILON = 1e-12
+
+
+class DistributionTooLarge(ValueError):
+    """Distribuição exata grande demais: formula_stats cai para os momentos"""
+
+
+def _array(probs):
+    if numpy is not None:
+        array = numpy.asarray(probs, dtype=float)
+        array.setflags(write=False)  # compartilhado pelo cache
+        return array
+    return tuple(probs)
+
+
+def _convolve(a, b):
+    """Convolução de duas listas de probabilidades"""
+    if numpy is not None:
+        return _array(numpy.convolve(a, b))
+
+    if len(a) * len(b) > MAX_PYTHON_CONVOLUTION:
+        raise DistributionTooLarge('distribuição grande demais sem NumPy (pip install numpy)')
+    result = [0.0] * (len(a) + len(b) - 1)
+    for i, p in enumerate(a):
+        if p:
+            for j, q in enumerate(b):
+                result[i + j] += p * q
+    return tuple(result)
+
+
+class Distribution:
+    """Distribuição discreta: probs[i] = P(resultado = offset + i)"""
+
+    __slots__ = ('offset', 'probs')
+
+    def __init__(self, offset, probs):
+        self.offset = offset
+        self.probs = probs
+
+    def __add__(self, other):
+        if len(self.probs) + len(other.probs) - 1 > MAX_OUTCOMES:
+            raise DistributionTooLarge('resultados possíveis demais para calcular a distribuição')
+        return Distribution(self.offset + other.offset, _convolve(self.probs, other.probs))
+
+    def negate(self):
+        return Distribution(-(self.offset + len(self.probs) - 1), _array(self.probs[::-1]))
+
+    def shift(self, amount):
+        return Distribution(self.offset + amount, self.probs)
+
+    def stats(self):
+        values = range(self.offset, self.offset + len(self.probs))
+        if numpy is not None:
+            points = numpy.arange(self.offset, self.offset + len(self.probs))
+            mean = float(points @ self.probs)
+            variance = float((points - mean) ** 2 @ self.probs)
+        else:
+            mean = sum(v * p for v, p in zip(values, self.probs))
+            variance = sum((v - mean) ** 2 * p for v, p in zip(values, self.probs))
+        outcomes = [(v, float(p)) for v, p in zip(values, self.probs) if p > 0]
+
+        return {
+            'mean': round(mean, 6),
+            'variance': round(variance, 6),
+            'std_dev': round(math.sqrt(max(variance, 0)), 6),
+            'min': outcomes[0][0],
+            'max': outcomes[-1][0],
+            'distribution': outcomes
+        }
+
+
+@lru_cache(maxsize=256)
+def dice_sum(count, sides):
+    """Soma de `count` dados de `sides` faces (metades reaproveitadas do cache)"""
+    if count == 1:
+        return Distribution(1, _array([1 / sides] * sides))
+    half = count // 2
+    return dice_sum(half, sides) + dice_sum(count - half, sides)
+
+
+@lru_cache(maxsize=256)
+def exploding_die(sides):
+    """Um dado explosivo: s*j + r com j explosões (cauda abaixo de EXPLODE_EPSILON cortada)"""
+    depth = max(1, math.ceil(math.log(EXPLODE_EPSILON) / math.log(1 / sides)))
+    probs = [0.0] * (sides * depth)
+    for j in range(depth):
+        for face in range(1, sides):
+            probs[sides * j + face - 1] = (1 / sides) ** (j + 1)
+    return Distribution(1, _array(probs))
+
+
+@lru_cache(maxsize=256)
+def exploding_sum(count, sides):
+    if count == 1:
+        return exploding_die(sides)
+    half = count // 2
+    return exploding_sum(half, sides) + exploding_sum(count - half, sides)
+
+
+@lru_cache(maxsize=256)
+def keep_highest(count, sides, keep):
+    """
+    Soma dos `keep` maiores de `count` dados
+
+    Percorre as faces da maior para a menor: dado que os dados restantes
+    são ≤ v, o número dos que mostram v é binomial(restantes, 1/v). O
+    estado é (dados mantidos até agora, soma); com `keep` dados mantidos
+    a soma não muda mais e o estado sai do laço.
+    """
+    if sides ** 2 * keep ** 3 > MAX_KEEP_WORK:
+        raise ValueError('manter/descartar grande demais para calcular a distribuição exata')
+
+    states = {(0, 0): 1.0}
+    done = [0.0] * (keep * sides + 1)
+    for face in range(sides, 0, -1):
+        following = {}
+        for (kept, total), p in states.items():
+            remaining = count - kept
+            need = keep - kept
+            if face == 1:
+                # Todos os restantes mostram 1
+                done[total + need] += p
+                continue
+
+            tail = 1.0
+            for c in range(need):
+                q = math.comb(remaining, c) * (1 / face) ** c * ((face - 1) / face) ** (remaining - c)
+                tail -= q
+                key = (kept + c, total + c * face)
+                following[key] = following.get(key, 0.0) + p * q
+            done[total + need * face] += p * max(tail, 0.0)
+        states = following
+
+    return Distribution(keep, _array(done[keep:]))
+
+
+def term_distribution(term):
+    if not term.is_dice:
+        dist = Distribution(term.constant, _array([1.0]))
+    elif term.explode and term.keep:
+        raise ValueError('distribuição de dados explosivos com manter/descartar não é suportada')
+    elif term.explode:
+        dist = exploding_sum(term.count, term.sides)
+    elif term.keep and term.keep[0] == 'high':
+        dist = keep_highest(term.count, term.sides, term.keep[1])
+    elif term.keep:
+        # Menores k de X = k*(s+1) - maiores k de (s+1-X)
+        dist = keep_highest(term.count, term.sides, term.keep[1]).negate().shift(term.keep[1] * (term.sides + 1))
+    else:
+        dist = dice_sum(term.count, term.sides)
+    return dist.negate() if term.sign < 0 else dist
+
+
+def term_moments(term):
+    """
+    Média, variância, mínimo e máximo de um termo sem montar a distribuição
+
+    Dados independentes somam média e variância, então basta a distribuição
+    de um dado só; manter/descartar usa a distribuição exata (já limitada).
+    """
+    if term.is_dice and term.keep:
+        stats = term_distribution(term).stats()
+        return stats['mean'], stats['variance'], stats['min'], stats['max']
+
+    if term.is_dice:
+        die = (exploding_die(term.sides) if term.explode else dice_sum(1, term.sides)).stats()
+        mean, variance = term.count * die['mean'], term.count * die['variance']
+        low, high = term.count * die['min'], term.count * die['max']
+    else:
+        mean, variance, low, high = term.constant, 0.0, term.constant, term.constant
+
+    if term.sign < 0:
+        return -mean, variance, -high, -low
+    return mean, variance, low, high
+
+
+def _moment_stats(normalized, moments):
+    """Estatísticas sem a distribuição (fórmulas grandes demais para a exata)"""
+    mean = sum(m[0] for m in moments)
+    variance = sum(m[1] for m in moments)
+
+    return {
+        'formula': normalized,
+        'mean': round(mean, 6),
+        'variance': round(variance, 6),
+        'std_dev': round(math.sqrt(variance), 6),
+        'min': sum(m[2] for m in moments),
+        'max': sum(m[3] for m in moments),
+        'distribution': None
+    }
+
+
+@lru_cache(maxsize=512)
+def _formula_stats(normalized):
+    terms = parse_formula(normalized)
+    moments = [term_moments(term) for term in terms]
+
+    # Tamanho da distribuição conhecido de antemão: não começar convoluções
+    # que estourariam MAX_OUTCOMES no fim
+    if 1 + sum(high - low for _, _, low, high in moments) > MAX_OUTCOMES:
+        return _moment_stats(normalized, moments)
+
+    try:
+        dist = term_distribution(terms[0])
+        for term in terms[1:]:
+            dist = dist + term_distribution(term)
+    except DistributionTooLarge:
+        return _moment_stats(normalized, moments)
+
+    return {'formula': normalized, **dist.stats()}
+
+
+def formula_stats(formula):
+    """
+    Valor esperado, variância e distribuição exata de uma fórmula
+
+    Fórmulas grandes demais para a distribuição exata (ou para o Python puro,
+    sem NumPy) trazem só média, variância, mínimo e máximo, com
+    distribution = None. Levanta ValueError para fórmulas inválidas ou
+    manter/descartar grande demais. O resultado é cacheado pela fórmula
+    normalizada ('d20adv' = '2d20kh1').
+    """
+    return _formula_stats(format_formula(parse_formula(formula)))
+
+
+def expected_mean(formula):
+    """Média esperada da fórmula, ou None se não dá para calcular"""
+    try:
+        return formula_stats(formula)['mean']
+    except ValueError:
+        return None
+
+
+def player_stats(rows):
+    """
+    Estatísticas por jogador a partir dos contadores do banco (db.dice_stats)
+
+    Para cada fórmula: média e desvio observados ao lado da média esperada,
+    então dá para ver quem está com sorte (ou azar) acima do normal.
+    """
+    players = {}
+    for row in rows:
+        player = players.setdefault(row['roller_key'], {
+            'roller_id': row['roller_id'],
+            'roller_name': row['roller_name'],
+            'rolls': 0,
+            'criticals': 0,
+            'failures': 0,
+            'formulas': []
+        })
+
+        rolls = row['rolls']
+        mean = row['total_sum'] / rolls
+        variance = max(row['total_squares'] / rolls - mean ** 2, 0)
+
+        player['rolls'] += rolls
+        player['criticals'] += row['criticals']
+        player['failures'] += row['failures']
+        player['formulas'].append({
+            'formula': row['formula'],
+            'rolls': rolls,
+            'mean': round(mean, 3),
+            'std_dev': round(math.sqrt(variance), 3),
+            'expected_mean': expected_mean(row['formula']),
+            'min': row['min_total'],
+            'max': row['max_total'],
+            'criticals': row['criticals'],
+            'failures': row['failures']
+        })
+
+    return sorted(players.values(), key=lambda player: player['rolls'], reverse=True)
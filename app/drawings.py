@@ -0,0 +1,400 @@
+import hashlib
+import io
+import json
+import re
+
+from PIL import Image, ImageDraw
+
+from app.assets import assets, asset_url
+
+# Tolerância (px) da simplificação Ramer–Douglas–Peucker
+DRAWING_TOLERANCE = 1.0
+
+# Coordenadas são arredondadas para múltiplos deste valor (px)
+DRAWING_QUANTUM = 1
+
+# Com mais pontos vetoriais que isso, os traços antigos viram uma imagem
+RASTER_POINT_LIMIT = 20000
+
+# Traços mais recentes que continuam vetoriais após a rasterização
+RASTER_KEEP_STROKES = 200
+
+# A rasterização avança em blocos deste tamanho (traços)
+RASTER_STEP = 500
+
+# Maior lado (px) da camada rasterizada
+RASTER_MAX_SIZE = 4096
+
+_RGB_PATTERN = re.compile(r'rgba?\(\s*([\d.]+)\s*,\s*([\d.]+)\s*,\s*([\d.]+)\s*(?:,\s*([\d.]+)\s*)?\)')
+
+
+# ==================
+# FORMATOS
+# ==================
+#
+#   traço     {id, color, size, path: [{x, y}, ...]}          (formato dos clientes)
+#   grupo     {id, color, size, strokes: [[x0, y0, x1, y1, ...], ...]}
+#   raster    {id, image: '/assets/<hash>', x, y, width, height}
+#
+# Traços consecutivos com a mesma cor e espessura viram um grupo com
+# coordenadas inteiras em arrays planos; os clientes expandem ao receber
+# (DrawingLayers.unpack em drawing_layers.js).
+
+def is_raster(drawing):
+    return 'image' in drawing
+
+
+def is_group(drawing):
+    return 'strokes' in drawing
+
+
+def simplify(points, tolerance=DRAWING_TOLERANCE):
+    """Ramer–Douglas–Peucker iterativo sobre [(x, y), ...]"""
+    if len(points) < 3:
+        return list(points)
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    tolerance_sq = tolerance * tolerance
+
+    while stack:
+        start, end = stack.pop()
+        (x1, y1), (x2, y2) = points[start], points[end]
+        dx, dy = x2 - x1, y2 - y1
+        length_sq = dx * dx + dy * dy
+
+        farthest, max_dist = None, tolerance_sq
+        for i in range(start + 1, end):
+            px, py = points[i]
+            if length_sq:
+                # Distância² até o segmento (área do paralelogramo² / base²)
+                cross = dx * (py - y1) - dy * (px - x1)
+                dist = cross * cross / length_sq
+            else:
+                dist = (px - x1) ** 2 + (py - y1) ** 2
+            if dist > max_dist:
+                farthest, max_dist = i, dist
+
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((start, farthest))
+            stack.append((farthest, end))
+
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def _quantize(value):
+    return int(round(float(value) / DRAWING_QUANTUM) * DRAWING_QUANTUM)
+
+
+def pack_path(path, tolerance=DRAWING_TOLERANCE):
+    """Path de {x, y} → array plano de inteiros, simplificado e sem pontos repetidos"""
+    points = []
+    for point in path or []:
+        try:
+            xy = (_quantize(point['x']), _quantize(point['y']))
+        except (KeyError, TypeError, ValueError):
+            continue
+        if not points or points[-1] != xy:
+            points.append(xy)
+
+    return [coord for point in simplify(points, tolerance) for coord in point]
+
+
+def unpack_path(flat):
+    return [{'x': flat[i], 'y': flat[i + 1]} for i in range(0, len(flat) - 1, 2)]
+
+
+def compact_stroke(drawing):
+    """Traço no formato dos clientes, simplificado e quantizado"""
+    if not isinstance(drawing, dict) or is_raster(drawing) or is_group(drawing):
+        return drawing
+    return {**drawing, 'path': unpack_path(pack_path(drawing.get('path')))}
+
+
+def group_id(color, size, strokes):
+    """Id de um grupo sem id: derivado do conteúdo, igual a cada compactação"""
+    content = json.dumps([color, size, strokes[0]], separators=(',', ':'))
+    return 'g_' + hashlib.sha1(content.encode()).hexdigest()[:12]
+
+
+def _parse_color(color):
+    """'#rgb', '#rrggbb' ou 'rgb[a](...)' → (r, g, b, a); None se desconhecido"""
+    color = (color or '').strip()
+    if color.startswith('#') and len(color) in (4, 7):
+        digits = color[1:] if len(color) == 7 else ''.join(c * 2 for c in color[1:])
+        try:
+            return tuple(int(digits[i:i + 2], 16) for i in (0, 2, 4)) + (255,)
+        except ValueError:
+            return None
+
+    match = _RGB_PATTERN.fullmatch(color)
+    if match:
+        r, g, b, a = match.groups()
+        alpha = float(a) if a is not None else 1.0
+        return (int(float(r)), int(float(g)), int(float(b)), int(max(0.0, min(alpha, 1.0)) * 255))
+    return None
+
+
+class DrawingStore:
+    """
+    Desenhos de uma sessão/cena em formato compacto
+
+    Traços novos são simplificados, quantizados e agrupados com o traço
+    anterior se a cor e a espessura forem as mesmas. Quando a quantidade de
+    pontos passa de RASTER_POINT_LIMIT, os traços mais antigos são
+    desenhados numa imagem (asset /assets/<hash>) e deixam de ocupar espaço
+    no estado, nos saves e nos payloads de cena.
+
+    A rasterização não acontece dentro de add(): quem chama verifica
+    needs_raster() e roda plan_raster() / render() / apply_raster(), com o
+    render (Pillow) fora da transação da sessão.
+    """
+
+    __slots__ = ('items', 'stroke_count', 'point_count', 'raster_retry_at')
+
+    def __init__(self, drawings=None):
+        self.items = []
+        self.stroke_count = 0
+        self.point_count = 0
+        # Após uma rasterização impossível (cor desconhecida, área grande demais)
+        self.raster_retry_at = 0
+        if drawings:
+            self.extend(drawings)
+
+    def __len__(self):
+        return self.stroke_count
+
+    def add(self, drawing):
+        """Adicionar traço (ou grupo/raster já compacto); retorna o item compactado"""
+        if not isinstance(drawing, dict):
+            return None
+
+        if is_raster(drawing):
+            self.items.append(drawing)
+            return drawing
+
+        if is_group(drawing):
+            strokes = [list(map(_quantize, s)) for s in drawing.get('strokes') or [] if len(s) >= 2]
+            meta = {k: v for k, v in drawing.items() if k != 'strokes'}
+        else:
+            flat = pack_path(drawing.get('path'))
+            strokes = [flat] if flat else []
+            meta = {k: v for k, v in drawing.items() if k != 'path'}
+
+        if not strokes:
+            return None
+
+        last = self.items[-1] if self.items else None
+        if (last is not None and is_group(last)
+                and last.get('color') == meta.get('color') and last.get('size') == meta.get('size')):
+            last['strokes'].extend(strokes)
+        else:
+            self.items.append({
+                'id': meta.get('id') or group_id(meta.get('color'), meta.get('size'), strokes),
+                'color': meta.get('color'),
+                'size': meta.get('size'),
+                'strokes': strokes
+            })
+
+        self.stroke_count += len(strokes)
+        self.point_count += sum(len(s) for s in strokes) // 2
+
+        if is_group(drawing):
+            return {**meta, 'strokes': strokes}
+        return {**meta, 'path': unpack_path(strokes[0])}
+
+    def extend(self, drawings):
+        for drawing in drawings or []:
+            self.add(drawing)
+
+    def reset(self, drawings):
+        self.clear()
+        self.extend(drawings)
+
+    def clear(self):
+        self.items = []
+        self.stroke_count = 0
+        self.point_count = 0
+        self.raster_retry_at = 0
+
+    def to_list(self):
+        return self.items
+
+    def needs_raster(self):
+        """Pontos vetoriais demais (e nenhuma tentativa impossível recente)"""
+        return self.point_count > RASTER_POINT_LIMIT and self.stroke_count >= self.raster_retry_at
+
+    # ==================
+    # RASTERIZAÇÃO
+    # ==================
+
+    def rasterize(self, keep_strokes=RASTER_KEEP_STROKES):
+        """
+        Desenhar numa imagem os traços mais antigos (menos os keep_strokes últimos)
+
+        Versão síncrona de plan_raster() → render() → apply_raster(), para
+        quem já roda fora dos handlers (saves). Retorna False se não havia o
+        que fazer ou a imagem não pôde ser gerada.
+        """
+        old = self.plan_raster(keep_strokes)
+        if old is None:
+            return False
+        return self.apply_raster(old, self.render(old))
+
+    def plan_raster(self, keep_strokes=RASTER_KEEP_STROKES):
+        """
+        Parte antiga a rasterizar (cópia, pode ir para outra thread); None se não há
+
+        O corte anda em blocos de RASTER_STEP traços, então saves seguidos do
+        mesmo desenho geram a mesma imagem (mesmo hash) em vez de uma nova.
+        Rasters anteriores entram na nova imagem: sobra no máximo um raster
+        no início da lista.
+        """
+        total = sum(len(item['strokes']) for item in self.items if is_group(item))
+        cut = (total - keep_strokes) // RASTER_STEP * RASTER_STEP
+        if cut <= 0:
+            return None
+        return self._split(cut)[0]
+
+    def apply_raster(self, old, layer):
+        """
+        Trocar a parte antiga pela imagem de render(old)
+
+        Traços novos só entram no fim da lista, então a parte antiga continua
+        a mesma enquanto ninguém limpou/recarregou os desenhos; se mudou, a
+        imagem é descartada. Retorna True se a troca foi feita.
+        """
+        if layer is None:
+            self.raster_retry_at = self.stroke_count + RASTER_STEP
+            return False
+
+        current, kept = self._split(sum(len(item['strokes']) for item in old if is_group(item)))
+        if current != old:
+            return False
+
+        self.items = [layer] + kept
+        self.stroke_count = sum(len(item['strokes']) for item in kept if is_group(item))
+        self.point_count = sum(len(s) for item in kept if is_group(item) for s in item['strokes']) // 2
+        return True
+
+    def _split(self, cut):
+        """(parte antiga com os primeiros `cut` traços + rasters, parte recente)"""
+        old, kept = [], []
+        remaining = cut
+        for item in self.items:
+            if remaining <= 0:
+                kept.append(item)
+            elif is_raster(item):
+                old.append(item)
+            elif len(item['strokes']) <= remaining:
+                # Cópia da lista: o último grupo continua recebendo traços
+                old.append({**item, 'strokes': list(item['strokes'])})
+                remaining -= len(item['strokes'])
+            else:
+                old.append({**item, 'strokes': item['strokes'][:remaining]})
+                kept.append({**item, 'strokes': item['strokes'][remaining:]})
+                remaining = 0
+        return old, kept
+
+    def render(self, items):
+        """
+        Imagem (item raster) com os itens de plan_raster(); None se impossível
+
+        Não lê nem altera o store: roda fora da transação, numa thread real.
+        """
+        # Limites da imagem: rasters anteriores + traços (com a espessura)
+        boxes = []
+        for item in items:
+            if is_raster(item):
+                boxes.append((item['x'], item['y'], item['x'] + item['width'], item['y'] + item['height']))
+            else:
+                pad = int(item.get('size') or 1) + 1
+                for s in item['strokes']:
+                    xs, ys = s[0::2], s[1::2]
+                    boxes.append((min(xs) - pad, min(ys) - pad, max(xs) + pad, max(ys) + pad))
+
+        left = int(min(b[0] for b in boxes))
+        top = int(min(b[1] for b in boxes))
+        width = int(max(b[2] for b in boxes)) - left
+        height = int(max(b[3] for b in boxes)) - top
+
+        if width <= 0 or height <= 0 or max(width, height) > RASTER_MAX_SIZE:
+            return None
+
+        image = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+
+        for item in items:
+            if is_raster(item):
+                previous = self._open_raster(item)
+                if previous is None:
+                    return None
+                image.alpha_composite(previous, (int(item['x']) - left, int(item['y']) - top))
+                continue
+
+            color = _parse_color(item.get('color'))
+            if color is None:
+                return None
+
+            size = max(1, int(round(float(item.get('size') or 1))))
+            for s in item['strokes']:
+                points = [(s[i] - left, s[i + 1] - top) for i in range(0, len(s) - 1, 2)]
+
+                if color[3] == 255:
+                    self._draw_stroke(ImageDraw.Draw(image), points, color, size)
+                    continue
+
+                # Translúcido: cada traço numa camada própria (recortada) para a
+                # transparência não acumular nas junções, como no stroke() do canvas
+                xs, ys = [p[0] for p in points], [p[1] for p in points]
+                box = (max(min(xs) - size, 0), max(min(ys) - size, 0),
+                       min(max(xs) + size + 1, width), min(max(ys) + size + 1, height))
+                layer = Image.new('RGBA', (box[2] - box[0], box[3] - box[1]), (0, 0, 0, 0))
+                shifted = [(x - box[0], y - box[1]) for x, y in points]
+                self._draw_stroke(ImageDraw.Draw(layer), shifted, color[:3] + (255,), size)
+                layer.putalpha(layer.getchannel('A').point(lambda a: a * color[3] // 255))
+                image.alpha_composite(layer, box[:2])
+
+        buffer = io.BytesIO()
+        image.save(buffer, 'PNG')
+        asset_hash = assets.put(buffer.getvalue())
+
+        return {
+            'id': f'raster_{asset_hash[:12]}',
+            'image': asset_url(asset_hash),
+            'x': left,
+            'y': top,
+            'width': width,
+            'height': height
+        }
+
+    @staticmethod
+    def _draw_stroke(draw, points, color, size):
+        if len(points) > 1:
+            draw.line(points, fill=color, width=size, joint='curve')
+        # lineCap = 'round'
+        radius = size / 2
+        for x, y in (points[0], points[-1]):
+            draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=color)
+
+    def _open_raster(self, item):
+        match = re.search(r'([0-9a-f]{64})', item.get('image') or '')
+        if not match or not assets.exists(match.group(1)):
+            return None
+        with Image.open(assets.path_for(match.group(1))) as raster:
+            return raster.convert('RGBA')
+
+
+def compact_drawings(drawings, rasterize=True):
+    """
+    Lista de desenhos (qualquer formato) → lista compacta; usada nos saves e cenas
+
+    rasterize=False só agrupa e simplifica (handlers de socket: sem Pillow).
+    """
+    if not drawings:
+        return drawings
+    store = DrawingStore(drawings)
+    if rasterize and store.needs_raster():
+        store.rasterize()
+    return store.to_list()
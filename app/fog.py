@@ -0,0 +1,384 @@
+import base64
+import io
+import math
+from itertools import groupby
+
+from PIL import Image
+
+# Dimensões do canvas dos clientes (CANVAS_WIDTH/CANVAS_HEIGHT no JS)
+FOG_WIDTH = 2000
+FOG_HEIGHT = 2000
+
+# Tamanho (px) de cada célula da máscara: 2000/4 = 500x500 células
+FOG_CELL_SIZE = 4
+
+# Limites de segurança para operações vindas do cliente
+MAX_OP_POINTS = 4000
+MAX_BRUSH_SIZE = 2000
+
+# Coordenadas ficam a no máximo um canvas de distância das bordas
+# (x em [-FOG_WIDTH, 2*FOG_WIDTH]); raios até cobrir o canvas dali
+MAX_RADIUS = 2 * math.hypot(FOG_WIDTH, FOG_HEIGHT)
+
+# Traço: soma das linhas da máscara tocadas por todos os segmentos
+# (o mestre envia traços longos em partes de FOG_STROKE_CHUNK pontos)
+MAX_STROKE_ROWS = 100000
+
+FOG_MODES = ('reveal', 'cover')
+FOG_SHAPES = ('rect', 'circle', 'polygon', 'stroke', 'all')
+BRUSH_SHAPES = ('circle', 'square')
+
+# Tabela para converter pixels 0/255 em '0'/'1'
+_BIT_TABLE = bytes.maketrans(bytes([0, 255]), b'01')
+
+
+def pack_runs(runs):
+    """Comprimentos do RLE como varints (7 bits por byte, bit alto = continua)"""
+    packed = bytearray()
+    for length in runs:
+        while length >= 0x80:
+            packed.append(length & 0x7f | 0x80)
+            length >>= 7
+        packed.append(length)
+    return bytes(packed)
+
+
+def _number(value):
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError('coordenada inválida')
+    return round(value, 1)
+
+
+def _clamp(value, low, high):
+    return min(max(value, low), high)
+
+
+def _x(value):
+    return _clamp(_number(value), -FOG_WIDTH, 2 * FOG_WIDTH)
+
+
+def _y(value):
+    return _clamp(_number(value), -FOG_HEIGHT, 2 * FOG_HEIGHT)
+
+
+def _points(raw):
+    if not isinstance(raw, list) or not raw:
+        raise ValueError('pontos ausentes')
+    if len(raw) > MAX_OP_POINTS:
+        raise ValueError('pontos demais na operação')
+    return [[_x(p[0]), _y(p[1])] for p in raw]
+
+
+class FogMask:
+    """
+    Máscara de névoa de uma cena, em células de FOG_CELL_SIZE px
+
+    Cada linha é um int Python usado como bitset (bit c = coluna c,
+    1 = coberto). Operações (retângulo, círculo, polígono, traço de pincel)
+    são aplicadas incrementalmente por spans de linha, e o estado completo
+    é transmitido em RLE só quando um cliente precisa ressincronizar.
+    """
+
+    __slots__ = ('cols', 'rows', 'cell_size', 'version', '_rows', '_full')
+
+    def __init__(self, width=FOG_WIDTH, height=FOG_HEIGHT, cell_size=FOG_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cols = math.ceil(width / cell_size)
+        self.rows = math.ceil(height / cell_size)
+        self.version = 0
+        self._full = (1 << self.cols) - 1
+        self._rows = [0] * self.rows
+
+    # ==================
+    # OPERAÇÕES
+    # ==================
+
+    def apply(self, op):
+        """
+        Validar e aplicar uma operação; retorna a operação normalizada
+
+        Formato: {'mode': 'reveal'|'cover', 'shape': ..., <parâmetros>}
+            rect:    x, y, w, h
+            circle:  x, y, r
+            polygon: points [[x, y], ...]
+            stroke:  points [[x, y], ...], size, brush ('circle'|'square')
+            all:     (sem parâmetros)
+
+        Coordenadas fora do canvas são limitadas (ver MAX_RADIUS); a
+        operação retornada já vem com os valores limitados.
+
+        Raises:
+            ValueError: operação malformada
+        """
+        if not isinstance(op, dict):
+            raise ValueError('operação inválida')
+
+        mode = op.get('mode')
+        shape = op.get('shape')
+        if mode not in FOG_MODES or shape not in FOG_SHAPES:
+            raise ValueError(f'operação de névoa desconhecida: {mode}/{shape}')
+
+        covered = mode == 'cover'
+        normalized = {'mode': mode, 'shape': shape}
+
+        if shape == 'rect':
+            # Cortar as bordas (não x e w separados) mantém a área dentro do canvas
+            x, y, w, h = (_number(op[k]) for k in ('x', 'y', 'w', 'h'))
+            x, x2 = _x(x), _x(x + w)
+            y, y2 = _y(y), _y(y + h)
+            w, h = round(x2 - x, 1), round(y2 - y, 1)
+            self._rect(x, y, w, h, covered)
+            normalized.update(x=x, y=y, w=w, h=h)
+
+        elif shape == 'circle':
+            x, y = _x(op['x']), _y(op['y'])
+            r = _clamp(_number(op['r']), 0, round(MAX_RADIUS, 1))
+            self._circle(x, y, r, covered)
+            normalized.update(x=x, y=y, r=r)
+
+        elif shape == 'polygon':
+            points = _points(op.get('points'))
+            self._polygon(points, covered)
+            normalized['points'] = points
+
+        elif shape == 'stroke':
+            points = _points(op.get('points'))
+            size = min(max(_number(op.get('size', 50)), 1), MAX_BRUSH_SIZE)
+            brush = op.get('brush', 'circle')
+            if brush not in BRUSH_SHAPES:
+                raise ValueError(f'pincel desconhecido: {brush}')
+            self._stroke(points, size, brush, covered)
+            normalized.update(points=points, size=size, brush=brush)
+
+        else:
+            self.fill(covered)
+
+        self.version += 1
+        return normalized
+
+    def fill(self, covered):
+        self._rows = [self._full if covered else 0] * self.rows
+
+    def clear(self):
+        self.fill(False)
+        self.version += 1
+
+    def _span(self, row, x0, x1, covered):
+        """Marcar células da linha cujo centro está em [x0, x1]"""
+        if row < 0 or row >= self.rows:
+            return
+
+        c0 = max(math.ceil(x0 / self.cell_size - 0.5), 0)
+        c1 = min(math.floor(x1 / self.cell_size - 0.5), self.cols - 1)
+        if c1 < c0:
+            return
+
+        mask = ((1 << (c1 - c0 + 1)) - 1) << c0
+        if covered:
+            self._rows[row] |= mask
+        else:
+            self._rows[row] &= ~mask
+
+    def _row_range(self, y0, y1):
+        """Linhas cujo centro está em [y0, y1]"""
+        r0 = max(math.ceil(y0 / self.cell_size - 0.5), 0)
+        r1 = min(math.floor(y1 / self.cell_size - 0.5), self.rows - 1)
+        return range(r0, r1 + 1)
+
+    def _center_y(self, row):
+        return (row + 0.5) * self.cell_size
+
+    def _rect(self, x, y, w, h, covered):
+        if w < 0:
+            x, w = x + w, -w
+        if h < 0:
+            y, h = y + h, -h
+
+        for row in self._row_range(y, y + h):
+            self._span(row, x, x + w, covered)
+
+    def _circle(self, cx, cy, radius, covered):
+        for row in self._row_range(cy - radius, cy + radius):
+            dy = self._center_y(row) - cy
+            half = math.sqrt(max(radius * radius - dy * dy, 0))
+            self._span(row, cx - half, cx + half, covered)
+
+    def _polygon(self, points, covered):
+        if len(points) < 3:
+            return
+
+        ys = [p[1] for p in points]
+        edges = list(zip(points, points[1:] + points[:1]))
+
+        # Scanline par/ímpar no centro de cada linha
+        for row in self._row_range(min(ys), max(ys)):
+            y = self._center_y(row)
+            crossings = sorted(
+                x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+                for (x1, y1), (x2, y2) in edges
+                if (y1 <= y < y2) or (y2 <= y < y1)
+            )
+            for x0, x1 in zip(crossings[::2], crossings[1::2]):
+                self._span(row, x0, x1, covered)
+
+    def _stroke(self, points, size, brush, covered):
+        """
+        Pincel arrastado pelos pontos
+
+        Cada segmento vira uma forma só (cápsula para o pincel redondo,
+        hexágono para o quadrado) cortada em intervalos por linha, então o
+        custo depende das linhas tocadas e não do comprimento do segmento.
+        Os intervalos de cada linha são unidos antes de ir para a máscara.
+        """
+        half = size / 2
+        segments = list(zip(points, points[1:])) or [(points[0], points[0])]
+
+        rows = sum(
+            len(self._row_range(min(y1, y2) - half, max(y1, y2) + half))
+            for (_, y1), (_, y2) in segments
+        )
+        if rows > MAX_STROKE_ROWS:
+            raise ValueError('traço grande demais')
+
+        spans = self._square_spans if brush == 'square' else self._round_spans
+        by_row = {}
+        for (x1, y1), (x2, y2) in segments:
+            for row, x0, x1_ in spans(x1, y1, x2, y2, half):
+                by_row.setdefault(row, []).append((x0, x1_))
+
+        for row, intervals in by_row.items():
+            intervals.sort()
+            start, end = intervals[0]
+            for x0, x1 in intervals[1:]:
+                if x0 > end:
+                    self._span(row, start, end, covered)
+                    start = x0
+                end = max(end, x1)
+            self._span(row, start, end, covered)
+
+    def _square_spans(self, x1, y1, x2, y2, half):
+        """Quadrado de lado 2*half arrastado de (x1, y1) a (x2, y2)"""
+        for row in self._row_range(min(y1, y2) - half, max(y1, y2) + half):
+            y = self._center_y(row)
+            if y1 == y2:
+                t0, t1 = 0.0, 1.0
+            else:
+                # Trecho do segmento cujo quadrado alcança esta linha
+                ta = (y - half - y1) / (y2 - y1)
+                tb = (y + half - y1) / (y2 - y1)
+                t0, t1 = max(min(ta, tb), 0.0), min(max(ta, tb), 1.0)
+            xa = x1 + (x2 - x1) * t0
+            xb = x1 + (x2 - x1) * t1
+            yield row, min(xa, xb) - half, max(xa, xb) + half
+
+    def _round_spans(self, x1, y1, x2, y2, radius):
+        """Cápsula: círculos nas pontas + faixa de largura 2*radius entre eles"""
+        length = math.hypot(x2 - x1, y2 - y1)
+        if length:
+            nx, ny = -(y2 - y1) / length * radius, (x2 - x1) / length * radius
+            band = [(x1 + nx, y1 + ny), (x2 + nx, y2 + ny), (x2 - nx, y2 - ny), (x1 - nx, y1 - ny)]
+            edges = list(zip(band, band[1:] + band[:1]))
+
+        for row in self._row_range(min(y1, y2) - radius, max(y1, y2) + radius):
+            y = self._center_y(row)
+            xs = []
+            for cx, cy in ((x1, y1), (x2, y2)):
+                dy = y - cy
+                if abs(dy) <= radius:
+                    half = math.sqrt(radius * radius - dy * dy)
+                    xs += (cx - half, cx + half)
+            if length:
+                xs += (
+                    ax + (y - ay) * (bx - ax) / (by - ay)
+                    for (ax, ay), (bx, by) in edges
+                    if ay != by and min(ay, by) <= y <= max(ay, by)
+                )
+            if xs:
+                yield row, min(xs), max(xs)
+
+    # ==================
+    # CONSULTAS
+    # ==================
+
+    def is_covered(self, x, y):
+        col = int(x // self.cell_size)
+        row = int(y // self.cell_size)
+        if not (0 <= col < self.cols and 0 <= row < self.rows):
+            return False
+        return bool(self._rows[row] >> col & 1)
+
+    def covered_ratio(self):
+        covered = sum(bin(row).count('1') for row in self._rows)
+        return covered / (self.cols * self.rows)
+
+    # ==================
+    # SERIALIZAÇÃO
+    # ==================
+
+    def _bits(self):
+        """Todas as células em ordem linha a linha, como string '0'/'1'"""
+        return ''.join(format(row, f'0{self.cols}b')[::-1] for row in self._rows)
+
+    def to_rle(self):
+        """Comprimentos de runs alternados, começando por células descobertas"""
+        runs = []
+        expected = '0'
+        for bit, group in groupby(self._bits()):
+            if bit != expected:
+                runs.append(0)
+            runs.append(sum(1 for _ in group))
+            expected = '1' if bit == '0' else '0'
+        return runs
+
+    def load_rle(self, runs):
+        parts = []
+        bit = '0'
+        for length in runs:
+            parts.append(bit * int(length))
+            bit = '1' if bit == '0' else '0'
+
+        bits = ''.join(parts).ljust(self.cols * self.rows, '0')
+        self._rows = [
+            int(bits[r * self.cols:(r + 1) * self.cols][::-1], 2)
+            for r in range(self.rows)
+        ]
+        self.version += 1
+
+    def to_snapshot(self, binary=False):
+        """binary: runs em varints (anexo binário do Socket.IO) em vez de lista JSON"""
+        runs = self.to_rle()
+        return {
+            'cols': self.cols,
+            'rows': self.rows,
+            'cell_size': self.cell_size,
+            'version': self.version,
+            'rle': pack_runs(runs) if binary else runs
+        }
+
+    def load_image(self, data_url):
+        """
+        Reconstruir a máscara a partir do PNG da névoa (fogCanvas.toDataURL)
+
+        Usado para o protocolo legado (update_fog_state) e para cenas salvas.
+        Retorna False se a imagem não puder ser lida.
+        """
+        try:
+            encoded = data_url.split(',', 1)[1]
+            image = Image.open(io.BytesIO(base64.b64decode(encoded)))
+            image.load()
+        except Exception as e:
+            print(f'⚠️ Erro ao ler imagem da névoa: {e}')
+            return False
+
+        alpha = image.getchannel('A') if 'A' in image.getbands() else image.convert('L')
+        alpha = alpha.resize((self.cols, self.rows), Image.Resampling.BOX)
+        pixels = alpha.point(lambda a: 255 if a >= 128 else 0).tobytes()
+
+        bits = pixels.translate(_BIT_TABLE).decode('ascii')
+        self._rows = [
+            int(bits[r * self.cols:(r + 1) * self.cols][::-1], 2)
+            for r in range(self.rows)
+        ]
+        self.version += 1
+        return True
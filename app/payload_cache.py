@@ -0,0 +1,190 @@
+import base64
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+# Payloads codificados mantidos em memória (os menos usados saem primeiro)
+PAYLOAD_CACHE_SIZE = 64
+
+# Payloads a partir deste tamanho (bytes de JSON) vão comprimidos com zlib (0 = nunca)
+COMPRESSION_THRESHOLD = int(os.getenv('SOCKETIO_COMPRESSION_THRESHOLD', '16384'))
+
+# Nível do zlib (1 = rápido ... 9 = menor)
+COMPRESSION_LEVEL = 6
+
+# Marcador que o encoder troca pelo JSON pronto (\x00 vira \u0000 no JSON)
+_MARKER = '\x00encoded:'
+_MARKER_PATTERN = re.compile(r'"\\u0000encoded:(\d+)"')
+
+
+class PreEncoded:
+    """Payload já convertido em JSON; entra como está nos pacotes do Socket.IO"""
+
+    __slots__ = ('text', 'value', '_deflated')
+
+    def __init__(self, text, value=None):
+        self.text = text
+        # Objeto original, para serializadores que não aceitam o texto (msgpack)
+        self.value = value
+        self._deflated = None
+
+    @classmethod
+    def encode(cls, payload):
+        return cls(json.dumps(payload, separators=(',', ':')), payload)
+
+    def __len__(self):
+        return len(self.text)
+
+    def deflated(self):
+        """Texto comprimido com zlib (calculado uma vez por payload)"""
+        if self._deflated is None:
+            started = time.perf_counter()
+            raw = self.text.encode('utf-8')
+            self._deflated = zlib.compress(raw, COMPRESSION_LEVEL)
+            compression.record(len(raw), len(self._deflated), time.perf_counter() - started)
+        return self._deflated
+
+
+class CompressionStats:
+    """Quanto a compressão dos payloads economiza e quanto custa de CPU"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.payloads = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    def record(self, bytes_in, bytes_out, seconds):
+        with self._lock:
+            self.payloads += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.seconds += seconds
+
+    def status(self):
+        with self._lock:
+            return {
+                'threshold': COMPRESSION_THRESHOLD,
+                'payloads': self.payloads,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'ratio': round(self.bytes_in / self.bytes_out, 2) if self.bytes_out else None,
+                'cpu_ms': round(self.seconds * 1000, 2),
+                'cpu_ms_per_mb': round(self.seconds * 1000 / (self.bytes_in / 1e6), 2) if self.bytes_in else None
+            }
+
+
+compression = CompressionStats()
+
+
+def compress_payload(payload):
+    """
+    Payload grande → {'deflate': <zlib do JSON>}, enviado como anexo binário
+
+    Os clientes descomprimem com DecompressionStream('deflate'). Aceita
+    PreEncoded (comprime uma vez e reaproveita) ou qualquer objeto JSON.
+    """
+    if not COMPRESSION_THRESHOLD:
+        return payload
+
+    # Já codificado aqui, o JSON não é refeito no envio se não comprimir
+    encoded = payload if isinstance(payload, PreEncoded) else PreEncoded.encode(payload)
+    if len(encoded.text) < COMPRESSION_THRESHOLD:
+        return encoded
+    return {'deflate': encoded.deflated()}
+
+
+def _decode_bytes(obj):
+    if len(obj) == 1 and '__bytes__' in obj:
+        return base64.b64decode(obj['__bytes__'])
+    return obj
+
+
+class PayloadJSON:
+    """
+    Módulo json do Socket.IO (SocketIO(json=payload_json)) e das filas entre workers
+
+    Igual ao json padrão, mas objetos PreEncoded são copiados para a saída
+    sem serializar de novo: o mesmo texto vai para todos os sockets. Bytes
+    (anexos binários) atravessam as filas como {"__bytes__": base64}; nos
+    pacotes o Socket.IO já os separa antes de chegar aqui.
+    """
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        raw = []
+
+        def default(value):
+            if isinstance(value, PreEncoded):
+                raw.append(value.text)
+                return f'{_MARKER}{len(raw) - 1}'
+            if isinstance(value, (bytes, bytearray)):
+                return {'__bytes__': base64.b64encode(value).decode('ascii')}
+            raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+        text = json.dumps(obj, default=default, **kwargs)
+        if not raw:
+            return text
+        return _MARKER_PATTERN.sub(lambda match: raw[int(match.group(1))], text)
+
+    @staticmethod
+    def loads(text, **kwargs):
+        return json.loads(text, object_hook=_decode_bytes, **kwargs)
+
+
+payload_json = PayloadJSON()
+
+
+class PayloadCache:
+    """
+    Payloads codificados por chave, válidos enquanto a versão não muda
+
+    get(chave, versão, build) devolve o PreEncoded guardado se a versão é a
+    mesma; senão chama build() e codifica uma vez. Uma entrada por chave.
+    """
+
+    def __init__(self, max_entries=PAYLOAD_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # chave → (versão, PreEncoded)
+        self._lock = threading.Lock()
+
+        self.stats = {
+            'hits': 0,
+            'misses': 0
+        }
+
+    def get(self, key, version, build):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[1]
+
+        # Codificar fora do lock (cenas grandes)
+        payload = PreEncoded.encode(build())
+
+        with self._lock:
+            self._entries[key] = (version, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self.stats['misses'] += 1
+        return payload
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def status(self):
+        with self._lock:
+            return {
+                **self.stats,
+                'entries': len(self._entries),
+                'bytes': sum(len(payload) for _, payload in self._entries.values())
+            }
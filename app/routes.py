@@ -1,9 +1,63 @@
 from . import app
-from flask import render_template, jsonify, request, redirect, url_for, session # type: ignore
+from flask import render_template, jsonify, request, redirect, url_for, session, send_file, abort, Response # type: ignore
+import hmac
+import json
+import os
+import secrets
 import uuid
 from datetime import timedelta  # noqa: F401
+from functools import wraps
 from .database import db
+from .save_queue import save_queue
+from .session_state import sessions
+from .assets import assets, asset_url, MAX_ASSET_BYTES
+from .tiles import tiles, TILE_FORMATS, TILE_PENDING
+from .payload_cache import compression
+from .dice_stats import formula_stats, player_stats
+from .socket_events import broadcasts, scene_payloads
 
+# Chave das notas do mestre (NOTES_KEY ou gerada uma vez em data/notes_key).
+# Quem abre /notes?key=<chave> fica com ela no cookie da sessão do Flask.
+NOTES_KEY_FILE = os.path.join('data', 'notes_key')
+
+def _load_notes_key():
+    key = os.getenv('NOTES_KEY')
+    if key:
+        return key
+    
+    if not os.path.exists(NOTES_KEY_FILE):
+        # Arquivo completo antes de aparecer (link falha se já existe): vários
+        # workers subindo juntos ficam com a mesma chave
+        os.makedirs('data', exist_ok=True)
+        temp = f'{NOTES_KEY_FILE}.{os.getpid()}'
+        with open(temp, 'w') as f:
+            f.write(secrets.token_urlsafe(16))
+        try:
+            os.link(temp, NOTES_KEY_FILE)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temp)
+    
+    with open(NOTES_KEY_FILE) as f:
+        return f.read().strip()
+
+NOTES_KEY = _load_notes_key()
+print(f'📝 Notas do mestre: abra /notes?key={NOTES_KEY} neste navegador')
+
+def has_notes_key():
+    """Cookie (ou header X-Notes-Key, para scripts) com a chave das notas"""
+    key = session.get('notes_key') or request.headers.get('X-Notes-Key')
+    return bool(key) and hmac.compare_digest(key.encode(), NOTES_KEY.encode())
+
+def notes_key_required(view):
+    """Notas do mestre não ficam abertas para quem só tem o link da mesa"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not has_notes_key():
+            return jsonify({"error": "Chave das notas ausente: abra /notes?key=... (ver o console do servidor)"}), 403
+        return view(*args, **kwargs)
+    return wrapper
 
 @app.route("/")
 def root():
@@ -35,7 +89,19 @@ def dice_roller():
 
 @app.route("/notes")
 def notes():
-    """Notas do Mestre"""
+    """Notas do Mestre (só com a chave, ver NOTES_KEY)"""
+    key = request.args.get('key')
+    if key is not None:
+        if not hmac.compare_digest(key.encode(), NOTES_KEY.encode()):
+            return "Chave das notas inválida", 403
+        session['notes_key'] = key
+        session.permanent = True
+        # Tirar a chave da URL (histórico, favoritos)
+        return redirect(url_for("notes"))
+    
+    if not has_notes_key():
+        return "Notas do mestre: abra /notes?key=... com a chave impressa no console do servidor", 403
+    
     return render_template("notes.html")
 
 # ===== API ENDPOINTS =====
@@ -51,19 +117,141 @@ def map_state():
 
 @app.route("/api/dice/history", methods=["GET"])
 def dice_history():
-    """Histórico de rolagens"""
-    return jsonify({"status": "success", "history": []})
+    """
+    Histórico de rolagens da sessão, da mais recente para a mais antiga
+    
+    Query: session_id, limit (máx. 200), before (id da rolagem; próxima
+    página = id da última recebida). Só rolagens públicas: as privadas
+    saem pelo evento get_dice_history, para quem rolou e para o mestre.
+    """
+    try:
+        session_id = request.args.get('session_id')
+        if not session_id:
+            return jsonify({"error": "session_id obrigatório"}), 400
+        
+        limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+        history = db.dice_history(
+            session_id,
+            before=request.args.get('before', type=int),
+            limit=limit + 1
+        )
+        
+        return jsonify({
+            "status": "success",
+            "history": history[:limit],
+            "has_more": len(history) > limit
+        })
+    
+    except Exception as e:
+        print(f"❌ Erro ao listar rolagens: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/dice/stats", methods=["GET"])
+def dice_stats():
+    """
+    Estatísticas de dados
+    
+    Query: formula (média, variância e distribuição exata) e/ou
+    session_id (rolagens públicas da sessão agregadas por jogador)
+    """
+    formula = request.args.get('formula')
+    session_id = request.args.get('session_id')
+    
+    if not formula and not session_id:
+        return jsonify({"error": "formula ou session_id obrigatório"}), 400
+    
+    try:
+        result = {"status": "success"}
+        
+        if formula:
+            result["formula"] = formula_stats(formula)
+        
+        if session_id:
+            result["players"] = player_stats(db.dice_stats(session_id))
+        
+        return jsonify(result)
+    
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    except Exception as e:
+        print(f"❌ Erro nas estatísticas de dados: {e}")
+        return jsonify({"error": str(e)}), 500
 
 @app.route("/api/notes/save", methods=["POST"])
+@notes_key_required
 def save_notes():
-    """Salvar notas do mestre"""
-    data = request.json
-    return jsonify({"status": "success"})
+    """
+    Salvar notas do mestre
+    
+    Body: {"note": {id?, title, body, category}} (uma nota, o uso normal)
+    ou {"notes": [...]} (importação em lote, ex.: do localStorage)
+    """
+    try:
+        payload = request.json or {}
+        
+        if isinstance(payload.get('notes'), list):
+            saved = db.save_notes(payload['notes'])
+            return jsonify({"status": "success", "saved": len(saved)})
+        
+        if not isinstance(payload.get('note'), dict):
+            return jsonify({"error": "note obrigatório"}), 400
+        
+        saved = db.save_notes([payload['note']])
+        return jsonify({"status": "success", "note": saved[0]})
+    
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    except Exception as e:
+        print(f"❌ Erro ao salvar nota: {e}")
+        return jsonify({"error": str(e)}), 500
 
 @app.route("/api/notes/get", methods=["GET"])
+@notes_key_required
 def get_notes():
-    """Buscar notas do mestre"""
-    return jsonify({"status": "success", "notes": []})
+    """Buscar notas do mestre (query: category, limit) + contagem por categoria"""
+    try:
+        return jsonify({
+            "status": "success",
+            "notes": db.list_notes(
+                category=request.args.get('category'),
+                limit=request.args.get('limit', type=int)
+            ),
+            "counts": db.note_counts()
+        })
+    
+    except Exception as e:
+        print(f"❌ Erro ao listar notas: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/notes/search", methods=["GET"])
+@notes_key_required
+def search_notes():
+    """Busca nas notas por relevância, com prefixo (query: q, category, limit)"""
+    try:
+        limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+        
+        return jsonify({
+            "status": "success",
+            "notes": db.search_notes(
+                request.args.get('q', ''),
+                category=request.args.get('category'),
+                limit=limit
+            )
+        })
+    
+    except Exception as e:
+        print(f"❌ Erro na busca de notas: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/notes/delete/<int:note_id>", methods=["DELETE"])
+@notes_key_required
+def delete_note(note_id):
+    """Deletar nota"""
+    if db.delete_note(note_id):
+        return jsonify({"status": "success"})
+    return jsonify({"error": "Nota não encontrada"}), 404
 
 # Rota para visão do jogador (somente leitura)
 @app.route("/player-view/<session_id>")
@@ -104,18 +292,17 @@ def save_session_data():
         if not data or not isinstance(data, dict):
             return jsonify({"error": "data inválido"}), 400
         
-        # Salvar no database
-        success = db.save_session(session_id, data)
+        # Enfileirar: a gravação acontece em segundo plano, em lote
+        seq = save_queue.enqueue(session_id, data)
+        size_mb = round((request.content_length or 0) / (1024 * 1024), 2)
         
-        if success:
-            size_mb = db.get_session_size(session_id)
-            return jsonify({
-                "status": "success",
-                "message": "Sessão salva com sucesso",
-                "size_mb": size_mb
-            })
-        else:
-            return jsonify({"error": "Erro ao salvar no banco"}), 500
+        return jsonify({
+            "status": "success",
+            "message": "Sessão enfileirada para salvar",
+            "queued": True,
+            "save_seq": seq,
+            "size_mb": size_mb
+        })
     
     except Exception as e:
         print(f"❌ Erro ao salvar sessão: {e}")
@@ -125,6 +312,27 @@ def save_session_data():
 def load_session_data(session_id):
     """Carregar estado da sessão"""
     try:
+        # Save ainda na fila: devolver o estado mais recente
+        pending = save_queue.pending_data(session_id)
+        if pending is not None and 'version' not in request.args:
+            return jsonify({
+                "status": "success",
+                "data": pending,
+                "pending": True
+            })
+        
+        # ?version=N: estado de uma versão anterior (snapshot + operações)
+        version = request.args.get('version', type=int)
+        if version is not None:
+            result = db.load_session_version(session_id, version)
+            if result:
+                return jsonify({
+                    "status": "success",
+                    "data": result['data'],
+                    "version": result['version']
+                })
+            return jsonify({"status": "not_found", "data": None}), 404
+        
         result = db.load_session(session_id)
         
         if result:
@@ -144,10 +352,141 @@ def load_session_data(session_id):
         print(f"❌ Erro ao carregar sessão: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/session/load/<session_id>/scene/<scene_id>", methods=["GET"])
+def load_scene_data(session_id, scene_id):
+    """Carregar uma única cena (mapas, entidades, tokens, desenhos e névoa)"""
+    try:
+        pending = save_queue.pending_data(session_id)
+        if pending is not None:
+            scene = next((s for s in pending.get('scenes') or [] if s.get('id') == scene_id), None)
+        else:
+            scene = db.load_scene(session_id, scene_id)
+        
+        if scene:
+            return jsonify({
+                "status": "success",
+                "scene": scene
+            })
+        
+        return jsonify({
+            "status": "not_found",
+            "scene": None
+        }), 404
+    
+    except Exception as e:
+        print(f"❌ Erro ao carregar cena: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/session/stream/<session_id>", methods=["GET"])
+def stream_session_data(session_id):
+    """
+    Carregar a sessão em seções NDJSON (uma linha JSON por seção)
+    
+    meta -> scenes (metadados) -> scene (a ativa primeiro, depois as outras)
+    -> legacy -> end. O cliente pode renderizar a cena ativa antes do resto
+    chegar, e o servidor nunca monta a campanha inteira em memória.
+    
+    Query: ?first=<scene_id> para escolher a cena enviada primeiro
+    (padrão: a cena ativa na sessão em tempo real, ou a última)
+    """
+    try:
+        # Save ainda na fila: gravar antes para não servir estado antigo
+        if save_queue.pending_data(session_id) is not None:
+            save_queue.flush(5)
+        
+        first = request.args.get('first')
+        if not first:
+            live = sessions.get(session_id)
+            first = live.active_scene_id if live else None
+        
+        sections = db.stream_session(session_id, first)
+        
+        if sections is None:
+            return jsonify({
+                "status": "not_found",
+                "data": None
+            }), 404
+        
+        def generate():
+            for section in sections:
+                yield json.dumps(section, ensure_ascii=False) + '\n'
+        
+        return Response(generate(), mimetype='application/x-ndjson', headers={
+            'Cache-Control': 'no-store',
+            'X-Accel-Buffering': 'no'
+        })
+    
+    except Exception as e:
+        print(f"❌ Erro ao transmitir sessão: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/session/history/<session_id>", methods=["GET"])
+def session_history(session_id):
+    """Versões com alterações (para escolher um ponto de restauração)"""
+    try:
+        limit = request.args.get('limit', 50, type=int)
+        
+        return jsonify({
+            "status": "success",
+            "versions": db.session_history(session_id, limit)
+        })
+    
+    except Exception as e:
+        print(f"❌ Erro ao listar histórico: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def _restore_response(session_id, new_version):
+    """Resposta de restore/undo: nova versão + estado restaurado"""
+    if new_version is None:
+        return jsonify({"error": "Versão fora do histórico"}), 404
+    
+    result = db.load_session(session_id)
+    return jsonify({
+        "status": "success",
+        "version": new_version,
+        "data": result['data'] if result else None
+    })
+
+@app.route("/api/session/restore/<session_id>", methods=["POST"])
+def restore_session_version(session_id):
+    """
+    Voltar a sessão para uma versão anterior (gravado como versão nova)
+    
+    Body: {"version": 42}
+    """
+    try:
+        version = (request.get_json(silent=True) or {}).get('version')
+        if not isinstance(version, int):
+            return jsonify({"error": "version obrigatório"}), 400
+        
+        # Saves na fila entram no histórico antes do restore
+        if not save_queue.flush(10):
+            return jsonify({"error": "Tempo esgotado ao gravar sessões"}), 503
+        
+        return _restore_response(session_id, db.restore_session(session_id, version))
+    
+    except Exception as e:
+        print(f"❌ Erro ao restaurar sessão: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/session/undo/<session_id>", methods=["POST"])
+def undo_session(session_id):
+    """Desfazer o último save (vale também depois de reiniciar o servidor)"""
+    try:
+        if not save_queue.flush(10):
+            return jsonify({"error": "Tempo esgotado ao gravar sessões"}), 503
+        
+        return _restore_response(session_id, db.undo_session(session_id))
+    
+    except Exception as e:
+        print(f"❌ Erro ao desfazer save: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route("/api/session/delete/<session_id>", methods=["DELETE"])
 def delete_session_data(session_id):
     """Deletar sessão"""
     try:
+        save_queue.discard(session_id)
         success = db.delete_session(session_id)
         
         if success:
@@ -162,6 +501,44 @@ def delete_session_data(session_id):
         print(f"❌ Erro ao deletar sessão: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/session/flush", methods=["POST"])
+def flush_sessions():
+    """Esperar a fila de gravação esvaziar (durabilidade explícita)"""
+    try:
+        timeout = (request.get_json(silent=True) or {}).get('timeout', 10)
+        flushed = save_queue.flush(timeout)
+        
+        if flushed:
+            return jsonify({
+                "status": "success",
+                "queue": save_queue.status()
+            })
+        else:
+            return jsonify({"error": "Tempo esgotado ao gravar sessões", "queue": save_queue.status()}), 503
+    
+    except Exception as e:
+        print(f"❌ Erro ao gravar fila: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/session/save/status", methods=["GET"])
+def save_queue_status():
+    """Estado da fila de gravação e dos pools de conexão"""
+    return jsonify({
+        "status": "success",
+        "queue": save_queue.status(),
+        "pools": db.pool_status()
+    })
+
+@app.route("/api/realtime/status", methods=["GET"])
+def realtime_status():
+    """Broadcasts agrupados, cache de cenas codificadas e compressão dos payloads"""
+    return jsonify({
+        "status": "success",
+        "broadcasts": broadcasts.status(),
+        "scene_payloads": scene_payloads.status(),
+        "compression": compression.status()
+    })
+
 @app.route("/api/sessions/list", methods=["GET"])
 def list_sessions():
     """Listar todas as sessões"""
@@ -198,4 +575,121 @@ def cleanup_sessions():
     except Exception as e:
         print(f"❌ Erro ao limpar sessões: {e}")
         return jsonify({"error": str(e)}), 500
-    
\ No newline at end of file
+
+# ==================
+# API DE ASSETS (imagens endereçadas por hash)
+# ==================
+
+@app.route("/api/assets/upload", methods=["POST"])
+def upload_asset():
+    """
+    Enviar imagem uma única vez e receber a referência /assets/<hash>
+    
+    Aceita multipart (campo "file") ou JSON {"data_url": "data:image/..."}
+    """
+    try:
+        uploaded = request.files.get('file')
+        
+        if uploaded:
+            # Ler no máximo um byte além do limite: put() recusa o excesso
+            content = uploaded.read(MAX_ASSET_BYTES + 1)
+            asset_hash = assets.put(content) if content else None
+        else:
+            payload = request.get_json(silent=True) or {}
+            asset_hash = assets.put_data_url(payload.get('data_url'))
+        
+        if not asset_hash:
+            return jsonify({"error": "imagem inválida"}), 400
+        
+        # Mapas grandes: fatiar em tiles em segundo plano
+        if tiles.should_ingest(asset_hash):
+            tiles.ingest_async(asset_hash)
+        
+        return jsonify({
+            "status": "success",
+            "hash": asset_hash,
+            "url": asset_url(asset_hash)
+        })
+    
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    except Exception as e:
+        print(f"❌ Erro ao enviar asset: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/assets/<asset_hash>", methods=["GET"])
+def get_asset(asset_hash):
+    """Servir asset com ETag forte e cache imutável (o hash nunca muda de conteúdo)"""
+    if not assets.exists(asset_hash):
+        abort(404)
+    
+    response = send_file(
+        assets.path_for(asset_hash),
+        mimetype=assets.mimetype_for(asset_hash),
+        etag=asset_hash,
+        max_age=31536000,
+        conditional=True
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    
+    # Assets antigos podem não ser imagens (ex.: SVG gravado antes da
+    # validação): nunca interpretar na origem do app
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers['Content-Security-Policy'] = 'sandbox'
+    if response.mimetype == 'application/octet-stream':
+        response.headers['Content-Disposition'] = 'attachment'
+    return response
+
+# ==================
+# TILES DE MAPAS (pirâmide multi-resolução)
+# ==================
+
+@app.route("/tiles/<asset_hash>/info", methods=["GET"])
+def tile_info(asset_hash):
+    """Descritor da pirâmide: dimensões, tamanho do tile e níveis disponíveis"""
+    if not assets.exists(asset_hash):
+        return jsonify({"error": "asset não encontrado"}), 404
+    
+    info = tiles.info(asset_hash)
+    if info is None:
+        return jsonify({"error": "asset não é uma imagem"}), 415
+    
+    # Os tiles vêm logo depois: começar a fatiar já
+    if not tiles.is_ingested(asset_hash):
+        tiles.ingest_async(asset_hash)
+    
+    response = jsonify({"status": "success", **info})
+    response.cache_control.public = True
+    response.cache_control.max_age = 31536000
+    response.cache_control.immutable = True
+    return response
+
+@app.route("/tiles/<asset_hash>/<int:level>/<int:col>_<int:row>.<fmt>", methods=["GET"])
+def get_tile(asset_hash, level, col, row, fmt):
+    """Servir um tile (503 + Retry-After enquanto a pirâmide é fatiada)"""
+    if fmt not in TILE_FORMATS or not assets.exists(asset_hash):
+        abort(404)
+    
+    path = tiles.get_tile(asset_hash, level, col, row, fmt)
+    if path is None:
+        abort(404)
+    
+    if path == TILE_PENDING:
+        response = jsonify({"error": "tiles sendo gerados"})
+        response.status_code = 503
+        response.headers['Retry-After'] = '2'
+        response.cache_control.no_store = True
+        return response
+    
+    response = send_file(
+        path,
+        mimetype='image/png' if fmt == 'png' else 'image/jpeg',
+        etag=f'{asset_hash}-{level}-{col}-{row}',
+        max_age=31536000,
+        conditional=True
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
@@ -0,0 +1,207 @@
+import atexit
+import os
+import threading
+import time
+
+from app.database import db
+
+# Janela (s) para juntar vários saves num único commit
+SAVE_BATCH_WINDOW = 0.5
+
+# Máximo de sessões gravadas por transação
+SAVE_BATCH_SIZE = 32
+
+
+class SaveQueue:
+    """
+    Fila de gravação em segundo plano (write-behind) para sessões
+
+    O request HTTP só enfileira o estado; uma thread grava em lote. Saves
+    repetidos da mesma sessão antes da gravação são fundidos no mais recente,
+    e flush() (chamado também no encerramento do processo) garante que tudo
+    que foi aceito chegue ao banco.
+    """
+
+    def __init__(self, database, batch_window=SAVE_BATCH_WINDOW, batch_size=SAVE_BATCH_SIZE):
+        self.db = database
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._enqueued_seq = 0
+        self._written_seq = 0
+        self._inflight = {}
+        self._closed = False
+        self._thread = None
+
+        self.stats = {
+            'enqueued': 0,
+            'coalesced': 0,
+            'written': 0,
+            'batches': 0,
+            'failed': 0,
+            'last_error': None,
+            'last_flush_at': None
+        }
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='save-queue', daemon=True)
+                self._thread.start()
+        return self
+
+    def _after_fork(self):
+        # Threads não sobrevivem ao fork (gunicorn com preload_app):
+        # cada worker precisa da sua própria thread de gravação
+        self._cond = threading.Condition()
+        self._thread = None
+        self._inflight = {}
+        self.start()
+
+    # ==================
+    # API
+    # ==================
+
+    def enqueue(self, session_id, data):
+        """Agendar gravação; retorna o número de sequência do save"""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('fila de gravação encerrada')
+
+            self._enqueued_seq += 1
+            if session_id in self._pending:
+                self.stats['coalesced'] += 1
+
+            # Reinserir para manter a ordem de chegada do save mais recente
+            self._pending.pop(session_id, None)
+            self._pending[session_id] = (data, self._enqueued_seq)
+            self.stats['enqueued'] += 1
+
+            self._cond.notify_all()
+            return self._enqueued_seq
+
+    def pending_data(self, session_id):
+        """Estado ainda não gravado da sessão (ler o que acabou de ser salvo)"""
+        with self._cond:
+            entry = self._pending.get(session_id) or self._inflight.get(session_id)
+            return entry[0] if entry else None
+
+    def discard(self, session_id):
+        """Descartar save pendente (sessão deletada)"""
+        with self._cond:
+            entry = self._pending.pop(session_id, None)
+            if entry:
+                self._mark_written()
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Esperar até que todos os saves enfileirados até agora estejam no banco"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._cond:
+            target = self._enqueued_seq
+            self._cond.notify_all()
+
+            while self._written_seq < target:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+
+        return True
+
+    def status(self):
+        with self._cond:
+            return {
+                **self.stats,
+                'pending': len(self._pending),
+                'pending_sessions': list(self._pending),
+                'running': bool(self._thread and self._thread.is_alive())
+            }
+
+    def close(self, timeout=30):
+        """Gravar tudo que está pendente e parar a thread"""
+        with self._cond:
+            if self._closed:
+                return
+        self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    # ==================
+    # WORKER
+    # ==================
+
+    def _mark_written(self):
+        # Saves são gravados fora de ordem entre sessões; só avançar até o
+        # menor save ainda não gravado (pendente ou no lote em andamento)
+        unwritten = [seq for _, seq in self._pending.values()]
+        unwritten += [seq for _, seq in self._inflight.values()]
+        if unwritten:
+            self._written_seq = max(self._written_seq, min(unwritten) - 1)
+        else:
+            self._written_seq = self._enqueued_seq
+
+    def _take_batch(self):
+        batch = []
+        for session_id in list(self._pending)[:self.batch_size]:
+            data, seq = self._pending.pop(session_id)
+            batch.append((session_id, data, seq))
+        self._inflight = {session_id: (data, seq) for session_id, data, seq in batch}
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+
+                if self._closed and not self._pending:
+                    return
+
+            # Janela para juntar saves próximos no mesmo commit
+            if self.batch_window:
+                time.sleep(self.batch_window)
+
+            with self._cond:
+                batch = self._take_batch()
+
+            if not batch:
+                continue
+
+            try:
+                written = self.db.save_sessions([(sid, data) for sid, data, _ in batch])
+                error = None
+            except Exception as e:
+                written = 0
+                error = str(e)
+
+            with self._cond:
+                if error:
+                    # Devolver para a fila (sem sobrescrever saves mais novos)
+                    for session_id, data, seq in batch:
+                        self._pending.setdefault(session_id, (data, seq))
+                    self.stats['failed'] += len(batch)
+                    self.stats['last_error'] = error
+                    print(f'❌ Erro na fila de gravação: {error}')
+                else:
+                    self.stats['written'] += written
+                    self.stats['batches'] += 1
+                    self.stats['last_flush_at'] = time.time()
+
+                self._inflight = {}
+                self._mark_written()
+                self._cond.notify_all()
+
+            if error:
+                time.sleep(1)
+
+
+save_queue = SaveQueue(db).start()
+atexit.register(save_queue.close)
+
+if hasattr(os, 'register_at_fork'):  # indisponível no Windows
+    os.register_at_fork(after_in_child=save_queue._after_fork)
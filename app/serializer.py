@@ -0,0 +1,34 @@
+import os
+
+from app.payload_cache import PreEncoded, payload_json
+
+# Formato dos pacotes do Socket.IO (SOCKETIO_SERIALIZER):
+#   json     texto; bytes vão como anexos binários (padrão)
+#   msgpack  binário (pip install msgpack); as páginas carregam o cliente
+#            socket.io.msgpack, então todos os clientes usam o mesmo formato
+SERIALIZERS = ('json', 'msgpack')
+
+SOCKETIO_SERIALIZER = os.getenv('SOCKETIO_SERIALIZER', 'json').strip().lower()
+
+if SOCKETIO_SERIALIZER not in SERIALIZERS:
+    raise ValueError(f'SOCKETIO_SERIALIZER desconhecido: {SOCKETIO_SERIALIZER} (use {", ".join(SERIALIZERS)})')
+
+
+def _msgpack_default(value):
+    # msgpack não aceita o texto JSON pronto: usar o objeto original
+    if isinstance(value, PreEncoded):
+        return value.value
+    raise TypeError(f'Object of type {type(value).__name__} is not msgpack serializable')
+
+
+def socketio_serializer_options(serializer=SOCKETIO_SERIALIZER):
+    """Argumentos do SocketIO para o formato dos pacotes"""
+    if serializer == 'json':
+        return {'json': payload_json}
+
+    try:
+        from socketio.msgpack_packet import MsgPackPacket
+    except ImportError:
+        raise RuntimeError('SOCKETIO_SERIALIZER=msgpack requer o pacote msgpack (pip install msgpack)')
+
+    return {'json': payload_json, 'serializer': MsgPackPacket.configure(dumps_default=_msgpack_default)}
@@ -0,0 +1,419 @@
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from app.drawings import DrawingStore
+from app.fog import FogMask
+from app.state_backend import STATE_COMPONENTS, InProcessBackend, create_state_backend
+
+DEFAULT_GRID_SETTINGS = {
+    'enabled': True,
+    'size': 50,
+    'color': 'rgba(155, 89, 182, 0.3)',
+    'lineWidth': 1
+}
+
+# Id usado no índice de sockets para o mestre
+MASTER_ID = 'master'
+
+# Tempo (s) que uma sessão sem ninguém conectado fica em memória antes de ser descartada
+EMPTY_SESSION_TTL = 300
+
+# Versões das cenas (muda a cada alteração; usada no cache de payloads)
+_scene_versions = itertools.count(1)
+
+
+def _item_id(item):
+    return item.get('id') if isinstance(item, dict) else None
+
+
+class IndexedCollection:
+    """Coleção ordenada com índice id → item (mantém ordem de inserção)"""
+
+    __slots__ = ('_items', '_key')
+
+    def __init__(self, items=None, key=_item_id):
+        self._key = key
+        self._items = {}
+        if items:
+            self.reset(items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items.values())
+
+    def __contains__(self, item_id):
+        return item_id in self._items
+
+    def get(self, item_id):
+        return self._items.get(item_id)
+
+    def put(self, item):
+        """Inserir ou substituir (substituição mantém a posição original)"""
+        self._items[self._key(item)] = item
+        return item
+
+    def replace(self, item_id, item):
+        """Substituir apenas se já existir; retorna True se substituiu"""
+        if item_id not in self._items:
+            return False
+        self._items[item_id] = item
+        return True
+
+    def remove(self, item_id):
+        return self._items.pop(item_id, None)
+
+    def reset(self, items):
+        self._items = {self._key(item): item for item in items}
+
+    def to_list(self):
+        return list(self._items.values())
+
+
+class PlayerRecord:
+    __slots__ = ('id', 'name', 'socket_id')
+
+    def __init__(self, player_id, name, socket_id):
+        self.id = player_id
+        self.name = name
+        self.socket_id = socket_id
+
+    def to_dict(self):
+        return {'id': self.id, 'name': self.name, 'socket_id': self.socket_id}
+
+
+class SceneRecord:
+    """Cena enviada pelo mestre + índices de entidades e de visibilidade"""
+
+    __slots__ = ('id', 'data', 'entity_index', 'visible_to', 'version')
+
+    def __init__(self, data):
+        self.id = data.get('id')
+        self.data = data
+        self.version = next(_scene_versions)
+        self.entity_index = {e.get('id'): e for e in data.get('entities') or [] if isinstance(e, dict)}
+        self.visible_to = frozenset(data.get('visible_to_players') or [])
+
+    @property
+    def name(self):
+        return self.data.get('name')
+
+    def is_visible_to(self, player_id):
+        return player_id in self.visible_to
+
+    def has_entity(self, entity_id):
+        return entity_id in self.entity_index
+
+    def add_entity(self, entity):
+        entities = self.data.setdefault('entities', [])
+        existing = self.entity_index.get(entity.get('id'))
+
+        if existing is None:
+            entities.append(entity)
+            self.entity_index[entity.get('id')] = entity
+        elif existing is not entity:
+            existing.clear()
+            existing.update(entity)
+        self.version = next(_scene_versions)
+
+    def update_entity(self, entity_id, entity):
+        """Atualizar a cópia da entidade dentro da cena (no lugar)"""
+        existing = self.entity_index.get(entity_id)
+        if existing is None:
+            return False
+
+        if existing is not entity:
+            existing.clear()
+            existing.update(entity)
+        self.version = next(_scene_versions)
+        return True
+
+
+class SessionState:
+    """Estado em memória de uma mesa (sessão)"""
+
+    __slots__ = (
+        'session_id', 'maps', 'entities', 'tokens', 'token_seq', 'drawings',
+        'players', 'permissions', 'chat_conversations', 'unread_messages',
+        'master_socket', 'fog_image', 'fog_masks', 'scenes', 'active_scene_id',
+        'grid_settings', 'component_versions'
+    )
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.maps = IndexedCollection()
+        self.entities = IndexedCollection()
+        self.tokens = IndexedCollection()
+        self.token_seq = 0
+        self.drawings = DrawingStore()
+        self.players = {}
+        self.permissions = {}
+        self.chat_conversations = {}
+        self.unread_messages = {}
+        self.master_socket = None
+        self.fog_image = None
+        self.fog_masks = {}
+        self.scenes = IndexedCollection(key=lambda record: record.id)
+        self.active_scene_id = None
+        self.grid_settings = dict(DEFAULT_GRID_SETTINGS)
+        # Versão de cada componente já carregada do backend compartilhado
+        self.component_versions = {}
+
+    # ==================
+    # CENAS
+    # ==================
+
+    def scene_list(self):
+        return [record.data for record in self.scenes]
+
+    def get_scene(self, scene_id):
+        return self.scenes.get(scene_id)
+
+    def put_scene(self, scene):
+        """Inserir/substituir cena; retorna o registro antigo (ou None)"""
+        old_record = self.scenes.get(scene.get('id'))
+        self.scenes.put(SceneRecord(scene))
+        return old_record
+
+    def active_scene(self):
+        if not self.active_scene_id:
+            return None
+        return self.scenes.get(self.active_scene_id)
+
+    # ==================
+    # NÉVOA
+    # ==================
+
+    def fog_mask(self, scene_id, create=True):
+        """Máscara de névoa da cena (scene_id None = modo legado sem cenas)"""
+        mask = self.fog_masks.get(scene_id)
+        if mask is None and create:
+            mask = self.fog_masks[scene_id] = FogMask()
+        return mask
+
+    # ==================
+    # JOGADORES
+    # ==================
+
+    def player_list(self):
+        return [player.to_dict() for player in self.players.values()]
+
+    def is_empty(self):
+        return not self.players and not self.master_socket
+
+    # ==================
+    # COMPONENTES (backend compartilhado entre workers)
+    # ==================
+
+    def dump_component(self, name):
+        """Parte do estado em formato JSON, para o backend compartilhado"""
+        if name == 'core':
+            return {
+                'players': self.player_list(),
+                'permissions': self.permissions,
+                'master_socket': self.master_socket,
+                'active_scene_id': self.active_scene_id,
+                'grid_settings': self.grid_settings,
+                'fog_image': self.fog_image
+            }
+        if name == 'maps':
+            return self.maps.to_list()
+        if name == 'entities':
+            return self.entities.to_list()
+        if name == 'tokens':
+            return {'items': self.tokens.to_list(), 'seq': self.token_seq}
+        if name == 'drawings':
+            return self.drawings.to_list()
+        if name == 'fog':
+            return [[scene_id, mask.to_snapshot()] for scene_id, mask in self.fog_masks.items()]
+        if name == 'scenes':
+            return self.scene_list()
+        if name == 'chat':
+            return {'conversations': self.chat_conversations, 'unread': self.unread_messages}
+        raise KeyError(name)
+
+    def load_component(self, name, data):
+        """Substituir parte do estado pelo que veio do backend compartilhado"""
+        if name == 'core':
+            self.players = {
+                p['id']: PlayerRecord(p['id'], p.get('name'), p.get('socket_id'))
+                for p in data.get('players', [])
+            }
+            self.permissions = data.get('permissions', {})
+            self.master_socket = data.get('master_socket')
+            self.active_scene_id = data.get('active_scene_id')
+            self.grid_settings = data.get('grid_settings') or dict(DEFAULT_GRID_SETTINGS)
+            self.fog_image = data.get('fog_image')
+        elif name == 'maps':
+            self.maps.reset(data)
+        elif name == 'entities':
+            self.entities.reset(data)
+        elif name == 'tokens':
+            self.tokens.reset(data.get('items', []))
+            self.token_seq = data.get('seq', 0)
+        elif name == 'drawings':
+            self.drawings.reset(data)
+        elif name == 'fog':
+            self.fog_masks = {}
+            for scene_id, snapshot in data:
+                mask = self.fog_mask(scene_id)
+                mask.load_rle(snapshot['rle'])
+                mask.version = snapshot['version']
+        elif name == 'scenes':
+            self.scenes.reset([SceneRecord(scene) for scene in data])
+        elif name == 'chat':
+            self.chat_conversations = data.get('conversations', {})
+            self.unread_messages = data.get('unread', {})
+        else:
+            raise KeyError(name)
+
+
+class SessionRegistry:
+    """
+    Todas as sessões ativas + índice reverso socket_id → (sessão, membro)
+
+    Junto com os índices por id de cada SessionState, permite que os
+    handlers de socket resolvam qualquer busca em O(1).
+
+    Com vários workers, o estado de cada sessão também vive num backend
+    compartilhado (SQLite ou Redis): transaction() recarrega só os
+    componentes que outro worker alterou e grava os que o handler alterou.
+    """
+
+    def __init__(self, empty_ttl=EMPTY_SESSION_TTL, backend=None):
+        self._sessions = {}
+        self._sockets = {}
+        # session_id → instante em que ficou vazia (ordem de inserção = ordem de expiração)
+        self._empty_since = {}
+        self.empty_ttl = empty_ttl
+        self.backend = backend or InProcessBackend()
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+
+    def __iter__(self):
+        return iter(list(self._sessions.values()))
+
+    def get(self, session_id):
+        return self._sessions.get(session_id)
+
+    def get_or_create(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = SessionState(session_id)
+            self._sessions[session_id] = session
+        return session
+
+    def discard(self, session_id):
+        self._empty_since.pop(session_id, None)
+        self._locks.pop(session_id, None)
+        return self._sessions.pop(session_id, None)
+
+    # ==================
+    # ESTADO COMPARTILHADO ENTRE WORKERS
+    # ==================
+
+    def _lock_for(self, session_id):
+        with self._locks_guard:
+            lock = self._locks.get(session_id)
+            if lock is None:
+                lock = self._locks[session_id] = threading.RLock()
+            return lock
+
+    @contextmanager
+    def transaction(self, session_id, writes=()):
+        """
+        Executar um handler sobre o estado coerente da sessão
+
+        writes: componentes (ver STATE_COMPONENTS) que o handler altera.
+        Sem writes, só lê um snapshot e não bloqueia os outros workers.
+        """
+        session = self.get_or_create(session_id)
+
+        if not self.backend.shared:
+            yield session
+            return
+
+        open_tx = self.backend.transaction if writes else self.backend.snapshot
+
+        with self._lock_for(session_id), open_tx(session_id) as tx:
+            try:
+                versions = tx.versions()
+                stale = [
+                    name for name in STATE_COMPONENTS
+                    if versions.get(name, 0) != session.component_versions.get(name, 0)
+                ]
+                if stale:
+                    for name, data in tx.load(stale).items():
+                        session.load_component(name, data)
+                    for name in stale:
+                        session.component_versions[name] = versions.get(name, 0)
+
+                yield session
+
+                if writes:
+                    written = tx.store({name: session.dump_component(name) for name in writes})
+                    session.component_versions.update(written)
+            except BaseException:
+                # Estado local pode ter ficado pela metade: recarregar tudo na próxima vez
+                session.component_versions.clear()
+                raise
+
+    # ==================
+    # ÍNDICE DE SOCKETS
+    # ==================
+
+    def bind_socket(self, socket_id, session_id, member_id):
+        """Registrar a qual sessão/membro (jogador ou mestre) o socket pertence"""
+        self._sockets[socket_id] = (session_id, member_id)
+        self._empty_since.pop(session_id, None)
+
+    def lookup_socket(self, socket_id):
+        return self._sockets.get(socket_id)
+
+    def unbind_socket(self, socket_id):
+        return self._sockets.pop(socket_id, None)
+
+    # ==================
+    # SESSÕES VAZIAS
+    # ==================
+
+    def mark_empty(self, session_id):
+        """Agendar descarte da sessão (cancelado se alguém entrar antes do TTL)"""
+        self._empty_since.pop(session_id, None)
+        self._empty_since[session_id] = time.monotonic()
+
+    def evict_expired(self):
+        """
+        Descartar sessões vazias há mais de empty_ttl segundos
+
+        Como _empty_since está em ordem de expiração, só olha o início do
+        dict: custo amortizado O(1) por chamada.
+        """
+        evicted = []
+        deadline = time.monotonic() - self.empty_ttl
+
+        while self._empty_since:
+            session_id, since = next(iter(self._empty_since.items()))
+            if since > deadline:
+                break
+
+            del self._empty_since[session_id]
+            session = self._sessions.get(session_id)
+            if session is not None and session.is_empty():
+                del self._sessions[session_id]
+                evicted.append(session_id)
+
+        return evicted
+
+
+sessions = SessionRegistry(backend=create_state_backend(os.getenv('STATE_BACKEND')))
@@ -1,33 +1,217 @@
-from flask_socketio import emit, join_room, leave_room # type: ignore  # noqa: F401
+from flask_socketio import emit, join_room, leave_room, close_room # type: ignore  # noqa: F401
 from flask import request # type: ignore
 from app import socketio
+from app.assets import assets
+from app.async_mode import run_blocking
+from app.drawings import compact_drawings
+from app.broadcast import BroadcastScheduler
+from app.stroke_stream import StrokeStream
+from app.payload_cache import PayloadCache, compress_payload
+from app.chat_store import chat, conversation_id, CHAT_PAGE_SIZE, CONVERSATION_SEPARATOR
+from app.database import db
+from app.dice import roller as dice_roller
+from app.session_state import sessions, PlayerRecord, MASTER_ID
+from functools import wraps
 import time
 
-# Estrutura de dados das sessões
-active_sessions = {}
+# A cada N deltas de token, enviar snapshot completo para ressincronizar
+TOKEN_SNAPSHOT_INTERVAL = 200
+
+# Fórmulas aceitas num único roll_shared_dice
+MAX_ROLLS_PER_REQUEST = 20
+
+# Broadcasts frequentes saem em ticks, com atualizações do mesmo objeto fundidas
+broadcasts = BroadcastScheduler(socketio)
+
+# Traços em andamento, repassados em lotes por tick
+strokes = StrokeStream(broadcasts)
+
+# scene_activated já codificado (reconexões e trocas de cena não reserializam)
+scene_payloads = PayloadCache()
+
+# Sessões com rasterização de desenhos em andamento (no máximo uma por sessão)
+rasterizing = set()
 
 def init_session(session_id):
-    """Inicializa uma nova sessão"""
-    if session_id not in active_sessions:
-        active_sessions[session_id] = {
-            'maps': [],
-            'entities': [],
-            'tokens': [],
-            'drawings': [],
-            'players': {},
-            'permissions': {},
-            'chat_conversations': {},
-            'master_socket': None,
-            'fog_image': None, 
-            'scenes': [],
-            'active_scene_id': None,
-            'grid_settings': {
-                'enabled': True,
-                'size': 50,
-                'color': 'rgba(155, 89, 182, 0.3)',
-                'lineWidth': 1
-            }
+    """Inicializa (se preciso) e retorna o estado da sessão"""
+    return sessions.get_or_create(session_id)
+
+def shared_state(*writes):
+    """
+    Rodar o handler dentro de sessions.transaction (estado coerente entre workers)
+    
+    writes: componentes do estado que o handler altera; sem nenhum, o
+    handler só lê um snapshot atualizado da sessão.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(data):
+            session_id = data.get('session_id') if isinstance(data, dict) else None
+            if not session_id:
+                return handler(data)
+            
+            with sessions.transaction(session_id, writes):
+                return handler(data)
+        return wrapper
+    return decorator
+
+def scene_activation(session, record):
+    """
+    Payload de scene_activated, codificado uma vez por versão da cena
+    
+    Se o servidor tem a máscara de névoa da cena, ela vai no lugar do PNG
+    (fog_image), que pode estar desatualizado em relação às operações.
+    """
+    mask = session.fog_mask(record.id, create=False)
+    version = (record.version, id(mask), mask.version) if mask is not None else (record.version,)
+    
+    def build():
+        if mask is None:
+            return {'scene_id': record.id, 'scene': record.data}
+        
+        return {
+            'scene_id': record.id,
+            'scene': {**record.data, 'fog_image': None},
+            'fog_mask': mask.to_snapshot()
         }
+    
+    # Cenas grandes vão comprimidas (uma vez por versão, junto com o cache)
+    return compress_payload(scene_payloads.get((session.session_id, record.id), version, build))
+
+def scenes_sync_payload(session):
+    """Lista de cenas para o mestre (comprimida se grande)"""
+    return compress_payload({'scenes': session.scene_list()})
+
+def compact_scene(scene):
+    """
+    Imagens embutidas viram assets e os desenhos vão para o formato compacto
+    
+    Sem rasterizar (Pillow) aqui dentro do handler: os traços antigos da cena
+    viram imagem no save (database._collect_scene).
+    """
+    assets.externalize(scene)
+    if scene.get('drawings'):
+        scene['drawings'] = compact_drawings(scene['drawings'], rasterize=False)
+
+def sync_fog_from_scene(session, scene):
+    """Cena enviada pelo mestre traz o PNG da névoa: reconstruir a máscara"""
+    if 'fog_image' not in scene:
+        return
+    
+    mask = session.fog_mask(scene.get('id'))
+    if not scene['fog_image'] or not mask.load_image(scene['fog_image']):
+        mask.clear()
+
+def scene_room(session_id, scene_id):
+    """Sala com os sockets dos jogadores que veem a cena (visible_to_players)"""
+    return f'{session_id}:scene:{scene_id}'
+
+def update_scene_room(session, old_record, record):
+    """
+    Colocar/tirar jogadores conectados da sala da cena quando a visibilidade muda
+    
+    O socket do jogador pode estar em outro worker: join_room/leave_room com
+    sid passam pelo client manager, que repassa o enter_room/leave_room pela
+    fila de mensagens ao worker dono do socket (na mesma ordem dos emits).
+    """
+    old_visible = old_record.visible_to if old_record else frozenset()
+    gained = record.visible_to - old_visible
+    lost = old_visible - record.visible_to
+    room = scene_room(session.session_id, record.id)
+    
+    for player_id in gained:
+        player = session.players.get(player_id)
+        if player and player.socket_id:
+            join_room(room, sid=player.socket_id, namespace='/')
+    
+    for player_id in lost:
+        player = session.players.get(player_id)
+        if player and player.socket_id:
+            leave_room(room, sid=player.socket_id, namespace='/')
+
+def sync_scene_rooms(session, player_id):
+    """
+    Acertar as salas de cena do socket atual pela visibilidade de cada cena
+    
+    Roda no worker do próprio socket (entrada e reconexão do jogador), então
+    corrige qualquer sala que tenha ficado para trás.
+    """
+    for record in session.scenes:
+        room = scene_room(session.session_id, record.id)
+        if record.is_visible_to(player_id):
+            join_room(room)
+        else:
+            leave_room(room)
+
+def flush_broadcasts(session):
+    """
+    Enviar os broadcasts pendentes da sessão antes de um emit imediato
+    
+    scene_activated, maps_sync e drawing_sync saem na hora; os deltas do
+    tick (entity_updated, token_delta, fog_op_applied...) ainda na fila
+    chegariam depois deles, já obsoletos.
+    """
+    broadcasts.flush_to(
+        session.session_id,
+        session.master_socket,
+        *(scene_room(session.session_id, record.id) for record in session.scenes)
+    )
+
+def schedule_rasterize(session):
+    """Traços vetoriais demais: rasterizar os antigos em segundo plano, fora do handler"""
+    if session.session_id in rasterizing or not session.drawings.needs_raster():
+        return
+    
+    rasterizing.add(session.session_id)
+    socketio.start_background_task(rasterize_drawings, session.session_id)
+
+def rasterize_drawings(session_id):
+    """
+    Rasterização em três passos para o Pillow não segurar a transação
+    
+    O corte é copiado num snapshot, a imagem é desenhada numa thread real e
+    a troca acontece numa transação nova (descartada se os desenhos mudaram
+    no meio, ver DrawingStore.apply_raster). Os clientes continuam com os
+    traços vetoriais, que desenham o mesmo; a imagem vale para os próximos.
+    """
+    try:
+        with sessions.transaction(session_id) as session:
+            old = session.drawings.plan_raster()
+        if old is None:
+            return
+        
+        layer = run_blocking(session.drawings.render, old)
+        
+        with sessions.transaction(session_id, ('drawings',)) as session:
+            if session.drawings.apply_raster(old, layer):
+                print(f'🖼️ Desenhos antigos rasterizados na sessão {session_id}')
+    except Exception as e:
+        print(f'❌ Erro ao rasterizar desenhos da sessão {session_id}: {e}')
+    finally:
+        rasterizing.discard(session_id)
+
+def emit_scene_visibility(session, record, activation):
+    """
+    scene_activated para a sala da cena e scene_blocked para os demais jogadores
+    
+    Cada payload é serializado e enviado uma vez só, em vez de um emit por jogador.
+    """
+    flush_broadcasts(session)
+    emit('scene_activated', activation, room=scene_room(session.session_id, record.id))
+    
+    # Quem vê a cena (e o mestre) fica de fora do scene_blocked
+    viewers = [
+        player.socket_id for player_id, player in session.players.items()
+        if player.socket_id and player_id in record.visible_to
+    ]
+    if session.master_socket:
+        viewers.append(session.master_socket)
+    
+    if len(viewers) < len(session.players) + bool(session.master_socket):
+        emit('scene_blocked', {
+            'scene_id': record.id,
+            'scene_name': record.name
+        }, room=session.session_id, skip_sid=viewers)
 
 @socketio.on('connect')
 def handle_connect():
@@ -36,32 +220,45 @@ def handle_connect():
 @socketio.on('disconnect')
 def handle_disconnect():
     print(f'Cliente desconectado: {request.sid}')
+    strokes.drop_socket(request.sid)
     
-    for session_id, session_data in active_sessions.items():
-        # Remover jogadores desconectados
-        players_to_remove = [pid for pid, pdata in session_data['players'].items() 
-                            if pdata.get('socket_id') == request.sid]
-        for pid in players_to_remove:
-            player_name = session_data['players'][pid]['name']
-            del session_data['players'][pid]
-            emit('player_left', {'player_id': pid, 'player_name': player_name}, 
-                 room=session_id, skip_sid=request.sid)
+    # ✅ O(1): índice reverso preenchido em join_session/player_join
+    membership = sessions.unbind_socket(request.sid)
+    
+    if membership and membership[0] in sessions:
+        session_id, member_id = membership
         
-        # Remover mestre desconectado
-        if session_data.get('master_socket') == request.sid:
-            session_data['master_socket'] = None
+        with sessions.transaction(session_id, ('core',)) as session:
+            if member_id == MASTER_ID:
+                # Remover mestre desconectado (se não reconectou com outro socket)
+                if session.master_socket == request.sid:
+                    session.master_socket = None
+            else:
+                # Remover jogador desconectado (se não reconectou com outro socket)
+                player = session.players.get(member_id)
+                if player and player.socket_id == request.sid:
+                    del session.players[member_id]
+                    emit('player_left', {'player_id': member_id, 'player_name': player.name}, 
+                         room=session_id, skip_sid=request.sid)
+            
+            if session.is_empty():
+                sessions.mark_empty(session_id)
+    
+    # 🧹 Liberar memória de sessões vazias há muito tempo
+    for session_id in sessions.evict_expired():
+        print(f'🧹 Sessão {session_id} removida da memória (sem conexões)')
 
 @socketio.on('join_session')
+@shared_state('core')
 def handle_join_session(data):
     """Mestre se conecta à sessão"""
     session_id = data.get('session_id')
     join_room(session_id)
-    init_session(session_id)
+    session = init_session(session_id)
     
     # Registrar socket do mestre
-    active_sessions[session_id]['master_socket'] = request.sid
-    
-    session_state = active_sessions[session_id]
+    session.master_socket = request.sid
+    sessions.bind_socket(request.sid, session_id, MASTER_ID)
     
     # ✅ CORRIGIDO: Não enviar dados globais, apenas cenas
     emit('session_state', {
@@ -70,30 +267,26 @@ def handle_join_session(data):
         'tokens': [],
         'drawings': []
     })
-
+    
     # Fog vazio (será carregado pela cena)
     emit('fog_state_sync', {
         'fog_image': None
     })
-
+    
     # Enviar grid
     emit('grid_settings_sync', {
-        'grid_settings': session_state.get('grid_settings', {
-            'enabled': True,
-            'size': 50,
-            'color': 'rgba(155, 89, 182, 0.3)',
-            'lineWidth': 1
-        })
+        'grid_settings': session.grid_settings
     })
     
-    emit('players_list', {'players': list(session_state.get('players', {}).values())})
+    emit('players_list', {'players': session.player_list()})
     
     # ✅ ENVIAR CENAS
-    emit('scenes_sync', {'scenes': session_state.get('scenes', [])})
+    emit('scenes_sync', scenes_sync_payload(session))
     
     print(f'✅ Mestre entrou na sessão: {session_id}')
 
 @socketio.on('player_join')
+@shared_state('core')
 def handle_player_join(data):
     """Jogador se conecta à sessão"""
     session_id = data.get('session_id')
@@ -101,46 +294,40 @@ def handle_player_join(data):
     player_name = data.get('player_name')
     
     join_room(session_id)
-    init_session(session_id)
+    session = init_session(session_id)
     
-    active_sessions[session_id]['players'][player_id] = {
-        'id': player_id,
-        'name': player_name,
-        'socket_id': request.sid
-    }
+    session.players[player_id] = PlayerRecord(player_id, player_name, request.sid)
+    sessions.bind_socket(request.sid, session_id, player_id)
+    
+    # Salas das cenas que o jogador pode ver
+    sync_scene_rooms(session, player_id)
     
-    active_sessions[session_id]['permissions'][player_id] = {
+    session.permissions[player_id] = {
         'moveTokens': [],
         'draw': False,
         'ping': True
     }
     
-    session_state = active_sessions[session_id]
-    
     # ✅ CORRIGIDO: Verificar se há cena ativa
-    active_scene_id = session_state.get('active_scene_id')
+    active_scene_id = session.active_scene_id
     
     if active_scene_id:
-        scenes = session_state.get('scenes', [])
-        active_scene = next((s for s in scenes if s.get('id') == active_scene_id), None)
+        active_scene = session.active_scene()
         
         if active_scene:
-            visible_players = active_scene.get('visible_to_players', [])
-            is_visible = player_id in visible_players
+            is_visible = active_scene.is_visible_to(player_id)
             
-            print(f'🎬 Jogador {player_name} - Cena ativa: {active_scene.get("name")} - Visível: {is_visible}')
+            print(f'🎬 Jogador {player_name} - Cena ativa: {active_scene.name} - Visível: {is_visible}')
             
             if is_visible:
                 # ✅ TEM PERMISSÃO - Enviar cena
-                emit('scene_activated', {
-                    'scene_id': active_scene_id,
-                    'scene': active_scene
-                })
+                flush_broadcasts(session)
+                emit('scene_activated', scene_activation(session, active_scene))
             else:
                 # ❌ SEM PERMISSÃO - Bloquear
                 emit('scene_blocked', {
                     'scene_id': active_scene_id,
-                    'scene_name': active_scene.get('name')
+                    'scene_name': active_scene.name
                 })
         else:
             # Cena ativa não existe mais
@@ -152,23 +339,18 @@ def handle_player_join(data):
     
     # Grid settings
     emit('grid_settings_sync', {
-        'grid_settings': session_state.get('grid_settings', {
-            'enabled': True,
-            'size': 50,
-            'color': 'rgba(155, 89, 182, 0.3)',
-            'lineWidth': 1
-        })
+        'grid_settings': session.grid_settings
     })
-        
+    
     emit('permissions_updated', {
         'player_id': player_id,
-        'permissions': active_sessions[session_id]['permissions'][player_id]
+        'permissions': session.permissions[player_id]
     })
     
-    emit('player_joined', {'player_id': player_id, 'player_name': player_name}, 
+    emit('player_joined', {'player_id': player_id, 'player_name': player_name},
          room=session_id, include_self=False)
     
-    emit('players_list', {'players': list(session_state['players'].values())}, 
+    emit('players_list', {'players': session.player_list()},
          room=session_id)
     
     print(f'✅ Jogador {player_name} entrou na sessão: {session_id}')
@@ -177,223 +359,349 @@ def handle_player_join(data):
 # MAPS
 # ==================
 @socketio.on('add_map')
+@shared_state('maps')
 def handle_add_map(data):
     session_id = data.get('session_id')
     map_data = data.get('map')
     
-    init_session(session_id)
-    active_sessions[session_id]['maps'].append(map_data)
+    session = init_session(session_id)
+    assets.externalize(map_data)
+    session.maps.put(map_data)
     
-    emit('maps_sync', {'maps': active_sessions[session_id]['maps']}, 
+    flush_broadcasts(session)
+    emit('maps_sync', {'maps': session.maps.to_list()},
          room=session_id, include_self=True)
     print(f'📍 Mapa adicionado - broadcasting para sessão {session_id}')
 
 @socketio.on('update_map')
+@shared_state('maps')
 def handle_update_map(data):
     session_id = data.get('session_id')
     map_id = data.get('map_id')
     map_data = data.get('map')
     
-    init_session(session_id)
+    session = init_session(session_id)
+    assets.externalize(map_data)
+    session.maps.replace(map_id, map_data)
     
-    for i, m in enumerate(active_sessions[session_id]['maps']):
-        if m['id'] == map_id:
-            active_sessions[session_id]['maps'][i] = map_data
-            break
-    
-    emit('maps_sync', {'maps': active_sessions[session_id]['maps']}, 
+    flush_broadcasts(session)
+    emit('maps_sync', {'maps': session.maps.to_list()},
          room=session_id, include_self=True)
     print(f'📍 Mapa atualizado - broadcasting para sessão {session_id}')
 
 @socketio.on('delete_map')
+@shared_state('maps')
 def handle_delete_map(data):
     session_id = data.get('session_id')
     map_id = data.get('map_id')
     
-    init_session(session_id)
-    active_sessions[session_id]['maps'] = [m for m in active_sessions[session_id]['maps'] 
-                                            if m['id'] != map_id]
+    session = init_session(session_id)
+    session.maps.remove(map_id)
     
-    emit('maps_sync', {'maps': active_sessions[session_id]['maps']}, 
+    flush_broadcasts(session)
+    emit('maps_sync', {'maps': session.maps.to_list()},
          room=session_id, include_self=True)
     print(f'📍 Mapa removido - broadcasting para sessão {session_id}')
 
 # ==================
 # ENTITIES
 # ==================
+def emit_entity_to_scene(session, scene, entity_id, entity_data):
+    """Enviar entity_updated para jogadores que veem a cena + mestre"""
+    payload = {
+        'entity_id': entity_id,
+        'entity': dict(entity_data)
+    }
+    
+    # Drag rápido: só a última posição da entidade sai em cada tick
+    broadcasts.send('entity_updated', payload, to=scene_room(session.session_id, scene.id), key=entity_id)
+    
+    if session.master_socket:
+        broadcasts.send('entity_updated', payload, to=session.master_socket, key=entity_id)
+
 @socketio.on('add_entity')
+@shared_state('entities', 'scenes')
 def handle_add_entity(data):
     session_id = data.get('session_id')
     entity_data = data.get('entity')
     
-    init_session(session_id)
-    session_data = active_sessions[session_id]
+    session = init_session(session_id)
+    assets.externalize(entity_data)
     
     # ✅ ADICIONAR ao servidor
-    session_data['entities'].append(entity_data)
+    session.entities.put(entity_data)
     
     # ✅ VERIFICAR se há cena ativa
-    active_scene_id = session_data.get('active_scene_id')
-    
-    if active_scene_id:
+    if session.active_scene_id:
         # 🎬 MODO CENAS: Adicionar à cena ativa
-        scenes = session_data.get('scenes', [])
-        active_scene = next((s for s in scenes if s.get('id') == active_scene_id), None)
+        active_scene = session.active_scene()
         
         if active_scene:
-            # Adicionar à cena
-            if 'entities' not in active_scene:
-                active_scene['entities'] = []
-            active_scene['entities'].append(entity_data)
+            active_scene.add_entity(entity_data)
             
-            print(f'🎬 Entity adicionada à cena ativa: {active_scene.get("name")}')
+            print(f'🎬 Entity adicionada à cena ativa: {active_scene.name}')
             
-            # ✅ BROADCAST para jogadores com permissão
-            visible_players = active_scene.get('visible_to_players', [])
+            # ✅ BROADCAST para jogadores com permissão + mestre
+            emit_entity_to_scene(session, active_scene, entity_data['id'], entity_data)
             
-            for player_id in visible_players:
-                player_data = session_data.get('players', {}).get(player_id)
-                if player_data:
-                    player_socket = player_data.get('socket_id')
-                    if player_socket:
-                        emit('entity_updated', {
-                            'entity_id': entity_data['id'],
-                            'entity': entity_data
-                        }, room=player_socket)
-            
-            # ✅ BROADCAST para o mestre
-            master_socket = session_data.get('master_socket')
-            if master_socket:
-                emit('entity_updated', {
-                    'entity_id': entity_data['id'],
-                    'entity': entity_data
-                }, room=master_socket)
-            
-            print(f'✅ Entity broadcast para {len(visible_players)} jogadores')
+            print(f'✅ Entity broadcast para {len(active_scene.visible_to)} jogadores')
         else:
             print('⚠️ Cena ativa não encontrada')
     else:
         # 📦 MODO LEGADO: Broadcast para todos
         print('📦 Modo legado - broadcast para toda sala')
-        emit('entities_sync', {
-            'entities': session_data['entities']
-        }, room=session_id, include_self=True)
+        broadcasts.send('entities_sync', {
+            'entities': session.entities.to_list()
+        }, to=session_id, key='all')
 
 @socketio.on('update_entity')
+@shared_state('entities', 'scenes')
 def handle_update_entity(data):
     session_id = data.get('session_id')
     entity_id = data.get('entity_id')
     entity_data = data.get('entity')
     
-    init_session(session_id)
+    session = init_session(session_id)
+    assets.externalize(entity_data)
     
     # ✅ Atualizar no servidor
-    for i, e in enumerate(active_sessions[session_id]['entities']):
-        if e['id'] == entity_id:
-            active_sessions[session_id]['entities'][i] = entity_data
-            break
+    session.entities.replace(entity_id, entity_data)
     
     # ✅ BROADCAST INDIVIDUAL apenas para quem vê a cena ativa
-    session_data = active_sessions[session_id]
-    active_scene_id = session_data.get('active_scene_id')
-    
-    if not active_scene_id:
+    if not session.active_scene_id:
         print('⚠️ Sem cena ativa - update ignorado para players')
         return
     
-    # Encontrar cena ativa
-    scenes = session_data.get('scenes', [])
-    active_scene = next((s for s in scenes if s.get('id') == active_scene_id), None)
+    active_scene = session.active_scene()
     
     if not active_scene:
         print('⚠️ Cena ativa não encontrada')
         return
     
-    # ✅ Verificar se a entidade pertence à cena ativa
-    scene_entities = active_scene.get('entities', [])
-    entity_in_scene = any(e.get('id') == entity_id for e in scene_entities)
-    
-    if not entity_in_scene:
+    # ✅ Verificar se a entidade pertence à cena ativa (e atualizar a cópia da cena)
+    if not active_scene.update_entity(entity_id, entity_data):
         print(f'ℹ️ Entity {entity_id} não pertence à cena ativa - não broadcast')
         return
     
-    # ✅ Enviar apenas para jogadores que veem a cena
-    visible_players = active_scene.get('visible_to_players', [])
-    
-    for player_id in visible_players:
-        player_data = session_data.get('players', {}).get(player_id)
-        if player_data:
-            player_socket = player_data.get('socket_id')
-            if player_socket:
-                emit('entity_updated', {
-                    'entity_id': entity_id,
-                    'entity': entity_data
-                }, room=player_socket)
-    
-    # ✅ Enviar para o mestre também
-    master_socket = session_data.get('master_socket')
-    if master_socket:
-        emit('entity_updated', {
-            'entity_id': entity_id,
-            'entity': entity_data
-        }, room=master_socket)
+    # ✅ Enviar apenas para jogadores que veem a cena + mestre
+    emit_entity_to_scene(session, active_scene, entity_id, entity_data)
     
-    print(f'🎭 Entity {entity_id} atualizada - broadcast para {len(visible_players)} jogadores')
+    print(f'🎭 Entity {entity_id} atualizada - broadcast para {len(active_scene.visible_to)} jogadores')
 
 @socketio.on('delete_entity')
+@shared_state('entities')
 def handle_delete_entity(data):
     session_id = data.get('session_id')
     entity_id = data.get('entity_id')
     
-    init_session(session_id)
-    active_sessions[session_id]['entities'] = [e for e in active_sessions[session_id]['entities'] 
-                                                if e['id'] != entity_id]
+    session = init_session(session_id)
+    session.entities.remove(entity_id)
     
-    emit('entities_sync', {'entities': active_sessions[session_id]['entities']}, 
-         room=session_id, include_self=True)
+    broadcasts.send('entities_sync', {'entities': session.entities.to_list()},
+                    to=session_id, key='all')
     print(f'🎭 Entidade removida - broadcasting para sessão {session_id}')
 
 # ==================
 # TOKENS
 # ==================
+def emit_token_snapshot(session, to=None):
+    """Enviar lista completa de tokens (com seq atual) para a sala ou um socket"""
+    payload = {
+        'tokens': [dict(token) for token in session.tokens],
+        'seq': session.token_seq
+    }
+    
+    if to:
+        emit('token_sync', payload, room=to)
+        return
+    
+    # Deltas ainda não enviados já estão no snapshot
+    broadcasts.discard(session.session_id, 'token_delta')
+    broadcasts.send('token_sync', payload, to=session.session_id, key='all')
+
+def merge_token_moves(pending, delta):
+    """Dois 'moved' do mesmo token no mesmo tick viram um (mantém o seq do primeiro)"""
+    if pending.get('op') == 'moved' and delta.get('op') == 'moved':
+        pending['changes'].update(delta['changes'])
+        return pending
+    return None
+
+def emit_token_delta(session, delta):
+    """Aplicar número de sequência e espalhar delta para a sala"""
+    delta['seq'] = session.token_seq + 1
+    key = delta['token_id'] if delta['op'] == 'moved' else None
+    
+    queued = broadcasts.send('token_delta', delta, to=session.session_id,
+                             key=key, merge=merge_token_moves)
+    if queued is not delta:
+        # Fundido com um delta pendente: nenhum seq novo
+        return
+    
+    session.token_seq += 1
+    
+    # Snapshot periódico para quem perdeu algum delta
+    if session.token_seq % TOKEN_SNAPSHOT_INTERVAL == 0:
+        emit_token_snapshot(session)
+
 @socketio.on('token_update')
+@shared_state('tokens')
 def handle_token_update(data):
+    """Substituir lista completa de tokens (snapshot - undo/redo e clientes antigos)"""
     session_id = data.get('session_id')
     tokens = data.get('tokens', [])
     
-    init_session(session_id)
-    active_sessions[session_id]['tokens'] = tokens
+    session = init_session(session_id)
+    assets.externalize(tokens)
+    session.tokens.reset(tokens)
+    session.token_seq += 1
     
     print(f'🎯 TOKEN UPDATE: {len(tokens)} tokens na sessão {session_id}')
     
     # ✅ BROADCAST para TODOS na sala
-    emit('token_sync', {'tokens': tokens}, 
-         room=session_id, 
-         include_self=True)  # ✅ INCLUIR o próprio remetente
+    emit_token_snapshot(session)
+
+@socketio.on('token_moved')
+@shared_state('tokens')
+def handle_token_moved(data):
+    """Aplicar apenas os campos alterados de um token (posição, tamanho...)"""
+    session_id = data.get('session_id')
+    token_id = data.get('token_id')
+    changes = data.get('changes') or {}
+    
+    session = init_session(session_id)
+    changes.pop('id', None)
+    assets.externalize(changes)
+    
+    token = session.tokens.get(token_id)
+    
+    if not token:
+        # Cliente está dessincronizado - mandar snapshot só para ele
+        print(f'⚠️ Token {token_id} não encontrado - enviando snapshot')
+        emit_token_snapshot(session, to=request.sid)
+        return
+    
+    token.update(changes)
+    
+    emit_token_delta(session, {
+        'op': 'moved',
+        'token_id': token_id,
+        'changes': changes
+    })
+
+@socketio.on('token_added')
+@shared_state('tokens')
+def handle_token_added(data):
+    session_id = data.get('session_id')
+    token = data.get('token')
+    
+    if not token or not token.get('id'):
+        return
+    
+    session = init_session(session_id)
+    assets.externalize(token)
+    session.tokens.put(token)
+    
+    print(f'🎯 Token {token["id"]} adicionado na sessão {session_id}')
+    
+    emit_token_delta(session, {
+        'op': 'added',
+        'token_id': token['id'],
+        'token': dict(token)
+    })
+
+@socketio.on('token_removed')
+@shared_state('tokens')
+def handle_token_removed(data):
+    session_id = data.get('session_id')
+    token_id = data.get('token_id')
+    
+    session = init_session(session_id)
+    session.tokens.remove(token_id)
+    
+    print(f'🎯 Token {token_id} removido da sessão {session_id}')
+    
+    emit_token_delta(session, {
+        'op': 'removed',
+        'token_id': token_id
+    })
+
+@socketio.on('request_token_snapshot')
+@shared_state()
+def handle_request_token_snapshot(data):
+    """Cliente detectou salto de sequência e pede ressincronização"""
+    session_id = data.get('session_id')
+    
+    session = init_session(session_id)
+    emit_token_snapshot(session, to=request.sid)
 
 # ==================
 # DRAWINGS - ✅ CORRIGIDO
 # ==================
 @socketio.on('drawing_update')
+@shared_state('drawings')
 def handle_drawing_update(data):
     session_id = data.get('session_id')
     drawing = data.get('drawing')
     
-    init_session(session_id)
-    active_sessions[session_id]['drawings'].append(drawing)
+    session = init_session(session_id)
+    
+    # Simplificado/quantizado: todos recebem (e guardam) a versão compacta
+    drawing = session.drawings.add(drawing)
+    if drawing is None:
+        return
+    schedule_rasterize(session)
     
     print('✏️ Desenho adicionado - broadcasting')
     
     # ✅ BROADCAST para TODOS
-    emit('drawing_sync', {'drawing': drawing}, 
+    flush_broadcasts(session)
+    emit('drawing_sync', {'drawing': drawing},
          room=session_id, include_self=True)
 
+@socketio.on('stroke_begin')
+def handle_stroke_begin(data):
+    """Início de um traço ao vivo (pontos chegam depois em stroke_points)"""
+    session_id = data.get('session_id')
+    bound = sessions.lookup_socket(request.sid)
+    if not bound or bound[0] != session_id:
+        return {'error': 'entre na sessão antes de desenhar'}
+    
+    strokes.begin(session_id, request.sid, data.get('stroke_id'), {
+        'color': data.get('color'),
+        'size': data.get('size')
+    })
+
+@socketio.on('stroke_points')
+def handle_stroke_points(data):
+    """Pedaço de pontos [x0, y0, x1, y1, ...]; repassado no próximo tick"""
+    strokes.append(request.sid, data.get('stroke_id'), data.get('points'))
+
+@socketio.on('stroke_end')
+@shared_state('drawings')
+def handle_stroke_end(data):
+    """Fim do traço: gravar a versão compacta e mandar junto com o fim"""
+    stroke_id = data.get('stroke_id')
+    
+    closed = strokes.end(request.sid, stroke_id)
+    if closed is None:
+        return
+    
+    session_id, meta, path = closed
+    session = init_session(session_id)
+    
+    drawing = session.drawings.add({'id': stroke_id, 'path': path, **meta})
+    strokes.finish(request.sid, stroke_id, drawing)
+    schedule_rasterize(session)
+    
+    print(f'✏️ Traço {stroke_id} finalizado ({len(path)} pontos)')
+
 @socketio.on('clear_drawings')
+@shared_state('drawings')
 def handle_clear_drawings(data):
     session_id = data.get('session_id')
     
-    init_session(session_id)
-    active_sessions[session_id]['drawings'] = []
+    session = init_session(session_id)
+    session.drawings.clear()
     
     print('🧹 Desenhos limpos - broadcasting')
     
@@ -401,53 +709,109 @@ def handle_clear_drawings(data):
     emit('drawings_cleared', {}, room=session_id, include_self=True)
 
 # ==================
-# FOG OF WAR - ✅ TOTALMENTE REESCRITO
+# FOG OF WAR - ✅ MÁSCARA NO SERVIDOR + OPERAÇÕES INCREMENTAIS
 # ==================
+@socketio.on('fog_op')
+@shared_state('fog')
+def handle_fog_op(data):
+    """
+    Aplicar operação de névoa (reveal/cover de rect, circle, polygon, stroke)
+    
+    Apenas a operação (alguns bytes) é repassada para a sala, em vez do PNG
+    completo da névoa.
+    """
+    session_id = data.get('session_id')
+    
+    session = init_session(session_id)
+    scene_id = data.get('scene_id') or session.active_scene_id
+    mask = session.fog_mask(scene_id)
+    
+    try:
+        op = mask.apply(data.get('op'))
+    except (ValueError, KeyError, TypeError, IndexError, ArithmeticError) as e:
+        print(f'⚠️ Operação de névoa inválida: {e}')
+        return
+    
+    # Na mesma fila do fog_state_sync para não chegar fora de ordem
+    broadcasts.send('fog_op_applied', {
+        'scene_id': scene_id,
+        'op': op,
+        'version': mask.version
+    }, to=session_id, skip_sid=request.sid)
+
+@socketio.on('request_fog_snapshot')
+@shared_state()
+def handle_request_fog_snapshot(data):
+    """Cliente perdeu operações (salto de versão) e pede a máscara completa"""
+    session_id = data.get('session_id')
+    
+    session = init_session(session_id)
+    scene_id = data.get('scene_id') or session.active_scene_id
+    
+    # Clientes que pedem binary recebem o RLE como anexo binário (varints)
+    emit('fog_mask_sync', {
+        'scene_id': scene_id,
+        'fog_mask': session.fog_mask(scene_id).to_snapshot(binary=bool(data.get('binary')))
+    })
+
 @socketio.on('update_fog_state')
+@shared_state('core', 'fog')
 def handle_update_fog_state(data):
-    """Atualizar estado da névoa (imagem completa)"""
+    """Atualizar estado da névoa (imagem completa - undo/redo e clientes antigos)"""
     session_id = data.get('session_id')
     fog_image = data.get('fog_image')
     
-    init_session(session_id)
+    session = init_session(session_id)
     
     # ✅ Salvar imagem da névoa no servidor
-    active_sessions[session_id]['fog_image'] = fog_image
+    session.fog_image = fog_image
+    
+    # ✅ Manter a máscara da cena ativa coerente com a imagem
+    mask = session.fog_mask(session.active_scene_id)
+    if not fog_image or not mask.load_image(fog_image):
+        mask.clear()
     
     print('🌫️ Fog atualizado - broadcasting para TODOS')
     
-    # ✅ BROADCAST para TODA A SALA (incluindo mestre)
-    emit('fog_state_sync', {
-        'fog_image': fog_image
-    }, room=session_id, include_self=True)
+    # ✅ BROADCAST para TODA A SALA (incluindo mestre) - só a imagem mais recente por tick
+    broadcasts.send('fog_state_sync', {
+        'fog_image': fog_image,
+        'version': mask.version
+    }, to=session_id, key='all')
 
 @socketio.on('clear_fog_state')
+@shared_state('core', 'fog')
 def handle_clear_fog_state(data):
     """Limpar toda a névoa"""
     session_id = data.get('session_id')
     
-    init_session(session_id)
-    active_sessions[session_id]['fog_image'] = None
+    session = init_session(session_id)
+    session.fog_image = None
+    
+    mask = session.fog_mask(session.active_scene_id)
+    mask.clear()
     
     print('🌫️ Fog limpo - broadcasting para TODOS')
     
     # ✅ BROADCAST para TODA A SALA
-    emit('fog_state_sync', {
-        'fog_image': None
-    }, room=session_id, include_self=True)
+    broadcasts.send('fog_state_sync', {
+        'fog_image': None,
+        'version': mask.version
+    }, to=session_id, key='all')
 
 # ==================
 # GRID
 # ==================
 @socketio.on('update_grid_settings')
+@shared_state('core')
 def handle_update_grid_settings(data):
     session_id = data.get('session_id')
     grid_settings = data.get('grid_settings')
     
-    init_session(session_id)
-    active_sessions[session_id]['grid_settings'] = grid_settings
+    session = init_session(session_id)
+    session.grid_settings = grid_settings
     
-    emit('grid_settings_sync', {'grid_settings': grid_settings}, 
+    emit('grid_settings_sync', {'grid_settings': grid_settings},
          room=session_id, include_self=True)
     
     print(f'📐 Grid settings atualizados na sessão {session_id}')
@@ -456,34 +820,36 @@ def handle_update_grid_settings(data):
 # PERMISSIONS
 # ==================
 @socketio.on('update_permissions')
+@shared_state('core')
 def handle_update_permissions(data):
     session_id = data.get('session_id')
     player_id = data.get('player_id')
     permissions = data.get('permissions')
     
-    init_session(session_id)
+    session = init_session(session_id)
     
-    if player_id in active_sessions[session_id]['players']:
-        active_sessions[session_id]['permissions'][player_id] = permissions
+    player = session.players.get(player_id)
+    if player:
+        session.permissions[player_id] = permissions
         
-        player_socket_id = active_sessions[session_id]['players'][player_id].get('socket_id')
-        if player_socket_id:
+        if player.socket_id:
             emit('permissions_updated', {
                 'player_id': player_id,
                 'permissions': permissions
-            }, room=player_socket_id)
+            }, room=player.socket_id)
 
 @socketio.on('get_players')
+@shared_state()
 def handle_get_players(data):
     session_id = data.get('session_id')
-    init_session(session_id)
+    session = init_session(session_id)
     
     players_list = []
-    for player_id, player_data in active_sessions[session_id]['players'].items():
+    for player_id, player in session.players.items():
         players_list.append({
             'id': player_id,
-            'name': player_data['name'],
-            'permissions': active_sessions[session_id]['permissions'].get(player_id, {})
+            'name': player.name,
+            'permissions': session.permissions.get(player_id, {})
         })
     
     emit('players_list', {'players': players_list})
@@ -492,32 +858,30 @@ def handle_get_players(data):
 # CHAT
 # ==================
 @socketio.on('get_chat_contacts')
+@shared_state()
 def handle_get_contacts(data):
     session_id = data.get('session_id')
     user_id = data.get('user_id')
     
-    init_session(session_id)
-    
-    if 'unread_messages' not in active_sessions[session_id]:
-        active_sessions[session_id]['unread_messages'] = {}
+    session = init_session(session_id)
     
     contacts = []
-    unread_data = active_sessions[session_id]['unread_messages']
+    unread_data = session.unread_messages
     
     if user_id == 'master':
         # ✅ MESTRE: Mostrar APENAS jogadores individuais (sem conversas entre eles)
-        for player_id, player_data in active_sessions[session_id]['players'].items():
+        for player_id, player in session.players.items():
             unread_count = unread_data.get(f"{user_id}_{player_id}", 0)
             contacts.append({
                 'id': player_id,
-                'name': player_data['name'],
+                'name': player.name,
                 'unread': unread_count,
                 'type': 'player'
             })
         
         # ✅ REMOVIDO: Não mostrar conversas entre jogadores no chat do mestre
         # O mestre agora usa o Monitor dedicado para ver essas conversas
-        
+    
     else:
         # ✅ JOGADOR: Mostrar mestre + outros jogadores
         unread_count = unread_data.get(f"{user_id}_master", 0)
@@ -528,12 +892,12 @@ def handle_get_contacts(data):
             'type': 'player'
         })
         
-        for player_id, player_data in active_sessions[session_id]['players'].items():
+        for player_id, player in session.players.items():
             if player_id != user_id:
                 unread_count = unread_data.get(f"{user_id}_{player_id}", 0)
                 contacts.append({
                     'id': player_id,
-                    'name': player_data['name'],
+                    'name': player.name,
                     'unread': unread_count,
                     'type': 'player'
                 })
@@ -541,208 +905,172 @@ def handle_get_contacts(data):
     emit('chat_contacts_loaded', {'contacts': contacts})
 
 @socketio.on('send_private_message')
+@shared_state('chat')
 def handle_send_message(data):
     session_id = data.get('session_id')
     sender_id = data.get('sender_id')
     recipient_id = data.get('recipient_id')
     message_text = data.get('message')
     
-    init_session(session_id)
-    
-    if 'unread_messages' not in active_sessions[session_id]:
-        active_sessions[session_id]['unread_messages'] = {}
+    session = init_session(session_id)
     
     if sender_id == 'master':
         sender_name = 'Mestre'
     else:
-        sender_data = active_sessions[session_id]['players'].get(sender_id)
-        sender_name = sender_data['name'] if sender_data else 'Desconhecido'
+        sender = session.players.get(sender_id)
+        sender_name = sender.name if sender else 'Desconhecido'
     
-    message_data = {
-        'id': f"{int(time.time() * 1000)}_{sender_id}_{recipient_id}",
+    message_data = chat.append(session, {
         'sender_id': sender_id,
         'sender_name': sender_name,
         'recipient_id': recipient_id,
         'message': message_text,
         'timestamp': time.time() * 1000
-    }
-    
-    if sender_id not in active_sessions[session_id]['chat_conversations']:
-        active_sessions[session_id]['chat_conversations'][sender_id] = {}
-    if recipient_id not in active_sessions[session_id]['chat_conversations'][sender_id]:
-        active_sessions[session_id]['chat_conversations'][sender_id][recipient_id] = []
-    
-    if recipient_id not in active_sessions[session_id]['chat_conversations']:
-        active_sessions[session_id]['chat_conversations'][recipient_id] = {}
-    if sender_id not in active_sessions[session_id]['chat_conversations'][recipient_id]:
-        active_sessions[session_id]['chat_conversations'][recipient_id][sender_id] = []
-    
-    active_sessions[session_id]['chat_conversations'][sender_id][recipient_id].append(message_data)
-    active_sessions[session_id]['chat_conversations'][recipient_id][sender_id].append(message_data)
+    })
     
     unread_key = f"{recipient_id}_{sender_id}"
-    if unread_key not in active_sessions[session_id]['unread_messages']:
-        active_sessions[session_id]['unread_messages'][unread_key] = 0
-    active_sessions[session_id]['unread_messages'][unread_key] += 1
+    session.unread_messages[unread_key] = session.unread_messages.get(unread_key, 0) + 1
     
     emit('new_private_message', message_data, room=request.sid)
     
     if recipient_id == 'master':
-        master_socket = active_sessions[session_id].get('master_socket')
+        master_socket = session.master_socket
         if master_socket and master_socket != request.sid:
             emit('new_private_message', message_data, room=master_socket)
     else:
-        recipient_socket = active_sessions[session_id]['players'].get(recipient_id, {}).get('socket_id')
-        if recipient_socket:
-            emit('new_private_message', message_data, room=recipient_socket)
-    
+        recipient = session.players.get(recipient_id)
+        if recipient and recipient.socket_id:
+            emit('new_private_message', message_data, room=recipient.socket_id)
+    
+    # Conversa entre jogadores: repassar ao monitor do mestre (se aberto)
+    if MASTER_ID not in (sender_id, recipient_id):
+        emit('monitor_message', {
+            **monitor_entry(session, sender_id, recipient_id),
+            'message': message_data
+        }, to=monitor_room(session_id))
+
 
 @socketio.on('get_conversation')
+@shared_state()
 def handle_get_conversation(data):
+    """
+    Página do histórico: as `limit` mensagens anteriores a `before` (id; ausente = as mais recentes)
+    
+    Só participantes leem a conversa: user_id tem que ser o membro ligado ao
+    socket. O mestre (pelo socket dele) também lê conversas entre jogadores.
+    """
     session_id = data.get('session_id')
     user_id = data.get('user_id')
     other_user_id = data.get('other_user_id')
+    before = data.get('before')
     
-    init_session(session_id)
+    if not isinstance(user_id, str) or not isinstance(other_user_id, str):
+        return {'error': 'user_id e other_user_id obrigatórios'}
     
-    messages = []
+    if sessions.lookup_socket(request.sid) != (session_id, user_id):
+        return {'error': 'conversa não pertence a este socket'}
     
-    if user_id == 'master' and '_' in other_user_id:
-        player_ids = other_user_id.split('_')
-        if len(player_ids) == 2:
-            player1_id, player2_id = player_ids
-            
-            if player1_id in active_sessions[session_id]['chat_conversations']:
-                if player2_id in active_sessions[session_id]['chat_conversations'][player1_id]:
-                    messages = active_sessions[session_id]['chat_conversations'][player1_id][player2_id]
+    session = init_session(session_id)
+    
+    if request.sid == session.master_socket and CONVERSATION_SEPARATOR in other_user_id:
+        # Monitor: other_user_id já é o id da conversa entre dois jogadores
+        conv_id = conversation_id(*other_user_id.split(CONVERSATION_SEPARATOR, 1))
     else:
-        if user_id in active_sessions[session_id]['chat_conversations']:
-            if other_user_id in active_sessions[session_id]['chat_conversations'][user_id]:
-                messages = active_sessions[session_id]['chat_conversations'][user_id][other_user_id]
+        conv_id = conversation_id(user_id, other_user_id)
+    
+    messages, has_more = chat.page(session, conv_id, before=before, limit=data.get('limit', CHAT_PAGE_SIZE))
     
     emit('conversation_loaded', {
         'messages': messages,
-        'other_user_id': other_user_id
+        'other_user_id': other_user_id,
+        'before': before,
+        'has_more': has_more
     })
 
 @socketio.on('mark_conversation_read')
+@shared_state('chat')
 def handle_mark_read(data):
     session_id = data.get('session_id')
     user_id = data.get('user_id')
     other_user_id = data.get('other_user_id')
     
-    init_session(session_id)
-    
-    if 'unread_messages' not in active_sessions[session_id]:
-        active_sessions[session_id]['unread_messages'] = {}
+    session = init_session(session_id)
     
     unread_key = f"{user_id}_{other_user_id}"
-    active_sessions[session_id]['unread_messages'][unread_key] = 0
+    session.unread_messages[unread_key] = 0
 
 # ==================
 # SCENES
 # ==================
 @socketio.on('scene_create')
+@shared_state('scenes', 'fog')
 def handle_scene_create(data):
     session_id = data.get('session_id')
     scene = data.get('scene')
     
-    init_session(session_id)
+    session = init_session(session_id)
+    compact_scene(scene)
+    sync_fog_from_scene(session, scene)
+    old_scene = session.put_scene(scene)
+    update_scene_room(session, old_scene, session.get_scene(scene.get('id')))
     
-    if 'scenes' not in active_sessions[session_id]:
-        active_sessions[session_id]['scenes'] = []
-    
-    active_sessions[session_id]['scenes'].append(scene)
-    
-    emit('scenes_sync', {
-        'scenes': active_sessions[session_id]['scenes']
-    }, room=session_id, include_self=True)
+    emit('scenes_sync', scenes_sync_payload(session), room=session_id, include_self=True)
     
     print(f'🎬 Nova cena criada: {scene.get("name")} na sessão {session_id}')
 
 @socketio.on('scene_update')
+@shared_state('scenes', 'fog')
 def handle_scene_update(data):
     """✅ REESCRITO - Atualizar cena e notificar mudanças de visibilidade"""
     session_id = data.get('session_id')
     scene = data.get('scene')
     scene_id = scene.get('id')
     
-    init_session(session_id)
-    
-    if 'scenes' not in active_sessions[session_id]:
-        active_sessions[session_id]['scenes'] = []
+    session = init_session(session_id)
+    compact_scene(scene)
+    sync_fog_from_scene(session, scene)
     
-    # Encontrar cena antiga para comparar visibilidade
-    old_scene = None
-    updated = False
-    for i, s in enumerate(active_sessions[session_id]['scenes']):
-        if s.get('id') == scene_id:
-            old_scene = active_sessions[session_id]['scenes'][i]
-            active_sessions[session_id]['scenes'][i] = scene
-            updated = True
-            break
-    
-    if not updated:
-        active_sessions[session_id]['scenes'].append(scene)
+    # Substituir cena mantendo a antiga para comparar visibilidade
+    old_scene = session.put_scene(scene)
+    record = session.get_scene(scene_id)
+    update_scene_room(session, old_scene, record)
+    scene_payloads.invalidate((session_id, scene_id))
     
     # ✅ Sincronizar lista de cenas para o mestre
-    emit('scenes_sync', {
-        'scenes': active_sessions[session_id]['scenes']
-    }, room=session_id, include_self=True)
+    emit('scenes_sync', scenes_sync_payload(session), room=session_id, include_self=True)
     
     print(f'🎬 Cena atualizada: {scene.get("name")}')
     
     # ✅ SE ESTA É A CENA ATIVA, ATUALIZAR TODOS OS JOGADORES
-    if active_sessions[session_id].get('active_scene_id') == scene_id:
+    if session.active_scene_id == scene_id:
         print('🎬 Cena ativa modificada - atualizando jogadores')
         
-        session_data = active_sessions[session_id]
-        
         # ✅ Verificar mudanças de visibilidade
-        old_visible = set(old_scene.get('visible_to_players', [])) if old_scene else set()
-        new_visible = set(scene.get('visible_to_players', []))
-        
-        gained_access = new_visible - old_visible
-        lost_access = old_visible - new_visible
+        old_visible = old_scene.visible_to if old_scene else frozenset()
+        gained_access = record.visible_to - old_visible
+        lost_access = old_visible - record.visible_to
         
-        print(f'📊 Mudanças de acesso: Ganharam: {gained_access}, Perderam: {lost_access}')
+        print(f'📊 Mudanças de acesso: Ganharam: {set(gained_access)}, Perderam: {set(lost_access)}')
         
-        # ✅ Para cada jogador conectado
-        for player_id, player_data in session_data.get('players', {}).items():
-            player_socket = player_data.get('socket_id')
-            
-            if not player_socket:
-                continue
-            
-            is_visible = player_id in new_visible
-            
-            if is_visible:
-                # ✅ JOGADOR TEM PERMISSÃO
-                print(f'  👁️ {player_id} - Enviando cena completa')
-                emit('scene_activated', {
-                    'scene_id': scene_id,
-                    'scene': scene
-                }, room=player_socket)
-            else:
-                # ❌ JOGADOR NÃO TEM PERMISSÃO
-                print(f'  🚫 {player_id} - Bloqueando acesso')
-                emit('scene_blocked', {
-                    'scene_id': scene_id,
-                    'scene_name': scene.get('name')
-                }, room=player_socket)
+        # ✅ Um envio para a sala da cena + um scene_blocked para os demais
+        emit_scene_visibility(session, record, scene_activation(session, record))
         
         print('✅ Todos os jogadores atualizados')
 
 @socketio.on('request_current_scene')
+@shared_state()
 def handle_request_current_scene(data):
     """✅ NOVO - Jogador solicita a cena atual após reconexão"""
     session_id = data.get('session_id')
     player_id = data.get('player_id')
     
-    init_session(session_id)
+    session = init_session(session_id)
+    
+    # Reconexão: o socket volta para as salas das cenas que o jogador vê
+    if sessions.lookup_socket(request.sid) == (session_id, player_id):
+        sync_scene_rooms(session, player_id)
     
-    session_data = active_sessions[session_id]
-    active_scene_id = session_data.get('active_scene_id')
+    active_scene_id = session.active_scene_id
     
     if not active_scene_id:
         print(f'ℹ️ Nenhuma cena ativa para {player_id}')
@@ -750,8 +1078,7 @@ def handle_request_current_scene(data):
         return
     
     # Encontrar cena ativa
-    scenes = session_data.get('scenes', [])
-    active_scene = next((s for s in scenes if s.get('id') == active_scene_id), None)
+    active_scene = session.active_scene()
     
     if not active_scene:
         print('⚠️ Cena ativa não encontrada')
@@ -759,86 +1086,60 @@ def handle_request_current_scene(data):
         return
     
     # Verificar permissão
-    visible_players = active_scene.get('visible_to_players', [])
-    is_visible = player_id in visible_players
-    
-    if is_visible:
-        print(f'✅ {player_id} tem acesso à cena {active_scene.get("name")}')
-        emit('scene_activated', {
-            'scene_id': active_scene_id,
-            'scene': active_scene
-        })
+    if active_scene.is_visible_to(player_id):
+        print(f'✅ {player_id} tem acesso à cena {active_scene.name}')
+        flush_broadcasts(session)
+        emit('scene_activated', scene_activation(session, active_scene))
     else:
-        print(f'❌ {player_id} não tem acesso à cena {active_scene.get("name")}')
+        print(f'❌ {player_id} não tem acesso à cena {active_scene.name}')
         emit('scene_blocked', {
             'scene_id': active_scene_id,
-            'scene_name': active_scene.get('name')
+            'scene_name': active_scene.name
         })
 
 @socketio.on('scene_delete')
+@shared_state('scenes')
 def handle_scene_delete(data):
     session_id = data.get('session_id')
     scene_id = data.get('scene_id')
     
-    init_session(session_id)
+    session = init_session(session_id)
+    session.scenes.remove(scene_id)
+    close_room(scene_room(session_id, scene_id))
+    scene_payloads.invalidate((session_id, scene_id))
     
-    if 'scenes' not in active_sessions[session_id]:
-        return
-    
-    active_sessions[session_id]['scenes'] = [
-        s for s in active_sessions[session_id]['scenes']
-        if s.get('id') != scene_id
-    ]
-    
-    emit('scenes_sync', {
-        'scenes': active_sessions[session_id]['scenes']
-    }, room=session_id, include_self=True)
+    emit('scenes_sync', scenes_sync_payload(session), room=session_id, include_self=True)
     
     print(f'🎬 Cena removida: {scene_id} da sessão {session_id}')
 
 @socketio.on('scene_switch')
+@shared_state('core', 'scenes', 'fog')
 def handle_scene_switch(data):
     """✅ TOTALMENTE REESCRITO - Trocar cena ativa"""
     session_id = data.get('session_id')
     scene_id = data.get('scene_id')
     scene = data.get('scene')
     
-    init_session(session_id)
+    session = init_session(session_id)
+    compact_scene(scene)
+    sync_fog_from_scene(session, scene)
     
     # Salvar ID da cena ativa
-    active_sessions[session_id]['active_scene_id'] = scene_id
+    session.active_scene_id = scene_id
     
-    print(f'🎬 Trocando para cena: {scene.get("name")}')
+    # A cena enviada é a versão atual do mestre: guardar e acertar a sala
+    scene.setdefault('id', scene_id)
+    old_scene = session.put_scene(scene)
+    record = session.get_scene(scene_id)
+    update_scene_room(session, old_scene, record)
     
-    # ✅ ENVIAR PARA CADA JOGADOR INDIVIDUALMENTE
-    session_data = active_sessions[session_id]
+    print(f'🎬 Trocando para cena: {scene.get("name")} - {len(record.visible_to)} jogadores com acesso')
     
-    for player_id, player_data in session_data.get('players', {}).items():
-        player_socket = player_data.get('socket_id')
-        
-        if not player_socket:
-            continue
-        
-        visible_players = scene.get('visible_to_players', [])
-        is_visible = player_id in visible_players
-        
-        print(f'  👤 {player_id} - Visível: {is_visible}')
-        
-        if is_visible:
-            # ✅ TEM PERMISSÃO - Enviar cena COMPLETA
-            emit('scene_activated', {
-                'scene_id': scene_id,
-                'scene': scene
-            }, room=player_socket)
-        else:
-            # ❌ SEM PERMISSÃO - Bloquear
-            emit('scene_blocked', {
-                'scene_id': scene_id,
-                'scene_name': scene.get('name')
-            }, room=player_socket)
+    # ✅ Um envio para a sala da cena + um scene_blocked para os demais
+    emit_scene_visibility(session, record, scene_activation(session, record))
     
     # ✅ Notificar mestre
-    master_socket = session_data.get('master_socket')
+    master_socket = session.master_socket
     if master_socket:
         emit('scene_switched', {
             'scene_id': scene_id,
@@ -851,80 +1152,165 @@ def handle_scene_switch(data):
 # SHARED DICE ROLLS
 # ==================
 @socketio.on('roll_shared_dice')
+@shared_state()
 def handle_shared_dice_roll(data):
-    """Broadcast de rolagem de dados para toda a sessão"""
-    session_id = data.get('session_id')
-    roller_name = data.get('roller_name', 'Desconhecido')
-    dice_type = data.get('dice_type', 'd20')
-    result = data.get('result', 0)
-    formula = data.get('formula', '')
-    is_critical = data.get('is_critical', False)
-    is_failure = data.get('is_failure', False)
-    
-    print(f'🎲 [BROADCAST] {roller_name} rolou {formula}: {result}')
-    
-    # ✅ BROADCAST para TODA A SALA (incluindo o mestre e o próprio remetente)
-    emit('dice_rolled_shared', {
-        'roller_name': roller_name,
-        'dice_type': dice_type,
-        'result': result,
-        'formula': formula,
-        'is_critical': is_critical,
-        'is_failure': is_failure,
-        'timestamp': time.time()
-    }, room=session_id, include_self=True)
+    """
+    Rolar dados no servidor, gravar no log e enviar para toda a sessão
+    
+    formula: '1d20+5', '4d6kh3', 'd20adv', '2d6!'... ou formulas: lista
+    (várias rolagens de uma vez, uma transação). private: só quem rolou
+    recebe (a rolagem fica no log marcada como privada). O resultado e o
+    nome enviados pelo cliente são ignorados: quem rolou é o membro da
+    sessão ligado ao socket. O ack devolve as rolagens.
+    """
+    session_id = data.get('session_id')
+    private = bool(data.get('private', False))
+    formulas = data.get('formulas') or [data.get('formula') or data.get('dice_type') or 'd20']
+    
+    if not isinstance(formulas, list) or len(formulas) > MAX_ROLLS_PER_REQUEST:
+        return {'error': 'rolagens demais'}
+    
+    bound = sessions.lookup_socket(request.sid)
+    if not bound or bound[0] != session_id:
+        return {'error': 'entre na sessão antes de rolar dados'}
+    
+    roller_id = bound[1]
+    if roller_id == MASTER_ID:
+        roller_name = 'Mestre'
+    else:
+        player = init_session(session_id).players.get(roller_id)
+        roller_name = player.name if player else 'Desconhecido'
+    
+    try:
+        rolls = [dice_roller.roll(formula) for formula in formulas]
+    except (ValueError, TypeError) as e:
+        print(f'⚠️ Fórmula de dados inválida: {e}')
+        return {'error': str(e)}
+    
+    timestamp = time.time() * 1000
+    for roll in rolls:
+        roll.update({
+            'roller_id': roller_id,
+            'roller_name': roller_name,
+            'result': roll['total'],
+            'private': private,
+            'timestamp': timestamp
+        })
+    
+    for roll, roll_id in zip(rolls, db.add_dice_rolls(session_id, rolls)):
+        roll['id'] = roll_id
+        print(f'🎲 [{"PRIVADO" if private else "BROADCAST"}] {roller_name} rolou {roll["formula"]}: {roll["total"]}')
+        
+        if not private:
+            # ✅ BROADCAST para TODA A SALA (incluindo o mestre e o próprio remetente)
+            emit('dice_rolled_shared', roll, room=session_id, include_self=True)
+    
+    return {'rolls': rolls}
+
+@socketio.on('get_dice_history')
+def handle_get_dice_history(data):
+    """
+    Página do log de rolagens com as privadas que o socket pode ver
+    
+    Mestre vê todas; jogador vê as públicas e as próprias privadas. Quem
+    pede é o membro ligado ao socket, nunca um id enviado pelo cliente.
+    """
+    session_id = data.get('session_id')
+    bound = sessions.lookup_socket(request.sid)
+    if not bound or bound[0] != session_id:
+        return {'error': 'entre na sessão antes de ver as rolagens'}
+    
+    try:
+        limit = max(1, min(int(data.get('limit', 50)), 200))
+        before = int(data['before']) if data.get('before') is not None else None
+    except (TypeError, ValueError):
+        return {'error': 'paginação inválida'}
+    
+    member_id = bound[1]
+    history = db.dice_history(
+        session_id,
+        before=before,
+        limit=limit + 1,
+        include_private=member_id == MASTER_ID,
+        roller_id=member_id
+    )
+    
+    return {'history': history[:limit], 'has_more': len(history) > limit}
 
 # ==================
 # MONITOR DE CHAT - MESTRE
 # ==================
+def monitor_room(session_id):
+    """Sala dos sockets com o monitor de conversas aberto (só o mestre)"""
+    return f'{session_id}:monitor'
+
+def monitor_entry(session, player1_id, player2_id):
+    """Dados de uma conversa entre jogadores para a lista do monitor"""
+    player1_id, player2_id = sorted((player1_id, player2_id))
+    player1 = session.players.get(player1_id)
+    player2 = session.players.get(player2_id)
+    player1_name = (player1.name if player1 else None) or 'Jogador'
+    player2_name = (player2.name if player2 else None) or 'Jogador'
+    
+    return {
+        'conversation_id': conversation_id(player1_id, player2_id),
+        'name': f"{player1_name} ↔ {player2_name}",
+        'player1_id': player1_id,
+        'player2_id': player2_id
+    }
+
 @socketio.on('get_all_player_conversations')
+@shared_state()
 def handle_get_all_player_conversations(data):
-    """Enviar todas as conversas entre jogadores para o mestre"""
+    """
+    Abrir o monitor: índice das conversas entre jogadores + inscrição nas novas mensagens
+    
+    Só o índice (nomes, contagem, última mensagem) é enviado; as mensagens
+    chegam por monitor_message e as páginas por get_monitor_conversation.
+    """
     session_id = data.get('session_id')
     
-    init_session(session_id)
+    session = init_session(session_id)
+    if request.sid != session.master_socket:
+        return
     
-    conversations = {}
-    session_data = active_sessions[session_id]
+    join_room(monitor_room(session_id))
     
-    # Processar todas as conversas
-    for sender_id in session_data.get('chat_conversations', {}):
-        if sender_id == 'master':
-            continue
-        
-        for recipient_id in session_data['chat_conversations'][sender_id]:
-            if recipient_id == 'master':
-                continue
-            
-            # Criar ID único para o par (ordenado)
-            conv_id = '_'.join(sorted([sender_id, recipient_id]))
-            
-            # Evitar duplicatas
-            if conv_id in conversations:
-                continue
-            
-            # Buscar nomes dos jogadores
-            player1 = session_data['players'].get(sender_id, {})
-            player2 = session_data['players'].get(recipient_id, {})
-            
-            if not player1 or not player2:
-                continue
-            
-            player1_name = player1.get('name', 'Jogador')
-            player2_name = player2.get('name', 'Jogador')
-            
-            # Buscar mensagens
-            messages = session_data['chat_conversations'][sender_id].get(recipient_id, [])
-            
-            conversations[conv_id] = {
-                'name': f"{player1_name} ↔ {player2_name}",
-                'messages': messages,
-                'player1_id': sender_id,
-                'player2_id': recipient_id
-            }
+    conversations = {}
+    for row in chat.conversations(session, exclude=MASTER_ID):
+        entry = monitor_entry(session, row['user_a'], row['user_b'])
+        entry['message_count'] = row['message_count']
+        entry['last_timestamp'] = row['last_timestamp']
+        conversations[entry['conversation_id']] = entry
     
-    print(f'📊 Enviando {len(conversations)} conversas para monitor')
+    print(f'📊 Enviando índice de {len(conversations)} conversas para monitor')
     
     emit('player_conversations_data', {
         'conversations': conversations
     })
+
+@socketio.on('monitor_unsubscribe')
+def handle_monitor_unsubscribe(data):
+    """Monitor fechado: parar de receber monitor_message"""
+    leave_room(monitor_room(data.get('session_id')))
+
+@socketio.on('get_monitor_conversation')
+@shared_state()
+def handle_get_monitor_conversation(data):
+    """Página de uma conversa entre jogadores (before/limit como em get_conversation)"""
+    session_id = data.get('session_id')
+    conv_id = data.get('conversation_id')
+    before = data.get('before')
+    
+    session = init_session(session_id)
+    if request.sid != session.master_socket or not conv_id:
+        return
+    
+    messages, has_more = chat.page(session, conv_id, before=before, limit=data.get('limit', CHAT_PAGE_SIZE))
+    
+    emit('monitor_conversation_loaded', {
+        'conversation_id': conv_id,
+        'messages': messages,
+        'before': before,
+        'has_more': has_more
+    })
@@ -0,0 +1,456 @@
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import socketio
+from socketio import PubSubManager
+
+from app.database import ConnectionPool
+from app.payload_cache import payload_json
+
+# Partes do SessionState sincronizadas separadamente (ver SessionState.dump_component)
+STATE_COMPONENTS = ('core', 'maps', 'entities', 'tokens', 'drawings', 'fog', 'scenes', 'chat')
+
+# Tempo máximo (s) segurando o lock de uma sessão (libera locks de workers que morreram)
+STATE_LOCK_TTL = 10
+
+# Tempo máximo (s) esperando o lock de uma sessão
+STATE_LOCK_TIMEOUT = 5
+
+DEFAULT_STATE_DB = 'data/live_state.db'
+
+# A fila de mensagens fica em outro arquivo: os emits acontecem dentro da
+# transação (BEGIN IMMEDIATE) do handler e esperariam pelo próprio lock
+DEFAULT_QUEUE_DB = 'data/live_queue.db'
+
+
+class StateTransaction:
+    """Operações de leitura/escrita de componentes dentro de uma transação"""
+
+    def versions(self):
+        """Versão atual de cada componente no backend"""
+        return {}
+
+    def load(self, components):
+        """Dados JSON dos componentes pedidos"""
+        return {}
+
+    def store(self, components):
+        """Gravar {componente: dados}; retorna as novas versões"""
+        return {}
+
+
+class InProcessBackend:
+    """
+    Estado só na memória do processo (padrão)
+
+    Com um único worker não há nada para sincronizar: as transações do
+    SessionRegistry viram no-ops.
+    """
+
+    shared = False
+
+    @contextmanager
+    def transaction(self, session_id):
+        yield StateTransaction()
+
+    snapshot = transaction
+
+
+# ==================
+# SQLITE COMPARTILHADO
+# ==================
+
+class _SQLiteTransaction(StateTransaction):
+    def __init__(self, conn, session_id):
+        self.conn = conn
+        self.session_id = session_id
+
+    def versions(self):
+        rows = self.conn.execute(
+            'SELECT component, version FROM live_state WHERE session_id = ?',
+            (self.session_id,)
+        )
+        return {row['component']: row['version'] for row in rows}
+
+    def load(self, components):
+        marks = ', '.join('?' for _ in components)
+        rows = self.conn.execute(
+            f'SELECT component, data FROM live_state WHERE session_id = ? AND component IN ({marks})',
+            (self.session_id, *components)
+        )
+        return {row['component']: json.loads(row['data']) for row in rows}
+
+    def store(self, components):
+        current = self.versions()
+        versions = {name: current.get(name, 0) + 1 for name in components}
+
+        self.conn.executemany('''
+            INSERT INTO live_state (session_id, component, version, data)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(session_id, component) DO UPDATE SET
+                version = excluded.version,
+                data = excluded.data,
+                updated_at = CURRENT_TIMESTAMP
+        ''', [
+            (self.session_id, name, versions[name], json.dumps(data, ensure_ascii=False))
+            for name, data in components.items()
+        ])
+        return versions
+
+
+class SQLiteStateBackend:
+    """
+    Estado compartilhado entre os workers de uma máquina num arquivo SQLite
+
+    Uma transação de escrita é um BEGIN IMMEDIATE: o lock de escrita do
+    SQLite serializa os handlers que alteram estado em todos os workers.
+    Leituras usam o pool somente leitura e não esperam pelo escritor (WAL).
+    """
+
+    shared = True
+
+    def __init__(self, path=DEFAULT_STATE_DB):
+        self.path = path
+        _ensure_directory(path)
+
+        self.writer = ConnectionPool(path, size=1, timeout=STATE_LOCK_TIMEOUT)
+
+        with self.writer.connection() as conn:
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS live_state (
+                    session_id TEXT NOT NULL,
+                    component TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (session_id, component)
+                ) WITHOUT ROWID
+            ''')
+            conn.commit()
+
+        self.reader = ConnectionPool(path, size=4, readonly=True)
+
+    @contextmanager
+    def transaction(self, session_id):
+        with self.writer.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield _SQLiteTransaction(conn, session_id)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    @contextmanager
+    def snapshot(self, session_id):
+        with self.reader.connection() as conn:
+            yield _SQLiteTransaction(conn, session_id)
+
+    def prune(self, days=1):
+        """Remover estado de sessões sem alterações há mais de `days` dias"""
+        with self.writer.connection() as conn:
+            deleted = conn.execute('''
+                DELETE FROM live_state
+                WHERE session_id IN (
+                    SELECT session_id FROM live_state
+                    GROUP BY session_id
+                    HAVING MAX(updated_at) < datetime('now', '-' || ? || ' days')
+                )
+            ''', (days,)).rowcount
+            conn.commit()
+        return deleted
+
+
+# ==================
+# REDIS
+# ==================
+
+class InMemoryRedis:
+    """
+    Substituto local do Redis com os comandos usados pelo RedisStateBackend
+
+    Serve para testar o backend Redis sem um servidor (STATE_BACKEND=redis+local://);
+    o estado fica só neste processo.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def _alive(self, key):
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return key in self._data
+
+    def get(self, key):
+        with self._lock:
+            return self._data.get(key) if self._alive(key) else None
+
+    def set(self, key, value, nx=False, px=None):
+        with self._lock:
+            if nx and self._alive(key):
+                return None
+            self._data[key] = str(value)
+            if px:
+                self._expires[key] = time.monotonic() + px / 1000
+            else:
+                self._expires.pop(key, None)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            removed = 0
+            for key in keys:
+                if self._alive(key):
+                    del self._data[key]
+                    removed += 1
+                self._expires.pop(key, None)
+            return removed
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._data.get(key, {})) if self._alive(key) else {}
+
+    def hincrby(self, key, field, amount=1):
+        with self._lock:
+            if not self._alive(key):
+                self._data[key] = {}
+            value = int(self._data[key].get(field, 0)) + amount
+            self._data[key][field] = str(value)
+            return value
+
+
+class _RedisTransaction(StateTransaction):
+    def __init__(self, client, session_id):
+        self.client = client
+        self.prefix = f'rpg:state:{session_id}'
+
+    def versions(self):
+        return {name: int(v) for name, v in self.client.hgetall(f'{self.prefix}:versions').items()}
+
+    def load(self, components):
+        loaded = {}
+        for name in components:
+            raw = self.client.get(f'{self.prefix}:{name}')
+            if raw is not None:
+                loaded[name] = json.loads(raw)
+        return loaded
+
+    def store(self, components):
+        versions = {}
+        for name, data in components.items():
+            self.client.set(f'{self.prefix}:{name}', json.dumps(data, ensure_ascii=False))
+            versions[name] = self.client.hincrby(f'{self.prefix}:versions', name, 1)
+        return versions
+
+
+class RedisStateBackend:
+    """
+    Estado compartilhado num Redis (workers em uma ou várias máquinas)
+
+    Escritas são serializadas por sessão com um lock SET NX PX; o lock
+    expira sozinho se o worker morrer no meio de um handler.
+    """
+
+    shared = True
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url):
+        if url.startswith('redis+local://'):
+            return cls(InMemoryRedis())
+
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('STATE_BACKEND=redis requer o pacote redis (pip install redis)')
+
+        return cls(redis.Redis.from_url(url, decode_responses=True))
+
+    @contextmanager
+    def transaction(self, session_id):
+        lock_key = f'rpg:state:{session_id}:lock'
+        owner = uuid.uuid4().hex
+        deadline = time.monotonic() + STATE_LOCK_TIMEOUT
+        delay = 0.001
+
+        while not self.client.set(lock_key, owner, nx=True, px=STATE_LOCK_TTL * 1000):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'lock da sessão {session_id} ocupado')
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+        try:
+            yield _RedisTransaction(self.client, session_id)
+        finally:
+            if self.client.get(lock_key) == owner:
+                self.client.delete(lock_key)
+
+    @contextmanager
+    def snapshot(self, session_id):
+        yield _RedisTransaction(self.client, session_id)
+
+
+# ==================
+# FILA DE MENSAGENS (fan-out de eventos entre workers)
+# ==================
+
+class SQLiteMessageQueue(PubSubManager):
+    """
+    Client manager do Socket.IO que publica eventos numa tabela SQLite
+
+    Equivalente ao message_queue do Redis para workers da mesma máquina:
+    cada worker insere os emits e lê (polling) os emits dos outros.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path=DEFAULT_QUEUE_DB, channel='socketio', poll_interval=0.02,
+                 retention=60, write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=payload_json)
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        _ensure_directory(path)
+        self.pool = ConnectionPool(path, size=2)
+
+        with self.pool.connection() as conn:
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS socketio_messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    channel TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            conn.commit()
+
+    def _publish(self, data):
+        with self.pool.connection() as conn:
+            conn.execute(
+                'INSERT INTO socketio_messages (channel, payload, created_at) VALUES (?, ?, ?)',
+                (self.channel, self.json.dumps(data), time.time())
+            )
+            conn.commit()
+
+    def _listen(self):
+        with self.pool.connection() as conn:
+            last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM socketio_messages').fetchone()[0]
+
+        last_prune = time.monotonic()
+
+        while True:
+            with self.pool.connection() as conn:
+                rows = conn.execute('''
+                    SELECT id, payload FROM socketio_messages
+                    WHERE id > ? AND channel = ?
+                    ORDER BY id
+                ''', (last_id, self.channel)).fetchall()
+
+                # Mensagens antigas já foram lidas por todos os workers
+                if time.monotonic() - last_prune > self.retention:
+                    conn.execute(
+                        'DELETE FROM socketio_messages WHERE created_at < ?',
+                        (time.time() - self.retention,)
+                    )
+                    conn.commit()
+                    last_prune = time.monotonic()
+
+            for row in rows:
+                last_id = row['id']
+                yield row['payload']
+
+            if not rows:
+                self.server.sleep(self.poll_interval)
+
+
+# ==================
+# CONFIGURAÇÃO
+# ==================
+
+def _is_sqlite(url):
+    return url == 'sqlite' or url.startswith('sqlite://')
+
+
+def _sqlite_path(url, default=DEFAULT_STATE_DB):
+    """sqlite:///relativo.db → relativo.db, sqlite:////tmp/x.db → /tmp/x.db"""
+    path = url[len('sqlite:///'):] if url.startswith('sqlite:///') else ''
+    return path or default
+
+
+def _ensure_directory(path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+
+def _queue_path(queue_url, state_url):
+    """Arquivo da fila SQLite, nunca o mesmo do estado (ver DEFAULT_QUEUE_DB)"""
+    path = _sqlite_path(queue_url, DEFAULT_QUEUE_DB)
+    if _is_sqlite(state_url) and os.path.abspath(path) == os.path.abspath(_sqlite_path(state_url)):
+        root, ext = os.path.splitext(path)
+        path = f'{root}-queue{ext or ".db"}'
+    return path
+
+
+def create_state_backend(url=None):
+    """
+    Backend de estado a partir de STATE_BACKEND
+
+        memory (padrão)          só este processo
+        sqlite[:///caminho.db]   workers da mesma máquina
+        redis://host:6379/0      workers em qualquer máquina
+        redis+local://           Redis simulado em memória (testes)
+    """
+    url = (url or 'memory').strip()
+
+    if url == 'memory':
+        return InProcessBackend()
+    if _is_sqlite(url):
+        return SQLiteStateBackend(_sqlite_path(url))
+    if url.startswith(('redis://', 'rediss://', 'redis+local://')):
+        return RedisStateBackend.from_url(url)
+
+    raise ValueError(f'STATE_BACKEND desconhecido: {url}')
+
+
+def socketio_queue_options(queue_url=None, state_url=None):
+    """
+    Argumentos do SocketIO para espalhar emits entre workers
+
+    SOCKETIO_MESSAGE_QUEUE tem prioridade ('none' desliga); sem ela, segue
+    o STATE_BACKEND (sqlite usa a tabela de mensagens, redis usa o próprio Redis).
+    """
+    url = (queue_url or '').strip()
+    state_url = (state_url or '').strip()
+
+    if url == 'none':
+        return {}
+    if not url and (_is_sqlite(state_url) or state_url.startswith(('redis://', 'rediss://'))):
+        url = state_url
+
+    if not url:
+        return {}
+    if _is_sqlite(url):
+        return {'client_manager': SQLiteMessageQueue(_queue_path(url, state_url))}
+
+    # Mesmas classes que o Flask-SocketIO usaria para message_queue, mas com
+    # o json que entende payloads pré-codificados e anexos binários
+    if url.startswith(('redis://', 'rediss://')):
+        queue_class = socketio.RedisManager
+    elif url.startswith('kafka://'):
+        queue_class = socketio.KafkaManager
+    elif url.startswith('zmq'):
+        queue_class = socketio.ZmqManager
+    else:
+        queue_class = socketio.KombuManager
+    return {'client_manager': queue_class(url, channel='flask-socketio', json=payload_json)}
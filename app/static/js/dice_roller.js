@@ -176,8 +176,7 @@ function displayResult(value, formula, details, rolls, isCritSuccess, isCritFail
 
 // adiciona ao histórico
 function addToHistory(formula, result) {
-    const timestamp = new Date().toLocaleTimeString('pt-BR', { hour: '2-digit', minute: '2-digit' });
-    history.unshift({ formula, result, timestamp });
+    history.unshift({ formula, result, timestamp: Date.now() });
     if (history.length > 80) history = history.slice(0, 80);
     renderHistory();
 }
@@ -191,7 +190,7 @@ function renderHistory() {
     }
     list.innerHTML = history.map(item => `
         <div class="history-item">
-            <div class="history-roll"><strong>${item.formula}</strong> <span style="color:#666; margin-left:10px;">${item.timestamp}</span></div>
+            <div class="history-roll"><strong>${item.formula}</strong> <span style="color:#666; margin-left:10px;">${new Date(item.timestamp).toLocaleTimeString('pt-BR', { hour: '2-digit', minute: '2-digit' })}</span></div>
             <div class="history-result">${item.result}</div>
         </div>
     `).join('');
@@ -0,0 +1,188 @@
+// ==========================================
+// DESENHOS COMPACTOS (grupos e camadas raster do servidor)
+// ==========================================
+//
+// O servidor guarda os desenhos agrupados ({strokes: [[x0, y0, x1, y1, ...]]})
+// e rasteriza os traços antigos numa imagem ({image, x, y, width, height}).
+// Aqui os grupos voltam a ser traços {path: [{x, y}]} e os rasters são
+// desenhados a partir de um cache de imagens.
+
+const DrawingLayers = {
+    imageCache: new Map(),
+
+    /**
+     * Expandir grupos em traços individuais (rasters ficam como estão)
+     */
+    unpack(list) {
+        const result = [];
+
+        (list || []).forEach(drawing => {
+            if (!drawing) return;
+
+            if (!Array.isArray(drawing.strokes)) {
+                result.push(drawing);
+                return;
+            }
+
+            drawing.strokes.forEach((flat, i) => {
+                const path = [];
+                for (let j = 0; j + 1 < flat.length; j += 2) {
+                    path.push({ x: flat[j], y: flat[j + 1] });
+                }
+                result.push({
+                    id: i === 0 ? drawing.id : `${drawing.id}_${i}`,
+                    path: path,
+                    color: drawing.color,
+                    size: drawing.size
+                });
+            });
+        });
+
+        return result;
+    },
+
+    isRaster(drawing) {
+        return Boolean(drawing && drawing.image);
+    },
+
+    /**
+     * Desenhar camada raster; se a imagem ainda não carregou, chama onReady depois
+     */
+    renderRaster(ctx, drawing, onReady) {
+        let entry = this.imageCache.get(drawing.image);
+
+        if (!entry) {
+            const img = new Image();
+            entry = { img: img, loaded: false };
+            img.onload = () => {
+                entry.loaded = true;
+                if (onReady) onReady();
+            };
+            img.src = drawing.image;
+            this.imageCache.set(drawing.image, entry);
+        }
+
+        if (entry.loaded) {
+            ctx.drawImage(entry.img, drawing.x, drawing.y, drawing.width, drawing.height);
+        }
+    }
+};
+
+window.DrawingLayers = DrawingLayers;
+
+// ==========================================
+// TRAÇOS AO VIVO (stroke_begin / stroke_points / stroke_end)
+// ==========================================
+//
+// Quem desenha envia os pontos em lotes pequenos enquanto o mouse se move;
+// o servidor junta os lotes de todos a cada tick e repassa em stroke_batch.
+
+const LiveStrokes = {
+    FLUSH_MS: 33,
+
+    current: null,
+    flushTimer: null,
+    remote: new Map(),
+
+    /**
+     * Começar a transmitir um traço; retorna o id do traço
+     */
+    begin(socket, sessionId, color, size) {
+        if (this.current) this.end();
+
+        const id = Date.now() + '_' + Math.random().toString(36).substr(2, 9);
+        this.current = { socket: socket, sessionId: sessionId, id: id, buffer: [] };
+
+        socket.emit('stroke_begin', {
+            session_id: sessionId,
+            stroke_id: id,
+            color: color,
+            size: size
+        });
+        return id;
+    },
+
+    add(point) {
+        if (!this.current) return;
+
+        this.current.buffer.push(Math.round(point.x), Math.round(point.y));
+
+        if (!this.flushTimer) {
+            this.flushTimer = setTimeout(() => this.flush(), this.FLUSH_MS);
+        }
+    },
+
+    flush() {
+        clearTimeout(this.flushTimer);
+        this.flushTimer = null;
+
+        const stroke = this.current;
+        if (!stroke || stroke.buffer.length === 0) return;
+
+        stroke.socket.emit('stroke_points', {
+            session_id: stroke.sessionId,
+            stroke_id: stroke.id,
+            points: stroke.buffer
+        });
+        stroke.buffer = [];
+    },
+
+    /**
+     * Terminar o traço (o servidor grava e manda a versão final para os outros)
+     */
+    end() {
+        const stroke = this.current;
+        if (!stroke) return null;
+
+        this.flush();
+        stroke.socket.emit('stroke_end', {
+            session_id: stroke.sessionId,
+            stroke_id: stroke.id
+        });
+        this.current = null;
+        return stroke.id;
+    },
+
+    /**
+     * Aplicar um stroke_batch recebido à lista de desenhos; retorna true se mudou
+     */
+    apply(drawings, ops) {
+        let changed = false;
+
+        (ops || []).forEach(op => {
+            let drawing = this.remote.get(op.stroke_id);
+
+            if (op.op === 'begin') {
+                drawing = { id: op.stroke_id, color: op.color, size: op.size, path: [] };
+                this.remote.set(op.stroke_id, drawing);
+                drawings.push(drawing);
+            } else if (!drawing) {
+                // Começo do traço chegou antes de entrarmos: só a versão final importa
+                if (op.op === 'end' && op.drawing) {
+                    drawings.push(op.drawing);
+                    changed = true;
+                }
+                return;
+            } else if (op.op === 'points') {
+                for (let i = 0; i + 1 < op.points.length; i += 2) {
+                    drawing.path.push({ x: op.points[i], y: op.points[i + 1] });
+                }
+            } else if (op.op === 'end') {
+                this.remote.delete(op.stroke_id);
+
+                if (op.drawing) {
+                    // Versão final (simplificada) substitui a prévia
+                    Object.assign(drawing, op.drawing);
+                } else {
+                    const index = drawings.indexOf(drawing);
+                    if (index >= 0) drawings.splice(index, 1);
+                }
+            }
+            changed = true;
+        });
+
+        return changed;
+    }
+};
+
+window.LiveStrokes = LiveStrokes;
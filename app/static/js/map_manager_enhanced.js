@@ -134,17 +134,28 @@ let hasLoadedInitialState = false;
 window.lastSavedState = null;       
 let isLoadingState = false;         
 
+// ✅ Resolvido quando o servidor termina de responder ao join_session
+// (com limite de tempo, para não travar a ativação da cena se o socket cair)
+let resolveSessionJoined;
+const sessionJoined = Promise.race([
+    new Promise(resolve => { resolveSessionJoined = resolve; }),
+    new Promise(resolve => setTimeout(resolve, 3000))
+]);
+
 // ==========================================
 // OTIMIZAÇÕES DE PERFORMANCE
 // ==========================================
 
-// Debounced socket emits
-const debouncedTokenUpdate = CanvasOptimizer.debounce((tokens) => {
-    socket.emit('token_update', {
+// Delta de token: enviar apenas os campos alterados
+function emitTokenMoved(token) {
+    socket.emit('token_moved', {
         session_id: SESSION_ID,
-        tokens: tokens
+        token_id: token.id,
+        changes: { x: token.x, y: token.y }
     });
-}, 150);
+}
+
+// Debounced socket emits
 
 const debouncedMapUpdate = CanvasOptimizer.debounce((mapId, mapData) => {
     socket.emit('update_map', {
@@ -369,7 +380,7 @@ async function saveCurrentStateWithoutFog() {
     }
     
     // ✅ PROTEÇÃO: Não salvar se ainda não carregou estado inicial
-    if (!hasLoadedInitialState) {
+    if (!hasLoadedInitialState || scenesStillLoading()) {
         console.log('⚠️ Aguardando carregamento inicial antes de salvar');
         return;
     }
@@ -494,6 +505,12 @@ async function saveCurrentState() {
         return;
     }
     
+    // ✅ PROTEÇÃO: cenas ainda chegando pelo streaming
+    if (scenesStillLoading()) {
+        console.log('⚠️ Cenas ainda carregando - save adiado');
+        return;
+    }
+    
     isSaving = true;
     console.log('💾 [STATE] Salvando estado atual...');
     
@@ -568,6 +585,22 @@ async function saveCurrentState() {
     }
 }
 
+function applySavedGridSettings(settings) {
+    if (!settings) return;
+    
+    gridEnabled = settings.enabled;
+    gridSize = settings.size;
+    gridColor = settings.color;
+    gridLineWidth = settings.lineWidth;
+}
+
+/**
+ * Cenas ainda chegando pelo streaming (não salvar por cima delas)
+ */
+function scenesStillLoading() {
+    return scenes.some(s => s._pending);
+}
+
 /**
  * ✅ Carregar estado salvo (COM PROTEÇÃO CONTRA DUPLICAÇÃO)
  */
@@ -596,7 +629,37 @@ async function loadSavedState() {
     console.log('📂 [STATE] Carregando estado salvo...');
     
     try {
-        const savedData = await PersistenceManager.loadSession(SESSION_ID);
+        let earlySceneId = null;
+        
+        // ✅ Streaming: a cena ativa é renderizada assim que chega, sem esperar o resto
+        const savedData = await PersistenceManager.streamSession(SESSION_ID, (section, data) => {
+            if (section.type === 'scenes' && data.scenes.length > 0) {
+                scenes = data.scenes;
+                hasCreatedScene = true;
+                overlayInitialized = true;
+                renderScenesList();
+                
+            } else if (section.type === 'scene') {
+                // Substituir o placeholder (por id: `scenes` pode ter sido reatribuído por scenes_sync)
+                const index = scenes.findIndex(s => s.id === section.scene.id);
+                if (index >= 0) {
+                    scenes[index] = section.scene;
+                }
+                
+                if (!earlySceneId && section.scene.id === data.active_scene_id) {
+                    earlySceneId = section.scene.id;
+                    applySavedGridSettings(data.grid_settings);
+                    
+                    // Esperar o join (que limpa névoa e sincroniza grid) antes de ativar
+                    sessionJoined.then(() => {
+                        console.log('🎬 Ativando cena antes do fim do carregamento:', section.scene.name);
+                        switchToScene(earlySceneId);
+                    });
+                }
+                
+                renderScenesList();
+            }
+        });
         
         if (!savedData) {
             console.log('ℹ️ [STATE] Sem dados salvos');
@@ -611,14 +674,11 @@ async function loadSavedState() {
         if (savedData.scenes && savedData.scenes.length > 0) {
             console.log('🎬 Sistema de cenas detectado - modo SCENE');
             
-            scenes = savedData.scenes;
+            // Manter cenas criadas/sincronizadas durante o streaming
+            const loadedIds = new Set(savedData.scenes.map(s => s.id));
+            scenes = [...savedData.scenes, ...scenes.filter(s => !loadedIds.has(s.id))];
             
-            if (savedData.grid_settings) {
-                gridEnabled = savedData.grid_settings.enabled;
-                gridSize = savedData.grid_settings.size;
-                gridColor = savedData.grid_settings.color;
-                gridLineWidth = savedData.grid_settings.lineWidth;
-            }
+            applySavedGridSettings(savedData.grid_settings);
             
             drawGrid();
             renderScenesList();
@@ -628,9 +688,9 @@ async function loadSavedState() {
             
             console.log('✅ Cenas carregadas:', scenes.length);
             
-            // ✅ ATIVAR ÚLTIMA CENA USADA (se houver)
-            if (scenes.length > 0) {
-                const lastScene = scenes[scenes.length - 1];
+            // ✅ ATIVAR CENA ATIVA (ou a última), se o streaming ainda não ativou
+            if (!earlySceneId && scenes.length > 0) {
+                const lastScene = scenes.find(s => s.id === savedData.active_scene_id) || scenes[scenes.length - 1];
                 
                 console.log('🎬 Ativando última cena:', lastScene.name);
                 
@@ -647,7 +707,7 @@ async function loadSavedState() {
             
             images = savedData.images || [];
             tokens = savedData.tokens || [];
-            drawings = savedData.drawings || [];
+            drawings = DrawingLayers.unpack(savedData.drawings);
             
             if (savedData.grid_settings) {
                 gridEnabled = savedData.grid_settings.enabled;
@@ -904,6 +964,10 @@ socket.on('connect', () => {
     if (!hasLoadedInitialState) {
         console.log('📂 Primeira conexão - tentando restaurar estado');
         
+        // ✅ Join ANTES do carregamento: a cena ativa é ativada assim que
+        // chega pelo streaming, depois das respostas do join
+        socket.emit('join_session', { session_id: SESSION_ID });
+        
         loadSavedState().then(wasRestored => {
             if (wasRestored) {
                 console.log('♻️ Estado restaurado do banco');
@@ -911,10 +975,7 @@ socket.on('connect', () => {
                 console.log('🆕 Iniciando sessão nova');
             }
             
-            // ✅ Join na sessão APÓS carregar
-            socket.emit('join_session', { session_id: SESSION_ID });
-            
-            // ✅ Iniciar auto-save APÓS join
+            // ✅ Iniciar auto-save APÓS carregar
             startAutoSave();
 
             // ✅ Inicializar sistema de cenas APÓS tudo
@@ -928,9 +989,6 @@ socket.on('connect', () => {
             
         }).catch(error => {
             console.error('❌ Erro ao carregar estado:', error);
-            
-            // Mesmo com erro, fazer join
-            socket.emit('join_session', { session_id: SESSION_ID });
             startAutoSave();
         });
     } else {
@@ -961,7 +1019,7 @@ socket.on('session_state', (data) => {
         entities = data.entities || [];
         images = [...maps, ...entities];
         tokens = data.tokens || [];
-        drawings = data.drawings || [];
+        drawings = DrawingLayers.unpack(data.drawings);
         scenes = data.scenes || [];
         
         preloadAllImages();
@@ -982,9 +1040,12 @@ socket.on('session_state', (data) => {
     })();
 });
 
-socket.on('scenes_sync', (data) => {
+SocketPayloads.on(socket, 'scenes_sync', (data) => {
     console.log('🎬 Sincronização de cenas recebida:', data);
     
+    // Última resposta do join_session
+    resolveSessionJoined();
+    
     // ✅ Atualizar apenas se não conflitar com estado local
     if (data.scenes && Array.isArray(data.scenes)) {
         // ✅ Merge inteligente: preservar cenas locais novas
@@ -1084,7 +1145,14 @@ socket.on('entity_updated', (data) => {
     }
 });
 
+// Último número de sequência de token aplicado
+let tokenSeq = 0;
+
 socket.on('token_sync', (data) => {
+    if (typeof data.seq === 'number') {
+        tokenSeq = data.seq;
+    }
+    
     console.log('🎯 [MESTRE] TOKEN SYNC recebido:', {
         timestamp: new Date().toISOString(),
         tokensCount: data.tokens?.length,
@@ -1106,6 +1174,42 @@ socket.on('token_sync', (data) => {
     });
 });
 
+socket.on('token_delta', (data) => {
+    // Delta perdido - pedir snapshot completo
+    if (tokenSeq && data.seq !== tokenSeq + 1) {
+        console.warn(`⚠️ [MESTRE] Salto de sequência de token (${tokenSeq} → ${data.seq})`);
+        socket.emit('request_token_snapshot', { session_id: SESSION_ID });
+        return;
+    }
+    tokenSeq = data.seq;
+    
+    if (data.op === 'moved') {
+        const token = tokens.find(t => t.id === data.token_id);
+        // Não sobrescrever o token que está sendo arrastado agora
+        if (token && !(isDraggingItem && draggingItem === token)) {
+            Object.assign(token, data.changes);
+        }
+    } else if (data.op === 'added') {
+        const index = tokens.findIndex(t => t.id === data.token_id);
+        if (index >= 0) {
+            tokens[index] = data.token;
+        } else {
+            tokens.push(data.token);
+        }
+        preloadAllImages();
+        renderTokenList();
+    } else if (data.op === 'removed') {
+        loadedImages.delete(data.token_id);
+        tokens = tokens.filter(t => t.id !== data.token_id);
+        renderTokenList();
+    }
+    
+    window.requestAnimationFrame(() => {
+        redrawAll();
+        markChanges();
+    });
+});
+
 socket.on('drawing_sync', (data) => {
     drawings.push(data.drawing);
     redrawDrawings();
@@ -1113,6 +1217,13 @@ socket.on('drawing_sync', (data) => {
     markChanges();
 });
 
+socket.on('stroke_batch', (data) => {
+    if (LiveStrokes.apply(drawings, data.ops)) {
+        redrawDrawings();
+        markChanges();
+    }
+});
+
 socket.on('drawings_cleared', () => {
     drawings = [];
     redrawDrawings();
@@ -1157,14 +1268,25 @@ socket.on('chat_contacts_loaded', (data) => {
 
 socket.on('conversation_loaded', (data) => {
     console.log('💬 Conversa carregada:', data);
-    currentConversation = data.messages || [];
+    let messages = data.messages || [];
+    
+    // Página mais antiga (before): juntar na frente do que já está carregado
+    if (data.before && data.other_user_id) {
+        const loaded = conversationsCache[data.other_user_id] || [];
+        const known = new Set(loaded.map(m => m.id));
+        messages = messages.filter(m => !known.has(m.id)).concat(loaded);
+    }
     
     if (data.other_user_id) {
-        conversationsCache[data.other_user_id] = [...currentConversation];
-        console.log(`💾 Cache atualizado para ${data.other_user_id}:`, currentConversation.length, 'mensagens');
+        conversationsCache[data.other_user_id] = [...messages];
+        conversationHasMore[data.other_user_id] = !!data.has_more;
+        console.log(`💾 Cache atualizado para ${data.other_user_id}:`, messages.length, 'mensagens');
     }
     
-    renderConversation();
+    if (!data.before || data.other_user_id === currentChatContact) {
+        currentConversation = messages;
+        renderConversation(!!data.before);
+    }
 });
 
 socket.on('new_private_message', (data) => {
@@ -1180,8 +1302,8 @@ socket.on('new_private_message', (data) => {
         if (data.sender_id === currentChatContact || data.recipient_id === currentChatContact) {
             shouldAdd = true;
         }
-        else if (currentChatContact.includes('_')) {
-            const [player1, player2] = currentChatContact.split('_');
+        else if (currentChatContact.includes('|')) {
+            const [player1, player2] = currentChatContact.split('|');
             if ((data.sender_id === player1 && data.recipient_id === player2) ||
                 (data.sender_id === player2 && data.recipient_id === player1)) {
                 shouldAdd = true;
@@ -1212,7 +1334,7 @@ socket.on('new_private_message', (data) => {
         }
     }
     else if (data.sender_id !== 'master' && data.recipient_id !== 'master') {
-        const conversationKey = [data.sender_id, data.recipient_id].sort().join('_');
+        const conversationKey = [data.sender_id, data.recipient_id].sort().join('|');
         if (!conversationsCache[conversationKey]) {
             conversationsCache[conversationKey] = [];
         }
@@ -1479,6 +1601,11 @@ function redrawDrawingsLegacy() {
         drawCtx.clearRect(0, 0, CANVAS_WIDTH, CANVAS_HEIGHT);
         
         drawings.forEach(drawing => {
+            if (DrawingLayers.isRaster(drawing)) {
+                DrawingLayers.renderRaster(drawCtx, drawing, redrawDrawings);
+                return;
+            }
+            
             drawCtx.strokeStyle = drawing.color;
             drawCtx.lineWidth = drawing.size;
             drawCtx.lineCap = 'round';
@@ -1741,7 +1868,7 @@ canvasWrapper.addEventListener('mouseup', (e) => {
                 debouncedEntityUpdate(draggingItem.id, draggingItem);
             }
         } else if (selectedType === 'token') {
-            debouncedTokenUpdate(tokens);
+            emitTokenMoved(draggingItem);
         }
         saveState(selectedType === 'image' ? 'Mover Imagem' : 'Mover Token');
         
@@ -1773,10 +1900,7 @@ canvasWrapper.addEventListener('mouseleave', () => {
                 });
             }
         } else if (selectedType === 'token') {
-            socket.emit('token_update', {
-                session_id: SESSION_ID,
-                tokens: tokens
-            });
+            emitTokenMoved(draggingItem);
         }
     }
     
@@ -1841,6 +1965,11 @@ function renderDrawingPreview() {
     
     // Redesenhar desenhos existentes
     drawings.forEach(drawing => {
+        if (DrawingLayers.isRaster(drawing)) {
+            DrawingLayers.renderRaster(drawCtx, drawing, redrawDrawings);
+            return;
+        }
+        
         drawCtx.strokeStyle = drawing.color;
         drawCtx.lineWidth = drawing.size;
         drawCtx.lineCap = 'round';
@@ -1885,6 +2014,7 @@ function addDrawingPoint(x, y) {
     }
     
     currentPath.push({ x, y });
+    LiveStrokes.add({ x, y });
     lastPointTime = now;
     return true;
 }
@@ -1917,6 +2047,10 @@ drawingCanvas.addEventListener('mousedown', (e) => {
         currentPath = [pos];
         lastPointTime = performance.now();
         
+        // ✅ Transmitir o traço ao vivo para os outros
+        LiveStrokes.begin(socket, SESSION_ID, drawingColor, brushSize);
+        LiveStrokes.add(pos);
+        
         // Primeira renderização
         scheduleDrawingRender();
         
@@ -1967,8 +2101,9 @@ drawingCanvas.addEventListener('mouseup', () => {
         // Simplificar path (remover pontos redundantes)
         const simplifiedPath = simplifyPath(currentPath, 2);
         
+        // ✅ Pontos já foram transmitidos; o servidor grava ao encerrar o traço
         const drawing = {
-            id: Date.now() + '_' + Math.random().toString(36).substr(2, 9),
+            id: LiveStrokes.end(),
             path: simplifiedPath,
             color: drawingColor,
             size: brushSize
@@ -1979,12 +2114,6 @@ drawingCanvas.addEventListener('mouseup', () => {
         // ✅ Renderizar final
         redrawDrawings();
         
-        // ✅ ENVIAR PARA O SERVIDOR (apenas no final)
-        socket.emit('drawing_update', {
-            session_id: SESSION_ID,
-            drawing: drawing
-        });
-        
         currentPath = [];
         saveState('Desenhar');
         
@@ -2008,7 +2137,7 @@ drawingCanvas.addEventListener('mouseleave', () => {
         const simplifiedPath = simplifyPath(currentPath, 2);
         
         const drawing = {
-            id: Date.now() + '_' + Math.random().toString(36).substr(2, 9),
+            id: LiveStrokes.end(),
             path: simplifiedPath,
             color: drawingColor,
             size: brushSize
@@ -2017,11 +2146,6 @@ drawingCanvas.addEventListener('mouseleave', () => {
         drawings.push(drawing);
         redrawDrawings();
         
-        socket.emit('drawing_update', {
-            session_id: SESSION_ID,
-            drawing: drawing
-        });
-        
         currentPath = [];
         saveState('Desenhar');
     }
@@ -2088,7 +2212,7 @@ function eraseDrawingsAt(x, y) {
     const newDrawings = [];
     
     drawings.forEach(drawing => {
-        const hasPointInRadius = drawing.path.some(point => {
+        const hasPointInRadius = !DrawingLayers.isRaster(drawing) && drawing.path.some(point => {
             const dist = Math.hypot(point.x - x, point.y - y);
             return dist < eraseRadius;
         });
@@ -2130,7 +2254,8 @@ window.fogState = {
     brushShape: 'circle',
     masterOpacity: 0.5,
     paintMode: false,
-    eraseMode: false
+    eraseMode: false,
+    strokePoints: []
 };
 
 /**
@@ -2380,6 +2505,7 @@ function coverAllWithFog() {
         fogCtx.fillStyle = 'rgba(0, 0, 0, 1)';
         fogCtx.fillRect(0, 0, CANVAS_WIDTH, CANVAS_HEIGHT);
         
+        emitFogOp({ mode: 'cover', shape: 'all' });
         syncFogToServer();
         showToast('🌫️ Mapa coberto com névoa');
         markChanges();
@@ -2406,7 +2532,43 @@ function clearAllFog() {
 }
 
 /**
- * Sincronizar fog com servidor (throttled)
+ * Enviar operação de névoa para o servidor (aplicada na máscara da cena)
+ */
+function emitFogOp(op) {
+    socket.emit('fog_op', {
+        session_id: SESSION_ID,
+        scene_id: currentSceneId,
+        op: op
+    });
+}
+
+// Traços longos vão em partes (o servidor limita o tamanho de cada operação)
+const FOG_STROKE_CHUNK = 200;
+
+/**
+ * Enviar o traço de pincel recém-terminado como uma única operação
+ * 
+ * continuing: traço ainda em andamento - a próxima parte começa no último ponto
+ */
+function emitFogStroke(continuing = false) {
+    const points = window.fogState.strokePoints;
+    window.fogState.strokePoints = continuing ? [points[points.length - 1]] : [];
+    
+    if (!points || points.length === 0) return;
+    
+    emitFogOp({
+        mode: window.fogState.eraseMode ? 'reveal' : 'cover',
+        shape: 'stroke',
+        brush: window.fogState.brushShape,
+        size: window.fogState.brushSize,
+        points: points
+    });
+}
+
+/**
+ * Atualizar a névoa salva da cena (throttled)
+ * Os jogadores já receberam as operações via fog_op - aqui só o PNG local
+ * da cena é atualizado para o auto-save no banco.
  */
 let fogSyncTimeout = null;
 function syncFogToServer() {
@@ -2415,20 +2577,14 @@ function syncFogToServer() {
     fogSyncTimeout = setTimeout(() => {
         const fogCanvas = document.getElementById('fogCanvas');
         
-        console.log('🌫️ Sincronizando fog com servidor');
-        
-        PerformanceFix.syncFogThrottled(
-            SESSION_ID,
-            fogCanvas.toDataURL('image/png')
-        );
-        
-        // ✅ NÃO chamar markChanges() aqui para evitar auto-save
-        // markChanges(); ❌ REMOVIDO
-        
-        // ✅ Salvar diretamente apenas a cena (sem acionar auto-save global)
         if (hasCreatedScene && currentSceneId) {
-            saveCurrentScene();
+            const currentScene = scenes.find(s => s.id === currentSceneId);
+            if (currentScene) {
+                currentScene.fog_image = PerformanceFix.compressFog(fogCanvas);
+            }
         }
+        
+        markChanges();
     }, 500);
 }
 
@@ -2524,6 +2680,7 @@ function initializeFogCanvas() {
         window.fogState.isDrawing = true;
         window.fogState.lastX = pos.x;
         window.fogState.lastY = pos.y;
+        window.fogState.strokePoints = [[Math.round(pos.x), Math.round(pos.y)]];
         
         paintFog(pos.x, pos.y, window.fogState.eraseMode);
         
@@ -2552,6 +2709,11 @@ function initializeFogCanvas() {
         
         window.fogState.lastX = pos.x;
         window.fogState.lastY = pos.y;
+        window.fogState.strokePoints.push([Math.round(pos.x), Math.round(pos.y)]);
+        
+        if (window.fogState.strokePoints.length >= FOG_STROKE_CHUNK) {
+            emitFogStroke(true);
+        }
     }, true);
     
     // MouseUp
@@ -2563,6 +2725,7 @@ function initializeFogCanvas() {
             window.fogState.lastX = null;
             window.fogState.lastY = null;
             
+            emitFogStroke();
             syncFogToServer();
         }
     }, true);
@@ -2576,6 +2739,7 @@ function initializeFogCanvas() {
             window.fogState.lastX = null;
             window.fogState.lastY = null;
             
+            emitFogStroke();
             syncFogToServer();
         }
     }, true);
@@ -2621,6 +2785,9 @@ function addImage() {
                         0.85
                     );
                     
+                    // ✅ Enviar uma única vez e referenciar por hash
+                    const imageUrl = await PersistenceManager.uploadAsset(compressedBase64);
+                    
                     let width = 400;
                     let height = 400;
                     
@@ -2637,7 +2804,7 @@ function addImage() {
                         y: CANVAS_HEIGHT / 2 - height / 2,
                         width: width,
                         height: height,
-                        image: compressedBase64
+                        image: imageUrl
                     };
                     
                     const compressedImg = new Image();
@@ -2748,12 +2915,15 @@ function createToken() {
                         0.8    // Qualidade 80%
                     );
                     
+                    // ✅ Enviar uma única vez e referenciar por hash
+                    const imageUrl = await PersistenceManager.uploadAsset(compressedBase64);
+                    
                     const newToken = {
                         id: 'token_' + Date.now(),
                         name: name,
                         x: CANVAS_WIDTH / 2,
                         y: CANVAS_HEIGHT / 2,
-                        image: compressedBase64,  // ✅ USAR COMPRIMIDO
+                        image: imageUrl,  // ✅ URL do asset comprimido
                         style: style
                     };
                     
@@ -2766,9 +2936,9 @@ function createToken() {
                         renderTokenList();
                         redrawAll();
                         
-                        socket.emit('token_update', {
+                        socket.emit('token_added', {
                             session_id: SESSION_ID,
-                            tokens: tokens
+                            token: newToken
                         });
                         
                         closeTokenModal();
@@ -2808,9 +2978,9 @@ function createToken() {
         renderTokenList();
         redrawAll();
         
-        socket.emit('token_update', {
+        socket.emit('token_added', {
             session_id: SESSION_ID,
-            tokens: tokens
+            token: newToken
         });
         
         closeTokenModal();
@@ -2855,9 +3025,9 @@ function deleteSelected() {
     } else if (selectedType === 'token') {
         loadedImages.delete(selectedItem.id);
         tokens = tokens.filter(t => t !== selectedItem);
-        socket.emit('token_update', {
+        socket.emit('token_removed', {
             session_id: SESSION_ID,
-            tokens: tokens
+            token_id: selectedItem.id
         });
         renderTokenList();
     }
@@ -2983,9 +3153,9 @@ function deleteItemById(itemId, type) {
                 loadedImages.delete(token.id);
                 tokens = tokens.filter(t => t.id !== itemId);
                 
-                socket.emit('token_update', {
+                socket.emit('token_removed', {
                     session_id: SESSION_ID,
-                    tokens: tokens
+                    token_id: itemId
                 });
                 
                 renderTokenList();
@@ -3009,6 +3179,7 @@ function deleteItemById(itemId, type) {
 // ==================
 
 let conversationsCache = {};
+let conversationHasMore = {};
 
 function toggleChatMinimize() {
     chatMinimized = !chatMinimized;
@@ -3146,12 +3317,22 @@ function openConversation(contactId) {
     loadChatContacts();
 }
 
-function renderConversation() {
+function renderConversation(keepScroll = false) {
     const messagesContainer = document.getElementById('conversationMessages');
     if (!messagesContainer) return;
     
+    const previousHeight = messagesContainer.scrollHeight - messagesContainer.scrollTop;
     messagesContainer.innerHTML = '';
     
+    // Histórico paginado: mensagens antigas só quando pedidas
+    if (conversationHasMore[currentChatContact]) {
+        const loadMore = document.createElement('button');
+        loadMore.className = 'load-older-messages';
+        loadMore.textContent = 'Carregar mensagens anteriores';
+        loadMore.onclick = loadOlderMessages;
+        messagesContainer.appendChild(loadMore);
+    }
+    
     if (currentConversation.length === 0) {
         messagesContainer.innerHTML = '<div class="empty-state">Nenhuma mensagem ainda</div>';
         return;
@@ -3174,7 +3355,21 @@ function renderConversation() {
         messagesContainer.appendChild(bubble);
     });
     
-    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    // Ao carregar mensagens anteriores, manter a posição de leitura
+    messagesContainer.scrollTop = keepScroll
+        ? messagesContainer.scrollHeight - previousHeight
+        : messagesContainer.scrollHeight;
+}
+
+function loadOlderMessages() {
+    if (!currentChatContact || currentConversation.length === 0) return;
+    
+    socket.emit('get_conversation', {
+        session_id: SESSION_ID,
+        user_id: 'master',
+        other_user_id: currentChatContact,
+        before: currentConversation[0].id
+    });
 }
 
 function sendChatMessage() {
@@ -3201,7 +3396,9 @@ function sendChatMessage() {
 // MONITOR DE CONVERSAS - SOMENTE LEITURA
 // ==========================================
 
+// Índice das conversas (sem mensagens) e páginas já carregadas de cada uma
 let monitorData = {};
+let monitorPages = {};
 let currentMonitorConv = null;
 
 function openConversationsMonitor() {
@@ -3217,53 +3414,94 @@ function closeConversationsMonitor() {
     const modal = document.getElementById('conversationsMonitor');
     modal.classList.remove('show');
     currentMonitorConv = null;
+    
+    // Parar de receber as mensagens ao vivo
+    socket.emit('monitor_unsubscribe', {
+        session_id: SESSION_ID
+    });
 }
 
 function refreshMonitor() {
     console.log('🔄 Atualizando monitor');
     showToast('Atualizando...');
+    monitorPages = {};
     loadMonitorData();
 }
 
 function loadMonitorData() {
-    console.log('📡 Solicitando dados de conversas');
+    console.log('📡 Solicitando índice de conversas');
     
+    // Também inscreve o mestre em monitor_message
     socket.emit('get_all_player_conversations', {
         session_id: SESSION_ID
     });
 }
 
 socket.on('player_conversations_data', (data) => {
-    console.log('📦 Dados recebidos:', data);
+    console.log('📦 Índice recebido:', data);
     
     monitorData = data.conversations || {};
     
     renderMonitorConversationsList();
     
+    if (currentMonitorConv && monitorData[currentMonitorConv]) {
+        selectMonitorConversation(currentMonitorConv);
+    }
+    
     const count = Object.keys(monitorData).length;
     showToast(`${count} conversa(s) encontrada(s)`);
 });
 
+socket.on('monitor_conversation_loaded', (data) => {
+    const convId = data.conversation_id;
+    let messages = data.messages || [];
+    
+    // Página mais antiga: juntar na frente do que já está carregado
+    if (data.before && monitorPages[convId]) {
+        const loaded = monitorPages[convId].messages;
+        const known = new Set(loaded.map(m => m.id));
+        messages = messages.filter(m => !known.has(m.id)).concat(loaded);
+    }
+    
+    monitorPages[convId] = { messages, hasMore: !!data.has_more };
+    
+    if (currentMonitorConv === convId) {
+        renderMonitorMessages(convId, !!data.before);
+    }
+});
+
+// ✅ Mensagem nova entre jogadores (só chega com o monitor aberto)
+socket.on('monitor_message', (data) => {
+    const convId = data.conversation_id;
+    const msg = data.message;
+    
+    const entry = monitorData[convId] || (monitorData[convId] = {
+        conversation_id: convId,
+        name: data.name,
+        player1_id: data.player1_id,
+        player2_id: data.player2_id,
+        message_count: 0
+    });
+    entry.message_count += 1;
+    entry.last_timestamp = msg.timestamp;
+    
+    const page = monitorPages[convId];
+    if (page && !page.messages.some(m => m.id === msg.id)) {
+        page.messages.push(msg);
+    }
+    
+    renderMonitorConversationsList();
+    
+    if (currentMonitorConv === convId && page) {
+        renderMonitorMessages(convId);
+    }
+});
+
 function renderMonitorConversationsList() {
     const listEl = document.getElementById('monitorConvList');
     listEl.innerHTML = '';
     
-    const conversations = [];
-    
-    for (let convId in monitorData) {
-        const conv = monitorData[convId];
-        
-        if (conv.messages && conv.messages.length > 0) {
-            const lastMsg = conv.messages[conv.messages.length - 1];
-            
-            conversations.push({
-                id: convId,
-                name: conv.name,
-                messageCount: conv.messages.length,
-                lastMessageTime: lastMsg.timestamp
-            });
-        }
-    }
+    const conversations = Object.values(monitorData).filter(conv => conv.message_count > 0);
     
     if (conversations.length === 0) {
         listEl.innerHTML = `
@@ -3279,19 +3517,19 @@ function renderMonitorConversationsList() {
     }
     
     // Ordenar por última mensagem
-    conversations.sort((a, b) => b.lastMessageTime - a.lastMessageTime);
+    conversations.sort((a, b) => b.last_timestamp - a.last_timestamp);
     
     conversations.forEach(conv => {
         const item = document.createElement('div');
         item.className = 'monitor-conv-item';
         
-        if (currentMonitorConv === conv.id) {
+        if (currentMonitorConv === conv.conversation_id) {
             item.classList.add('active');
         }
         
-        item.onclick = () => selectMonitorConversation(conv.id);
+        item.onclick = () => selectMonitorConversation(conv.conversation_id);
         
-        const lastTime = new Date(conv.lastMessageTime);
+        const lastTime = new Date(conv.last_timestamp);
         const timeStr = lastTime.toLocaleTimeString('pt-BR', {
             hour: '2-digit',
             minute: '2-digit'
@@ -3300,7 +3538,7 @@ function renderMonitorConversationsList() {
         item.innerHTML = `
             <div class="monitor-conv-title">${conv.name}</div>
             <div class="monitor-conv-meta">
-                <span class="monitor-conv-count">${conv.messageCount} msgs</span>
+                <span class="monitor-conv-count">${conv.message_count} msgs</span>
                 <span class="monitor-conv-time">${timeStr}</span>
             </div>
         `;
@@ -3315,10 +3553,7 @@ function selectMonitorConversation(convId) {
     currentMonitorConv = convId;
     
     // Atualizar visual da lista
-    document.querySelectorAll('.monitor-conv-item').forEach(item => {
-        item.classList.remove('active');
-    });
-    event.currentTarget?.classList.add('active');
+    renderMonitorConversationsList();
     
     // Mostrar painel de mensagens
     document.getElementById('monitorEmptyState').style.display = 'none';
@@ -3327,14 +3562,43 @@ function selectMonitorConversation(convId) {
     const conv = monitorData[convId];
     document.getElementById('monitorCurrentConvTitle').textContent = conv.name;
     
-    renderMonitorMessages(conv.messages, conv.player1_id, conv.player2_id);
+    // Só a página mais recente; as anteriores sob demanda
+    if (monitorPages[convId]) {
+        renderMonitorMessages(convId);
+    } else {
+        document.getElementById('monitorMessagesContainer').innerHTML = `
+            <div class="monitor-empty">
+                <p>Carregando...</p>
+            </div>
+        `;
+        socket.emit('get_monitor_conversation', {
+            session_id: SESSION_ID,
+            conversation_id: convId
+        });
+    }
 }
 
-function renderMonitorMessages(messages, player1Id, player2Id) {
+function loadOlderMonitorMessages() {
+    const page = monitorPages[currentMonitorConv];
+    if (!page || page.messages.length === 0) return;
+    
+    socket.emit('get_monitor_conversation', {
+        session_id: SESSION_ID,
+        conversation_id: currentMonitorConv,
+        before: page.messages[0].id
+    });
+}
+
+function renderMonitorMessages(convId, keepScroll = false) {
     const container = document.getElementById('monitorMessagesContainer');
+    const previousHeight = container.scrollHeight - container.scrollTop;
     container.innerHTML = '';
     
-    if (!messages || messages.length === 0) {
+    const conv = monitorData[convId];
+    const page = monitorPages[convId];
+    const messages = page ? page.messages : [];
+    
+    if (messages.length === 0) {
         container.innerHTML = `
             <div class="monitor-empty">
                 <p>Nenhuma mensagem nesta conversa</p>
@@ -3343,11 +3607,19 @@ function renderMonitorMessages(messages, player1Id, player2Id) {
         return;
     }
     
+    if (page.hasMore) {
+        const loadMore = document.createElement('button');
+        loadMore.className = 'load-older-messages';
+        loadMore.textContent = 'Carregar mensagens anteriores';
+        loadMore.onclick = loadOlderMonitorMessages;
+        container.appendChild(loadMore);
+    }
+    
     messages.forEach(msg => {
         const msgDiv = document.createElement('div');
         msgDiv.className = 'monitor-message-group';
         
-        const isPlayer1 = msg.sender_id === player1Id;
+        const isPlayer1 = msg.sender_id === conv.player1_id;
         const playerClass = isPlayer1 ? 'player-1' : 'player-2';
         
         const time = new Date(msg.timestamp).toLocaleTimeString('pt-BR', {
@@ -3368,27 +3640,12 @@ function renderMonitorMessages(messages, player1Id, player2Id) {
         container.appendChild(msgDiv);
     });
     
-    // Scroll para o final
-    container.scrollTop = container.scrollHeight;
+    // Scroll para o final (ou manter a posição ao carregar anteriores)
+    container.scrollTop = keepScroll
+        ? container.scrollHeight - previousHeight
+        : container.scrollHeight;
 }
 
-// ✅ Atualizar automaticamente quando nova mensagem chega
-socket.on('new_private_message', (data) => {
-    // Se o monitor está aberto E a mensagem não é do mestre
-    const modal = document.getElementById('conversationsMonitor');
-    
-    if (modal && modal.classList.contains('show')) {
-        if (data.sender_id !== 'master' && data.recipient_id !== 'master') {
-            console.log('🔄 Nova mensagem detectada - atualizando monitor');
-            
-            // Aguardar um pouco para o servidor processar
-            setTimeout(() => {
-                loadMonitorData();
-            }, 500);
-        }
-    }
-});
-
 // Fechar com ESC
 document.addEventListener('keydown', (e) => {
     if (e.key === 'Escape') {
@@ -3562,58 +3819,48 @@ function toggleDiceRoller() {
 // DICE ROLLER
 // ==================
 
+// Rolagem feita no servidor (CSPRNG + log da sessão); onRoll recebe o resultado
+function requestServerRoll(formula, isPrivate, onRoll) {
+    socket.emit('roll_shared_dice', {
+        session_id: SESSION_ID,
+        formula: formula,
+        private: isPrivate
+    }, (response) => {
+        if (!response || response.error) {
+            showToast(`⚠️ ${response?.error || 'Falha na rolagem'}`);
+            return;
+        }
+        onRoll(response.rolls[0]);
+    });
+}
+
 function rollDice(sides) {
-    const result = Math.floor(Math.random() * sides) + 1;
     const isPrivate = document.getElementById('dicePrivacyToggle')?.checked || false;
-    const resultDiv = document.getElementById('diceResult');
     
-    // Resultado local
-    resultDiv.textContent = result;
-    resultDiv.className = 'dice-result';
-    
-    const isCritical = sides === 20 && result === 20;
-    const isFail = sides === 20 && result === 1;
-    
-    addDiceToHistory(`1d${sides}`, result, isCritical, isFail);
-    
-    setTimeout(() => {
-        resultDiv.classList.add('show');
+    requestServerRoll(`1d${sides}`, isPrivate, (roll) => {
+        const resultDiv = document.getElementById('diceResult');
         
-        if (isCritical) {
-            resultDiv.classList.add('critical-success');
-            showToast('🎉 CRÍTICO!');
-        } else if (isFail) {
-            resultDiv.classList.add('critical-fail');
-            showToast('💀 FALHA CRÍTICA!');
-        }
-    }, 10);
-    
-    // Se for privado, apenas mostrar localmente
-    if (isPrivate) {
-        showToast('🔒 Rolagem privada (apenas você vê)');
-        
-        // Exibir na notificação discreta local
-        SharedDiceSystem.show({
-            roller_name: 'Mestre (Privado)',
-            dice_type: `d${sides}`,
-            result: result,
-            formula: `1d${sides}`,
-            is_critical: isCritical,
-            is_failure: isFail
-        });
+        // Resultado local
+        resultDiv.textContent = roll.total;
+        resultDiv.className = 'dice-result';
         
-        return;
-    }
-    
-    // ✅ BROADCAST para todos
-    socket.emit('roll_shared_dice', {
-        session_id: SESSION_ID,
-        roller_name: 'Mestre',
-        dice_type: `d${sides}`,
-        result: result,
-        formula: `1d${sides}`,
-        is_critical: isCritical,
-        is_failure: isFail
+        addDiceToHistory(roll.formula, roll.total, roll.is_critical, roll.is_failure, '', roll.timestamp);
+        
+        setTimeout(() => {
+            resultDiv.classList.add('show');
+            
+            if (roll.is_critical) {
+                resultDiv.classList.add('critical-success');
+                showToast('🎉 CRÍTICO!');
+            } else if (roll.is_failure) {
+                resultDiv.classList.add('critical-fail');
+                showToast('💀 FALHA CRÍTICA!');
+            }
+        }, 10);
+        
+        if (isPrivate) {
+            showPrivateRoll(roll);
+        }
     });
 }
 
@@ -3623,67 +3870,41 @@ function rollCustomDice() {
     const modifier = parseInt(document.getElementById('customDiceModifier')?.value) || 0;
     const isPrivate = document.getElementById('dicePrivacyToggle')?.checked || false;
     
-    let rolls = [];
-    let sum = 0;
-    
-    for (let i = 0; i < count; i++) {
-        const roll = Math.floor(Math.random() * sides) + 1;
-        rolls.push(roll);
-        sum += roll;
-    }
-    
-    const total = sum + modifier;
     const formula = `${count}d${sides}${modifier !== 0 ? (modifier > 0 ? '+' : '') + modifier : ''}`;
-    const breakdown = rolls.join(' + ') + (modifier !== 0 ? ` ${modifier > 0 ? '+' : ''}${modifier}` : '');
-    
-    const resultDiv = document.getElementById('diceResult');
-    resultDiv.textContent = total;
-    resultDiv.className = 'dice-result show';
-    
-    const isCrit = sides === 20 && count === 1 && rolls[0] === 20;
-    const isFail = sides === 20 && count === 1 && rolls[0] === 1;
-    
-    if (isCrit) {
-        resultDiv.classList.add('critical-success');
-        showToast('🎉 CRÍTICO!');
-    } else if (isFail) {
-        resultDiv.classList.add('critical-fail');
-        showToast('💀 FALHA CRÍTICA!');
-    }
     
-    addDiceToHistory(formula, total, isCrit, isFail, breakdown);
-    
-    // Se for privado, apenas mostrar localmente
-    if (isPrivate) {
-        showToast('🔒 Rolagem privada (apenas você vê)');
+    requestServerRoll(formula, isPrivate, (roll) => {
+        const resultDiv = document.getElementById('diceResult');
+        resultDiv.textContent = roll.total;
+        resultDiv.className = 'dice-result show';
         
-        SharedDiceSystem.show({
-            roller_name: 'Mestre (Privado)',
-            dice_type: `d${sides}`,
-            result: total,
-            formula: formula,
-            is_critical: isCrit,
-            is_failure: isFail
-        });
+        if (roll.is_critical) {
+            resultDiv.classList.add('critical-success');
+            showToast('🎉 CRÍTICO!');
+        } else if (roll.is_failure) {
+            resultDiv.classList.add('critical-fail');
+            showToast('💀 FALHA CRÍTICA!');
+        }
         
-        return;
-    }
-    
-    // ✅ BROADCAST para todos
-    socket.emit('roll_shared_dice', {
-        session_id: SESSION_ID,
-        roller_name: 'Mestre',
-        dice_type: `d${sides}`,
-        result: total,
-        formula: formula,
-        is_critical: isCrit,
-        is_failure: isFail
+        addDiceToHistory(roll.formula, roll.total, roll.is_critical, roll.is_failure, roll.breakdown, roll.timestamp);
+        
+        if (isPrivate) {
+            showPrivateRoll(roll);
+        }
     });
 }
 
-function addDiceToHistory(formula, result, isCrit, isFail, breakdown = '') {
-    const timestamp = new Date().toLocaleTimeString('pt-BR', { hour: '2-digit', minute: '2-digit' });
+// Rolagem privada: só o mestre vê (o servidor não faz broadcast)
+function showPrivateRoll(roll) {
+    showToast('🔒 Rolagem privada (apenas você vê)');
     
+    SharedDiceSystem.show({
+        ...roll,
+        roller_name: 'Mestre (Privado)'
+    });
+}
+
+// timestamp em ms (o mesmo da rolagem no servidor)
+function addDiceToHistory(formula, result, isCrit, isFail, breakdown = '', timestamp = Date.now()) {
     diceHistory.unshift({
         formula,
         result,
@@ -3728,7 +3949,7 @@ function renderDiceHistory() {
                     <span ${resultClass}>${item.result}</span>
                 </div>
                 ${item.breakdown ? `<div style="font-size: 0.85rem; color: #888;">${item.breakdown}</div>` : ''}
-                <div style="font-size: 0.75rem; color: #666; margin-top: 4px;">${item.timestamp}</div>
+                <div style="font-size: 0.75rem; color: #666; margin-top: 4px;">${new Date(item.timestamp).toLocaleTimeString('pt-BR', { hour: '2-digit', minute: '2-digit' })}</div>
             </div>
         `;
     }).join('');
@@ -3947,6 +4168,11 @@ function switchToScene(sceneId) {
         return;
     }
     
+    if (scene._pending) {
+        showToast('⏳ Cena ainda carregando...');
+        return;
+    }
+    
     console.log('🎬 Trocando para cena:', scene.name);
     
     // ✅ SALVAR cena atual ANTES de trocar
@@ -3999,7 +4225,7 @@ function switchToScene(sceneId) {
     // ✅ CRIAR NOVOS ARRAYS (não usar spread que mantém referências)
     images = JSON.parse(JSON.stringify([...sceneMaps, ...sceneEntities]));
     tokens = JSON.parse(JSON.stringify(sceneTokens));
-    drawings = JSON.parse(JSON.stringify(sceneDrawings));
+    drawings = DrawingLayers.unpack(JSON.parse(JSON.stringify(sceneDrawings)));
     
     console.log('📦 Conteúdo carregado:', {
         images: images.length,
@@ -4713,9 +4939,9 @@ async function initializeSceneSystem() {
             overlayInitialized = true;
             renderScenesList();
             
-            // Ativar última cena
-            if (scenes.length > 0) {
-                const lastScene = scenes[scenes.length - 1];
+            // Ativar cena ativa/última (se o carregamento ainda não ativou)
+            if (scenes.length > 0 && !currentSceneId) {
+                const lastScene = scenes.find(s => s.id === savedData.active_scene_id) || scenes[scenes.length - 1];
                 console.log('🎬 Ativando última cena:', lastScene.name);
                 setTimeout(() => {
                     switchToScene(lastScene.id);
@@ -3,19 +3,55 @@ let notes = [];
 let currentCategory = 'all';
 let editingNoteId = null;
 
-// Carregar notas do localStorage
-function loadNotes() {
-    const saved = localStorage.getItem('rpg_notes');
-    if (saved) {
-        notes = JSON.parse(saved);
+let categoryCounts = {};
+let searchResults = null;   // notas da busca no servidor (null = sem busca)
+let searchTimeout = null;
+
+// Carregar notas do servidor
+async function loadNotes() {
+    try {
+        await importLocalNotes();
+        
+        const response = await fetch('/api/notes/get');
+        const data = await response.json();
+        
+        if (data.status === 'success') {
+            notes = data.notes;
+            categoryCounts = data.counts;
+        }
+    } catch (error) {
+        console.error('Erro ao carregar notas:', error);
+        showToast('Erro ao carregar notas');
     }
     renderNotes();
     updateCategoryCounts();
 }
 
-// Salvar notas no localStorage
-function saveNotesToStorage() {
-    localStorage.setItem('rpg_notes', JSON.stringify(notes));
+// Importar (uma vez) as notas antigas salvas no localStorage
+async function importLocalNotes() {
+    const saved = localStorage.getItem('rpg_notes');
+    if (!saved || localStorage.getItem('rpg_notes_migrated')) return;
+    
+    const localNotes = JSON.parse(saved).map(note => ({
+        id: note.id,
+        title: note.title,
+        category: note.category,
+        body: note.content,
+        created_at: note.createdAt,
+        updated_at: note.updatedAt
+    }));
+    
+    const response = await fetch('/api/notes/save', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ notes: localNotes })
+    });
+    const data = await response.json();
+    
+    if (data.status === 'success') {
+        localStorage.setItem('rpg_notes_migrated', '1');
+        if (data.saved) showToast(`${data.saved} notas importadas do navegador`);
+    }
 }
 
 // Abrir modal para nova nota
@@ -34,8 +70,8 @@ function closeNoteModal() {
     editingNoteId = null;
 }
 
-// Salvar nota
-function saveNote() {
+// Salvar nota (só a nota editada vai para o servidor)
+async function saveNote() {
     const title = document.getElementById('noteTitle').value.trim();
     const category = document.getElementById('noteCategory').value;
     const content = document.getElementById('noteContent').value.trim();
@@ -50,79 +86,133 @@ function saveNote() {
         return;
     }
     
-    if (editingNoteId) {
-        // Editar nota existente
-        const note = notes.find(n => n.id === editingNoteId);
-        if (note) {
-            note.title = title;
-            note.category = category;
-            note.content = content;
-            note.updatedAt = new Date().toISOString();
+    const wasEditing = Boolean(editingNoteId);
+    
+    try {
+        const response = await fetch('/api/notes/save', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                note: { id: editingNoteId, title: title, category: category, body: content }
+            })
+        });
+        const data = await response.json();
+        
+        if (data.status !== 'success') {
+            showToast(data.error || 'Erro ao salvar nota');
+            return;
         }
-        showToast('Nota atualizada com sucesso!');
-    } else {
-        // Criar nova nota
-        const newNote = {
-            id: Date.now(),
-            title: title,
-            category: category,
-            content: content,
-            createdAt: new Date().toISOString(),
-            updatedAt: new Date().toISOString()
-        };
-        notes.unshift(newNote);
-        showToast('Nota criada com sucesso!');
+        
+        const previous = notes.find(n => n.id === data.note.id);
+        if (previous) {
+            categoryCounts[previous.category]--;
+        }
+        notes = [data.note, ...notes.filter(n => n.id !== data.note.id)];
+        categoryCounts[data.note.category] = (categoryCounts[data.note.category] || 0) + 1;
+        
+        showToast(wasEditing ? 'Nota atualizada com sucesso!' : 'Nota criada com sucesso!');
+    } catch (error) {
+        console.error('Erro ao salvar nota:', error);
+        showToast('Erro ao salvar nota');
+        return;
     }
     
-    saveNotesToStorage();
-    renderNotes();
+    refreshSearch();
     updateCategoryCounts();
     closeNoteModal();
 }
 
 // Editar nota
 function editNote(noteId) {
-    const note = notes.find(n => n.id === noteId);
+    const note = notes.find(n => n.id === noteId)
+        || (searchResults || []).find(n => n.id === noteId);
     if (!note) return;
     
     editingNoteId = noteId;
     document.getElementById('modalTitle').textContent = 'Editar Nota';
     document.getElementById('noteTitle').value = note.title;
     document.getElementById('noteCategory').value = note.category;
-    document.getElementById('noteContent').value = note.content;
+    document.getElementById('noteContent').value = note.body;
     document.getElementById('noteModal').classList.add('show');
 }
 
 // Deletar nota
-function deleteNote(noteId) {
-    if (confirm('Tem certeza que deseja excluir esta nota?')) {
-        notes = notes.filter(n => n.id !== noteId);
-        saveNotesToStorage();
+async function deleteNote(noteId) {
+    if (!confirm('Tem certeza que deseja excluir esta nota?')) return;
+    
+    try {
+        const response = await fetch(`/api/notes/delete/${noteId}`, { method: 'DELETE' });
+        const data = await response.json();
+        
+        if (data.status !== 'success') {
+            showToast(data.error || 'Erro ao excluir nota');
+            return;
+        }
+    } catch (error) {
+        console.error('Erro ao excluir nota:', error);
+        showToast('Erro ao excluir nota');
+        return;
+    }
+    
+    const note = notes.find(n => n.id === noteId);
+    if (note) {
+        categoryCounts[note.category]--;
+    }
+    notes = notes.filter(n => n.id !== noteId);
+    if (searchResults) {
+        searchResults = searchResults.filter(n => n.id !== noteId);
+    }
+    renderNotes();
+    updateCategoryCounts();
+    showToast('Nota excluída');
+}
+
+// Busca no servidor (índice de texto, por relevância) com debounce
+function scheduleSearch() {
+    clearTimeout(searchTimeout);
+    searchTimeout = setTimeout(refreshSearch, 250);
+}
+
+async function refreshSearch() {
+    const searchTerm = document.getElementById('searchBox').value.trim();
+    
+    if (!searchTerm) {
+        searchResults = null;
         renderNotes();
-        updateCategoryCounts();
-        showToast('Nota excluída');
+        return;
+    }
+    
+    const params = new URLSearchParams({ q: searchTerm });
+    if (currentCategory !== 'all') {
+        params.set('category', currentCategory);
     }
+    
+    try {
+        const response = await fetch(`/api/notes/search?${params}`);
+        const data = await response.json();
+        
+        // Ignorar respostas de buscas que já mudaram
+        if (document.getElementById('searchBox').value.trim() !== searchTerm) return;
+        searchResults = data.status === 'success' ? data.notes : [];
+    } catch (error) {
+        console.error('Erro na busca de notas:', error);
+        searchResults = [];
+    }
+    renderNotes();
 }
 
 // Renderizar notas
 function renderNotes() {
     const grid = document.getElementById('notesGrid');
-    const searchTerm = document.getElementById('searchBox').value.toLowerCase();
+    const searchTerm = document.getElementById('searchBox').value.trim();
     
-    // Filtrar notas
-    let filteredNotes = notes;
+    // Com busca: resultados do servidor (já filtrados e ordenados por relevância)
+    let filteredNotes = searchTerm && searchResults ? searchResults : notes;
     
-    if (currentCategory !== 'all') {
+    if (!searchTerm && currentCategory !== 'all') {
         filteredNotes = notes.filter(n => n.category === currentCategory);
     }
     
-    if (searchTerm) {
-        filteredNotes = filteredNotes.filter(n => 
-            n.title.toLowerCase().includes(searchTerm) || 
-            n.content.toLowerCase().includes(searchTerm)
-        );
-    }
-    
     // Renderizar
     if (filteredNotes.length === 0) {
         grid.innerHTML = `
@@ -138,7 +228,7 @@ function renderNotes() {
     }
     
     grid.innerHTML = filteredNotes.map(note => {
-        const date = new Date(note.updatedAt);
+        const date = new Date(note.updated_at);
         const formattedDate = date.toLocaleDateString('pt-BR', { 
             day: '2-digit', 
             month: '2-digit', 
@@ -165,7 +255,7 @@ function renderNotes() {
                         <button class="note-action-btn delete" onclick="deleteNote(${note.id}); event.stopPropagation();">🗑️</button>
                     </div>
                 </div>
-                <div class="note-content">${note.content}</div>
+                <div class="note-content">${note.body}</div>
                 <div class="note-footer">
                     Atualizado em ${formattedDate}
                 </div>
@@ -180,10 +270,9 @@ function updateCategoryCounts() {
     
     const categories = ['npcs', 'locations', 'quests', 'items', 'lore', 'other'];
     categories.forEach(cat => {
-        const count = notes.filter(n => n.category === cat).length;
         const element = document.getElementById(`count-${cat}`);
         if (element) {
-            element.textContent = count;
+            element.textContent = categoryCounts[cat] || 0;
         }
     });
 }
@@ -211,14 +300,18 @@ function selectCategory(category) {
     
     document.getElementById('currentCategoryTitle').textContent = categoryTitles[category] || category;
     
-    renderNotes();
+    if (document.getElementById('searchBox').value.trim()) {
+        refreshSearch();
+    } else {
+        renderNotes();
+    }
 }
 
 // Busca em tempo real
 document.addEventListener('DOMContentLoaded', () => {
     const searchBox = document.getElementById('searchBox');
     if (searchBox) {
-        searchBox.addEventListener('input', renderNotes);
+        searchBox.addEventListener('input', scheduleSearch);
     }
     
     // Event listeners para categorias
@@ -5,7 +5,9 @@
 const PersistenceManager = {
     API_BASE: '/api',
     SAVE_DEBOUNCE: 2000,
+    STREAM_REUSE_MS: 10000,
     saveTimeout: null,
+    lastStream: null,
     
     /**
      * Salvar estado COMPLETO no backend
@@ -58,6 +60,12 @@ const PersistenceManager = {
      * Carregar estado do backend
      */
     async loadSession(sessionId) {
+        // Reaproveitar o load em streaming recém-iniciado (evita baixar a campanha de novo)
+        if (this.lastStream && this.lastStream.sessionId === sessionId &&
+            Date.now() - this.lastStream.startedAt < this.STREAM_REUSE_MS) {
+            return this.lastStream.promise;
+        }
+        
         try {
             console.log('📂 Carregando sessão do banco...');
             
@@ -87,6 +95,97 @@ const PersistenceManager = {
         }
     },
     
+    /**
+     * Carregar sessão em seções (NDJSON): metadados, lista de cenas e depois
+     * cada cena completa, a ativa primeiro
+     * @param {string} sessionId
+     * @param {function} onSection - chamado a cada seção: (section, data)
+     * @returns {Promise<object|null>} estado completo (mesmo formato de loadSession)
+     */
+    streamSession(sessionId, onSection) {
+        const promise = this._streamSession(sessionId, onSection);
+        this.lastStream = { sessionId, promise, startedAt: Date.now() };
+        return promise;
+    },
+    
+    async _streamSession(sessionId, onSection) {
+        try {
+            console.log('📂 Carregando sessão do banco (streaming)...');
+            
+            const response = await fetch(`${this.API_BASE}/session/stream/${sessionId}`);
+            
+            if (!response.ok) {
+                if (response.status === 404) {
+                    console.log('ℹ️ Nenhum estado salvo encontrado');
+                    return null;
+                }
+                throw new Error(`HTTP ${response.status}`);
+            }
+            
+            const data = { scenes: [] };
+            
+            const handle = (line) => {
+                if (!line.trim()) return;
+                
+                const section = JSON.parse(line);
+                
+                switch (section.type) {
+                    case 'meta':
+                        Object.assign(data, section.data);
+                        data.active_scene_id = section.active_scene_id;
+                        console.log(`✅ Sessão (versão ${section.version}) - recebendo cenas...`);
+                        break;
+                    case 'scenes':
+                        // Cenas ainda não recebidas ficam marcadas como _pending
+                        data.scenes = section.scenes.map(scene => ({
+                            ...scene,
+                            maps: [], entities: [], tokens: [], drawings: [],
+                            fog_image: null,
+                            _pending: true
+                        }));
+                        break;
+                    case 'scene': {
+                        const index = data.scenes.findIndex(s => s.id === section.scene.id);
+                        if (index >= 0) {
+                            data.scenes[index] = section.scene;
+                        } else {
+                            data.scenes.push(section.scene);
+                        }
+                        break;
+                    }
+                    case 'legacy':
+                        Object.assign(data, section.data);
+                        break;
+                }
+                
+                if (onSection) onSection(section, data);
+            };
+            
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                
+                buffer += decoder.decode(value, { stream: true });
+                const lines = buffer.split('\n');
+                buffer = lines.pop();
+                lines.forEach(handle);
+            }
+            
+            handle(buffer + decoder.decode());
+            
+            console.log(`✅ Sessão carregada (${data.scenes.length} cenas)`);
+            return data;
+            
+        } catch (e) {
+            console.error('❌ Erro ao carregar sessão:', e);
+            return null;
+        }
+    },
+    
     /**
      * Deletar sessão
      */
@@ -134,6 +233,37 @@ const PersistenceManager = {
         }
     },
     
+    /**
+     * Enviar imagem para o armazenamento de assets
+     * Retorna a URL /assets/<hash> (ou o próprio data URL se falhar)
+     */
+    async uploadAsset(dataUrl) {
+        try {
+            const response = await fetch(`${this.API_BASE}/assets/upload`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ data_url: dataUrl })
+            });
+            
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            
+            const result = await response.json();
+            
+            if (result.status === 'success' && result.url) {
+                console.log(`🖼️ Asset enviado: ${result.hash.substring(0, 12)}`);
+                return result.url;
+            }
+            
+            return dataUrl;
+            
+        } catch (e) {
+            console.error('❌ Erro ao enviar asset:', e);
+            return dataUrl;
+        }
+    },
+    
     async getSessionSize(sessionId) {
         try {
             const response = await fetch(`${this.API_BASE}/session/load/${sessionId}`);
@@ -20,6 +20,7 @@ let currentConversation = [];
 let chatMinimized = true;
 let chatCollapsed = false;
 let conversationsCache = {};
+let conversationHasMore = {};
 
 // Canvas
 const mapCanvas = document.getElementById('mapCanvas');
@@ -31,6 +32,10 @@ const drawCtx = drawingCanvas.getContext('2d');
 const canvasWrapper = document.getElementById('canvasWrapper');
 const canvasContainer = document.querySelector('.canvas-container');
 
+// Camada dos mapas: só a parte visível, na resolução da tela (ver drawMapLayer)
+const tileCanvas = document.getElementById('tileCanvas');
+const tileCtx = tileCanvas.getContext('2d');
+
 mapCanvas.width = gridCanvas.width = drawingCanvas.width = CANVAS_WIDTH;
 mapCanvas.height = gridCanvas.height = drawingCanvas.height = CANVAS_HEIGHT;
 
@@ -87,13 +92,8 @@ let playerHistoryIndex = -1;
 const MAX_PLAYER_HISTORY = 30;
 
 
-// Debounced socket emits
-const debouncedPlayerTokenUpdate = CanvasOptimizer.debounce((tokens) => {
-    socket.emit('token_update', {
-        session_id: SESSION_ID,
-        tokens: tokens
-    });
-}, 150);
+// Último número de sequência de token aplicado
+let tokenSeq = 0;
 
 let isPlayerDrawing = false;
 
@@ -241,19 +241,21 @@ function openPlayerDiceRoller() {
 }
 
 function rollPlayerDice(sides) {
-    const result = Math.floor(Math.random() * sides) + 1;
-    const isCritical = sides === 20 && result === 20;
-    const isFail = sides === 20 && result === 1;
-    
-    // Broadcast
+    // Rolado no servidor; o resultado chega por dice_rolled_shared
+    requestServerRoll(`1d${sides}`, () => {});
+}
+
+// Rolagem feita no servidor (CSPRNG + log da sessão); onRoll recebe o resultado
+function requestServerRoll(formula, onRoll) {
     socket.emit('roll_shared_dice', {
         session_id: SESSION_ID,
-        roller_name: playerName,
-        dice_type: `d${sides}`,
-        result: result,
-        formula: `1d${sides}`,
-        is_critical: isCritical,
-        is_failure: isFail
+        formula: formula
+    }, (response) => {
+        if (!response || response.error) {
+            showToast(`⚠️ ${response?.error || 'Falha na rolagem'}`);
+            return;
+        }
+        onRoll(response.rolls[0]);
     });
 }
 
@@ -288,6 +290,7 @@ function centerCanvas() {
 
 function applyTransform() {
     canvasWrapper.style.transform = `translate(${panX}px, ${panY}px) scale(${currentScale})`;
+    scheduleMapLayer();
 }
 
 function zoom(delta) {
@@ -348,53 +351,11 @@ function togglePlayerDicePanel() {
 }
 
 function rollPlayerDice(sides) {
-    const result = Math.floor(Math.random() * sides) + 1;
-    const isCritical = sides === 20 && result === 20;
-    const isFail = sides === 20 && result === 1;
-    
-    // Mostrar resultado local
-    const resultDiv = document.getElementById('playerDiceResult');
-    resultDiv.textContent = result;
-    resultDiv.style.opacity = '0';
-    resultDiv.style.transform = 'scale(0.8)';
-    
-    setTimeout(() => {
-        resultDiv.style.transition = 'all 0.3s cubic-bezier(0.34, 1.56, 0.64, 1)';
-        resultDiv.style.opacity = '1';
-        resultDiv.style.transform = 'scale(1)';
-        
-        if (isCritical) {
-            resultDiv.style.borderColor = '#fbbf24';
-            resultDiv.style.color = '#fbbf24';
-            resultDiv.style.background = 'linear-gradient(135deg, rgba(251, 191, 36, 0.15), rgba(245, 158, 11, 0.1))';
-            showToast('🎉 CRÍTICO!');
-        } else if (isFail) {
-            resultDiv.style.borderColor = '#ef4444';
-            resultDiv.style.color = '#ef4444';
-            resultDiv.style.background = 'linear-gradient(135deg, rgba(239, 68, 68, 0.15), rgba(220, 38, 38, 0.1))';
-            showToast('💀 FALHA CRÍTICA!');
-        } else {
-            resultDiv.style.borderColor = '#10b981';
-            resultDiv.style.color = '#10b981';
-            resultDiv.style.background = 'linear-gradient(135deg, rgba(16, 185, 129, 0.1), rgba(5, 150, 105, 0.05))';
-        }
-    }, 10);
-    
-    // Adicionar ao histórico
-    addPlayerDiceToHistory(`1d${sides}`, result, isCritical, isFail);
-    
-    // Broadcast para todos
-    socket.emit('roll_shared_dice', {
-        session_id: SESSION_ID,
-        roller_name: playerName,
-        dice_type: `d${sides}`,
-        result: result,
-        formula: `1d${sides}`,
-        is_critical: isCritical,
-        is_failure: isFail
+    requestServerRoll(`1d${sides}`, (roll) => {
+        showPlayerDiceResult(roll);
+        addPlayerDiceToHistory(roll.formula, roll.total, roll.is_critical, roll.is_failure, '', roll.timestamp);
+        console.log('🎲 [PLAYER] Dado rolado:', { sides, result: roll.total, playerName });
     });
-    
-    console.log('🎲 [PLAYER] Dado rolado:', { sides, result, playerName });
 }
 
 function rollPlayerCustomDice() {
@@ -402,25 +363,19 @@ function rollPlayerCustomDice() {
     const sides = parseInt(document.getElementById('playerCustomDiceSides')?.value) || 20;
     const modifier = parseInt(document.getElementById('playerCustomDiceModifier')?.value) || 0;
     
-    let rolls = [];
-    let sum = 0;
-    
-    for (let i = 0; i < count; i++) {
-        const roll = Math.floor(Math.random() * sides) + 1;
-        rolls.push(roll);
-        sum += roll;
-    }
-    
-    const total = sum + modifier;
     const formula = `${count}d${sides}${modifier !== 0 ? (modifier > 0 ? '+' : '') + modifier : ''}`;
-    const breakdown = rolls.join(' + ') + (modifier !== 0 ? ` ${modifier > 0 ? '+' : ''}${modifier}` : '');
-    
-    const isCrit = sides === 20 && count === 1 && rolls[0] === 20;
-    const isFail = sides === 20 && count === 1 && rolls[0] === 1;
     
-    // Mostrar resultado local
+    requestServerRoll(formula, (roll) => {
+        showPlayerDiceResult(roll);
+        addPlayerDiceToHistory(roll.formula, roll.total, roll.is_critical, roll.is_failure, roll.breakdown, roll.timestamp);
+        console.log('🎲 [PLAYER] Dado customizado rolado:', { formula, total: roll.total, playerName });
+    });
+}
+
+// Mostrar resultado local (o broadcast para todos é feito pelo servidor)
+function showPlayerDiceResult(roll) {
     const resultDiv = document.getElementById('playerDiceResult');
-    resultDiv.textContent = total;
+    resultDiv.textContent = roll.total;
     resultDiv.style.opacity = '0';
     resultDiv.style.transform = 'scale(0.8)';
     
@@ -429,12 +384,12 @@ function rollPlayerCustomDice() {
         resultDiv.style.opacity = '1';
         resultDiv.style.transform = 'scale(1)';
         
-        if (isCrit) {
+        if (roll.is_critical) {
             resultDiv.style.borderColor = '#fbbf24';
             resultDiv.style.color = '#fbbf24';
             resultDiv.style.background = 'linear-gradient(135deg, rgba(251, 191, 36, 0.15), rgba(245, 158, 11, 0.1))';
             showToast('🎉 CRÍTICO!');
-        } else if (isFail) {
+        } else if (roll.is_failure) {
             resultDiv.style.borderColor = '#ef4444';
             resultDiv.style.color = '#ef4444';
             resultDiv.style.background = 'linear-gradient(135deg, rgba(239, 68, 68, 0.15), rgba(220, 38, 38, 0.1))';
@@ -445,27 +400,10 @@ function rollPlayerCustomDice() {
             resultDiv.style.background = 'linear-gradient(135deg, rgba(16, 185, 129, 0.1), rgba(5, 150, 105, 0.05))';
         }
     }, 10);
-    
-    // Adicionar ao histórico
-    addPlayerDiceToHistory(formula, total, isCrit, isFail, breakdown);
-    
-    // Broadcast para todos
-    socket.emit('roll_shared_dice', {
-        session_id: SESSION_ID,
-        roller_name: playerName,
-        dice_type: `d${sides}`,
-        result: total,
-        formula: formula,
-        is_critical: isCrit,
-        is_failure: isFail
-    });
-    
-    console.log('🎲 [PLAYER] Dado customizado rolado:', { formula, total, playerName });
 }
 
-function addPlayerDiceToHistory(formula, result, isCrit, isFail, breakdown = '') {
-    const timestamp = new Date().toLocaleTimeString('pt-BR', { hour: '2-digit', minute: '2-digit' });
-    
+// timestamp em ms (o mesmo da rolagem no servidor)
+function addPlayerDiceToHistory(formula, result, isCrit, isFail, breakdown = '', timestamp = Date.now()) {
     playerDiceHistory.unshift({
         formula,
         result,
@@ -510,7 +448,7 @@ function renderPlayerDiceHistory() {
                     <span ${resultClass} style="font-size: 0.875rem;">${item.result}</span>
                 </div>
                 ${item.breakdown ? `<div style="font-size: 0.75rem; color: #888;">${item.breakdown}</div>` : ''}
-                <div style="font-size: 0.7rem; color: #666; margin-top: 4px;">${item.timestamp}</div>
+                <div style="font-size: 0.7rem; color: #666; margin-top: 4px;">${new Date(item.timestamp).toLocaleTimeString('pt-BR', { hour: '2-digit', minute: '2-digit' })}</div>
             </div>
         `;
     }).join('');
@@ -622,7 +560,7 @@ socket.on('session_state', (data) => {
     maps = data.maps || [];
     entities = data.entities || [];
     tokens = data.tokens || [];
-    drawings = data.drawings || [];
+    drawings = DrawingLayers.unpack(data.drawings);
     
     preloadAllImages();
     drawGrid();
@@ -709,6 +647,10 @@ socket.on('entity_updated', (data) => {
 });
 
 socket.on('token_sync', (data) => {
+    if (typeof data.seq === 'number') {
+        tokenSeq = data.seq;
+    }
+    
     console.log('🎯 [JOGADOR] TOKEN SYNC recebido:', {
         timestamp: new Date().toISOString(),
         tokensCount: data.tokens?.length,
@@ -735,12 +677,48 @@ socket.on('token_sync', (data) => {
     });
 });
 
+socket.on('token_delta', (data) => {
+    // Delta perdido - pedir snapshot completo
+    if (tokenSeq && data.seq !== tokenSeq + 1) {
+        console.warn(`⚠️ [JOGADOR] Salto de sequência de token (${tokenSeq} → ${data.seq})`);
+        socket.emit('request_token_snapshot', { session_id: SESSION_ID });
+        return;
+    }
+    tokenSeq = data.seq;
+    
+    if (data.op === 'moved') {
+        const token = tokens.find(t => t.id === data.token_id);
+        // Não sobrescrever o token que está sendo arrastado agora
+        if (token && token !== draggingToken) {
+            Object.assign(token, data.changes);
+        }
+    } else if (data.op === 'added') {
+        const index = tokens.findIndex(t => t.id === data.token_id);
+        if (index >= 0) {
+            tokens[index] = data.token;
+        } else {
+            tokens.push(data.token);
+        }
+        preloadAllImages();
+    } else if (data.op === 'removed') {
+        tokens = tokens.filter(t => t.id !== data.token_id);
+    }
+    
+    window.requestAnimationFrame(() => redrawAll());
+});
+
 socket.on('drawing_sync', (data) => {
     drawings.push(data.drawing);
     redrawDrawings();
     redrawAll();
 });
 
+socket.on('stroke_batch', (data) => {
+    if (LiveStrokes.apply(drawings, data.ops)) {
+        redrawDrawings();
+    }
+});
+
 socket.on('drawings_cleared', () => {
     drawings = [];
     redrawDrawings();
@@ -763,6 +741,8 @@ socket.on('player_joined', (data) => {
 socket.on('fog_state_sync', (data) => {
     console.log('🌫️ [JOGADOR] Fog state recebido');
     
+    fogVersion = data.version || 0;
+    
     if (data.fog_image) {
         loadFogStatePlayer(data.fog_image);
     } else {
@@ -783,6 +763,133 @@ socket.on('drawings_cleared', () => {
     redrawDrawings();
 });
 
+// ✅ Névoa incremental: versão da máscara da cena atual
+let fogVersion = 0;
+let fogSceneId = null;
+
+socket.on('fog_op_applied', (data) => {
+    // Operação de outra cena - ignorar
+    if (fogSceneId && data.scene_id && data.scene_id !== fogSceneId) return;
+    
+    // Operação perdida - pedir máscara completa
+    if (fogVersion && data.version !== fogVersion + 1) {
+        console.warn(`⚠️ [PLAYER] Salto de versão da névoa (${fogVersion} → ${data.version})`);
+        socket.emit('request_fog_snapshot', { session_id: SESSION_ID, scene_id: data.scene_id, binary: true });
+        return;
+    }
+    
+    fogVersion = data.version;
+    applyFogOp(data.op);
+});
+
+socket.on('fog_mask_sync', (data) => {
+    if (fogSceneId && data.scene_id && data.scene_id !== fogSceneId) return;
+    loadFogMask(data.fog_mask);
+});
+
+/**
+ * Desenhar uma operação de névoa (mesmo pincel do mestre)
+ */
+function applyFogOp(op) {
+    fogCtx.globalCompositeOperation = op.mode === 'reveal' ? 'destination-out' : 'source-over';
+    fogCtx.fillStyle = 'rgba(0, 0, 0, 1)';
+    
+    const stamp = (x, y) => {
+        if (op.brush === 'square') {
+            fogCtx.fillRect(x - op.size / 2, y - op.size / 2, op.size, op.size);
+        } else {
+            fogCtx.beginPath();
+            fogCtx.arc(x, y, op.size / 2, 0, Math.PI * 2);
+            fogCtx.fill();
+        }
+    };
+    
+    if (op.shape === 'rect') {
+        fogCtx.fillRect(op.x, op.y, op.w, op.h);
+    } else if (op.shape === 'circle') {
+        fogCtx.beginPath();
+        fogCtx.arc(op.x, op.y, op.r, 0, Math.PI * 2);
+        fogCtx.fill();
+    } else if (op.shape === 'polygon') {
+        fogCtx.beginPath();
+        op.points.forEach(([x, y], i) => i === 0 ? fogCtx.moveTo(x, y) : fogCtx.lineTo(x, y));
+        fogCtx.closePath();
+        fogCtx.fill();
+    } else if (op.shape === 'stroke') {
+        stamp(op.points[0][0], op.points[0][1]);
+        for (let i = 1; i < op.points.length; i++) {
+            const [x1, y1] = op.points[i - 1];
+            const [x2, y2] = op.points[i];
+            const steps = Math.max(1, Math.floor(Math.hypot(x2 - x1, y2 - y1) / 5));
+            for (let s = 1; s <= steps; s++) {
+                const t = s / steps;
+                stamp(x1 + (x2 - x1) * t, y1 + (y2 - y1) * t);
+            }
+        }
+    } else if (op.shape === 'all') {
+        fogCtx.fillRect(0, 0, CANVAS_WIDTH, CANVAS_HEIGHT);
+    }
+    
+    fogCtx.globalCompositeOperation = 'source-over';
+    fogCanvas.style.opacity = '1';
+}
+
+/**
+ * Runs do RLE: lista JSON ou anexo binário (varints de 7 bits)
+ */
+function decodeFogRuns(rle) {
+    if (Array.isArray(rle)) return rle;
+    
+    const bytes = rle instanceof ArrayBuffer ? new Uint8Array(rle) : new Uint8Array(rle.buffer, rle.byteOffset, rle.byteLength);
+    const runs = [];
+    let value = 0;
+    let shift = 0;
+    for (const byte of bytes) {
+        value += (byte & 0x7f) * Math.pow(2, shift);
+        if (byte & 0x80) {
+            shift += 7;
+        } else {
+            runs.push(value);
+            value = 0;
+            shift = 0;
+        }
+    }
+    return runs;
+}
+
+/**
+ * Carregar máscara de névoa do servidor (RLE, linha a linha)
+ */
+function loadFogMask(mask) {
+    fogVersion = mask.version;
+    
+    const grid = document.createElement('canvas');
+    grid.width = mask.cols;
+    grid.height = mask.rows;
+    const gridCtx = grid.getContext('2d');
+    const imageData = gridCtx.createImageData(mask.cols, mask.rows);
+    
+    let cell = 0;
+    let covered = false;
+    for (const run of decodeFogRuns(mask.rle)) {
+        if (covered) {
+            for (let i = cell; i < cell + run; i++) {
+                imageData.data[i * 4 + 3] = 255;
+            }
+        }
+        cell += run;
+        covered = !covered;
+    }
+    gridCtx.putImageData(imageData, 0, 0);
+    
+    fogCtx.clearRect(0, 0, CANVAS_WIDTH, CANVAS_HEIGHT);
+    fogCtx.imageSmoothingEnabled = false;
+    fogCtx.drawImage(grid, 0, 0, mask.cols * mask.cell_size, mask.rows * mask.cell_size);
+    fogCanvas.style.opacity = '1';
+    
+    console.log('✅ [PLAYER] Máscara de névoa aplicada (versão ' + mask.version + ')');
+}
+
 function loadFogStatePlayer(imageData) {
     console.log('🌫️ [PLAYER] Carregando névoa');
     
@@ -813,7 +920,7 @@ function loadFogStatePlayer(imageData) {
     img.src = imageData;
 }
 
-socket.on('scene_activated', (data) => {
+SocketPayloads.on(socket, 'scene_activated', (data) => {
     console.log('🎬 [PLAYER] Cena ativada:', data.scene?.name);
     
     if (!data.scene) {
@@ -850,6 +957,7 @@ socket.on('scene_activated', (data) => {
         mapCtx.clearRect(0, 0, CANVAS_WIDTH, CANVAS_HEIGHT);
         drawCtx.clearRect(0, 0, CANVAS_WIDTH, CANVAS_HEIGHT);
         fogCtx.clearRect(0, 0, CANVAS_WIDTH, CANVAS_HEIGHT);
+        scheduleMapLayer();
         
         showBlockedScreen(scene.name);
         showToast('🚫 Acesso negado a esta cena');
@@ -871,6 +979,7 @@ socket.on('scene_activated', (data) => {
     mapCtx.clearRect(0, 0, CANVAS_WIDTH, CANVAS_HEIGHT);
     drawCtx.clearRect(0, 0, CANVAS_WIDTH, CANVAS_HEIGHT);
     fogCtx.clearRect(0, 0, CANVAS_WIDTH, CANVAS_HEIGHT);
+    scheduleMapLayer();
     
     console.log('✅ [PLAYER] Estado limpo');
     
@@ -878,7 +987,7 @@ socket.on('scene_activated', (data) => {
     maps = JSON.parse(JSON.stringify(scene.maps || []));
     entities = JSON.parse(JSON.stringify(scene.entities || []));
     tokens = JSON.parse(JSON.stringify(scene.tokens || []));
-    drawings = JSON.parse(JSON.stringify(scene.drawings || []));
+    drawings = DrawingLayers.unpack(JSON.parse(JSON.stringify(scene.drawings || [])));
     
     console.log('📦 [PLAYER] Conteúdo carregado:', {
         maps: maps.length,
@@ -889,7 +998,13 @@ socket.on('scene_activated', (data) => {
     });
     
     // ✅ FOG
-    if (scene.fog_image) {
+    fogSceneId = data.scene_id;
+    fogVersion = 0;
+    
+    if (data.fog_mask) {
+        console.log('🌫️ [PLAYER] Carregando máscara de névoa do servidor');
+        loadFogMask(data.fog_mask);
+    } else if (scene.fog_image) {
         console.log('🌫️ [PLAYER] Carregando névoa da cena');
         loadFogStatePlayer(scene.fog_image);
     } else {
@@ -921,6 +1036,7 @@ socket.on('scene_blocked', (data) => {
     mapCtx.clearRect(0, 0, CANVAS_WIDTH, CANVAS_HEIGHT);
     drawCtx.clearRect(0, 0, CANVAS_WIDTH, CANVAS_HEIGHT);
     fogCtx.clearRect(0, 0, CANVAS_WIDTH, CANVAS_HEIGHT);
+    scheduleMapLayer();
     
     showBlockedScreen(data.scene_name);
     showToast('🚫 Você não tem acesso a esta cena');
@@ -939,6 +1055,7 @@ socket.on('no_active_scene', () => {
     mapCtx.clearRect(0, 0, CANVAS_WIDTH, CANVAS_HEIGHT);
     drawCtx.clearRect(0, 0, CANVAS_WIDTH, CANVAS_HEIGHT);
     fogCtx.clearRect(0, 0, CANVAS_WIDTH, CANVAS_HEIGHT);
+    scheduleMapLayer();
     
     showBlockedScreen('Aguardando...');
 });
@@ -955,15 +1072,25 @@ socket.on('chat_contacts_loaded', (data) => {
 
 socket.on('conversation_loaded', (data) => {
     console.log('💬 Conversa carregada:', data);
-    currentConversation = data.messages || [];
+    let messages = data.messages || [];
+    
+    // Página mais antiga (before): juntar na frente do que já está carregado
+    if (data.before && data.other_user_id) {
+        const loaded = conversationsCache[data.other_user_id] || [];
+        const known = new Set(loaded.map(m => m.id));
+        messages = messages.filter(m => !known.has(m.id)).concat(loaded);
+    }
     
-    // Salvar no cache
     if (data.other_user_id) {
-        conversationsCache[data.other_user_id] = [...currentConversation];
-        console.log(`💾 Cache atualizado para ${data.other_user_id}:`, currentConversation.length, 'mensagens');
+        conversationsCache[data.other_user_id] = [...messages];
+        conversationHasMore[data.other_user_id] = !!data.has_more;
+        console.log(`💾 Cache atualizado para ${data.other_user_id}:`, messages.length, 'mensagens');
     }
     
-    renderConversation();
+    if (!data.before || data.other_user_id === currentChatContact) {
+        currentConversation = messages;
+        renderConversation(!!data.before);
+    }
 });
 
 socket.on('new_private_message', (data) => {
@@ -1047,21 +1174,20 @@ function preloadAllImages() {
         }
     };
 
-    // ✅ Preload mapas
+    // ✅ Preload mapas (mapas grandes: só o descritor e a prévia; tiles sob demanda)
     if (maps && Array.isArray(maps)) {
         maps.forEach(img => {
             if (img.image && !loadedImages.has(img.id)) {
                 imagesToLoad++;
-                const i = new Image();
-                i.onload = () => {
-                    loadedImages.set(img.id, i);
-                    checkAllLoaded();
-                };
-                i.onerror = () => {
-                    console.error('Erro ao carregar mapa:', img.id);
-                    checkAllLoaded();
-                };
-                i.src = img.image;
+                TileLoader.load(img)
+                    .then(loaded => {
+                        loadedImages.set(img.id, loaded);
+                        checkAllLoaded();
+                    })
+                    .catch(() => {
+                        console.error('Erro ao carregar mapa:', img.id);
+                        checkAllLoaded();
+                    });
             }
         });
     }
@@ -1119,33 +1245,81 @@ function preloadAllImages() {
 // RENDER OTIMIZADO
 // ==================
 
+// Limite do buffer da camada de mapas (px físicos por lado)
+const MAP_LAYER_MAX_SIZE = 8192;
+
+let mapLayerFrame = null;
+
+function scheduleMapLayer() {
+    if (mapLayerFrame) return;
+    mapLayerFrame = requestAnimationFrame(() => {
+        mapLayerFrame = null;
+        drawMapLayer();
+    });
+}
+
+/**
+ * Desenhar os mapas só na parte visível do canvas, com a resolução da tela
+ * 
+ * O canvas da camada cobre o retângulo visível (em unidades do canvas) e
+ * tem currentScale × devicePixelRatio px por unidade, então o zoom fica
+ * nítido; mapas fatiados pedem só os tiles visíveis do nível certo.
+ */
+function drawMapLayer() {
+    const containerRect = canvasContainer.getBoundingClientRect();
+    const x0 = Math.max(0, -panX / currentScale);
+    const y0 = Math.max(0, -panY / currentScale);
+    const x1 = Math.min(CANVAS_WIDTH, (containerRect.width - panX) / currentScale);
+    const y1 = Math.min(CANVAS_HEIGHT, (containerRect.height - panY) / currentScale);
+    
+    if (x1 <= x0 || y1 <= y0) {
+        tileCanvas.width = tileCanvas.height = 0;
+        return;
+    }
+    
+    const ratio = Math.min(
+        currentScale * (window.devicePixelRatio || 1),
+        MAP_LAYER_MAX_SIZE / (x1 - x0),
+        MAP_LAYER_MAX_SIZE / (y1 - y0)
+    );
+    
+    tileCanvas.style.left = `${x0}px`;
+    tileCanvas.style.top = `${y0}px`;
+    tileCanvas.style.width = `${x1 - x0}px`;
+    tileCanvas.style.height = `${y1 - y0}px`;
+    tileCanvas.width = Math.ceil((x1 - x0) * ratio);
+    tileCanvas.height = Math.ceil((y1 - y0) * ratio);
+    
+    tileCtx.setTransform(ratio, 0, 0, ratio, -x0 * ratio, -y0 * ratio);
+    tileCtx.imageSmoothingEnabled = true;
+    
+    const view = { x0, y0, x1, y1, pixelRatio: ratio };
+    
+    if (maps && Array.isArray(maps)) {
+        maps.forEach(img => {
+            const loaded = loadedImages.get(img.id);
+            
+            if (TileLoader.isReady(loaded)) {
+                try {
+                    TileLoader.draw(tileCtx, loaded, img, view);
+                } catch (e) {
+                    console.error('Erro ao desenhar mapa:', e);
+                }
+            }
+        });
+    }
+}
+
+TileLoader.onTileLoaded = scheduleMapLayer;
+
 function redrawAll() {
     CanvasOptimizer.scheduleRedraw(() => {
         isPlayerDrawing = true;
         
         mapCtx.clearRect(0, 0, CANVAS_WIDTH, CANVAS_HEIGHT);
         
-        // ✅ Desenhar mapas
-        if (maps && Array.isArray(maps)) {
-            maps.forEach(img => {
-                const loadedImg = loadedImages.get(img.id);
-                
-                if (loadedImg && loadedImg.complete && loadedImg.naturalWidth > 0) {
-                    try {
-                        CanvasOptimizer.optimizeImageDraw(
-                            mapCtx, 
-                            loadedImg, 
-                            img.x, 
-                            img.y, 
-                            img.width, 
-                            img.height
-                        );
-                    } catch (e) {
-                        console.error('Erro ao desenhar mapa:', e);
-                    }
-                }
-            });
-        }
+        // ✅ Mapas ficam na camada própria (zoom/viewport)
+        drawMapLayer();
         
         // ✅ Desenhar entidades
         if (entities && Array.isArray(entities)) {
@@ -1250,6 +1424,11 @@ function redrawDrawings() {
     drawCtx.clearRect(0, 0, CANVAS_WIDTH, CANVAS_HEIGHT);
     
     drawings.forEach(drawing => {
+        if (DrawingLayers.isRaster(drawing)) {
+            DrawingLayers.renderRaster(drawCtx, drawing, redrawDrawings);
+            return;
+        }
+        
         drawCtx.strokeStyle = drawing.color;
         drawCtx.lineWidth = drawing.size;
         drawCtx.lineCap = 'round';
@@ -1368,11 +1547,8 @@ canvasWrapper.addEventListener('mouseup', () => {
     }
 
     if (draggingToken) {
-        const tokensCopy = JSON.parse(JSON.stringify(tokens));
-        
-        console.log('📤 [JOGADOR] Enviando token_update:', {
+        console.log('📤 [JOGADOR] Enviando token_moved:', {
             sessionId: SESSION_ID,
-            tokensCount: tokensCopy.length,
             movedToken: {
                 name: draggingToken.name,
                 newX: draggingToken.x,
@@ -1380,9 +1556,11 @@ canvasWrapper.addEventListener('mouseup', () => {
             }
         });
         
-        socket.emit('token_update', {
+        // ✅ Enviar apenas o delta do token arrastado
+        socket.emit('token_moved', {
             session_id: SESSION_ID,
-            tokens: tokensCopy
+            token_id: draggingToken.id,
+            changes: { x: draggingToken.x, y: draggingToken.y }
         });
         
         draggingToken = null;
@@ -1491,6 +1669,10 @@ drawingCanvas.addEventListener('mousedown', (e) => {
         isDrawing = true;
         const pos = getDrawingPos(e);
         currentPath = [pos];
+        
+        // ✅ Transmitir o traço ao vivo para os outros
+        LiveStrokes.begin(socket, SESSION_ID, drawColor, brushSize);
+        LiveStrokes.add(pos);
     } else if (drawTool === 'erase') {
         const pos = getDrawingPos(e);
         eraseDrawingsAt(pos.x, pos.y);
@@ -1503,6 +1685,7 @@ drawingCanvas.addEventListener('mousemove', (e) => {
     if (isDrawing && drawTool === 'draw') {
         const pos = getDrawingPos(e);
         currentPath.push(pos);
+        LiveStrokes.add(pos);
         
         drawCtx.strokeStyle = drawColor;
         drawCtx.lineWidth = brushSize;
@@ -1526,19 +1709,15 @@ drawingCanvas.addEventListener('mousemove', (e) => {
 
 drawingCanvas.addEventListener('mouseup', () => {
     if (isDrawing && currentPath.length > 0) {
+        // ✅ Pontos já foram transmitidos; o servidor grava ao encerrar o traço
         const drawing = {
-            id: Date.now() + '_' + Math.random().toString(36).substr(2, 9),
+            id: LiveStrokes.end(),
             path: currentPath,
             color: drawColor,
             size: brushSize
         };
         drawings.push(drawing);
         
-        socket.emit('drawing_update', {
-            session_id: SESSION_ID,
-            drawing: drawing
-        });
-        
         currentPath = [];
     }
     isDrawing = false;
@@ -1549,7 +1728,7 @@ function eraseDrawingsAt(x, y) {
     let changed = false;
     
     drawings = drawings.filter(drawing => {
-        const hasPointInRadius = drawing.path.some(point => {
+        const hasPointInRadius = !DrawingLayers.isRaster(drawing) && drawing.path.some(point => {
             const dist = Math.hypot(point.x - x, point.y - y);
             return dist < eraseRadius;
         });
@@ -1812,12 +1991,22 @@ function openConversation(contactId) {
     loadChatContacts();
 }
 
-function renderConversation() {
+function renderConversation(keepScroll = false) {
     const messagesContainer = document.getElementById('conversationMessages');
     if (!messagesContainer) return;
     
+    const previousHeight = messagesContainer.scrollHeight - messagesContainer.scrollTop;
     messagesContainer.innerHTML = '';
     
+    // Histórico paginado: mensagens antigas só quando pedidas
+    if (conversationHasMore[currentChatContact]) {
+        const loadMore = document.createElement('button');
+        loadMore.className = 'load-older-messages';
+        loadMore.textContent = 'Carregar mensagens anteriores';
+        loadMore.onclick = loadOlderMessages;
+        messagesContainer.appendChild(loadMore);
+    }
+    
     if (currentConversation.length === 0) {
         messagesContainer.innerHTML = '<div class="empty-state">Nenhuma mensagem ainda. Inicie a conversa!</div>';
         return;
@@ -1840,7 +2029,21 @@ function renderConversation() {
         messagesContainer.appendChild(bubble);
     });
     
-    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    // Ao carregar mensagens anteriores, manter a posição de leitura
+    messagesContainer.scrollTop = keepScroll
+        ? messagesContainer.scrollHeight - previousHeight
+        : messagesContainer.scrollHeight;
+}
+
+function loadOlderMessages() {
+    if (!currentChatContact || currentConversation.length === 0) return;
+    
+    socket.emit('get_conversation', {
+        session_id: SESSION_ID,
+        user_id: playerId,
+        other_user_id: currentChatContact,
+        before: currentConversation[0].id
+    });
 }
 
 function sendChatMessage() {
@@ -1987,6 +2190,7 @@ function initializePlayerView() {
     mapCtx.clearRect(0, 0, CANVAS_WIDTH, CANVAS_HEIGHT);
     drawCtx.clearRect(0, 0, CANVAS_WIDTH, CANVAS_HEIGHT);
     fogCtx.clearRect(0, 0, CANVAS_WIDTH, CANVAS_HEIGHT);
+    scheduleMapLayer();
     
     console.log('✅ [PLAYER] View inicializada');
 }
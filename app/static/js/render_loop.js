@@ -173,6 +173,11 @@ const RenderLoop = {
         
         if (window.drawings && Array.isArray(window.drawings)) {
             window.drawings.forEach(drawing => {
+                if (DrawingLayers.isRaster(drawing)) {
+                    DrawingLayers.renderRaster(ctx, drawing, () => this.requestDrawingRedraw());
+                    return;
+                }
+                
                 ctx.strokeStyle = drawing.color;
                 ctx.lineWidth = drawing.size;
                 ctx.lineCap = 'round';
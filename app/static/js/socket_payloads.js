@@ -0,0 +1,218 @@
+// ==========================================
+// PAYLOADS COMPRIMIDOS DO SERVIDOR
+// ==========================================
+//
+// Payloads grandes (cenas) chegam como {deflate: <zlib do JSON>} num anexo
+// binário (SOCKETIO_COMPRESSION_THRESHOLD no servidor). Navegadores sem
+// DecompressionStream (Safari < 16.4) usam o inflate em JS puro abaixo.
+
+// ==========================================
+// INFLATE (RFC 1950/1951)
+// ==========================================
+
+const Inflate = (() => {
+    const LENGTH_BASE = [3, 4, 5, 6, 7, 8, 9, 10, 11, 13, 15, 17, 19, 23, 27, 31,
+        35, 43, 51, 59, 67, 83, 99, 115, 131, 163, 195, 227, 258];
+    const LENGTH_EXTRA = [0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 2,
+        3, 3, 3, 3, 4, 4, 4, 4, 5, 5, 5, 5, 0];
+    const DIST_BASE = [1, 2, 3, 4, 5, 7, 9, 13, 17, 25, 33, 49, 65, 97, 129, 193,
+        257, 385, 513, 769, 1025, 1537, 2049, 3073, 4097, 6145, 8193, 12289, 16385, 24577];
+    const DIST_EXTRA = [0, 0, 0, 0, 1, 1, 2, 2, 3, 3, 4, 4, 5, 5, 6, 6,
+        7, 7, 8, 8, 9, 9, 10, 10, 11, 11, 12, 12, 13, 13];
+    const CODE_LENGTH_ORDER = [16, 17, 18, 0, 8, 7, 9, 6, 10, 5, 11, 4, 12, 3, 13, 2, 14, 1, 15];
+
+    /**
+     * Árvore de Huffman canônica: quantos códigos por comprimento + símbolos ordenados
+     */
+    function buildTree(lengths) {
+        const counts = new Uint16Array(16);
+        for (const length of lengths) counts[length]++;
+        counts[0] = 0;
+
+        const offsets = new Uint16Array(16);
+        for (let i = 1; i < 16; i++) offsets[i] = offsets[i - 1] + counts[i - 1];
+
+        const symbols = new Uint16Array(lengths.length);
+        lengths.forEach((length, symbol) => {
+            if (length) symbols[offsets[length]++] = symbol;
+        });
+        return { counts, symbols };
+    }
+
+    const FIXED_LITERALS = buildTree(Array.from({ length: 288 }, (_, i) =>
+        i < 144 ? 8 : i < 256 ? 9 : i < 280 ? 7 : 8));
+    const FIXED_DISTANCES = buildTree(new Array(30).fill(5));
+
+    /**
+     * Descomprimir dados zlib (Uint8Array) para Uint8Array
+     */
+    function inflate(data) {
+        if ((data[0] & 0x0f) !== 8 || ((data[0] << 8) | data[1]) % 31 !== 0) {
+            throw new Error('Cabeçalho zlib inválido');
+        }
+
+        let pos = 2;
+        let bitBuffer = 0;
+        let bitCount = 0;
+        let out = new Uint8Array(Math.max(data.length * 4, 1024));
+        let outLength = 0;
+
+        const ensure = (extra) => {
+            if (outLength + extra <= out.length) return;
+            const grown = new Uint8Array(Math.max(out.length * 2, outLength + extra));
+            grown.set(out.subarray(0, outLength));
+            out = grown;
+        };
+
+        const bit = () => {
+            if (!bitCount) {
+                if (pos >= data.length) throw new Error('Dados deflate truncados');
+                bitBuffer = data[pos++];
+                bitCount = 8;
+            }
+            const value = bitBuffer & 1;
+            bitBuffer >>>= 1;
+            bitCount--;
+            return value;
+        };
+
+        const bits = (count, base = 0) => {
+            let value = 0;
+            for (let i = 0; i < count; i++) value |= bit() << i;
+            return value + base;
+        };
+
+        const decode = (tree) => {
+            let code = 0;
+            let first = 0;
+            let index = 0;
+            for (let length = 1; length < 16; length++) {
+                code |= bit();
+                const count = tree.counts[length];
+                if (code - first < count) return tree.symbols[index + code - first];
+                index += count;
+                first = (first + count) << 1;
+                code <<= 1;
+            }
+            throw new Error('Código de Huffman inválido');
+        };
+
+        const dynamicTrees = () => {
+            const literalCount = bits(5, 257);
+            const distanceCount = bits(5, 1);
+            const codeLengthCount = bits(4, 4);
+
+            const codeLengths = new Array(19).fill(0);
+            for (let i = 0; i < codeLengthCount; i++) {
+                codeLengths[CODE_LENGTH_ORDER[i]] = bits(3);
+            }
+            const codeTree = buildTree(codeLengths);
+
+            const lengths = [];
+            while (lengths.length < literalCount + distanceCount) {
+                const symbol = decode(codeTree);
+                if (symbol < 16) {
+                    lengths.push(symbol);
+                } else if (symbol === 16) {
+                    if (!lengths.length) throw new Error('Repetição sem comprimento anterior');
+                    const previous = lengths[lengths.length - 1];
+                    for (let n = bits(2, 3); n > 0; n--) lengths.push(previous);
+                } else {
+                    for (let n = symbol === 17 ? bits(3, 3) : bits(7, 11); n > 0; n--) lengths.push(0);
+                }
+            }
+
+            return [
+                buildTree(lengths.slice(0, literalCount)),
+                buildTree(lengths.slice(literalCount, literalCount + distanceCount))
+            ];
+        };
+
+        let final = 0;
+        while (!final) {
+            final = bit();
+            const type = bits(2);
+
+            if (type === 0) {
+                // Bloco sem compressão: alinhado ao byte, LEN + NLEN
+                bitBuffer = 0;
+                bitCount = 0;
+                const length = data[pos] | (data[pos + 1] << 8);
+                pos += 4;
+                if (pos + length > data.length) throw new Error('Dados deflate truncados');
+                ensure(length);
+                out.set(data.subarray(pos, pos + length), outLength);
+                outLength += length;
+                pos += length;
+                continue;
+            }
+            if (type === 3) throw new Error('Tipo de bloco deflate inválido');
+
+            const [literals, distances] = type === 1
+                ? [FIXED_LITERALS, FIXED_DISTANCES]
+                : dynamicTrees();
+
+            for (;;) {
+                let symbol = decode(literals);
+                if (symbol < 256) {
+                    ensure(1);
+                    out[outLength++] = symbol;
+                    continue;
+                }
+                if (symbol === 256) break;
+
+                symbol -= 257;
+                const length = bits(LENGTH_EXTRA[symbol], LENGTH_BASE[symbol]);
+                const code = decode(distances);
+                const distance = bits(DIST_EXTRA[code], DIST_BASE[code]);
+                if (distance > outLength) throw new Error('Distância deflate inválida');
+
+                ensure(length);
+                for (let i = 0; i < length; i++, outLength++) {
+                    out[outLength] = out[outLength - distance];
+                }
+            }
+        }
+
+        return out.subarray(0, outLength);
+    }
+
+    return { inflate };
+})();
+
+const SocketPayloads = {
+    // Handlers rodam na ordem de chegada, mesmo com descompressões de tamanhos diferentes
+    queue: Promise.resolve(),
+
+    /**
+     * Descomprimir o payload se vier comprimido; retorna uma Promise
+     */
+    async inflate(data) {
+        if (!data || !data.deflate) return data;
+
+        if (typeof DecompressionStream === 'undefined') {
+            const bytes = data.deflate instanceof ArrayBuffer
+                ? new Uint8Array(data.deflate)
+                : new Uint8Array(data.deflate.buffer, data.deflate.byteOffset, data.deflate.byteLength);
+            return JSON.parse(new TextDecoder().decode(Inflate.inflate(bytes)));
+        }
+
+        const stream = new Blob([data.deflate]).stream()
+            .pipeThrough(new DecompressionStream('deflate'));
+        return JSON.parse(await new Response(stream).text());
+    },
+
+    /**
+     * socket.on com descompressão antes do handler
+     */
+    on(socket, event, handler) {
+        socket.on(event, (data) => {
+            this.queue = this.queue
+                .then(() => this.inflate(data))
+                .then(handler)
+                .catch(error => console.error(`❌ Erro em ${event}:`, error));
+        });
+    }
+};
+
+window.SocketPayloads = SocketPayloads;
@@ -0,0 +1,193 @@
+// ==========================================
+// CARREGADOR DE TILES (mapas grandes)
+// ==========================================
+
+const TileLoader = {
+    infoCache: new Map(),
+
+    // URL do tile -> Image carregada, ou {pending}/{failedAt} enquanto não chega
+    tiles: new Map(),
+
+    // Tiles mantidos em memória (os menos usados saem primeiro)
+    MAX_TILES: 256,
+
+    // Espera (ms) antes de pedir de novo um tile que falhou (ex.: mapa ainda sendo fatiado)
+    RETRY_DELAY: 2000,
+
+    // Chamado quando um tile chega (a view agenda um redesenho)
+    onTileLoaded: null,
+
+    /**
+     * Extrair o hash de uma URL /assets/<hash>
+     */
+    assetHash(url) {
+        const match = /^\/assets\/([0-9a-f]{64})$/.exec(url || '');
+        return match ? match[1] : null;
+    },
+
+    async getInfo(hash) {
+        if (!this.infoCache.has(hash)) {
+            this.infoCache.set(hash, fetch(`/tiles/${hash}/info`)
+                .then(r => r.ok ? r.json() : null)
+                .catch(() => null));
+        }
+        return this.infoCache.get(hash);
+    },
+
+    /**
+     * Menor nível cuja resolução cobre o tamanho do mapa na tela (px físicos)
+     */
+    pickLevel(info, screenWidth, screenHeight) {
+        const level = info.levels.find(l => l.width >= screenWidth && l.height >= screenHeight);
+        return level || info.levels[info.max_level];
+    },
+
+    /**
+     * Maior nível que cabe num tile só: prévia desenhada enquanto os tiles chegam
+     */
+    previewLevel(info) {
+        let preview = info.levels[0];
+        for (const level of info.levels) {
+            if (level.cols === 1 && level.rows === 1) preview = level;
+        }
+        return preview;
+    },
+
+    tileUrl(source, level, col, row) {
+        return `/tiles/${source.hash}/${level}/${col}_${row}.${source.info.format}`;
+    },
+
+    /**
+     * Preparar mapa para desenho
+     * Mapas fatiados: só o descritor e a prévia; os demais tiles são pedidos
+     * por draw() conforme o zoom e a parte visível do mapa
+     * @param {object} map - {image, width, height}
+     * @returns {Promise<HTMLImageElement|object>} Image ou {hash, info, preview}
+     */
+    async load(map) {
+        const hash = this.assetHash(map.image);
+        const info = hash ? await this.getInfo(hash) : null;
+
+        if (!info) {
+            return this.loadImage(map.image);
+        }
+
+        const source = { hash, info, preview: null };
+        try {
+            source.preview = await this.loadImage(this.tileUrl(source, this.previewLevel(info).level, 0, 0));
+        } catch (e) {
+            // Pirâmide ainda sendo fatiada (503): usar o original desta vez
+            return this.loadImage(map.image);
+        }
+        return source;
+    },
+
+    /**
+     * Desenhar mapa no contexto (já transformado para coordenadas do canvas)
+     * @param {object} view - {x0, y0, x1, y1} parte visível do canvas e
+     *                        pixelRatio (px físicos por unidade do canvas)
+     */
+    draw(ctx, source, map, view) {
+        const left = Math.max(map.x, view.x0);
+        const top = Math.max(map.y, view.y0);
+        const right = Math.min(map.x + map.width, view.x1);
+        const bottom = Math.min(map.y + map.height, view.y1);
+
+        if (right <= left || bottom <= top) return;
+
+        if (!source.info) {
+            ctx.drawImage(source, map.x, map.y, map.width, map.height);
+            return;
+        }
+
+        // Prévia por baixo: nunca fica buraco enquanto os tiles chegam
+        ctx.drawImage(source.preview, map.x, map.y, map.width, map.height);
+
+        const info = source.info;
+        const level = this.pickLevel(info, map.width * view.pixelRatio, map.height * view.pixelRatio);
+        if (level.level <= this.previewLevel(info).level) return;
+
+        // Px do nível por unidade do canvas
+        const scaleX = level.width / map.width;
+        const scaleY = level.height / map.height;
+        const size = info.tile_size;
+
+        const col0 = Math.max(0, Math.floor((left - map.x) * scaleX / size));
+        const col1 = Math.min(level.cols - 1, Math.floor(((right - map.x) * scaleX - 1e-6) / size));
+        const row0 = Math.max(0, Math.floor((top - map.y) * scaleY / size));
+        const row1 = Math.min(level.rows - 1, Math.floor(((bottom - map.y) * scaleY - 1e-6) / size));
+
+        for (let row = row0; row <= row1; row++) {
+            for (let col = col0; col <= col1; col++) {
+                const tile = this.getTile(this.tileUrl(source, level.level, col, row));
+                if (tile) {
+                    ctx.drawImage(
+                        tile,
+                        map.x + col * size / scaleX,
+                        map.y + row * size / scaleY,
+                        tile.naturalWidth / scaleX,
+                        tile.naturalHeight / scaleY
+                    );
+                }
+            }
+        }
+    },
+
+    /**
+     * Tile já carregado, ou null (e o pedido é feito em segundo plano)
+     */
+    getTile(url) {
+        const entry = this.tiles.get(url);
+
+        if (entry instanceof HTMLImageElement) {
+            // Recém-usado vai para o fim (LRU pela ordem de inserção do Map)
+            this.tiles.delete(url);
+            this.tiles.set(url, entry);
+            return entry;
+        }
+
+        if (entry && (entry.pending || Date.now() - entry.failedAt < this.RETRY_DELAY)) {
+            return null;
+        }
+
+        this.tiles.set(url, { pending: true });
+        this.loadImage(url)
+            .then(img => {
+                this.tiles.set(url, img);
+                this.evict();
+            })
+            .catch(() => {
+                this.tiles.set(url, { failedAt: Date.now() });
+                setTimeout(() => this.onTileLoaded && this.onTileLoaded(), this.RETRY_DELAY);
+            })
+            .then(() => this.onTileLoaded && this.onTileLoaded());
+        return null;
+    },
+
+    evict() {
+        for (const [url, entry] of this.tiles) {
+            if (this.tiles.size <= this.MAX_TILES) break;
+            if (entry instanceof HTMLImageElement) this.tiles.delete(url);
+        }
+    },
+
+    loadImage(src) {
+        return new Promise((resolve, reject) => {
+            const img = new Image();
+            img.onload = () => resolve(img);
+            img.onerror = reject;
+            img.src = src;
+        });
+    },
+
+    /**
+     * Imagem pronta, ou mapa fatiado com a prévia carregada
+     */
+    isReady(img) {
+        if (!img) return false;
+        if (img.info) return Boolean(img.preview);
+        return img.complete && img.naturalWidth > 0;
+    }
+};
+
+window.TileLoader = TileLoader;
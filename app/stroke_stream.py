@@ -0,0 +1,149 @@
+import math
+import threading
+import time
+
+# Máximo de pontos de um traço por tick; o resto vai nos ticks seguintes
+STROKE_MAX_POINTS_PER_TICK = 256
+
+# Traços maiores que isso param de aceitar pontos
+STROKE_MAX_POINTS = 20000
+
+# Traço sem pontos novos há mais que isso (s) é descartado (cliente sumiu)
+STROKE_IDLE_TIMEOUT = 30
+
+
+def _finite(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+class LiveStroke:
+    __slots__ = ('session_id', 'socket_id', 'stroke_id', 'meta', 'points', 'sent',
+                 'announced', 'closed', 'ended', 'final', 'touched_at')
+
+    def __init__(self, session_id, socket_id, stroke_id, meta):
+        self.session_id = session_id
+        self.socket_id = socket_id
+        self.stroke_id = stroke_id
+        self.meta = meta
+        self.points = []       # [x0, y0, x1, y1, ...]
+        self.sent = 0          # quantos valores de points já foram enviados
+        self.announced = False
+        self.closed = False    # stroke_end recebido, esperando a versão final
+        self.ended = False     # pronto para mandar o fim (com final ou cancelado)
+        self.final = None
+        self.touched_at = time.monotonic()
+
+    def path(self):
+        return [{'x': self.points[i], 'y': self.points[i + 1]} for i in range(0, len(self.points) - 1, 2)]
+
+
+class StrokeStream:
+    """
+    Traços sendo desenhados, repassados aos outros clientes em lotes por tick
+
+    Os clientes mandam pedaços de pontos (stroke_points) enquanto desenham;
+    a cada tick do BroadcastScheduler o que chegou de cada traço vira um
+    único stroke_batch por sala, com no máximo STROKE_MAX_POINTS_PER_TICK
+    pontos por traço, então um traço longo nunca vira uma mensagem gigante.
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self._strokes = {}  # (socket_id, stroke_id) → LiveStroke
+        self._lock = threading.Lock()
+        scheduler.add_source(self)
+
+    # ==================
+    # API (handlers de socket)
+    # ==================
+
+    def begin(self, session_id, socket_id, stroke_id, meta):
+        if not session_id or not stroke_id:
+            return
+        with self._lock:
+            self._strokes[(socket_id, stroke_id)] = LiveStroke(session_id, socket_id, stroke_id, meta)
+        self.scheduler.wake()
+
+    def append(self, socket_id, stroke_id, points):
+        with self._lock:
+            stroke = self._strokes.get((socket_id, stroke_id))
+            if stroke is None or stroke.closed or stroke.ended or not isinstance(points, list):
+                return
+
+            # Pares com algo que não é número finito (NaN, Infinity) são descartados inteiros
+            room = STROKE_MAX_POINTS * 2 - len(stroke.points)
+            for i in range(0, min(len(points), max(room, 0)) - 1, 2):
+                x, y = points[i], points[i + 1]
+                if _finite(x) and _finite(y):
+                    stroke.points.extend((int(x), int(y)))
+            stroke.touched_at = time.monotonic()
+        self.scheduler.wake()
+
+    def end(self, socket_id, stroke_id):
+        """Fechar o traço; retorna (session_id, meta, path) ou None"""
+        with self._lock:
+            stroke = self._strokes.get((socket_id, stroke_id))
+            if stroke is None or stroke.closed or stroke.ended:
+                return None
+            stroke.closed = True
+            stroke.touched_at = time.monotonic()
+            return stroke.session_id, stroke.meta, stroke.path()
+
+    def finish(self, socket_id, stroke_id, drawing):
+        """Versão final gravada (ou None para cancelar) vai junto com o fim do traço"""
+        with self._lock:
+            stroke = self._strokes.get((socket_id, stroke_id))
+            if stroke is not None:
+                stroke.final = drawing
+                stroke.ended = True
+        self.scheduler.wake()
+
+    def drop_socket(self, socket_id):
+        """Cliente desconectou no meio de um traço: cancelar os traços dele"""
+        with self._lock:
+            for stroke in self._strokes.values():
+                if stroke.socket_id == socket_id:
+                    stroke.ended = True
+                    stroke.final = None
+        self.scheduler.wake()
+
+    # ==================
+    # TICK (fonte do BroadcastScheduler)
+    # ==================
+
+    def pending(self):
+        with self._lock:
+            return bool(self._strokes)
+
+    def collect(self):
+        """Um stroke_batch por (sala, socket de origem) com o que chegou desde o último tick"""
+        messages = []
+        now = time.monotonic()
+
+        with self._lock:
+            batches = {}
+            for key, stroke in list(self._strokes.items()):
+                if not stroke.ended and now - stroke.touched_at > STROKE_IDLE_TIMEOUT:
+                    stroke.ended = True
+
+                ops = batches.setdefault((stroke.session_id, stroke.socket_id), [])
+
+                if not stroke.announced:
+                    ops.append({'op': 'begin', 'stroke_id': stroke.stroke_id, **stroke.meta})
+                    stroke.announced = True
+
+                if stroke.sent < len(stroke.points):
+                    end = stroke.sent + STROKE_MAX_POINTS_PER_TICK * 2
+                    ops.append({'op': 'points', 'stroke_id': stroke.stroke_id,
+                                'points': stroke.points[stroke.sent:end]})
+                    stroke.sent = min(end, len(stroke.points))
+
+                if stroke.ended and stroke.sent >= len(stroke.points):
+                    ops.append({'op': 'end', 'stroke_id': stroke.stroke_id, 'drawing': stroke.final})
+                    del self._strokes[key]
+
+            for (session_id, socket_id), ops in batches.items():
+                if ops:
+                    messages.append(('stroke_batch', {'ops': ops}, session_id, socket_id))
+
+        return messages
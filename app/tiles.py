@@ -0,0 +1,263 @@
+import json
+import math
+import os
+import threading
+from contextlib import contextmanager, suppress
+
+from PIL import Image
+
+from app.assets import assets
+from app.async_mode import run_blocking
+
+# Pirâmide no estilo Deep Zoom: nível máximo = resolução original,
+# cada nível abaixo tem metade da largura/altura, até 1x1 px no nível 0
+TILE_SIZE = 256
+TILE_JPEG_QUALITY = 85
+
+# Mapas menores que isso não compensam ser fatiados ao enviar
+TILE_INGEST_MIN_SIZE = 2048
+
+TILE_FORMATS = ('jpg', 'png')
+
+# Limite de "decompression bomb" ao abrir mapas (o padrão do Pillow barra
+# mapas de 16k×16k); vale só dentro de _open_map, o resto do processo
+# continua com o limite padrão
+TILE_MAX_IMAGE_PIXELS = 16384 * 16384
+
+# get_tile: tile ainda não gerado (a pirâmide está sendo fatiada)
+TILE_PENDING = 'pending'
+
+_pixel_limit_lock = threading.Lock()
+
+
+@contextmanager
+def _open_map(path):
+    """Image.open com TILE_MAX_IMAGE_PIXELS (a checagem só acontece na abertura)"""
+    with _pixel_limit_lock:
+        default = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = TILE_MAX_IMAGE_PIXELS
+        try:
+            image = Image.open(path)
+        finally:
+            Image.MAX_IMAGE_PIXELS = default
+
+    with image:
+        yield image
+
+
+class TileStore:
+    """
+    Pirâmide de tiles multi-resolução dos mapas (a partir do asset original)
+
+    Os tiles ficam em cache em disco (data/tiles/<hash>/<nível>/<col>_<lin>.<ext>),
+    para que os jogadores baixem apenas o nível de zoom que realmente usam.
+    """
+
+    def __init__(self, root='data/tiles', tile_size=TILE_SIZE):
+        self.root = os.path.abspath(root)
+        self.tile_size = tile_size
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._ingesting = {}
+
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+
+    def _lock_for(self, asset_hash):
+        with self._locks_guard:
+            return self._locks.setdefault(asset_hash, threading.Lock())
+
+    def _dir(self, asset_hash):
+        return os.path.join(self.root, asset_hash[:2], asset_hash)
+
+    def tile_path(self, asset_hash, level, col, row, fmt):
+        return os.path.join(self._dir(asset_hash), str(level), f'{col}_{row}.{fmt}')
+
+    # ==================
+    # DESCRITOR
+    # ==================
+
+    def info(self, asset_hash):
+        """
+        Descritor da pirâmide (dimensões por nível); None se o asset não existir
+
+        Só lê o cabeçalho da imagem, não decodifica os pixels.
+        """
+        info_path = os.path.join(self._dir(asset_hash), 'info.json')
+
+        if os.path.exists(info_path):
+            with open(info_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+
+        if not assets.exists(asset_hash):
+            return None
+
+        try:
+            with _open_map(assets.path_for(asset_hash)) as image:
+                width, height = image.size
+                has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+        except Exception as e:
+            print(f'❌ Asset {asset_hash[:12]} não é uma imagem válida: {e}')
+            return None
+
+        max_level = math.ceil(math.log2(max(width, height, 1)))
+        levels = []
+        for level in range(max_level + 1):
+            scale = 2 ** (max_level - level)
+            level_width = max(math.ceil(width / scale), 1)
+            level_height = max(math.ceil(height / scale), 1)
+            levels.append({
+                'level': level,
+                'width': level_width,
+                'height': level_height,
+                'cols': math.ceil(level_width / self.tile_size),
+                'rows': math.ceil(level_height / self.tile_size)
+            })
+
+        info = {
+            'hash': asset_hash,
+            'width': width,
+            'height': height,
+            'tile_size': self.tile_size,
+            'max_level': max_level,
+            'format': 'png' if has_alpha else 'jpg',
+            'levels': levels
+        }
+
+        os.makedirs(self._dir(asset_hash), exist_ok=True)
+        with open(info_path, 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+
+        return info
+
+    def is_ingested(self, asset_hash):
+        return os.path.exists(os.path.join(self._dir(asset_hash), 'done'))
+
+    # ==================
+    # INGESTÃO
+    # ==================
+
+    def ingest(self, asset_hash):
+        """
+        Gerar todos os tiles da pirâmide (do nível máximo para o 0)
+
+        Cada nível é obtido reduzindo o anterior pela metade, então a imagem
+        original é decodificada uma única vez. Tiles já em cache são mantidos.
+        """
+        info = self.info(asset_hash)
+        if info is None:
+            return None
+
+        with self._lock_for(asset_hash):
+            if self.is_ingested(asset_hash):
+                return info
+
+            fmt = info['format']
+            tile_count = 0
+
+            with _open_map(assets.path_for(asset_hash)) as source:
+                image = source.convert('RGBA' if fmt == 'png' else 'RGB')
+
+            for level_info in reversed(info['levels']):
+                size = (level_info['width'], level_info['height'])
+                if image.size != size:
+                    image = image.resize(size, Image.Resampling.BOX)
+
+                tile_count += self._cut_level(asset_hash, image, level_info, fmt)
+
+            with open(os.path.join(self._dir(asset_hash), 'done'), 'w') as f:
+                f.write(str(tile_count))
+
+        print(f'🧩 Mapa {asset_hash[:12]} fatiado: {tile_count} tiles, {info["max_level"] + 1} níveis')
+        return info
+
+    def ingest_async(self, asset_hash):
+        """
+        Fatiar em segundo plano (upload de mapas grandes, tile ainda não gerado)
+
+        Pedidos repetidos para o mesmo hash reaproveitam a ingestão em andamento.
+        """
+        with self._locks_guard:
+            thread = self._ingesting.get(asset_hash)
+            if thread is None:
+                thread = threading.Thread(target=self._ingest_background, args=(asset_hash,), daemon=True)
+                self._ingesting[asset_hash] = thread
+                thread.start()
+        return thread
+
+    def _ingest_background(self, asset_hash):
+        try:
+            # eventlet/gevent: decodificar e reduzir a imagem numa thread real
+            run_blocking(self.ingest, asset_hash)
+        except Exception as e:
+            print(f'❌ Erro ao fatiar mapa {asset_hash[:12]}: {e}')
+        finally:
+            with self._locks_guard:
+                self._ingesting.pop(asset_hash, None)
+
+    def should_ingest(self, asset_hash):
+        info = self.info(asset_hash)
+        return bool(info) and max(info['width'], info['height']) > TILE_INGEST_MIN_SIZE
+
+    def _cut_level(self, asset_hash, image, level_info, fmt):
+        level_dir = os.path.join(self._dir(asset_hash), str(level_info['level']))
+        os.makedirs(level_dir, exist_ok=True)
+
+        count = 0
+        for row in range(level_info['rows']):
+            for col in range(level_info['cols']):
+                path = self.tile_path(asset_hash, level_info['level'], col, row, fmt)
+                if not os.path.exists(path):
+                    box = (
+                        col * self.tile_size,
+                        row * self.tile_size,
+                        min((col + 1) * self.tile_size, level_info['width']),
+                        min((row + 1) * self.tile_size, level_info['height'])
+                    )
+                    self._save(image.crop(box), path, fmt)
+                count += 1
+
+        return count
+
+    def _save(self, tile, path, fmt):
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        if fmt == 'png':
+            tile.save(tmp_path, 'PNG', optimize=True)
+        else:
+            tile.save(tmp_path, 'JPEG', quality=TILE_JPEG_QUALITY)
+        os.replace(tmp_path, path)
+
+    # ==================
+    # LEITURA
+    # ==================
+
+    def get_tile(self, asset_hash, level, col, row, fmt):
+        """
+        Caminho do tile em disco
+
+        Retorna None se o asset, o nível ou a posição não existirem, e
+        TILE_PENDING se o tile ainda não foi gerado: a pirâmide é fatiada em
+        segundo plano (uma vez por hash) e o cliente tenta de novo.
+        """
+        info = self.info(asset_hash)
+        if info is None or fmt != info['format'] or not 0 <= level <= info['max_level']:
+            return None
+
+        level_info = info['levels'][level]
+        if not (0 <= col < level_info['cols'] and 0 <= row < level_info['rows']):
+            return None
+
+        path = self.tile_path(asset_hash, level, col, row, fmt)
+        if os.path.exists(path):
+            return path
+
+        if self.is_ingested(asset_hash):
+            # Tile apagado do cache: refazer (os tiles existentes são mantidos)
+            with suppress(FileNotFoundError):
+                os.remove(os.path.join(self._dir(asset_hash), 'done'))
+
+        self.ingest_async(asset_hash)
+        return TILE_PENDING
+
+
+tiles = TileStore()
@@ -1,10 +1,27 @@
 import multiprocessing
 import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Mesmo modo no gunicorn e no SocketIO (app/__init__.py lê ASYNC_MODE)
+ASYNC_MODE = os.environ.setdefault('ASYNC_MODE', 'eventlet')
+
+WORKER_CLASSES = {
+    'eventlet': 'eventlet',
+    'gevent': 'gevent',
+    'threading': 'gthread'
+}
 
 bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
-workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = 'eventlet' 
-worker_connections = 1000
+
+# Socket.IO com vários workers exige STATE_BACKEND compartilhado e sticky
+# sessions no proxy; com green threads um worker já aguenta milhares de sockets
+shared_state = os.getenv('STATE_BACKEND', 'memory') != 'memory'
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1 if shared_state else 1))
+worker_class = WORKER_CLASSES[ASYNC_MODE]
+worker_connections = int(os.getenv('WORKER_CONNECTIONS', '5000'))
+threads = int(os.getenv('WORKER_THREADS', '100')) if ASYNC_MODE == 'threading' else 1
 timeout = 120
 keepalive = 5
 
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# O app grava em data/ relativo ao diretório atual (banco, assets, tiles):
+# rodar os testes num diretório temporário para não tocar no data/ real
+os.chdir(tempfile.mkdtemp(prefix='rpg-tests-'))
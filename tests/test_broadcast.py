@@ -0,0 +1,115 @@
+from app.broadcast import BroadcastScheduler
+
+
+class FakeSocketIO:
+    """Registra emits e tasks; sleep não espera"""
+
+    def __init__(self):
+        self.emitted = []
+        self.tasks = []
+
+    def emit(self, event, payload, to=None, skip_sid=None):
+        self.emitted.append((event, payload, to))
+
+    def start_background_task(self, target):
+        self.tasks.append(target)
+
+    def sleep(self, seconds):
+        pass
+
+
+class Source:
+    def __init__(self, pending):
+        self._pending = pending
+        self.collected = []
+
+    def pending(self):
+        return self._pending()
+
+    def collect(self):
+        collected, self.collected = self.collected, []
+        return collected
+
+
+def test_updates_with_the_same_key_are_coalesced():
+    socketio = FakeSocketIO()
+    scheduler = BroadcastScheduler(socketio, rate=25)
+
+    scheduler.send('entity_updated', {'x': 1}, to='sala', key='e1')
+    scheduler.send('entity_updated', {'x': 2}, to='sala', key='e1')
+    scheduler.send('entity_updated', {'x': 9}, to='sala', key='e2')
+    scheduler.flush()
+
+    assert socketio.emitted == [('entity_updated', {'x': 2}, 'sala'), ('entity_updated', {'x': 9}, 'sala')]
+    assert len(socketio.tasks) == 1
+
+
+def test_flush_to_sends_only_those_destinations_in_order():
+    socketio = FakeSocketIO()
+    scheduler = BroadcastScheduler(socketio, rate=25)
+
+    scheduler.send('token_delta', {'seq': 1}, to='sessao')
+    scheduler.send('fog_op_applied', {'op': 1}, to='sessao:scene:a')
+    scheduler.send('entity_updated', {'x': 1}, to='outra')
+    scheduler.flush_to('sessao', 'sessao:scene:a', None)
+    socketio.emit('scene_activated', {}, to='sessao:scene:b')
+
+    assert [event for event, _, _ in socketio.emitted] == ['token_delta', 'fog_op_applied', 'scene_activated']
+    assert scheduler.status()['pending'] == 1
+
+
+def test_run_stops_when_idle():
+    socketio = FakeSocketIO()
+    scheduler = BroadcastScheduler(socketio, rate=25)
+    scheduler.add_source(Source(lambda: False))
+
+    scheduler.send('token_delta', {'seq': 1}, to='sessao')
+    socketio.tasks.pop()()
+
+    assert socketio.emitted == [('token_delta', {'seq': 1}, 'sessao')]
+    scheduler.wake()
+    assert len(socketio.tasks) == 1
+
+
+def test_source_data_arriving_while_the_task_stops_is_not_stranded():
+    socketio = FakeSocketIO()
+    scheduler = BroadcastScheduler(socketio, rate=25)
+    source = Source(lambda: bool(source.collected))
+    scheduler.add_source(source)
+
+    source.collected.append(('stroke_batch', {'ops': ['points']}, 'sessao', None))
+    scheduler.wake()
+    run = socketio.tasks.pop()
+
+    # O 'end' chega logo depois do flush: o wake() ainda vê o task vivo
+    original_flush = scheduler.flush
+    arrived = []
+
+    def flush():
+        original_flush()
+        if not arrived:
+            arrived.append(True)
+            source.collected.append(('stroke_batch', {'ops': ['end']}, 'sessao', None))
+            scheduler.wake()
+
+    scheduler.flush = flush
+    run()
+
+    assert [payload['ops'] for _, payload, _ in socketio.emitted] == [['points'], ['end']]
+    assert socketio.tasks == []
+
+
+def test_wake_during_shutdown_starts_a_new_task():
+    socketio = FakeSocketIO()
+    scheduler = BroadcastScheduler(socketio, rate=25)
+
+    def pending():
+        # Um append + wake() chega logo depois do task soltar o _task_pid
+        scheduler.wake()
+        return True
+
+    scheduler.add_source(Source(pending))
+    scheduler.wake()
+    socketio.tasks.pop()()
+
+    assert len(socketio.tasks) == 1
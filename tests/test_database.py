@@ -0,0 +1,254 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+from app import database as database_module
+from app.database import Database, SCHEMA_VERSION
+from app.dice import roller
+
+
+def session_data(token_x=10, scene_name='Taverna'):
+    return {
+        'grid_settings': {'enabled': True, 'size': 50},
+        'scenes': [{
+            'id': 'cena1',
+            'name': scene_name,
+            'visible_to_players': ['p1'],
+            'maps': [{'id': 'm1', 'image': '/assets/' + 'a' * 64, 'x': 0, 'y': 0}],
+            'entities': [],
+            'tokens': [{'id': 't1', 'x': token_x, 'y': 20}, {'id': 't2', 'x': 5, 'y': 5}],
+        }],
+        'tokens': [],
+    }
+
+
+def scene_of(loaded):
+    return loaded['data']['scenes'][0]
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    database = Database()
+    yield database
+    database.close()
+
+
+def test_save_and_load_round_trip(db):
+    assert db.save_session('s1', session_data())
+    loaded = db.load_session('s1')
+
+    assert loaded['version'] == 1
+    assert loaded['data']['grid_settings'] == {'enabled': True, 'size': 50}
+    assert scene_of(loaded)['name'] == 'Taverna'
+    assert scene_of(loaded)['tokens'] == [{'id': 't1', 'x': 10, 'y': 20}, {'id': 't2', 'x': 5, 'y': 5}]
+
+
+def test_unchanged_save_records_no_operations(db):
+    db.save_session('s1', session_data())
+    db.save_session('s1', session_data())
+
+    assert len(db.session_history('s1')) == 1
+    assert db.load_session('s1')['version'] == 2
+
+
+def test_history_records_only_changed_rows(db):
+    db.save_session('s1', session_data())
+    db.save_session('s1', session_data(token_x=99))
+
+    latest = db.session_history('s1')[0]
+    assert latest['version'] == 2
+    assert latest['parent'] == 1
+    assert latest['ops'] == 1
+
+
+def test_load_previous_version(db):
+    db.save_session('s1', session_data())
+    db.save_session('s1', session_data(token_x=99, scene_name='Masmorra'))
+
+    old = db.load_session_version('s1', 1)
+    assert scene_of(old)['name'] == 'Taverna'
+    assert scene_of(old)['tokens'][0]['x'] == 10
+    assert db.load_session_version('s1', 3) is None
+
+
+def test_undo_and_undo_of_undo(db):
+    db.save_session('s1', session_data(token_x=1))
+    db.save_session('s1', session_data(token_x=2))
+    db.save_session('s1', session_data(token_x=3))
+
+    assert db.undo_session('s1') == 4
+    assert scene_of(db.load_session('s1'))['tokens'][0]['x'] == 2
+
+    # O restore registra a versão nova com o mesmo pai da restaurada
+    assert db.undo_session('s1') == 5
+    assert scene_of(db.load_session('s1'))['tokens'][0]['x'] == 1
+
+    assert db.undo_session('s1') is None
+
+
+def test_restore_is_itself_undoable(db):
+    db.save_session('s1', session_data(token_x=1))
+    db.save_session('s1', session_data(token_x=2))
+
+    restored = db.restore_session('s1', 1)
+    assert scene_of(db.load_session('s1'))['tokens'][0]['x'] == 1
+    assert db.session_history('s1')[0]['restored_from'] == 1
+
+    assert db.restore_session('s1', 2) == restored + 1
+    assert scene_of(db.load_session('s1'))['tokens'][0]['x'] == 2
+
+
+def test_history_is_rebuilt_from_snapshots(db, monkeypatch):
+    prune = Database._prune_history
+    monkeypatch.setattr(database_module, 'SNAPSHOT_INTERVAL', 3)
+    monkeypatch.setattr(Database, '_prune_history',
+                        lambda self, cursor, session_id: prune(self, cursor, session_id, keep=4))
+
+    for x in range(12):
+        db.save_session('s1', session_data(token_x=x))
+
+    history = db.session_history('s1')
+    versions = [entry['version'] for entry in history]
+    assert versions == list(range(12, 12 - len(versions), -1))
+    assert 4 <= len(versions) < 12
+    assert any(entry['snapshot'] for entry in history)
+
+    for version in versions:
+        loaded = db.load_session_version('s1', version)
+        assert scene_of(loaded)['tokens'][0]['x'] == version - 1
+
+    assert db.load_session_version('s1', 1) is None
+
+
+def create_legacy_database(path, sessions):
+    """Banco do schema 1: sessão inteira num blob JSON"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE sessions (
+            session_id TEXT PRIMARY KEY,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            data TEXT NOT NULL,
+            version INTEGER DEFAULT 1
+        )
+    ''')
+    conn.executemany('INSERT INTO sessions (session_id, data, version) VALUES (?, ?, ?)', sessions)
+    conn.commit()
+    conn.close()
+
+
+def test_migrate_splits_legacy_blobs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    legacy = {
+        **session_data(),
+        'images': [{'id': 'img1', 'x': 1}],
+        'tokens': [{'id': 'tk', 'x': 2}],
+        'fogImage': 'data:image/png;base64,AAAA',
+    }
+    create_legacy_database('data/rpg_manager.db', [
+        ('s1', json.dumps(legacy), 7),
+        ('quebrada', '{não é json', 1),
+    ])
+
+    db = Database()
+    try:
+        loaded = db.load_session('s1')
+        assert loaded['version'] == 7
+        assert loaded['data']['images'] == [{'id': 'img1', 'x': 1}]
+        assert loaded['data']['tokens'] == [{'id': 'tk', 'x': 2}]
+        assert loaded['data']['fogImage'] == 'data:image/png;base64,AAAA'
+        assert scene_of(loaded)['tokens'][0] == {'id': 't1', 'x': 10, 'y': 20}
+
+        with db.read() as conn:
+            assert conn.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION
+            blob = conn.execute("SELECT data FROM sessions WHERE session_id = 's1'").fetchone()['data']
+            assert set(json.loads(blob)) == {'grid_settings'}
+
+        # Migração não cria histórico; o primeiro save parte do estado migrado
+        assert db.session_history('s1') == []
+        db.save_session('s1', {**legacy, 'tokens': []})
+        assert db.undo_session('s1') == 9
+        assert db.load_session('s1')['data']['tokens'] == [{'id': 'tk', 'x': 2}]
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize('version, drop', [(6, True), (5, True), (3, True), (6, False)])
+def test_migrate_rebuilds_dice_counters(db, tmp_path, version, drop):
+    rolls = [dict(roller.roll('1d20'), roller_id='p1', roller_name='Ana', timestamp=1) for _ in range(5)]
+    rolls.append(dict(roller.roll('1d20'), roller_id='p1', roller_name='Ana', timestamp=1, private=True))
+    db.add_dice_rolls('s1', rolls)
+    expected = db.dice_stats('s1')
+
+    # Voltar para um schema sem contadores (ou reprocessar os que já existem) e reabrir
+    with db.write() as conn:
+        if drop:
+            conn.execute('DELETE FROM dice_stats')
+        conn.execute(f'PRAGMA user_version = {version}')
+        conn.commit()
+    db.close()
+
+    reopened = Database()
+    try:
+        assert reopened.dice_stats('s1') == expected
+        assert expected[0]['rolls'] == 5
+        assert expected[0]['total_sum'] == sum(r['total'] for r in rolls[:5])
+    finally:
+        reopened.close()
+
+
+@pytest.mark.parametrize('version, drop', [(4, True), (3, True), (4, False)])
+def test_migrate_rebuilds_the_conversation_index(db, version, drop):
+    for i, (sender, recipient) in enumerate([('p1', 'p2'), ('p2', 'p1'), ('master', 'p1')]):
+        conversation = '|'.join(sorted((sender, recipient)))
+        db.add_chat_message('s1', conversation, {'sender_id': sender, 'recipient_id': recipient,
+                                                 'message': f'oi {i}', 'timestamp': i})
+
+    def index(database):
+        with database.read() as conn:
+            return [tuple(row) for row in conn.execute('SELECT * FROM chat_conversations ORDER BY conversation_id')]
+
+    expected = index(db)
+    with db.write() as conn:
+        if drop:
+            conn.execute('DELETE FROM chat_conversations')
+        conn.execute(f'PRAGMA user_version = {version}')
+        conn.commit()
+    db.close()
+
+    reopened = Database()
+    try:
+        assert index(reopened) == expected
+        assert [row[4] for row in expected] == [1, 2]
+    finally:
+        reopened.close()
+
+
+def test_dice_history_pages_and_hides_private(db):
+    rolls = [dict(roller.roll('1d6'), roller_id='p1', timestamp=i, private=i % 2 == 1) for i in range(6)]
+    ids = db.add_dice_rolls('s1', rolls)
+
+    public = db.dice_history('s1')
+    assert [entry['id'] for entry in public] == [ids[4], ids[2], ids[0]]
+
+    page = db.dice_history('s1', before=ids[4], limit=2, include_private=True)
+    assert [entry['id'] for entry in page] == [ids[3], ids[2]]
+    assert page[0]['private'] is True
+    assert page[0]['terms'] == rolls[3]['terms']
+
+
+def test_private_rolls_only_reach_their_roller(db):
+    rolls = [
+        dict(roller.roll('1d20'), roller_id='p1', timestamp=1, private=True),
+        dict(roller.roll('1d20'), roller_id='p2', timestamp=2, private=True),
+        dict(roller.roll('1d20'), roller_id='p2', timestamp=3),
+    ]
+    ids = db.add_dice_rolls('s1', rolls)
+
+    assert [entry['id'] for entry in db.dice_history('s1')] == [ids[2]]
+    assert [entry['id'] for entry in db.dice_history('s1', roller_id='p2')] == [ids[2], ids[1]]
+    assert [entry['id'] for entry in db.dice_history('s1', roller_id='p3')] == [ids[2]]
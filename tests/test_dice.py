@@ -0,0 +1,80 @@
+import pytest
+
+from app.dice import DiceRoller, format_formula, parse_formula, MAX_DICE, MAX_SIDES
+
+
+@pytest.mark.parametrize('formula, normalized', [
+    ('1d20+5', '1d20+5'),
+    ('d20', '1d20'),
+    ('D20 + 3', '1d20+3'),
+    ('d%', '1d100'),
+    ('d20adv', '2d20kh1'),
+    ('d20dis', '2d20kl1'),
+    ('4d6dl1', '4d6kh3'),
+    ('4d6dh1', '4d6kl3'),
+    ('2d6!-1', '2d6!-1'),
+    ('3d6kh3', '3d6'),
+    ('-1d4+2d8', '-1d4+2d8'),
+])
+def test_parse_normalizes(formula, normalized):
+    assert format_formula(parse_formula(formula)) == normalized
+
+
+@pytest.mark.parametrize('formula', [
+    '', '   ', 'abc', '1d', '2d6 3', '1d20++5', f'{MAX_DICE + 1}d6', f'1d{MAX_SIDES + 1}',
+    '1d1', '0d6', '3d20adv', '2d6kh3', '+'.join(['1'] * 21), '1' * 101, None,
+])
+def test_parse_rejects(formula):
+    with pytest.raises(ValueError):
+        parse_formula(formula)
+
+
+def test_batch_stays_in_range():
+    rolls = DiceRoller().batch(5000, 7)
+    assert len(rolls) == 5000
+    assert set(rolls) == set(range(1, 8))
+
+
+def test_roll_keeps_highest():
+    roller = DiceRoller()
+    for _ in range(50):
+        roll = roller.roll('4d6kh3+2')
+        term = roll['terms'][0]
+        kept = [r for i, r in enumerate(term['rolls']) if i not in term['dropped']]
+        assert len(term['dropped']) == 1
+        assert sorted(kept) == sorted(term['rolls'])[1:]
+        assert roll['total'] == sum(kept) + 2
+
+
+def test_roll_subtracts_negative_terms():
+    roll = DiceRoller().roll('10-1d4')
+    assert roll['total'] == 10 - roll['terms'][1]['rolls'][0]
+    assert roll['formula'] == '10-1d4'
+
+
+def test_exploding_rolls_extra_dice(monkeypatch):
+    roller = DiceRoller()
+    sequence = iter([[6, 2], [6], [3]])
+    monkeypatch.setattr(roller, 'batch', lambda count, sides: next(sequence))
+    roll = roller.roll('2d6!')
+    assert roll['terms'][0]['rolls'] == [6, 2, 6, 3]
+    assert roll['total'] == 17
+
+
+@pytest.mark.parametrize('rolls, critical, failure', [
+    ([20], True, False),
+    ([1], False, True),
+    ([12], False, False),
+])
+def test_critical_only_for_a_single_kept_d20(monkeypatch, rolls, critical, failure):
+    roller = DiceRoller()
+    monkeypatch.setattr(roller, 'batch', lambda count, sides: list(rolls))
+    roll = roller.roll('1d20+4')
+    assert (roll['is_critical'], roll['is_failure']) == (critical, failure)
+
+
+def test_no_critical_for_several_d20(monkeypatch):
+    roller = DiceRoller()
+    monkeypatch.setattr(roller, 'batch', lambda count, sides: [20] * count)
+    assert not roller.roll('2d20')['is_critical']
+    assert roller.roll('2d20kh1')['is_critical']
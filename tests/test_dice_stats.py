@@ -0,0 +1,130 @@
+import itertools
+import math
+
+import pytest
+
+from app import dice_stats
+from app.dice import parse_formula
+
+
+def brute_force(formula):
+    """Distribuição por enumeração de todas as combinações (fórmulas pequenas)"""
+    per_term = []
+    for term in parse_formula(formula):
+        if not term.is_dice:
+            per_term.append({term.sign * term.constant: 1.0})
+            continue
+
+        counts = {}
+        for faces in itertools.product(range(1, term.sides + 1), repeat=term.count):
+            kept = sorted(faces, reverse=term.keep[0] == 'high')[:term.keep[1]] if term.keep else faces
+            value = term.sign * sum(kept)
+            counts[value] = counts.get(value, 0) + 1
+        total = term.sides ** term.count
+        per_term.append({v: c / total for v, c in counts.items()})
+
+    result = {0: 1.0}
+    for dist in per_term:
+        combined = {}
+        for a, p in result.items():
+            for b, q in dist.items():
+                combined[a + b] = combined.get(a + b, 0.0) + p * q
+        result = combined
+    return result
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def backend(request, monkeypatch):
+    if request.param == 'numpy':
+        if dice_stats.numpy is None:
+            pytest.skip('NumPy não instalado')
+    else:
+        monkeypatch.setattr(dice_stats, 'numpy', None)
+
+    caches = (dice_stats.dice_sum, dice_stats.exploding_die, dice_stats.exploding_sum,
+              dice_stats.keep_highest, dice_stats._formula_stats)
+    for cached in caches:
+        cached.cache_clear()
+    yield request.param
+    for cached in caches:
+        cached.cache_clear()
+
+
+@pytest.mark.parametrize('formula', [
+    '1d20', '3d6+2', '2d8-1d4', 'd20adv', 'd20dis', '4d6kh3', '4d6kl2', '5d4dl2', '-3d6kh2+10', '1d6+1d6+1d6',
+])
+def test_exact_distribution_matches_brute_force(backend, formula):
+    stats = dice_stats.formula_stats(formula)
+    expected = brute_force(formula)
+
+    assert {v for v, _ in stats['distribution']} == set(expected)
+    for value, p in stats['distribution']:
+        assert p == pytest.approx(expected[value], abs=1e-12)
+
+    mean = sum(v * p for v, p in expected.items())
+    variance = sum((v - mean) ** 2 * p for v, p in expected.items())
+    assert stats['mean'] == pytest.approx(mean, abs=1e-6)
+    assert stats['variance'] == pytest.approx(variance, abs=1e-6)
+    assert (stats['min'], stats['max']) == (min(expected), max(expected))
+
+
+def test_exploding_die_mean(backend):
+    # E[d6!] = 3.5 * 6/5: cada explosão soma outro dado com probabilidade 1/6
+    stats = dice_stats.formula_stats('1d6!')
+    assert stats['mean'] == pytest.approx(4.2, abs=1e-6)
+    assert sum(p for _, p in stats['distribution']) == pytest.approx(1, abs=1e-9)
+
+
+@pytest.mark.parametrize('formula', ['1000d1000+1000d1000', '500d1000-200d6!', '300d300'])
+def test_large_formulas_fall_back_to_moments(backend, formula):
+    stats = dice_stats.formula_stats(formula)
+    mean = variance = 0.0
+    for term in parse_formula(formula):
+        die = dice_stats.exploding_die(term.sides).stats() if term.explode else None
+        die_mean = die['mean'] if die else (term.sides + 1) / 2
+        die_variance = die['variance'] if die else (term.sides ** 2 - 1) / 12
+        mean += term.sign * term.count * die_mean
+        variance += term.count * die_variance
+
+    assert stats['mean'] == pytest.approx(mean, rel=1e-6)
+    assert stats['variance'] == pytest.approx(variance, rel=1e-6)
+    if stats['distribution'] is None:
+        assert stats['std_dev'] == pytest.approx(math.sqrt(variance), rel=1e-6)
+
+
+def test_moments_match_exact_distribution(backend):
+    for formula in ('3d6+2', '-2d8+1d4-3', '4d6kh3', '-3d6!+5'):
+        terms = parse_formula(formula)
+        moments = dice_stats._moment_stats(formula, [dice_stats.term_moments(t) for t in terms])
+        exact = dice_stats.formula_stats(formula)
+        for key in ('mean', 'variance', 'min', 'max'):
+            assert moments[key] == pytest.approx(exact[key], abs=1e-5)
+
+
+def test_keep_too_large_is_rejected(backend):
+    with pytest.raises(ValueError):
+        dice_stats.formula_stats('1000d1000kh500')
+
+
+def test_exploding_keep_is_rejected(backend):
+    with pytest.raises(ValueError):
+        dice_stats.formula_stats('4d6!kh3')
+
+
+def test_player_stats_aggregates_counters():
+    rows = [
+        {'roller_key': 'p1', 'roller_id': 'p1', 'roller_name': 'Ana', 'formula': '1d20',
+         'rolls': 4, 'total_sum': 40, 'total_squares': 500, 'criticals': 1, 'failures': 0,
+         'min_total': 5, 'max_total': 20},
+        {'roller_key': 'p1', 'roller_id': 'p1', 'roller_name': 'Ana', 'formula': '2d6',
+         'rolls': 2, 'total_sum': 14, 'total_squares': 100, 'criticals': 0, 'failures': 0,
+         'min_total': 6, 'max_total': 8},
+    ]
+    player, = dice_stats.player_stats(rows)
+    d20 = player['formulas'][0]
+
+    assert player['rolls'] == 6
+    assert player['criticals'] == 1
+    assert d20['mean'] == 10
+    assert d20['std_dev'] == pytest.approx(5, abs=1e-3)
+    assert d20['expected_mean'] == 10.5
@@ -0,0 +1,67 @@
+import pytest
+
+from app import drawings
+from app.drawings import DrawingStore, compact_drawings, is_raster
+
+
+@pytest.fixture
+def small_limits(monkeypatch):
+    monkeypatch.setattr(drawings, 'RASTER_POINT_LIMIT', 40)
+    monkeypatch.setattr(drawings, 'RASTER_KEEP_STROKES', 2)
+    monkeypatch.setattr(drawings, 'RASTER_STEP', 4)
+
+
+def stroke(i, color='#ff0000'):
+    return {'color': color, 'size': 3, 'path': [{'x': i * 10, 'y': 0}, {'x': i * 10 + 5, 'y': 20}, {'x': i * 10, 'y': 40}]}
+
+
+def test_group_ids_are_the_same_on_every_compaction():
+    source = [stroke(0), stroke(1, '#00ff00'), stroke(2, '#00ff00')]
+
+    first, second = compact_drawings(source), compact_drawings(source)
+
+    assert [item['id'] for item in first] == [item['id'] for item in second]
+    assert len({item['id'] for item in first}) == 2
+
+
+def test_add_never_rasterizes(small_limits):
+    store = DrawingStore([stroke(i) for i in range(20)])
+
+    assert store.needs_raster()
+    assert not any(is_raster(item) for item in store.to_list())
+
+
+def test_raster_is_applied_when_only_new_strokes_arrived(small_limits):
+    store = DrawingStore([stroke(i) for i in range(20)])
+    old = store.plan_raster(keep_strokes=2)
+    layer = store.render(old)
+
+    # Traços que chegaram durante o render continuam vetoriais
+    store.add(stroke(20))
+    store.add(stroke(21))
+
+    assert store.apply_raster(old, layer)
+    items = store.to_list()
+    assert is_raster(items[0])
+    assert len(store) == 22 - 16
+    assert not store.needs_raster()
+
+
+def test_raster_is_discarded_if_the_drawings_were_replaced(small_limits):
+    store = DrawingStore([stroke(i) for i in range(20)])
+    old = store.plan_raster(keep_strokes=2)
+    layer = store.render(old)
+
+    store.reset([stroke(i, '#0000ff') for i in range(20)])
+
+    assert not store.apply_raster(old, layer)
+    assert not any(is_raster(item) for item in store.to_list())
+    assert len(store) == 20
+
+
+def test_compact_drawings_rasterizes_only_when_asked(monkeypatch):
+    monkeypatch.setattr(drawings, 'RASTER_POINT_LIMIT', 40)
+    source = [stroke(i % 300) for i in range(drawings.RASTER_KEEP_STROKES + drawings.RASTER_STEP)]
+
+    assert not any(is_raster(item) for item in compact_drawings(source, rasterize=False))
+    assert is_raster(compact_drawings(source)[0])
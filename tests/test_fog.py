@@ -0,0 +1,160 @@
+import math
+import time
+
+import pytest
+
+from app.fog import FogMask, FOG_HEIGHT, FOG_WIDTH, MAX_RADIUS, pack_runs
+
+
+def cell_centers(mask):
+    for row in range(mask.rows):
+        for col in range(mask.cols):
+            yield row, col, (col + 0.5) * mask.cell_size, (row + 0.5) * mask.cell_size
+
+
+def covered(mask, row, col):
+    return bool(mask._rows[row] >> col & 1)
+
+
+def assert_matches(mask, inside, margin=0.01):
+    """Células com centro claramente dentro/fora da forma (distância > margin da borda)"""
+    for row, col, x, y in cell_centers(mask):
+        distance = inside(x, y)
+        if distance > margin:
+            assert covered(mask, row, col), (row, col)
+        elif distance < -margin:
+            assert not covered(mask, row, col), (row, col)
+
+
+def segment_distance(px, py, x1, y1, x2, y2):
+    dx, dy = x2 - x1, y2 - y1
+    t = ((px - x1) * dx + (py - y1) * dy) / (dx * dx + dy * dy) if dx or dy else 0
+    t = min(max(t, 0), 1)
+    return math.hypot(px - x1 - t * dx, py - y1 - t * dy)
+
+
+def chebyshev_distance(px, py, x1, y1, x2, y2):
+    """max(|dx|, |dy|) até o segmento: o mínimo fica numa quebra da função (linear por partes)"""
+    ax, ay, dx, dy = x1 - px, y1 - py, x2 - x1, y2 - y1
+    candidates = {0.0, 1.0}
+    for a, d in ((ax, dx), (ay, dy), (ax - ay, dx - dy), (ax + ay, dx + dy)):
+        if d:
+            candidates.add(min(max(-a / d, 0.0), 1.0))
+    return min(max(abs(ax + t * dx), abs(ay + t * dy)) for t in candidates)
+
+
+@pytest.fixture
+def mask():
+    return FogMask(width=400, height=400)
+
+
+def test_rect_reveal_and_cover(mask):
+    mask.apply({'mode': 'cover', 'shape': 'all'})
+    mask.apply({'mode': 'reveal', 'shape': 'rect', 'x': 100, 'y': 50, 'w': -60, 'h': 120})
+    assert_matches(mask, lambda x, y: -min(min(x - 40, 100 - x), min(y - 50, 170 - y)))
+    assert mask.version == 2
+
+
+def test_circle(mask):
+    mask.apply({'mode': 'cover', 'shape': 'circle', 'x': 200, 'y': 180, 'r': 73.3})
+    assert_matches(mask, lambda x, y: 73.3 - math.hypot(x - 200, y - 180))
+
+
+def test_polygon_even_odd(mask):
+    triangle = [[20, 20], [380, 60], [100, 350]]
+    mask.apply({'mode': 'cover', 'shape': 'polygon', 'points': triangle})
+
+    def inside(x, y):
+        # Distância (com sinal) até a reta de cada aresta: dentro = todas do mesmo lado
+        sides = [
+            ((x2 - x1) * (y - y1) - (y2 - y1) * (x - x1)) / math.hypot(x2 - x1, y2 - y1)
+            for (x1, y1), (x2, y2) in zip(triangle, triangle[1:] + triangle[:1])
+        ]
+        nearest = min(abs(d) for d in sides)
+        return nearest if all(d > 0 for d in sides) or all(d < 0 for d in sides) else -nearest
+
+    assert_matches(mask, inside, margin=0.5)
+
+
+@pytest.mark.parametrize('brush', ['circle', 'square'])
+def test_stroke_covers_the_swept_brush(mask, brush):
+    points = [[30, 40], [300, 90], [320, 330], [320, 330], [60, 250]]
+    mask.apply({'mode': 'cover', 'shape': 'stroke', 'points': points, 'size': 36, 'brush': brush})
+
+    distance = segment_distance if brush == 'circle' else chebyshev_distance
+
+    def inside(x, y):
+        return 18 - min(distance(x, y, *a, *b) for a, b in zip(points, points[1:]))
+
+    assert_matches(mask, inside)
+
+
+def test_single_point_stroke_is_a_dot(mask):
+    mask.apply({'mode': 'cover', 'shape': 'stroke', 'points': [[200, 200]], 'size': 40})
+    assert_matches(mask, lambda x, y: 20 - math.hypot(x - 200, y - 200))
+
+
+def test_long_stroke_segment_is_cheap():
+    mask = FogMask()
+    start = time.perf_counter()
+    mask.apply({'mode': 'cover', 'shape': 'stroke', 'points': [[-1e6, 10], [1e6, 10]], 'size': 20})
+    assert time.perf_counter() - start < 0.5
+    assert mask.is_covered(FOG_WIDTH / 2, 10)
+
+
+def test_stroke_touching_too_many_rows_is_rejected():
+    mask = FogMask()
+    zigzag = [[0, 0], [0, FOG_HEIGHT]] * 150
+    with pytest.raises(ValueError):
+        mask.apply({'mode': 'cover', 'shape': 'stroke', 'points': zigzag, 'size': 1})
+
+
+def test_huge_values_are_clamped():
+    mask = FogMask()
+    op = mask.apply({'mode': 'cover', 'shape': 'circle', 'x': 1e200, 'y': -1e200, 'r': 1e200})
+    assert op == {'mode': 'cover', 'shape': 'circle', 'x': 2 * FOG_WIDTH, 'y': -FOG_HEIGHT,
+                  'r': round(MAX_RADIUS, 1)}
+
+    op = mask.apply({'mode': 'reveal', 'shape': 'rect', 'x': -1e308, 'y': 0, 'w': 1e308, 'h': 1e308})
+    assert (op['x'], op['w'], op['h']) == (-FOG_WIDTH, FOG_WIDTH, 2 * FOG_HEIGHT)
+
+
+@pytest.mark.parametrize('op', [
+    None,
+    {'mode': 'paint', 'shape': 'all'},
+    {'mode': 'cover', 'shape': 'circle', 'x': float('nan'), 'y': 0, 'r': 1},
+    {'mode': 'cover', 'shape': 'rect', 'x': 'abc', 'y': 0, 'w': 1, 'h': 1},
+    {'mode': 'cover', 'shape': 'polygon', 'points': []},
+    {'mode': 'cover', 'shape': 'stroke', 'points': [[0, 0]], 'brush': 'star'},
+])
+def test_malformed_ops_are_rejected(op):
+    with pytest.raises(ValueError):
+        FogMask().apply(op)
+
+
+def test_rle_round_trip(mask):
+    mask.apply({'mode': 'cover', 'shape': 'circle', 'x': 120, 'y': 140, 'r': 90})
+    mask.apply({'mode': 'reveal', 'shape': 'rect', 'x': 100, 'y': 0, 'w': 10, 'h': 400})
+
+    runs = mask.to_rle()
+    assert sum(runs) == mask.cols * mask.rows
+
+    copy = FogMask(width=400, height=400)
+    copy.load_rle(runs)
+    assert copy._rows == mask._rows
+    assert copy.covered_ratio() == mask.covered_ratio()
+
+
+def test_rle_starts_with_uncovered_run(mask):
+    mask.apply({'mode': 'cover', 'shape': 'all'})
+    assert mask.to_rle() == [0, mask.cols * mask.rows]
+
+
+def test_pack_runs_varints():
+    assert pack_runs([0, 1, 127, 128, 300]) == bytes([0, 1, 127, 0x80, 0x01, 0xac, 0x02])
+
+
+def test_binary_snapshot(mask):
+    snapshot = mask.to_snapshot(binary=True)
+    assert snapshot['rle'] == pack_runs(mask.to_rle())
+    assert (snapshot['cols'], snapshot['rows'], snapshot['cell_size']) == (100, 100, 4)
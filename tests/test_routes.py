@@ -0,0 +1,29 @@
+from app import app
+from app.routes import NOTES_KEY
+
+
+def test_notes_require_the_install_key():
+    client = app.test_client()
+
+    assert client.get('/notes').status_code == 403
+    assert client.get('/api/notes/get').status_code == 403
+    assert client.get('/api/notes/search', query_string={'q': 'goblin'}).status_code == 403
+    assert client.post('/api/notes/save', json={'note': {'title': 'x'}}).status_code == 403
+    assert client.delete('/api/notes/delete/1').status_code == 403
+    assert client.get('/notes', query_string={'key': 'errada'}).status_code == 403
+    assert client.get('/api/notes/get', headers={'X-Notes-Key': 'errada'}).status_code == 403
+
+
+def test_notes_key_link_unlocks_this_browser():
+    gm, player = app.test_client(), app.test_client()
+
+    response = gm.get('/notes', query_string={'key': NOTES_KEY})
+    assert response.status_code == 302 and 'key' not in response.headers['Location']
+
+    saved = gm.post('/api/notes/save', json={'note': {'title': 'Goblin rei', 'body': 'segredo', 'category': 'npcs'}})
+    assert saved.status_code == 200
+    assert gm.get('/notes').status_code == 200
+    assert [n['title'] for n in gm.get('/api/notes/search', query_string={'q': 'gob'}).get_json()['notes']] == ['Goblin rei']
+
+    assert player.get('/api/notes/search', query_string={'q': 'gob'}).status_code == 403
+    assert app.test_client().get('/api/notes/get', headers={'X-Notes-Key': NOTES_KEY}).status_code == 200
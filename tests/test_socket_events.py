@@ -0,0 +1,112 @@
+import pytest
+
+from app import app, socketio
+
+
+@pytest.fixture
+def clients():
+    """Mestre e dois jogadores numa sessão nova"""
+    master = socketio.test_client(app)
+    ana = socketio.test_client(app)
+    bruno = socketio.test_client(app)
+    session_id = f'sessao-{id(master)}'
+
+    master.emit('join_session', {'session_id': session_id})
+    ana.emit('player_join', {'session_id': session_id, 'player_id': 'ana', 'player_name': 'Ana'})
+    bruno.emit('player_join', {'session_id': session_id, 'player_id': 'bruno', 'player_name': 'Bruno'})
+    for client in (master, ana, bruno):
+        client.get_received()
+
+    yield session_id, master, ana, bruno
+
+    for client in (master, ana, bruno):
+        client.disconnect()
+
+
+def test_private_rolls_are_hidden_from_other_players(clients):
+    session_id, master, ana, bruno = clients
+    private = ana.emit('roll_shared_dice', {'session_id': session_id, 'formula': '1d20', 'private': True},
+                       callback=True)['rolls'][0]
+    public = bruno.emit('roll_shared_dice', {'session_id': session_id, 'formula': '1d6'},
+                        callback=True)['rolls'][0]
+
+    def seen_by(client):
+        response = client.emit('get_dice_history', {'session_id': session_id}, callback=True)
+        return [entry['id'] for entry in response['history']]
+
+    assert seen_by(ana) == [public['id'], private['id']]
+    assert seen_by(bruno) == [public['id']]
+    assert seen_by(master) == [public['id'], private['id']]
+
+    # A API HTTP só devolve rolagens públicas, com ou sem o antigo private=1
+    response = app.test_client().get('/api/dice/history', query_string={'session_id': session_id, 'private': '1'})
+    assert [entry['id'] for entry in response.get_json()['history']] == [public['id']]
+
+
+def test_dice_history_requires_the_session(clients):
+    session_id, _, ana, _ = clients
+    outsider = socketio.test_client(app)
+
+    assert 'error' in outsider.emit('get_dice_history', {'session_id': session_id}, callback=True)
+    assert 'error' in ana.emit('get_dice_history', {'session_id': 'outra'}, callback=True)
+    outsider.disconnect()
+
+
+def test_stroke_begin_requires_the_bound_session(clients):
+    session_id, _, ana, _ = clients
+    outsider = socketio.test_client(app)
+
+    assert 'error' in outsider.emit('stroke_begin', {'session_id': session_id, 'stroke_id': 't1'}, callback=True)
+    assert 'error' in ana.emit('stroke_begin', {'session_id': 'outra', 'stroke_id': 't2'}, callback=True)
+    assert not ana.emit('stroke_begin', {'session_id': session_id, 'stroke_id': 't3'}, callback=True)
+    outsider.disconnect()
+
+
+def test_only_participants_read_a_conversation(clients):
+    session_id, master, ana, bruno = clients
+    carla = socketio.test_client(app)
+    carla.emit('player_join', {'session_id': session_id, 'player_id': 'carla', 'player_name': 'Carla'})
+    ana.emit('send_private_message', {'session_id': session_id, 'sender_id': 'ana',
+                                      'recipient_id': 'bruno', 'message': 'segredo'})
+    for client in (master, ana, bruno, carla):
+        client.get_received()
+
+    def loaded(client, user_id, other_user_id):
+        error = client.emit('get_conversation', {'session_id': session_id, 'user_id': user_id,
+                                                 'other_user_id': other_user_id}, callback=True)
+        if error:
+            return error
+        (event,) = [e for e in client.get_received() if e['name'] == 'conversation_loaded']
+        return [m['message'] for m in event['args'][0]['messages']]
+
+    assert loaded(bruno, 'bruno', 'ana') == ['segredo']
+    assert loaded(master, 'master', 'ana|bruno') == ['segredo']
+
+    # Terceiro jogador: nem se passando pelo mestre, nem por um participante
+    assert 'error' in loaded(carla, 'master', 'ana|bruno')
+    assert 'error' in loaded(carla, 'ana', 'bruno')
+    assert loaded(carla, 'carla', 'ana|bruno') == []
+    carla.disconnect()
+
+
+def test_drawings_are_rasterized_outside_the_handler(clients, monkeypatch):
+    from app import drawings, socket_events
+    from app.session_state import sessions
+
+    session_id, master, _, _ = clients
+    monkeypatch.setattr(drawings, 'RASTER_POINT_LIMIT', 40)
+    tasks = []
+    monkeypatch.setattr(socketio, 'start_background_task', lambda target, *args: tasks.append((target, args)))
+
+    session = sessions.get_or_create(session_id)
+    session.drawings.reset([{'color': '#000', 'size': 2, 'path': [{'x': i % 90, 'y': 0}, {'x': i % 90, 'y': 9}]}
+                            for i in range(drawings.RASTER_KEEP_STROKES + drawings.RASTER_STEP)])
+    master.emit('drawing_update', {'session_id': session_id,
+                                   'drawing': {'color': '#000', 'size': 2, 'path': [{'x': 1, 'y': 1}, {'x': 5, 'y': 5}]}})
+
+    # O handler só agenda; a imagem sai na task
+    assert not drawings.is_raster(session.drawings.to_list()[0])
+    (target, args), = tasks
+    target(*args)
+    assert drawings.is_raster(session.drawings.to_list()[0])
+    assert session_id not in socket_events.rasterizing
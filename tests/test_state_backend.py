@@ -0,0 +1,146 @@
+import os
+import time
+
+import pytest
+import socketio
+
+from app.session_state import PlayerRecord, SessionRegistry, SessionState
+from app.state_backend import (
+    DEFAULT_QUEUE_DB, DEFAULT_STATE_DB, SQLiteMessageQueue, SQLiteStateBackend,
+    _queue_path, _sqlite_path, socketio_queue_options
+)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.mark.parametrize('url, path', [
+    ('sqlite', DEFAULT_STATE_DB),
+    ('sqlite://', DEFAULT_STATE_DB),
+    ('sqlite:///estado.db', 'estado.db'),
+    ('sqlite:////tmp/estado.db', '/tmp/estado.db'),
+])
+def test_sqlite_path(url, path):
+    assert _sqlite_path(url) == path
+
+
+def test_queue_never_shares_the_state_file():
+    assert _queue_path('sqlite', 'sqlite') == DEFAULT_QUEUE_DB
+    assert _queue_path('sqlite:///x/live.db', 'sqlite:///x/live.db') == 'x/live-queue.db'
+    assert _queue_path('sqlite:///x/fila.db', 'sqlite:///x/live.db') == 'x/fila.db'
+
+
+def test_queue_options_follow_the_state_backend(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert socketio_queue_options(None, 'memory') == {}
+    assert socketio_queue_options('none', 'sqlite') == {}
+
+    manager = socketio_queue_options(None, 'sqlite:///live/estado.db')['client_manager']
+    assert isinstance(manager, SQLiteMessageQueue)
+    assert manager.path == os.path.join('live', 'estado-queue.db')
+    assert os.path.isdir(tmp_path / 'live')
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Dois SessionRegistry (um por worker) com o mesmo arquivo de estado"""
+    path = str(tmp_path / 'state' / 'live.db')
+    return SessionRegistry(backend=SQLiteStateBackend(path)), SessionRegistry(backend=SQLiteStateBackend(path))
+
+
+def test_writes_reach_the_other_worker(workers):
+    first, second = workers
+
+    with first.transaction('s1', ('core',)) as session:
+        session.players['p1'] = PlayerRecord('p1', 'Ana', 'sid-1')
+
+    with second.transaction('s1') as session:
+        assert session.players['p1'].name == 'Ana'
+
+    with second.transaction('s1', ('core',)) as session:
+        del session.players['p1']
+
+    with first.transaction('s1') as session:
+        assert 'p1' not in session.players
+
+
+def test_only_stale_components_are_reloaded(workers, monkeypatch):
+    first, second = workers
+
+    with first.transaction('s1', ('core', 'chat')):
+        pass
+    with second.transaction('s1'):
+        pass
+
+    with first.transaction('s1', ('chat',)):
+        pass
+
+    loaded = []
+    original = SessionState.load_component
+    monkeypatch.setattr(SessionState, 'load_component',
+                        lambda self, name, data: loaded.append(name) or original(self, name, data))
+    with second.transaction('s1') as session:
+        pass
+
+    assert loaded == ['chat']
+    assert session.component_versions['chat'] == 2
+
+
+def test_failed_handler_rolls_back(workers):
+    first, second = workers
+
+    with pytest.raises(RuntimeError):
+        with first.transaction('s1', ('core',)) as session:
+            session.players['p1'] = PlayerRecord('p1', 'Ana', 'sid-1')
+            raise RuntimeError('handler falhou')
+
+    with second.transaction('s1') as session:
+        assert 'p1' not in session.players
+
+
+def test_publish_inside_a_state_transaction(tmp_path):
+    state = SQLiteStateBackend(str(tmp_path / 'live.db'))
+    queue = SQLiteMessageQueue(_queue_path(f'sqlite:///{tmp_path}/live.db', f'sqlite:///{tmp_path}/live.db'))
+
+    with state.transaction('s1') as tx:
+        tx.store({'core': {'players': {}}})
+        start = time.monotonic()
+        queue._publish({'method': 'emit', 'event': 'teste'})
+        assert time.monotonic() - start < 1
+
+    with queue.pool.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM socketio_messages').fetchone()[0] == 1
+
+
+def start_worker(path):
+    """Servidor Socket.IO com a fila SQLite e o listener rodando"""
+    server = socketio.Server(client_manager=SQLiteMessageQueue(path, poll_interval=0.005), async_mode='threading')
+    server.manager_initialized = True
+    server.manager.initialize()
+    return server
+
+
+def test_rooms_are_changed_on_the_worker_that_holds_the_socket(tmp_path):
+    path = str(tmp_path / 'queue.db')
+    first, second = start_worker(path), start_worker(path)
+
+    # Socket conectado só no segundo worker
+    sid = second.manager.connect('eio-1', '/')
+    assert not first.manager.is_connected(sid, '/')
+
+    # Como no Redis, o que foi publicado antes do listener começar se perde:
+    # repetir (enter_room é idempotente) até o segundo worker estar ouvindo
+    def entered():
+        first.manager.enter_room(sid, '/', 's1:scene:c1')
+        return wait_for(lambda: sid in second.manager.rooms['/'].get('s1:scene:c1', {}), timeout=0.2)
+
+    assert wait_for(entered)
+
+    first.manager.leave_room(sid, '/', 's1:scene:c1')
+    assert wait_for(lambda: sid not in second.manager.rooms['/'].get('s1:scene:c1', {}))
@@ -0,0 +1,31 @@
+from app.stroke_stream import StrokeStream
+
+
+class FakeScheduler:
+    def add_source(self, source):
+        pass
+
+    def wake(self):
+        pass
+
+
+def test_non_finite_points_are_dropped_in_pairs():
+    stream = StrokeStream(FakeScheduler())
+    stream.begin('sessao', 'sid', 't1', {'color': '#000', 'size': 2})
+
+    stream.append('sid', 't1', [1, 2, float('inf'), 4, 5, float('nan'), 7.9, 8, True, 1, 'x', 3, 9])
+
+    session_id, _, path = stream.end('sid', 't1')
+    assert session_id == 'sessao'
+    assert path == [{'x': 1, 'y': 2}, {'x': 7, 'y': 8}]
+
+
+def test_stroke_ops_are_batched_per_room():
+    stream = StrokeStream(FakeScheduler())
+    stream.begin('sessao', 'sid', 't1', {'color': '#000', 'size': 2})
+    stream.append('sid', 't1', [1, 2, 3, 4])
+
+    (event, payload, room, skip), = stream.collect()
+    assert (event, room, skip) == ('stroke_batch', 'sessao', 'sid')
+    assert [op['op'] for op in payload['ops']] == ['begin', 'points']
+    assert payload['ops'][1]['points'] == [1, 2, 3, 4]